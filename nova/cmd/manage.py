@@ -55,6 +55,7 @@
 from __future__ import print_function
 
 import argparse
+import datetime
 import os
 import sys
 import urllib
@@ -64,7 +65,9 @@ import netaddr
 from oslo_config import cfg
 from oslo_log import log as logging
 import oslo_messaging as messaging
+from oslo_serialization import jsonutils
 from oslo_utils import importutils
+from oslo_utils import timeutils
 import six
 
 from nova.api.ec2 import ec2utils
@@ -79,6 +82,8 @@ from nova import objects
 from nova.openstack.common import cliutils
 from nova import quota
 from nova import rpc
+from nova.scheduler import rpcapi as scheduler_rpcapi
+from nova.scheduler import timings as scheduler_timings
 from nova import servicegroup
 from nova import utils
 from nova import version
@@ -674,8 +679,9 @@ class VmCommands(object):
                                              _('index'))))
 
         if host is None:
-            instances = objects.InstanceList.get_by_filters(
-                context.get_admin_context(), {}, expected_attrs=['flavor'])
+            instances = objects.InstanceList.iter_by_filters(
+                context.get_admin_context(), {}, sort_keys=['created_at'],
+                sort_dirs=['desc'], expected_attrs=['flavor'])
         else:
             instances = objects.InstanceList.get_by_host(
                 context.get_admin_context(), host, expected_attrs=['flavor'])
@@ -697,6 +703,44 @@ class VmCommands(object):
                                                 instance.launch_index or 0)))
 
 
+class SchedulerCommands(object):
+    """Inspect the scheduler services."""
+
+    @staticmethod
+    def _format_seconds(seconds):
+        if seconds is None:
+            return '>%.1fs' % scheduler_timings.BUCKETS[-1]
+        return '%.2f' % (seconds * 1000)
+
+    @args('--host', metavar='<host>', help='Host of the scheduler service')
+    @args('--reset', action='store_true', dest='reset', default=False,
+          help='Reset the timings once they are shown')
+    def timings(self, host, reset=False):
+        """Show the time spent in each phase, filter and weigher by a
+        scheduler service, in milliseconds.
+        """
+        ctxt = context.get_admin_context()
+        timings = scheduler_rpcapi.SchedulerAPI().get_timings(ctxt, host,
+                                                              reset=reset)
+        print_format = "%-8s %-36s %8s %10s %10s %10s %10s %10s"
+        print(print_format % (_('Kind'), _('Name'), _('Count'), _('Average'),
+                              _('Max'), _('50%'), _('95%'), _('99%')))
+        for kind in (scheduler_timings.PHASE, scheduler_timings.FILTER,
+                     scheduler_timings.WEIGHER):
+            for name, histogram in sorted(timings.get(kind, {}).items()):
+                average = histogram['total'] / (histogram['count'] or 1)
+                print(print_format % (
+                    kind, name, histogram['count'],
+                    self._format_seconds(average),
+                    self._format_seconds(histogram['max']),
+                    self._format_seconds(
+                        scheduler_timings.percentile(histogram, 0.5)),
+                    self._format_seconds(
+                        scheduler_timings.percentile(histogram, 0.95)),
+                    self._format_seconds(
+                        scheduler_timings.percentile(histogram, 0.99))))
+
+
 class ServiceCommands(object):
     """Enable and disable running services."""
 
@@ -937,19 +981,110 @@ class DbCommands(object):
         """Print the current database version."""
         print(migration.db_version())
 
+    @staticmethod
+    def _load_checkpoint(path):
+        if path is None or not os.path.exists(path):
+            return {}
+        with open(path) as checkpoint:
+            return jsonutils.load(checkpoint)
+
+    @staticmethod
+    def _save_checkpoint(path, state):
+        # Written aside then renamed, not to leave a truncated checkpoint
+        # if interrupted.
+        with open(path + '.tmp', 'w') as checkpoint:
+            jsonutils.dump(state, checkpoint)
+        os.rename(path + '.tmp', path)
+
+    @staticmethod
+    def _format_progress(action, tablename, progress):
+        if progress.get('error'):
+            status = _('error')
+        elif progress['done']:
+            status = _('done')
+        else:
+            status = _('partial')
+        seconds = progress['seconds']
+        rate = progress['rows'] / seconds if seconds else 0
+        return "%-8s %-36s %10d %10.1f %10.1f %-8s" % (
+            action, tablename, progress['rows'], seconds, rate, status)
+
     @args('--max_rows', metavar='<number>',
             help='Maximum number of deleted rows to archive')
-    def archive_deleted_rows(self, max_rows):
+    @args('--batch_size', metavar='<number>',
+          help='Number of rows archived in each transaction, 1000 by '
+               'default')
+    @args('--workers', metavar='<number>',
+          help='Number of tables archived in parallel, 4 by default')
+    @args('--checkpoint', metavar='<path>',
+          help='File recording the progress, to resume an interrupted run')
+    @args('--purge_older_than', metavar='<days>',
+          help='Also delete the rows deleted more than this number of days '
+               'ago from the shadow tables')
+    @args('--verbose', action='store_true', dest='verbose', default=False,
+          help='Print the progress of each table after each batch')
+    def archive_deleted_rows(self, max_rows=None, batch_size=1000, workers=4,
+                             checkpoint=None, purge_older_than=None,
+                             verbose=False):
         """Move up to max_rows deleted rows from production tables to shadow
-        tables.
+        tables, and optionally purge the old rows of the shadow tables.
         """
-        if max_rows is not None:
-            max_rows = int(max_rows)
-            if max_rows < 0:
-                print(_("Must supply a positive value for max_rows"))
-                return(1)
+        values = {}
+        for name, value, minimum in (('max_rows', max_rows, 0),
+                                     ('batch_size', batch_size, 1),
+                                     ('workers', workers, 1),
+                                     ('purge_older_than', purge_older_than,
+                                      0)):
+            if value is not None:
+                value = int(value)
+                if value < minimum:
+                    print(_("Must supply a positive value for %s") % name)
+                    return(1)
+            values[name] = value
+
+        state = self._load_checkpoint(checkpoint)
+        print_format = "%-8s %-36s %10s %10s %10s %-8s"
+        header = print_format % (_('Action'), _('Table'), _('Rows'),
+                                 _('Seconds'), _('Rows/s'), _('Status'))
+
+        def _progress(action):
+            def _report(tablename, progress):
+                if checkpoint is not None:
+                    self._save_checkpoint(checkpoint, state)
+                if verbose:
+                    print(self._format_progress(action, tablename, progress))
+            return _report
+
+        if verbose:
+            print(header)
         admin_context = context.get_admin_context()
-        db.archive_deleted_rows(admin_context, max_rows)
+        archived = db.archive_deleted_rows_parallel(
+            admin_context, batch_size=values['batch_size'],
+            workers=values['workers'], max_rows=values['max_rows'],
+            state=state.setdefault('archive', {}),
+            progress=_progress('archive'))
+        results = [('archive', archived)]
+        if values['purge_older_than'] is not None:
+            before = timeutils.utcnow() - datetime.timedelta(
+                days=values['purge_older_than'])
+            purged = db.purge_shadow_tables(
+                admin_context, before, batch_size=values['batch_size'],
+                workers=values['workers'],
+                state=state.setdefault('purge', {}),
+                progress=_progress('purge'))
+            results.append(('purge', purged))
+
+        print(header)
+        for action, result in results:
+            for tablename, progress in sorted(result['tables'].items()):
+                if progress['rows'] or progress.get('error'):
+                    print(self._format_progress(action, tablename, progress))
+        if checkpoint is not None:
+            if all(result['complete'] for action, result in results):
+                if os.path.exists(checkpoint):
+                    os.remove(checkpoint)
+            else:
+                self._save_checkpoint(checkpoint, state)
 
     @args('--delete', action='store_true', dest='delete',
           help='If specified, automatically delete any records found where '
@@ -1263,6 +1398,7 @@ CATEGORIES = {
     'logs': GetLogCommands,
     'network': NetworkCommands,
     'project': ProjectCommands,
+    'scheduler': SchedulerCommands,
     'service': ServiceCommands,
     'shell': ShellCommands,
     'vm': VmCommands,
@@ -89,6 +89,7 @@ from nova.virt import block_device as driver_block_device
 from nova.virt import configdrive
 from nova.virt import driver
 from nova.virt import event as virtevent
+from nova.virt import imagecache
 from nova.virt import storage_users
 from nova.virt import virtapi
 from nova import volume
@@ -126,11 +127,38 @@ compute_opts = [
                help="Number of times to retry network allocation on failures"),
     cfg.IntOpt('max_concurrent_builds',
                default=10,
-               help='Maximum number of instance builds to run concurrently'),
+               help='Maximum number of instance builds to run concurrently. '
+                    'When max_concurrent_spawns is set, a build gives its '
+                    'slot back before it spawns its instance, so that the '
+                    'next builds prepare their images, networks and block '
+                    'devices meanwhile. Each stage of the builds is limited '
+                    'by its own max_concurrent_* option, 0 meaning '
+                    'unlimited, and the counters of the limited stages are '
+                    'logged every build_stage_stats_interval seconds.'),
+    cfg.IntOpt('max_concurrent_image_prefetches',
+               default=5,
+               help='Maximum number of builds fetching the image of their '
+                    'instance ahead of its spawn concurrently'),
+    cfg.IntOpt('max_concurrent_network_allocations',
+               default=10,
+               help='Maximum number of builds allocating the networks of '
+                    'their instance concurrently'),
+    cfg.IntOpt('max_concurrent_block_device_preps',
+               default=10,
+               help='Maximum number of builds preparing the block devices '
+                    'of their instance concurrently'),
+    cfg.IntOpt('max_concurrent_spawns',
+               default=10,
+               help='Maximum number of builds spawning their instance '
+                    'concurrently'),
     cfg.IntOpt('block_device_allocate_retries',
                default=60,
                help='Number of times to retry block device'
-                    ' allocation on failures')
+                    ' allocation on failures'),
+    cfg.IntOpt('sync_power_state_pool_size',
+               default=1000,
+               help='Maximum number of instances whose power state is '
+                    'synchronized concurrently'),
     ]
 
 interval_opts = [
@@ -148,6 +176,14 @@ interval_opts = [
                default=60,
                help="Number of seconds between instance network information "
                     "cache updates"),
+    cfg.FloatOpt("heal_instance_info_cache_rate",
+                 default=0,
+                 help="Number of instances per second whose network "
+                      "information cache is checked by the cache updates. "
+                      "The ports of the instances of each update are listed "
+                      "at once and only the stale caches are refreshed. "
+                      "With 0, the cache of a single instance is refreshed "
+                      "by each update."),
     cfg.IntOpt('reclaim_instance_interval',
                default=0,
                help='Interval in seconds for reclaiming deleted instances'),
@@ -169,6 +205,11 @@ interval_opts = [
                help='Interval in seconds for retrying failed instance file '
                     'deletes. Set to -1 to disable. '
                     'Setting this to 0 will run at the default rate.'),
+    cfg.IntOpt('build_stage_stats_interval',
+               default=600,
+               help='Interval in seconds for logging the counters of the '
+                    'limited instance build stages. Set to -1 to disable. '
+                    'Setting this to 0 will run at the default rate.'),
     cfg.IntOpt('block_device_allocate_retries_interval',
                default=3,
                help='Waiting time interval (seconds) between block'
@@ -676,7 +717,8 @@ class ComputeManager(manager.Manager):
         self.scheduler_client = scheduler_client.SchedulerClient()
         self._resource_tracker_dict = {}
         self.instance_events = InstanceEvents()
-        self._sync_power_pool = eventlet.GreenPool()
+        self._sync_power_pool = eventlet.GreenPool(
+            CONF.sync_power_state_pool_size)
         self._syncs_in_progress = {}
         self.send_instance_updates = CONF.scheduler_tracks_instance_changes
         if CONF.max_concurrent_builds != 0:
@@ -684,6 +726,16 @@ class ComputeManager(manager.Manager):
                 CONF.max_concurrent_builds)
         else:
             self._build_semaphore = compute_utils.UnlimitedSemaphore()
+        self._build_slots = {}
+        self._build_stages = {
+            'image': compute_utils.BuildStage(
+                'image', CONF.max_concurrent_image_prefetches),
+            'network': compute_utils.BuildStage(
+                'network', CONF.max_concurrent_network_allocations),
+            'block_device': compute_utils.BuildStage(
+                'block_device', CONF.max_concurrent_block_device_preps),
+            'spawn': compute_utils.BuildStage(
+                'spawn', CONF.max_concurrent_spawns)}
 
         super(ComputeManager, self).__init__(service_name="compute",
                                              *args, **kwargs)
@@ -1517,12 +1569,13 @@ class ComputeManager(manager.Manager):
         retry_time = 1
         for attempt in range(1, attempts + 1):
             try:
-                nwinfo = self.network_api.allocate_for_instance(
-                        context, instance, vpn=is_vpn,
-                        requested_networks=requested_networks,
-                        macs=macs,
-                        security_groups=security_groups,
-                        dhcp_options=dhcp_options)
+                with self._build_stages['network']:
+                    nwinfo = self.network_api.allocate_for_instance(
+                            context, instance, vpn=is_vpn,
+                            requested_networks=requested_networks,
+                            macs=macs,
+                            security_groups=security_groups,
+                            dhcp_options=dhcp_options)
                 LOG.debug('Instance network_info: |%s|', nwinfo,
                           instance=instance)
                 instance.system_metadata['network_allocated'] = 'True'
@@ -1830,8 +1883,12 @@ class ComputeManager(manager.Manager):
             # locked because we could wait in line to build this instance
             # for a while and we want to make sure that nothing else tries
             # to do anything with this instance while we wait.
-            with self._build_semaphore:
-                self._do_build_and_run_instance(*args, **kwargs)
+            with compute_utils.BuildSlot(self._build_semaphore) as slot:
+                self._build_slots[instance.uuid] = slot
+                try:
+                    self._do_build_and_run_instance(*args, **kwargs)
+                finally:
+                    self._build_slots.pop(instance.uuid, None)
 
         # NOTE(danms): We spawn here to return the RPC worker thread back to
         # the pool. Since what follows could take a really long time, we don't
@@ -1976,10 +2033,18 @@ class ComputeManager(manager.Manager):
                             task_states.BLOCK_DEVICE_MAPPING)
                     block_device_info = resources['block_device_info']
                     network_info = resources['network_info']
-                    self.driver.spawn(context, instance, image,
-                                      injected_files, admin_password,
-                                      network_info=network_info,
-                                      block_device_info=block_device_info)
+                    spawn_stage = self._build_stages['spawn']
+                    if spawn_stage.limit:
+                        # NOTE: The spawns are limited on their own, let the
+                        # next build prepare while this one waits to spawn.
+                        slot = self._build_slots.get(instance.uuid)
+                        if slot is not None:
+                            slot.release()
+                    with spawn_stage:
+                        self.driver.spawn(context, instance, image,
+                                          injected_files, admin_password,
+                                          network_info=network_info,
+                                          block_device_info=block_device_info)
         except (exception.InstanceNotFound,
                 exception.UnexpectedDeletingTaskStateError) as e:
             with excutils.save_and_reraise_exception():
@@ -2047,11 +2112,36 @@ class ComputeManager(manager.Manager):
                 extra_usage_info={'message': _('Success')},
                 network_info=network_info)
 
+    def _prefetch_image(self, context, instance, image, block_device_mapping):
+        """Fetch the image of an instance in the background while its
+        networks and block devices are prepared.
+
+        Returns the greenthread fetching the image, or None when the
+        instance is booted from a volume. A failed prefetch is only logged,
+        the spawn fetches the image again and reports the failure.
+        """
+        root_bdm = block_device.get_root_bdm(block_device_mapping)
+        if not instance.image_ref or (root_bdm is not None and
+                root_bdm.get('destination_type') == 'volume'):
+            return None
+
+        def _do_prefetch_image():
+            try:
+                with self._build_stages['image']:
+                    self.driver.prefetch_image(context, instance, image)
+            except Exception:
+                LOG.warning(_LW('Failed to prefetch the image of the '
+                                'instance'), instance=instance, exc_info=True)
+
+        return utils.spawn(_do_prefetch_image)
+
     @contextlib.contextmanager
     def _build_resources(self, context, instance, requested_networks,
             security_groups, image, block_device_mapping):
         resources = {}
         network_info = None
+        prefetch = self._prefetch_image(context, instance, image,
+                                        block_device_mapping)
         try:
             network_info = self._build_networks_for_instance(context, instance,
                     requested_networks, security_groups)
@@ -2081,9 +2171,12 @@ class ComputeManager(manager.Manager):
             instance.task_state = task_states.BLOCK_DEVICE_MAPPING
             instance.save()
 
-            block_device_info = self._prep_block_device(context, instance,
-                    block_device_mapping)
+            with self._build_stages['block_device']:
+                block_device_info = self._prep_block_device(context,
+                        instance, block_device_mapping)
             resources['block_device_info'] = block_device_info
+            if prefetch is not None:
+                prefetch.wait()
         except (exception.InstanceNotFound,
                 exception.UnexpectedDeletingTaskStateError):
             with excutils.save_and_reraise_exception():
@@ -5224,6 +5317,10 @@ class ComputeManager(manager.Manager):
         if not heal_interval:
             return
 
+        if CONF.heal_instance_info_cache_rate > 0:
+            self._heal_instance_info_caches(context, heal_interval)
+            return
+
         instance_uuids = getattr(self, '_instance_uuids_to_heal', [])
         instance = None
 
@@ -5301,6 +5398,72 @@ class ComputeManager(manager.Manager):
             LOG.debug("Didn't find any instances for network info cache "
                       "update.")
 
+    def _heal_instance_info_caches(self, context, heal_interval):
+        """Check the info_cache's network information of the next batch of
+        instances of the list, so that heal_instance_info_cache_rate
+        instances are checked per second, and refresh the stale ones.
+        """
+        batch_size = max(
+            int(CONF.heal_instance_info_cache_rate * heal_interval), 1)
+        instance_uuids = getattr(self, '_instance_uuids_to_heal', [])
+
+        LOG.debug('Starting heal instance info caches')
+
+        if not instance_uuids:
+            LOG.debug('Rebuilding the list of instances to heal')
+            db_instances = objects.InstanceList.get_by_host(
+                context, self.host, expected_attrs=[], use_slave=True)
+            instance_uuids = [inst.uuid for inst in db_instances]
+            self._instance_uuids_to_heal = instance_uuids
+
+        batch_uuids = instance_uuids[:batch_size]
+        del instance_uuids[:batch_size]
+        if not batch_uuids:
+            LOG.debug("Didn't find any instances for network info cache "
+                      "update.")
+            return
+
+        filters = {'uuid': batch_uuids, 'deleted': False}
+        db_instances = objects.InstanceList.get_by_filters(
+            context, filters, expected_attrs=['system_metadata', 'info_cache'],
+            use_slave=True)
+        instances = []
+        for inst in db_instances:
+            if inst.host != self.host:
+                LOG.debug('Skipping network cache update for instance '
+                          'because it has been migrated to another '
+                          'host.', instance=inst)
+            elif inst.vm_state == vm_states.BUILDING:
+                LOG.debug('Skipping network cache update for instance '
+                          'because it is Building.', instance=inst)
+            elif inst.task_state == task_states.DELETING:
+                LOG.debug('Skipping network cache update for instance '
+                          'because it is being deleted.', instance=inst)
+            else:
+                instances.append(inst)
+
+        try:
+            healed = self.network_api.heal_instance_info_caches(context,
+                                                                instances)
+        except Exception:
+            LOG.error(_LE('An error occurred while refreshing the network '
+                          'caches.'), exc_info=True)
+            return
+        LOG.debug('Updated the network info_cache for %(healed)d of '
+                  '%(checked)d instances',
+                  {'healed': len(healed), 'checked': len(instances)})
+
+    @periodic_task.periodic_task(spacing=CONF.build_stage_stats_interval)
+    def _log_build_stage_stats(self, context):
+        """Log the counters of the limited build stages."""
+        for name, stage in sorted(self._build_stages.items()):
+            if not stage.limit:
+                continue
+            LOG.info(_LI('Build stage %(stage)s: limit %(limit)d, '
+                         '%(running)d running, %(waiting)d waiting (at most '
+                         '%(max_waiting)d), %(completed)d completed'),
+                     dict(stage.get_stats(), stage=name))
+
     @periodic_task.periodic_task
     def _poll_rebooting_instances(self, context):
         if CONF.reboot_timeout > 0:
@@ -5461,11 +5624,12 @@ class ComputeManager(manager.Manager):
             return
 
         begin, end = utils.last_completed_audit_period()
-        instances = objects.InstanceList.get_active_by_window_joined(
+        num_instances = objects.InstanceList.get_count_active_by_window(
+            context, begin, end, host=self.host, use_slave=True)
+        instances = objects.InstanceList.iter_active_by_window_joined(
             context, begin, end, host=self.host,
             expected_attrs=['system_metadata', 'info_cache', 'metadata'],
             use_slave=True)
-        num_instances = len(instances)
         errors = 0
         successes = 0
         LOG.info(_LI("Running instance usage audit for"
@@ -5651,12 +5815,24 @@ class ComputeManager(manager.Manager):
         number of virtual machines known by the database, we proceed in a lazy
         loop, one database record at a time, checking if the hypervisor has the
         same power state as is in the database.
+
+        If the driver can return the power states of all its instances at
+        once, only the instances whose power state does not match the
+        database are synchronized.
         """
         db_instances = objects.InstanceList.get_by_host(context, self.host,
                                                         expected_attrs=[],
                                                         use_slave=True)
 
-        num_vm_instances = self.driver.get_num_instances()
+        try:
+            vm_power_states = self.driver.get_power_states()
+        except NotImplementedError:
+            vm_power_states = None
+
+        if vm_power_states is not None:
+            num_vm_instances = len(vm_power_states)
+        else:
+            num_vm_instances = self.driver.get_num_instances()
         num_db_instances = len(db_instances)
 
         if num_vm_instances != num_db_instances:
@@ -5685,6 +5861,14 @@ class ComputeManager(manager.Manager):
             self._syncs_in_progress.pop(db_instance.uuid)
 
         for db_instance in db_instances:
+            if vm_power_states is not None:
+                vm_power_state = vm_power_states.get(db_instance.uuid,
+                                                     power_state.NOSTATE)
+                if (db_instance.task_state is not None or
+                        self._power_state_in_sync(db_instance,
+                                                  vm_power_state)):
+                    continue
+
             # process syncs asynchronously - don't want instance locking to
             # block entire periodic task thread
             uuid = db_instance.uuid
@@ -5719,6 +5903,29 @@ class ComputeManager(manager.Manager):
             # silently ignore.
             pass
 
+    @staticmethod
+    def _power_state_in_sync(db_instance, vm_power_state):
+        """Check whether _sync_instance_power_state would leave the instance
+        as it is, given the power state of the hypervisor.
+        """
+        if vm_power_state != db_instance.power_state:
+            return False
+        vm_state = db_instance.vm_state
+        if vm_state == vm_states.ACTIVE:
+            return vm_power_state == power_state.RUNNING
+        elif vm_state == vm_states.STOPPED:
+            return vm_power_state in (power_state.NOSTATE,
+                                      power_state.SHUTDOWN,
+                                      power_state.CRASHED)
+        elif vm_state == vm_states.PAUSED:
+            return vm_power_state not in (power_state.SHUTDOWN,
+                                          power_state.CRASHED)
+        elif vm_state in (vm_states.SOFT_DELETED,
+                          vm_states.DELETED):
+            return vm_power_state in (power_state.NOSTATE,
+                                      power_state.SHUTDOWN)
+        return True
+
     def _sync_instance_power_state(self, context, db_instance, vm_power_state,
                                    use_slave=False):
         """Align instance power state between the database and hypervisor.
@@ -6179,8 +6386,8 @@ class ComputeManager(manager.Manager):
         filters = {'deleted': False,
                    'soft_deleted': True,
                    'host': nodes}
-        filtered_instances = objects.InstanceList.get_by_filters(context,
-                                 filters, expected_attrs=[], use_slave=True)
+        filtered_instances = objects.InstanceList.get_projected_by_filters(
+            context, filters, imagecache.INSTANCE_FIELDS, use_slave=True)
 
         self.driver.manage_image_cache(context, filtered_instances)
 
@@ -24,6 +24,7 @@ from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_serialization import jsonutils
 from oslo_utils import importutils
+import six
 
 from nova.compute import claims
 from nova.compute import monitors
@@ -53,6 +54,14 @@ resource_tracker_opts = [
     cfg.ListOpt('compute_resources',
                 default=['vcpu'],
                 help='The names of the extra resources to track.'),
+    cfg.BoolOpt('incremental_resource_tracking',
+                default=False,
+                help='Only recompute the resource usage of the node in the '
+                     'periodic audit when its instances, migrations or '
+                     'hypervisor resources changed since the usage was '
+                     'last computed. The claims and the instance changes '
+                     'reported to the tracker are applied to the usage as '
+                     'they happen.'),
 ]
 
 CONF = cfg.CONF
@@ -63,6 +72,16 @@ COMPUTE_RESOURCE_SEMAPHORE = "compute_resources"
 
 CONF.import_opt('my_ip', 'nova.netconf')
 
+# The fields of the compute node computed from the usage of the instances,
+# migrations and orphans rather than copied from the virt driver
+_USAGE_FIELDS = ('vcpus_used', 'memory_mb_used', 'local_gb_used',
+                 'free_ram_mb', 'free_disk_gb', 'current_workload',
+                 'running_vms', 'numa_topology')
+
+# The hypervisor resources the usage is computed against
+_USAGE_RESOURCES = ('vcpus', 'memory_mb', 'local_gb', 'numa_topology',
+                    'stats')
+
 
 class ResourceTracker(object):
     """Compute helper class for keeping track of resource usage as instances
@@ -79,6 +98,13 @@ class ResourceTracker(object):
         self.stats = importutils.import_object(CONF.compute_stats_class)
         self.tracked_instances = {}
         self.tracked_migrations = {}
+        # The times the instances and migrations the usage accounts for last
+        # changed, None until they are read back from the database, and the
+        # hypervisor resources and orphans the last audit computed the usage
+        # against, with incremental_resource_tracking
+        self._accounted_instances = {}
+        self._accounted_migrations = {}
+        self._accounted_resources = None
         self.conductor_api = conductor.API()
         monitor_handler = monitors.ResourceMonitorHandler()
         self.monitors = monitor_handler.choose_monitors(self)
@@ -182,6 +208,8 @@ class ResourceTracker(object):
         migration = self._create_migration(context, instance,
                                            instance_type)
         claim.migration = migration
+        if CONF.incremental_resource_tracking:
+            self._accounted_migrations[migration.id] = None
 
         # Mark the resources in-use for the resize landing on this
         # compute host:
@@ -239,6 +267,8 @@ class ResourceTracker(object):
         """Remove usage for an incoming/outgoing migration."""
         if instance['uuid'] in self.tracked_migrations:
             migration, itype = self.tracked_migrations.pop(instance['uuid'])
+            if CONF.incremental_resource_tracking:
+                self._accounted_migrations.pop(migration.id, None)
 
             if not instance_type:
                 ctxt = context.elevated()
@@ -409,6 +439,14 @@ class ResourceTracker(object):
     @utils.synchronized(COMPUTE_RESOURCE_SEMAPHORE)
     def _update_available_resource(self, context, resources):
 
+        # keep the usage accounted since the last audit, initialising the
+        # compute node resets it to the view of the virt driver
+        usage = None
+        if (CONF.incremental_resource_tracking and
+                self._accounted_resources is not None and
+                not self.disabled):
+            usage = self._get_usage_snapshot()
+
         # initialise the compute node object, creating it
         # if it does not already exist.
         self._init_compute_node(context, resources)
@@ -434,6 +472,46 @@ class ResourceTracker(object):
                                                              node_id=n_id)
             self.pci_tracker.set_hvdevs(devs)
 
+        if usage is not None and self._usage_is_current(context, resources):
+            # nothing the usage depends on changed since it was computed
+            self._restore_usage_snapshot(usage)
+        else:
+            self._update_usage_from_node(context, resources)
+
+        if self.pci_tracker:
+            dev_pools_obj = self.pci_tracker.stats.to_device_pools_obj()
+            self.compute_node.pci_device_pools = dev_pools_obj
+        else:
+            self.compute_node.pci_device_pools = objects.PciDevicePoolList()
+
+        self._report_final_resource_view()
+
+        metrics = self._get_host_metrics(context, self.nodename)
+        # TODO(pmurray): metrics should not be a json string in ComputeNode,
+        # but it is. This should be changed in ComputeNode
+        self.compute_node.metrics = jsonutils.dumps(metrics)
+
+        # update the compute_node
+        self._update(context)
+        LOG.info(_LI('Compute_service record updated for %(host)s:%(node)s'),
+                     {'host': self.host, 'node': self.nodename})
+
+    @staticmethod
+    def _filter_tracked_migrations(migrations):
+        """Returns the resize and migrate migrations among the migrations
+        in progress on this node.
+        """
+        # Only look at resize/migrate migration records
+        # NOTE(danms): RT should probably examine live migration
+        # records as well and do something smart. However, ignore
+        # those for now to avoid them being included in below calculations.
+        return [migration for migration in migrations
+                if migration.migration_type in ('resize', 'migrate')]
+
+    def _update_usage_from_node(self, context, resources):
+        """Recompute the usage from the instances, migrations and orphans
+        of the node.
+        """
         # Grab all instances assigned to this node:
         instances = objects.InstanceList.get_by_host_and_node(
             context, self.host, self.nodename,
@@ -444,15 +522,10 @@ class ResourceTracker(object):
         self._update_usage_from_instances(context, instances)
 
         # Grab all in-progress migrations:
-        migrations = objects.MigrationList.get_in_progress_by_host_and_node(
-                context, self.host, self.nodename)
-
-        # Only look at resize/migrate migration records
-        # NOTE(danms): RT should probably examine live migration
-        # records as well and do something smart. However, ignore
-        # those for now to avoid them being included in below calculations.
-        migrations = [migration for migration in migrations
-                      if migration.migration_type in ('resize', 'migrate')]
+        all_migrations = (
+            objects.MigrationList.get_in_progress_by_host_and_node(
+                context, self.host, self.nodename))
+        migrations = self._filter_tracked_migrations(all_migrations)
 
         self._update_usage_from_migrations(context, migrations)
 
@@ -467,22 +540,83 @@ class ResourceTracker(object):
         # from deleted instances.
         if self.pci_tracker:
             self.pci_tracker.clean_usage(instances, migrations, orphans)
-            dev_pools_obj = self.pci_tracker.stats.to_device_pools_obj()
-            self.compute_node.pci_device_pools = dev_pools_obj
-        else:
-            self.compute_node.pci_device_pools = objects.PciDevicePoolList()
 
-        self._report_final_resource_view()
+        if CONF.incremental_resource_tracking:
+            # NOTE: The rows read here are the ones the next audits compare
+            # the summaries of the node with.
+            self._accounted_instances = {
+                instance.uuid: self._get_changed_at(instance)
+                for instance in instances
+                if instance.vm_state != vm_states.DELETED}
+            self._accounted_migrations = {
+                migration.id: self._get_changed_at(migration)
+                for migration in all_migrations}
+            self._accounted_resources = self._get_resources_key(resources,
+                                                                orphans)
+
+    def _usage_is_current(self, context, resources):
+        """Check that the instances, migrations and orphans of the node and
+        its hypervisor resources are still the ones the usage accounts for.
+
+        The claims and drops keep the accounted instances and migrations up
+        to date, so only their number and the time the last of them changed
+        are read from the database, with an aggregate query each.
+        """
+        for accounted in (self._accounted_instances,
+                          self._accounted_migrations):
+            if None in six.itervalues(accounted):
+                # a claim changed some rows since they were last read
+                return False
+
+        summary = objects.InstanceList.get_summary_by_host_and_node(
+            context, self.host, self.nodename)
+        if summary != self._get_summary(self._accounted_instances):
+            return False
+
+        summary = (
+            objects.MigrationList.get_in_progress_summary_by_host_and_node(
+                context, self.host, self.nodename))
+        if summary != self._get_summary(self._accounted_migrations):
+            return False
 
-        metrics = self._get_host_metrics(context, self.nodename)
-        # TODO(pmurray): metrics should not be a json string in ComputeNode,
-        # but it is. This should be changed in ComputeNode
-        self.compute_node.metrics = jsonutils.dumps(metrics)
+        orphans = self._find_orphaned_instances()
+        return (self._get_resources_key(resources, orphans) ==
+                self._accounted_resources)
 
-        # update the compute_node
-        self._update(context)
-        LOG.info(_LI('Compute_service record updated for %(host)s:%(node)s'),
-                     {'host': self.host, 'node': self.nodename})
+    @staticmethod
+    def _get_changed_at(obj):
+        """Returns the time a row was last created or updated, with the
+        precision of the summaries.
+        """
+        changed_at = obj.updated_at or obj.created_at
+        return changed_at and changed_at.replace(microsecond=0)
+
+    @staticmethod
+    def _get_summary(accounted):
+        """Returns the summary the database gives for the accounted rows."""
+        if not accounted:
+            return 0, None
+        return len(accounted), max(six.itervalues(accounted))
+
+    @staticmethod
+    def _get_resources_key(resources, orphans):
+        resources_key = tuple(copy.deepcopy(resources.get(key))
+                              for key in _USAGE_RESOURCES)
+        orphans_key = frozenset((orphan['uuid'], orphan['memory_mb'])
+                                for orphan in orphans)
+        return resources_key, orphans_key
+
+    def _get_usage_snapshot(self):
+        """Returns the usage of the compute node and the stats."""
+        fields = {field: self.compute_node[field]
+                  for field in _USAGE_FIELDS
+                  if self.compute_node.obj_attr_is_set(field)}
+        return fields, copy.deepcopy(self.stats)
+
+    def _restore_usage_snapshot(self, usage):
+        fields, self.stats = usage
+        for field, value in fields.items():
+            self.compute_node[field] = value
 
     def _get_compute_node(self, context):
         """Returns compute node for the host and nodename."""
@@ -742,6 +876,12 @@ class ResourceTracker(object):
             self.tracked_instances.pop(uuid)
             sign = -1
 
+        if CONF.incremental_resource_tracking:
+            if is_deleted_instance:
+                self._accounted_instances.pop(uuid, None)
+            else:
+                self._accounted_instances[uuid] = None
+
         self.stats.update_stats_for_instance(instance)
 
         if self.pci_tracker:
@@ -766,6 +906,7 @@ class ResourceTracker(object):
         currently powered on.
         """
         self.tracked_instances.clear()
+        self._accounted_instances.clear()
 
         # set some initial values, reserve room for host/hypervisor:
         self.compute_node.local_gb_used = CONF.reserved_host_disk_mb / 1024
@@ -18,6 +18,7 @@ import itertools
 import string
 import traceback
 
+import eventlet.semaphore
 import netifaces
 from oslo_config import cfg
 from oslo_log import log
@@ -470,9 +471,88 @@ class UnlimitedSemaphore(object):
     def __enter__(self):
         pass
 
-    def __exit__(self):
+    def __exit__(self, exc_type, exc_val, exc_tb):
         pass
 
     @property
     def balance(self):
         return 0
+
+
+class BuildSlot(object):
+    """Context manager holding a slot of the builds admitted by a
+    semaphore, which the build may give back with release() before it is
+    done.
+    """
+
+    def __init__(self, semaphore):
+        self._semaphore = semaphore
+        self.held = False
+
+    def __enter__(self):
+        self._semaphore.__enter__()
+        self.held = True
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+        return False
+
+    def release(self):
+        if self.held:
+            self.held = False
+            self._semaphore.__exit__(None, None, None)
+
+
+class BuildStage(object):
+    """Context manager limiting the number of builds running a stage of
+    the instance build concurrently.
+
+    A limit of 0 or less leaves the stage unlimited. The number of builds
+    waiting to enter the stage and running it are kept, with the most
+    builds which waited at once, and reported by get_stats().
+    """
+
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = max(limit, 0)
+        if limit > 0:
+            self._semaphore = eventlet.semaphore.Semaphore(limit)
+        else:
+            self._semaphore = None
+        self.waiting = 0
+        self.max_waiting = 0
+        self.running = 0
+        self.completed = 0
+
+    def __enter__(self):
+        if self._semaphore is not None and self._semaphore.locked():
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+            LOG.debug('Waiting for the %(stage)s build stage, %(waiting)d '
+                      'build(s) waiting and %(running)d running',
+                      {'stage': self.name, 'waiting': self.waiting,
+                       'running': self.running})
+            try:
+                self._semaphore.acquire()
+            finally:
+                self.waiting -= 1
+        elif self._semaphore is not None:
+            self._semaphore.acquire()
+        self.running += 1
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.running -= 1
+        self.completed += 1
+        if self._semaphore is not None:
+            self._semaphore.release()
+        return False
+
+    def get_stats(self):
+        """Return the counters of the stage in a dict."""
+        return {'limit': self.limit,
+                'waiting': self.waiting,
+                'max_waiting': self.max_waiting,
+                'running': self.running,
+                'completed': self.completed}
@@ -209,6 +209,19 @@ def compute_node_get_all(context):
     return IMPL.compute_node_get_all(context)
 
 
+def compute_node_get_all_changed_since(context, since):
+    """Get computeNodes created, updated or deleted since a given time.
+
+    :param context: The security context
+    :param since: Datetime after which a change to a compute node is
+                  reported
+
+    :returns: List of dictionaries each containing compute node properties,
+              including soft-deleted compute nodes
+    """
+    return IMPL.compute_node_get_all_changed_since(context, since)
+
+
 def compute_node_get_all_by_host(context, host, use_slave=False):
     """Get compute nodes by host name
 
@@ -479,6 +492,14 @@ def migration_get_in_progress_by_host_and_node(context, host, node):
     return IMPL.migration_get_in_progress_by_host_and_node(context, host, node)
 
 
+def migration_get_in_progress_summary_by_host_and_node(context, host, node):
+    """Get the number of migrations in progress for the given host + node
+    and the time the last of them changed.
+    """
+    return IMPL.migration_get_in_progress_summary_by_host_and_node(
+        context, host, node)
+
+
 def migration_get_all_by_filters(context, filters):
     """Finds all migrations in progress."""
     return IMPL.migration_get_all_by_filters(context, filters)
@@ -673,30 +694,58 @@ def instance_get_all_by_filters(context, filters, sort_key='created_at',
 def instance_get_all_by_filters_sort(context, filters, limit=None,
                                      marker=None, columns_to_join=None,
                                      use_slave=False, sort_keys=None,
-                                     sort_dirs=None):
+                                     sort_dirs=None, columns=None):
     """Get all instances that match all filters sorted by multiple keys.
 
-    sort_keys and sort_dirs must be a list of strings.
+    sort_keys and sort_dirs must be a list of strings. marker is either the
+    uuid of the last instance of the previous page, or the continuation
+    token returned by instance_pagination_marker() for it. When columns is
+    given, only these columns and the id are read, and no table is joined.
     """
     return IMPL.instance_get_all_by_filters_sort(
         context, filters, limit=limit, marker=marker,
         columns_to_join=columns_to_join, use_slave=use_slave,
-        sort_keys=sort_keys, sort_dirs=sort_dirs)
+        sort_keys=sort_keys, sort_dirs=sort_dirs, columns=columns)
+
+
+def instance_pagination_marker(instance, sort_keys=None, sort_dirs=None):
+    """Get the continuation token of the page following an instance.
+
+    The token can be passed as the marker of
+    instance_get_all_by_filters_sort() with the same sort keys and
+    directions, which then doesn't need to look the marker instance up.
+    """
+    return IMPL.instance_pagination_marker(instance, sort_keys=sort_keys,
+                                           sort_dirs=sort_dirs)
 
 
 def instance_get_active_by_window_joined(context, begin, end=None,
                                          project_id=None, host=None,
                                          use_slave=False,
-                                         columns_to_join=None):
+                                         columns_to_join=None,
+                                         limit=None, marker=None):
     """Get instances and joins active during a certain time window.
 
     Specifying a project_id will filter for a certain project.
     Specifying a host will filter for instances on a given compute host.
+    When a limit or a marker is given, the instances are sorted by id and
+    marker must be the instance_pagination_marker() of the last instance
+    of the previous page, for the ['id'] sort key and 'asc' direction.
     """
     return IMPL.instance_get_active_by_window_joined(context, begin, end,
                                               project_id, host,
                                               use_slave=use_slave,
-                                              columns_to_join=columns_to_join)
+                                              columns_to_join=columns_to_join,
+                                              limit=limit, marker=marker)
+
+
+def instance_count_active_by_window(context, begin, end=None,
+                                    project_id=None, host=None,
+                                    use_slave=False):
+    """Get the number of instances active during a certain time window."""
+    return IMPL.instance_count_active_by_window(context, begin, end,
+                                                project_id, host,
+                                                use_slave=use_slave)
 
 
 def instance_get_all_by_host(context, host,
@@ -714,6 +763,13 @@ def instance_get_all_by_host_and_node(context, host, node,
         context, host, node, columns_to_join=columns_to_join)
 
 
+def instance_get_summary_by_host_and_node(context, host, node):
+    """Get the number of instances of a node and the time the last of them
+    changed.
+    """
+    return IMPL.instance_get_summary_by_host_and_node(context, host, node)
+
+
 def instance_get_all_by_host_and_not_type(context, host, type_id=None):
     """Get all instances belonging to a host with a different type_id."""
     return IMPL.instance_get_all_by_host_and_not_type(context, host, type_id)
@@ -1113,6 +1169,31 @@ def reservation_rollback(context, reservations, project_id=None, user_id=None):
                                      user_id=user_id)
 
 
+def quota_reserve_cas(context, resources, quotas, user_quotas, deltas,
+                      expire, until_refresh, max_age, project_id=None,
+                      user_id=None):
+    """Check quotas and create reservations without locking the usages."""
+    return IMPL.quota_reserve_cas(context, resources, quotas, user_quotas,
+                                  deltas, expire, until_refresh, max_age,
+                                  project_id=project_id, user_id=user_id)
+
+
+def reservation_commit_cas(context, reservations, project_id=None,
+                           user_id=None):
+    """Commit quota reservations without locking the usages."""
+    return IMPL.reservation_commit_cas(context, reservations,
+                                       project_id=project_id,
+                                       user_id=user_id)
+
+
+def reservation_rollback_cas(context, reservations, project_id=None,
+                             user_id=None):
+    """Roll back quota reservations without locking the usages."""
+    return IMPL.reservation_rollback_cas(context, reservations,
+                                         project_id=project_id,
+                                         user_id=user_id)
+
+
 def quota_destroy_all_by_project_and_user(context, project_id, user_id):
     """Destroy all quotas associated with a given project and user."""
     return IMPL.quota_destroy_all_by_project_and_user(context,
@@ -1901,6 +1982,29 @@ def archive_deleted_rows_for_table(context, tablename, max_rows=None):
                                                max_rows=max_rows)
 
 
+def archive_deleted_rows_parallel(context, batch_size=1000, workers=4,
+                                  max_rows=None, state=None, progress=None):
+    """Move the deleted rows to the shadow tables, in dependency order and
+    in batches, resuming from the state of a previous run.
+
+    :returns: the state, with the progress of each table.
+    """
+    return IMPL.archive_deleted_rows_parallel(
+        context, batch_size=batch_size, workers=workers, max_rows=max_rows,
+        state=state, progress=progress)
+
+
+def purge_shadow_tables(context, before, batch_size=1000, workers=4,
+                        state=None, progress=None):
+    """Delete the rows deleted before a date from the shadow tables.
+
+    :returns: the state, with the progress of each table.
+    """
+    return IMPL.purge_shadow_tables(context, before, batch_size=batch_size,
+                                    workers=workers, state=state,
+                                    progress=progress)
+
+
 ####################
 
 
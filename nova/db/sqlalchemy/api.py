@@ -44,9 +44,11 @@ from sqlalchemy import Integer
 from sqlalchemy import MetaData
 from sqlalchemy import or_
 from sqlalchemy.orm import aliased
+from sqlalchemy.orm import attributes as orm_attributes
 from sqlalchemy.orm import contains_eager
 from sqlalchemy.orm import joinedload
 from sqlalchemy.orm import joinedload_all
+from sqlalchemy.orm import load_only
 from sqlalchemy.orm import noload
 from sqlalchemy.orm import undefer
 from sqlalchemy.schema import Table
@@ -63,9 +65,13 @@ from nova import block_device
 from nova.compute import task_states
 from nova.compute import vm_states
 import nova.context
+from nova.db.sqlalchemy import archive
 from nova.db.sqlalchemy import models
+from nova.db.sqlalchemy import pagination
+from nova.db.sqlalchemy import routing
 from nova import exception
 from nova.i18n import _, _LI, _LE, _LW
+from nova import pagination as common_pagination
 from nova import quota
 
 db_opts = [
@@ -136,6 +142,7 @@ _ENGINE_FACADE = {'main': None, 'api': None}
 _MAIN_FACADE = 'main'
 _API_FACADE = 'api'
 _LOCK = threading.Lock()
+_ROUTER = None
 
 
 def _create_facade(conf_group):
@@ -168,7 +175,42 @@ def _create_facade_lazily(facade, conf_group):
     return _ENGINE_FACADE[facade]
 
 
+def _get_router():
+    global _ROUTER
+    if _ROUTER is None:
+        with _LOCK:
+            if _ROUTER is None:
+                _ROUTER = routing.Router.from_config(CONF.database)
+    return _ROUTER
+
+
+def _routing_enabled():
+    """Return True if the slaves are picked by the router.
+
+    Otherwise, use_slave reads go to the slave_connection of the engine
+    facade, without the health and lag checks of the router.
+    """
+    conf_group = CONF.database
+    return bool(conf_group.slave_read_routing or
+                conf_group.slave_connections)
+
+
+def _get_replica(use_slave):
+    """Return the slave database to use, or None for the master."""
+    replica = routing.current_replica()
+    if replica is None and use_slave:
+        replica = _get_router().pick()
+    if replica is routing.MASTER:
+        return None
+    return replica
+
+
 def get_engine(use_slave=False):
+    if _routing_enabled():
+        replica = _get_replica(use_slave)
+        if replica is not None:
+            return replica.engine
+        use_slave = False
     conf_group = CONF.database
     facade = _create_facade_lazily(_MAIN_FACADE, conf_group)
     return facade.get_engine(use_slave=use_slave)
@@ -181,6 +223,11 @@ def get_api_engine():
 
 
 def get_session(use_slave=False, **kwargs):
+    if _routing_enabled():
+        replica = _get_replica(use_slave)
+        if replica is not None:
+            return replica.get_session(**kwargs)
+        use_slave = False
     conf_group = CONF.database
     facade = _create_facade_lazily(_MAIN_FACADE, conf_group)
     return facade.get_session(use_slave=use_slave, **kwargs)
@@ -198,7 +245,13 @@ PER_PROJECT_QUOTAS = ['fixed_ips', 'floating_ips', 'networks']
 
 
 def get_backend():
-    """The backend is this module itself."""
+    """The backend is this module itself.
+
+    When slave_read_routing is enabled, it is wrapped to send the bulk reads
+    to the slave databases.
+    """
+    if CONF.database.slave_read_routing:
+        return routing.RoutingBackend(sys.modules[__name__], _get_router)
     return sys.modules[__name__]
 
 
@@ -606,6 +659,15 @@ def compute_node_get_all(context):
     return model_query(context, models.ComputeNode, read_deleted='no').all()
 
 
+def compute_node_get_all_changed_since(context, since):
+    since = timeutils.normalize_time(since)
+    return model_query(context, models.ComputeNode, read_deleted='yes').\
+            filter(or_(models.ComputeNode.created_at > since,
+                       models.ComputeNode.updated_at > since,
+                       models.ComputeNode.deleted_at > since)).\
+            all()
+
+
 def compute_node_search_by_hypervisor(context, hypervisor_match):
     field = models.ComputeNode.hypervisor_hostname
     return model_query(context, models.ComputeNode).\
@@ -1893,11 +1955,15 @@ def instance_get_all_by_filters(context, filters, sort_key, sort_dir,
 @require_context
 def instance_get_all_by_filters_sort(context, filters, limit=None, marker=None,
                                      columns_to_join=None, use_slave=False,
-                                     sort_keys=None, sort_dirs=None):
+                                     sort_keys=None, sort_dirs=None,
+                                     columns=None):
     """Return instances that match all filters sorted the the given keys.
     Deleted instances will be returned by default, unless there's a filter that
     says otherwise.
 
+    When a list of columns is given, only these columns (and the id) are read
+    and returned in plain dicts, without any joined table or metadata.
+
     Depending on the name of a filter, matching for that filter is
     performed using either exact matching or as regular expression
     matching. Exact matching is applied for the following filters::
@@ -1959,7 +2025,14 @@ def instance_get_all_by_filters_sort(context, filters, limit=None, marker=None,
 
     session = get_session(use_slave=use_slave)
 
-    if columns_to_join is None:
+    if columns is not None:
+        for column in columns:
+            if column not in models.Instance.__table__.columns:
+                msg = _("Unknown instance column %s") % column
+                raise exception.InvalidInput(reason=msg)
+        columns_to_join_new = []
+        manual_joins = []
+    elif columns_to_join is None:
         columns_to_join_new = ['info_cache', 'security_groups']
         manual_joins = ['metadata', 'system_metadata']
     else:
@@ -1967,6 +2040,8 @@ def instance_get_all_by_filters_sort(context, filters, limit=None, marker=None,
             _manual_join_columns(columns_to_join))
 
     query_prefix = session.query(models.Instance)
+    if columns is not None:
+        query_prefix = query_prefix.options(load_only(*columns))
     for column in columns_to_join_new:
         if 'extra.' in column:
             query_prefix = query_prefix.options(undefer(column))
@@ -2061,7 +2136,13 @@ def instance_get_all_by_filters_sort(context, filters, limit=None, marker=None,
     query_prefix = _tag_instance_filter(context, query_prefix, filters)
 
     # paginate query
-    if marker is not None:
+    marker_values = None
+    if common_pagination.is_marker_token(marker):
+        # NOTE: A continuation token carries the sort values of the last
+        # row, so there is no need to look the marker instance up.
+        marker_values = common_pagination.decode_marker(
+            marker, sort_keys, sort_dirs)
+    elif marker is not None:
         try:
             if deleted:
                 marker = _instance_get_by_uuid(
@@ -2072,18 +2153,28 @@ def instance_get_all_by_filters_sort(context, filters, limit=None, marker=None,
                                                marker, session=session)
         except exception.InstanceNotFound:
             raise exception.MarkerNotFound(marker)
+        marker_values = common_pagination.marker_values(marker, sort_keys)
     try:
-        query_prefix = sqlalchemyutils.paginate_query(query_prefix,
+        query_prefix = pagination.paginate_query(query_prefix,
                                models.Instance, limit,
-                               sort_keys,
-                               marker=marker,
-                               sort_dirs=sort_dirs)
+                               sort_keys, sort_dirs,
+                               marker_values=marker_values)
     except db_exc.InvalidSortKey:
         raise exception.InvalidSortKey()
 
+    if columns is not None:
+        columns = set(columns) | set(['id'])
+        return [{column: inst[column] for column in columns}
+                for inst in query_prefix.all()]
+
     return _instances_fill_metadata(context, query_prefix.all(), manual_joins)
 
 
+def instance_pagination_marker(instance, sort_keys=None, sort_dirs=None):
+    return common_pagination.get_marker(instance, sort_keys=sort_keys,
+                                         sort_dirs=sort_dirs)
+
+
 def _tag_instance_filter(context, query, filters):
     """Applies tag filtering to an Instance query.
 
@@ -2235,80 +2326,30 @@ def _exact_instance_filter(query, filters, legal_keys):
     return query
 
 
-def process_sort_params(sort_keys, sort_dirs,
-                        default_keys=['created_at', 'id'],
-                        default_dir='asc'):
-    """Process the sort parameters to include default keys.
-
-    Creates a list of sort keys and a list of sort directions. Adds the default
-    keys to the end of the list if they are not already included.
-
-    When adding the default keys to the sort keys list, the associated
-    direction is:
-    1) The first element in the 'sort_dirs' list (if specified), else
-    2) 'default_dir' value (Note that 'asc' is the default value since this is
-    the default in sqlalchemy.utils.paginate_query)
-
-    :param sort_keys: List of sort keys to include in the processed list
-    :param sort_dirs: List of sort directions to include in the processed list
-    :param default_keys: List of sort keys that need to be included in the
-                         processed list, they are added at the end of the list
-                         if not already specified.
-    :param default_dir: Sort direction associated with each of the default
-                        keys that are not supplied, used when they are added
-                        to the processed list
-    :returns: list of sort keys, list of sort directions
-    :raise exception.InvalidInput: If more sort directions than sort keys
-                                   are specified or if an invalid sort
-                                   direction is specified
-    """
-    # Determine direction to use for when adding default keys
-    if sort_dirs and len(sort_dirs) != 0:
-        default_dir_value = sort_dirs[0]
-    else:
-        default_dir_value = default_dir
-
-    # Create list of keys (do not modify the input list)
-    if sort_keys:
-        result_keys = list(sort_keys)
-    else:
-        result_keys = []
-
-    # If a list of directions is not provided, use the default sort direction
-    # for all provided keys
-    if sort_dirs:
-        result_dirs = []
-        # Verify sort direction
-        for sort_dir in sort_dirs:
-            if sort_dir not in ('asc', 'desc'):
-                msg = _("Unknown sort direction, must be 'desc' or 'asc'")
-                raise exception.InvalidInput(reason=msg)
-            result_dirs.append(sort_dir)
-    else:
-        result_dirs = [default_dir_value for _sort_key in result_keys]
-
-    # Ensure that the key and direction length match
-    while len(result_dirs) < len(result_keys):
-        result_dirs.append(default_dir_value)
-    # Unless more direction are specified, which is an error
-    if len(result_dirs) > len(result_keys):
-        msg = _("Sort direction size exceeds sort key size")
-        raise exception.InvalidInput(reason=msg)
+# NOTE: The sort parameters are also completed by the callers building the
+# continuation tokens, so this is shared with them.
+process_sort_params = common_pagination.process_sort_params
 
-    # Ensure defaults are included
-    for key in default_keys:
-        if key not in result_keys:
-            result_keys.append(key)
-            result_dirs.append(default_dir_value)
 
-    return result_keys, result_dirs
+def _instance_active_by_window_filter(query, begin, end=None,
+                                      project_id=None, host=None):
+    query = query.filter(or_(models.Instance.terminated_at == null(),
+                             models.Instance.terminated_at > begin))
+    if end:
+        query = query.filter(models.Instance.launched_at < end)
+    if project_id:
+        query = query.filter_by(project_id=project_id)
+    if host:
+        query = query.filter_by(host=host)
+    return query
 
 
 @require_context
 def instance_get_active_by_window_joined(context, begin, end=None,
                                          project_id=None, host=None,
                                          use_slave=False,
-                                         columns_to_join=None):
+                                         columns_to_join=None,
+                                         limit=None, marker=None):
     """Return instances and joins that were active during window."""
     session = get_session(use_slave=use_slave)
     query = session.query(models.Instance)
@@ -2326,18 +2367,39 @@ def instance_get_active_by_window_joined(context, begin, end=None,
         else:
             query = query.options(joinedload(column))
 
-    query = query.filter(or_(models.Instance.terminated_at == null(),
-                             models.Instance.terminated_at > begin))
-    if end:
-        query = query.filter(models.Instance.launched_at < end)
-    if project_id:
-        query = query.filter_by(project_id=project_id)
-    if host:
-        query = query.filter_by(host=host)
+    query = _instance_active_by_window_filter(query, begin, end,
+                                              project_id, host)
+
+    if limit is not None or marker is not None:
+        # NOTE: Pages are sorted by id, and the marker must be the
+        # continuation token returned by instance_pagination_marker() for
+        # these sort keys.
+        sort_keys, sort_dirs = process_sort_params(['id'], ['asc'])
+        marker_values = None
+        if marker is not None:
+            if not common_pagination.is_marker_token(marker):
+                raise exception.MarkerNotFound(marker=marker)
+            marker_values = common_pagination.decode_marker(
+                marker, sort_keys, sort_dirs)
+        query = pagination.paginate_query(query, models.Instance, limit,
+                                          sort_keys, sort_dirs,
+                                          marker_values=marker_values)
 
     return _instances_fill_metadata(context, query.all(), manual_joins)
 
 
+@require_context
+def instance_count_active_by_window(context, begin, end=None,
+                                    project_id=None, host=None,
+                                    use_slave=False):
+    """Return the number of instances that were active during window."""
+    session = get_session(use_slave=use_slave)
+    query = session.query(func.count(models.Instance.id))
+    query = _instance_active_by_window_filter(query, begin, end,
+                                              project_id, host)
+    return query.scalar()
+
+
 def _instance_get_all_query(context, project_only=False,
                             joins=None, use_slave=False):
     if joins is None:
@@ -2395,6 +2457,18 @@ def instance_get_all_by_host_and_node(context, host, node,
                 filter_by(node=node).all(), manual_joins=manual_joins)
 
 
+def instance_get_summary_by_host_and_node(context, host, node):
+    changed_at = func.coalesce(models.Instance.updated_at,
+                               models.Instance.created_at)
+    query = model_query(context, models.Instance,
+                        (func.count(models.Instance.id),
+                         func.max(changed_at)), read_deleted='no')
+    query = query.filter_by(host=host, node=node).\
+        filter(or_(models.Instance.vm_state == null(),
+                   models.Instance.vm_state != vm_states.DELETED))
+    return tuple(query.one())
+
+
 @require_admin_context
 def instance_get_all_by_host_and_not_type(context, host, type_id=None):
     return _instances_fill_metadata(context,
@@ -2446,38 +2520,73 @@ def instance_update_and_get_original(context, instance_uuid, values,
                             columns_to_join=columns_to_join)
 
 
+def _instance_metadata_write(context, session, model, instance_uuid,
+                             updates, inserts):
+    """Write the changed and new keys of an instance's metadata.
+
+    The changed keys are written by a single UPDATE and the new ones by a
+    single multi-row INSERT, rather than a statement per key.
+    """
+    if updates:
+        model_query(context, model, session=session, read_deleted="no").\
+            filter_by(instance_uuid=instance_uuid).\
+            filter(model.key.in_(list(updates))).\
+            update({'value': sql.case(updates, value=model.key)},
+                   synchronize_session=False)
+    if inserts:
+        session.execute(model.__table__.insert(),
+                        [{'instance_uuid': instance_uuid, 'key': key,
+                          'value': value}
+                         for key, value in six.iteritems(inserts)])
+
+
 # NOTE(danms): This updates the instance's metadata list in-place and in
 # the database to avoid stale data and refresh issues. It assumes the
 # delete=True behavior of instance_metadata_update(...)
 def _instance_metadata_update_in_place(context, instance, metadata_type, model,
                                        metadata, session):
     metadata = dict(metadata)
+    updates = {}
+    kept = []
     to_delete = []
     for keyvalue in instance[metadata_type]:
         key = keyvalue['key']
         if key in metadata:
-            keyvalue['value'] = metadata.pop(key)
-        elif key not in metadata:
-            to_delete.append(keyvalue)
-
-    # NOTE: we have to hard_delete here otherwise we will get more than one
-    # system_metadata record when we read deleted for an instance;
-    # regular metadata doesn't have the same problem because we don't
-    # allow reading deleted regular metadata anywhere.
-    if metadata_type == 'system_metadata':
-        for condemned in to_delete:
-            session.delete(condemned)
-            instance[metadata_type].remove(condemned)
-    else:
-        for condemned in to_delete:
-            condemned.soft_delete(session=session)
+            value = metadata.pop(key)
+            if keyvalue['value'] != value:
+                updates[key] = value
+                # NOTE: The row is written by _instance_metadata_write(),
+                # the session must not flush it again.
+                orm_attributes.set_committed_value(keyvalue, 'value', value)
+            kept.append(keyvalue)
+        else:
+            to_delete.append(keyvalue['id'])
+
+    if to_delete:
+        query = model_query(context, model, session=session,
+                            read_deleted="yes").\
+            filter(model.id.in_(to_delete))
+        # NOTE: we have to hard_delete here otherwise we will get more than
+        # one system_metadata record when we read deleted for an instance;
+        # regular metadata doesn't have the same problem because we don't
+        # allow reading deleted regular metadata anywhere.
+        if metadata_type == 'system_metadata':
+            query.delete(synchronize_session=False)
+        else:
+            query.soft_delete(synchronize_session=False)
 
-    for key, value in metadata.items():
-        newitem = model()
-        newitem.update({'key': key, 'value': value,
-                        'instance_uuid': instance['uuid']})
-        session.add(newitem)
-        instance[metadata_type].append(newitem)
+    _instance_metadata_write(context, session, model, instance['uuid'],
+                             updates, metadata)
+    if metadata:
+        # NOTE: The new rows may reuse the ids of the deleted ones, which
+        # are still in the session.
+        kept.extend(model_query(context, model, session=session,
+                                read_deleted="no").
+                    filter_by(instance_uuid=instance['uuid']).
+                    filter(model.key.in_(list(metadata))).
+                    populate_existing().
+                    all())
+    orm_attributes.set_committed_value(instance, metadata_type, kept)
 
 
 @oslo_db_api.wrap_db_retry(max_retries=5, retry_on_deadlock=True)
@@ -3104,6 +3213,7 @@ def quota_create(context, project_id, resource, limit, user_id=None):
         quota_ref.save()
     except db_exc.DBDuplicateEntry:
         raise exception.QuotaExists(project_id=project_id, resource=resource)
+    quota.LIMIT_CACHE.clear()
     return quota_ref
 
 
@@ -3123,6 +3233,7 @@ def quota_update(context, project_id, resource, limit, user_id=None):
                                                      user_id=user_id)
         else:
             raise exception.ProjectQuotaNotFound(project_id=project_id)
+    quota.LIMIT_CACHE.clear()
 
 
 ###################
@@ -3175,6 +3286,7 @@ def quota_class_create(context, class_name, resource, limit):
     quota_class_ref.resource = resource
     quota_class_ref.hard_limit = limit
     quota_class_ref.save()
+    quota.LIMIT_CACHE.clear()
     return quota_class_ref
 
 
@@ -3187,6 +3299,7 @@ def quota_class_update(context, class_name, resource, limit):
 
     if not result:
         raise exception.QuotaClassNotFound(class_name=class_name)
+    quota.LIMIT_CACHE.clear()
 
 
 ###################
@@ -3266,12 +3379,17 @@ def quota_usage_update(context, project_id, user_id, resource, **kwargs):
         if key in kwargs:
             updates[key] = kwargs[key]
 
-    result = model_query(context, models.QuotaUsage, read_deleted="no").\
-                     filter_by(project_id=project_id).\
-                     filter_by(resource=resource).\
-                     filter(or_(models.QuotaUsage.user_id == user_id,
-                                models.QuotaUsage.user_id == null())).\
-                     update(updates)
+    session = get_session()
+    with session.begin():
+        result = model_query(context, models.QuotaUsage, read_deleted="no",
+                             session=session).\
+                         filter_by(project_id=project_id).\
+                         filter_by(resource=resource).\
+                         filter(or_(models.QuotaUsage.user_id == user_id,
+                                    models.QuotaUsage.user_id == null())).\
+                         update(updates)
+        if result:
+            _project_quota_usages_invalidate(session, project_id)
 
     if not result:
         raise exception.QuotaUsageNotFound(project_id=project_id)
@@ -3303,13 +3421,14 @@ def _reservation_create(uuid, usage, project_id, user_id, resource,
 # on reservations.
 
 def _get_project_user_quota_usages(context, session, project_id,
-                                   user_id):
-    rows = model_query(context, models.QuotaUsage,
-                       read_deleted="no",
-                       session=session).\
-                   filter_by(project_id=project_id).\
-                   with_lockmode('update').\
-                   all()
+                                   user_id, lock=True):
+    query = model_query(context, models.QuotaUsage,
+                        read_deleted="no",
+                        session=session).\
+                    filter_by(project_id=project_id)
+    if lock:
+        query = query.with_lockmode('update')
+    rows = query.all()
     proj_result = dict()
     user_result = dict()
     # Get the total count of in_use,reserved
@@ -3446,6 +3565,37 @@ def _calculate_overquota(project_quotas, user_quotas, deltas,
     return overs
 
 
+def _get_overquota(project_quotas, user_quotas, deltas, overs,
+                   project_usages, user_usages):
+    """Return the OverQuota exception for the resources over quota."""
+    if project_quotas == user_quotas:
+        usages = project_usages
+    else:
+        # NOTE(mriedem): user_usages is a dict of resource keys to
+        # QuotaUsage sqlalchemy dict-like objects and doen't log well
+        # so convert the user_usages values to something useful for
+        # logging. Remove this if we ever change how
+        # _get_project_user_quota_usages returns the user_usages values.
+        user_usages = {k: dict(in_use=v['in_use'], reserved=v['reserved'],
+                               total=v['total'])
+                  for k, v in user_usages.items()}
+        usages = user_usages
+    usages = {k: dict(in_use=v['in_use'], reserved=v['reserved'])
+              for k, v in usages.items()}
+    LOG.debug('Raise OverQuota exception because: '
+              'project_quotas: %(project_quotas)s, '
+              'user_quotas: %(user_quotas)s, deltas: %(deltas)s, '
+              'overs: %(overs)s, project_usages: %(project_usages)s, '
+              'user_usages: %(user_usages)s',
+              {'project_quotas': project_quotas,
+               'user_quotas': user_quotas,
+               'overs': overs, 'deltas': deltas,
+               'project_usages': project_usages,
+               'user_usages': user_usages})
+    return exception.OverQuota(overs=sorted(overs), quotas=user_quotas,
+                               usages=usages)
+
+
 @require_context
 @oslo_db_api.wrap_db_retry(max_retries=5, retry_on_deadlock=True)
 def quota_reserve(context, resources, project_quotas, user_quotas, deltas,
@@ -3460,6 +3610,10 @@ def quota_reserve(context, resources, project_quotas, user_quotas, deltas,
         if user_id is None:
             user_id = context.user_id
 
+        # NOTE: The usages are synced and reserved without the
+        # compare-and-swap of the project totals.
+        _project_quota_usages_invalidate(session, project_id)
+
         # Get the current usages
         project_usages, user_usages = _get_project_user_quota_usages(
                 context, session, project_id, user_id)
@@ -3566,32 +3720,8 @@ def quota_reserve(context, resources, project_quotas, user_quotas, deltas,
                         "resources: %s"), unders)
 
     if overs:
-        if project_quotas == user_quotas:
-            usages = project_usages
-        else:
-            # NOTE(mriedem): user_usages is a dict of resource keys to
-            # QuotaUsage sqlalchemy dict-like objects and doen't log well
-            # so convert the user_usages values to something useful for
-            # logging. Remove this if we ever change how
-            # _get_project_user_quota_usages returns the user_usages values.
-            user_usages = {k: dict(in_use=v['in_use'], reserved=v['reserved'],
-                                   total=v['total'])
-                      for k, v in user_usages.items()}
-            usages = user_usages
-        usages = {k: dict(in_use=v['in_use'], reserved=v['reserved'])
-                  for k, v in usages.items()}
-        LOG.debug('Raise OverQuota exception because: '
-                  'project_quotas: %(project_quotas)s, '
-                  'user_quotas: %(user_quotas)s, deltas: %(deltas)s, '
-                  'overs: %(overs)s, project_usages: %(project_usages)s, '
-                  'user_usages: %(user_usages)s',
-                  {'project_quotas': project_quotas,
-                   'user_quotas': user_quotas,
-                   'overs': overs, 'deltas': deltas,
-                   'project_usages': project_usages,
-                   'user_usages': user_usages})
-        raise exception.OverQuota(overs=sorted(overs), quotas=user_quotas,
-                                  usages=usages)
+        raise _get_overquota(project_quotas, user_quotas, deltas, overs,
+                             project_usages, user_usages)
 
     return reservations
 
@@ -3640,6 +3770,296 @@ def reservation_rollback(context, reservations, project_id=None, user_id=None):
         reservation_query.soft_delete(synchronize_session=False)
 
 
+# NOTE: The compare-and-swap variants of quota_reserve(),
+# reservation_commit() and reservation_rollback() below don't lock the
+# usages. A reservation updates the usages of all its resources with a
+# single statement, which only matches the usages whose user quotas still
+# allow it when the statement runs, and the commits and rollbacks apply
+# relative changes to the usages. The project quotas are checked the same
+# way against the totals of the project in project_quota_usages, which are
+# counted again from the usages when they are missing, invalidated by the
+# locking quota_reserve() or too high for a reservation.
+
+def _project_quota_usages_invalidate(session, project_id):
+    """Mark the totals of a project to be counted again."""
+    usage = models.ProjectQuotaUsage
+    session.query(usage).\
+        filter_by(project_id=project_id).\
+        update({'total': None, 'generation': usage.generation + 1},
+               synchronize_session=False)
+
+
+def _project_quota_usages_count(context, project_id, resources):
+    """Count the totals of the resources in a project again.
+
+    The totals are only stored if no other reservation or invalidation
+    changed them meanwhile, which the generations of the rows tell. The
+    missing rows are created invalid, to be counted by the next call.
+    Returns the totals counted.
+    """
+    usage = models.QuotaUsage
+    project_usage = models.ProjectQuotaUsage
+    session = get_session()
+    try:
+        with session.begin():
+            # NOTE: The generations are read before the usages, so that
+            # the usages counted are at least as recent.
+            query = session.query(project_usage.resource,
+                                  project_usage.generation).\
+                filter_by(project_id=project_id).\
+                filter(project_usage.resource.in_(resources))
+            generations = dict(query.all())
+            query = model_query(context, usage,
+                                args=(usage.resource,
+                                      func.sum(usage.in_use + usage.reserved)),
+                                read_deleted="no", session=session).\
+                filter_by(project_id=project_id).\
+                filter(usage.resource.in_(resources)).\
+                group_by(usage.resource)
+            totals = dict.fromkeys(resources, 0)
+            totals.update(query.all())
+            for res in resources:
+                if res not in generations:
+                    session.add(project_usage(project_id=project_id,
+                                              resource=res, generation=0))
+                    continue
+                session.query(project_usage).\
+                    filter_by(project_id=project_id).\
+                    filter_by(resource=res).\
+                    filter_by(generation=generations[res]).\
+                    update({'total': totals[res],
+                            'generation': project_usage.generation + 1},
+                           synchronize_session=False)
+    except db_exc.DBDuplicateEntry:
+        LOG.debug('The totals of the project %s were created by a '
+                  'concurrent reservation', project_id)
+    return totals
+
+
+def _project_quota_usages_reserve(session, project_id, project_quotas,
+                                  increments):
+    """Add the increments to the totals of the project.
+
+    Each total is only updated if it is known and the project quota allows
+    the increment when the statement runs. Returns the number of totals
+    updated.
+    """
+    usage = models.ProjectQuotaUsage
+    criteria = []
+    totals = []
+    for res, delta in increments.items():
+        criteria.append(and_(usage.resource == res,
+                             usage.total + delta <= project_quotas[res]))
+        totals.append((usage.resource == res, usage.total + delta))
+
+    return session.query(usage).\
+        filter_by(project_id=project_id).\
+        filter(or_(*criteria)).\
+        update({'total': sql.case(totals, else_=usage.total),
+                'generation': usage.generation + 1},
+               synchronize_session=False)
+
+
+def _quota_usages_reserve(context, session, user_quotas, increments,
+                          user_usages):
+    """Add the increments to the reserved quantities of the usages.
+
+    Each usage is only updated if the user quota allows its increment when
+    the statement runs. Returns the number of usages updated.
+    """
+    usage = models.QuotaUsage
+    criteria = []
+    reserved = []
+    for res, delta in increments.items():
+        criterion = [usage.resource == res]
+        # NOTE: Like _calculate_overquota(), only the resources with a
+        # user quota are checked.
+        if user_quotas[res] >= 0:
+            criterion.append(usage.in_use + usage.reserved + delta <=
+                             user_quotas[res])
+        criteria.append(and_(*criterion))
+        reserved.append((usage.resource == res, usage.reserved + delta))
+
+    return model_query(context, usage, read_deleted="no",
+                       session=session).\
+        filter(usage.id.in_([user_usages[res].id for res in increments])).\
+        filter(or_(*criteria)).\
+        update({'reserved': sql.case(reserved, else_=usage.reserved)},
+               synchronize_session=False)
+
+
+@require_context
+@oslo_db_api.wrap_db_retry(max_retries=5, retry_on_deadlock=True,
+                           retry_on_request=True)
+def quota_reserve_cas(context, resources, project_quotas, user_quotas, deltas,
+                      expire, until_refresh, max_age, project_id=None,
+                      user_id=None):
+    if project_id is None:
+        project_id = context.project_id
+    if user_id is None:
+        user_id = context.user_id
+
+    session = get_session()
+    project_usages, user_usages = _get_project_user_quota_usages(
+            context, session, project_id, user_id, lock=False)
+
+    # The usages which are missing or must be refreshed are synced under
+    # the locks taken by quota_reserve(), which also makes the reservation.
+    if until_refresh or any(
+            res not in user_usages or
+            user_usages[res].until_refresh is not None or
+            _is_quota_refresh_needed(user_usages[res], max_age)
+            for res in deltas):
+        return quota_reserve(context, resources, project_quotas, user_quotas,
+                             deltas, expire, until_refresh, max_age,
+                             project_id=project_id, user_id=user_id)
+
+    overs = _calculate_overquota(project_quotas, user_quotas, deltas,
+                                 project_usages, user_usages)
+    if overs:
+        raise _get_overquota(project_quotas, user_quotas, deltas, overs,
+                             project_usages, user_usages)
+
+    increments = {res: delta for res, delta in deltas.items() if delta > 0}
+    reservations = [{'uuid': str(uuid.uuid4()),
+                     'usage_id': user_usages[res].id,
+                     'project_id': project_id,
+                     'user_id': user_id,
+                     'resource': res,
+                     'delta': delta,
+                     'expire': expire} for res, delta in deltas.items()]
+    # NOTE: Unlike _calculate_overquota(), the project quotas are also
+    # checked for the resources without a user quota.
+    limited = {res: delta for res, delta in increments.items()
+               if project_quotas[res] >= 0}
+    project_stale = False
+    try:
+        with session.begin():
+            if limited:
+                updated = _project_quota_usages_reserve(
+                    session, project_id, project_quotas, limited)
+                if updated != len(limited):
+                    project_stale = True
+                    raise db_exc.RetryRequest(_get_overquota(
+                        project_quotas, user_quotas, deltas, list(limited),
+                        project_usages, user_usages))
+            if increments:
+                updated = _quota_usages_reserve(context, session,
+                                                user_quotas, increments,
+                                                user_usages)
+                if updated != len(increments):
+                    LOG.debug('The usages were updated by a concurrent '
+                              'reservation, checking the quotas again')
+                    raise db_exc.RetryRequest(_get_overquota(
+                        project_quotas, user_quotas, deltas,
+                        list(increments), project_usages, user_usages))
+            if reservations:
+                session.execute(models.Reservation.__table__.insert(),
+                                reservations)
+    except db_exc.RetryRequest:
+        if project_stale:
+            # The totals of the project are missing, invalid or too high
+            # for the reservation: count them again before retrying, and
+            # give up if the project quota really is exceeded.
+            LOG.debug('Counting the usages of the project %s again',
+                      project_id)
+            totals = _project_quota_usages_count(context, project_id,
+                                                 list(limited))
+            overs = [res for res, delta in limited.items()
+                     if totals[res] + delta > project_quotas[res]]
+            if overs:
+                raise _get_overquota(project_quotas, user_quotas, deltas,
+                                     overs, project_usages, user_usages)
+        raise
+
+    unders = [res for res, delta in deltas.items()
+              if delta < 0 and
+              delta + user_usages[res].in_use < 0]
+    if unders:
+        LOG.warning(_LW("Change will make usage less than 0 for the following "
+                        "resources: %s"), unders)
+
+    return [reservation['uuid'] for reservation in reservations]
+
+
+def _reservations_apply(context, reservations, commit):
+    session = get_session()
+    with session.begin():
+        query = model_query(context, models.Reservation,
+                            read_deleted="no",
+                            session=session).\
+                    filter(models.Reservation.uuid.in_(reservations))
+        rows = query.all()
+        if not rows:
+            return
+
+        # Remove the reservations first, so that one which is expired or
+        # applied concurrently isn't applied twice.
+        if query.soft_delete(synchronize_session=False) != len(rows):
+            LOG.debug('The reservations were removed by a concurrent '
+                      'transaction, reading them again')
+            raise db_exc.RetryRequest(exception.ReservationNotFound(
+                uuid=', '.join(reservations)))
+
+        reserved = collections.defaultdict(int)
+        in_use = collections.defaultdict(int)
+        # The decreases of the totals of the projects
+        released = collections.defaultdict(
+            lambda: collections.defaultdict(int))
+        for reservation in rows:
+            reserved[reservation.usage_id] += max(reservation.delta, 0)
+            in_use[reservation.usage_id] += reservation.delta
+            if commit:
+                release = max(-reservation.delta, 0)
+            else:
+                release = max(reservation.delta, 0)
+            if release:
+                released[reservation.project_id][reservation.resource] += (
+                    release)
+
+        usage = models.QuotaUsage
+        values = {'reserved': sql.case(
+            [(usage.id == usage_id, usage.reserved - delta)
+             for usage_id, delta in reserved.items()],
+            else_=usage.reserved)}
+        if commit:
+            values['in_use'] = sql.case(
+                [(usage.id == usage_id, usage.in_use + delta)
+                 for usage_id, delta in in_use.items()],
+                else_=usage.in_use)
+        model_query(context, usage, read_deleted="no", session=session).\
+            filter(usage.id.in_(list(reserved))).\
+            update(values, synchronize_session=False)
+
+        project_usage = models.ProjectQuotaUsage
+        for project_id, releases in released.items():
+            session.query(project_usage).\
+                filter_by(project_id=project_id).\
+                filter(project_usage.resource.in_(list(releases))).\
+                update({'total': sql.case(
+                    [(project_usage.resource == res,
+                      project_usage.total - release)
+                     for res, release in releases.items()],
+                    else_=project_usage.total)},
+                    synchronize_session=False)
+
+
+@require_context
+@oslo_db_api.wrap_db_retry(max_retries=5, retry_on_deadlock=True,
+                           retry_on_request=True)
+def reservation_commit_cas(context, reservations, project_id=None,
+                           user_id=None):
+    _reservations_apply(context, reservations, commit=True)
+
+
+@require_context
+@oslo_db_api.wrap_db_retry(max_retries=5, retry_on_deadlock=True,
+                           retry_on_request=True)
+def reservation_rollback_cas(context, reservations, project_id=None,
+                             user_id=None):
+    _reservations_apply(context, reservations, commit=False)
+
+
 def quota_destroy_all_by_project_and_user(context, project_id, user_id):
     session = get_session()
     with session.begin():
@@ -3660,6 +4080,7 @@ def quota_destroy_all_by_project_and_user(context, project_id, user_id):
                 filter_by(project_id=project_id).\
                 filter_by(user_id=user_id).\
                 soft_delete(synchronize_session=False)
+    quota.LIMIT_CACHE.clear()
 
 
 def quota_destroy_all_by_project(context, project_id):
@@ -3685,6 +4106,11 @@ def quota_destroy_all_by_project(context, project_id):
                 filter_by(project_id=project_id).\
                 soft_delete(synchronize_session=False)
 
+        session.query(models.ProjectQuotaUsage).\
+                filter_by(project_id=project_id).\
+                delete(synchronize_session=False)
+    quota.LIMIT_CACHE.clear()
+
 
 @oslo_db_api.wrap_db_retry(max_retries=5, retry_on_deadlock=True)
 def reservation_expire(context):
@@ -4131,6 +4557,7 @@ def _security_group_ensure_default(context, session=None):
                                     session=session)
             else:
                 usage.update({'in_use': int(usage.first().in_use) + 1})
+            _project_quota_usages_invalidate(session, context.project_id)
 
             default_rules = _security_group_rule_get_default_query(context,
                                 session=session).all()
@@ -4421,6 +4848,21 @@ def migration_get_in_progress_by_host_and_node(context, host, node):
             all()
 
 
+def migration_get_in_progress_summary_by_host_and_node(context, host, node):
+    changed_at = func.coalesce(models.Migration.updated_at,
+                               models.Migration.created_at)
+    query = model_query(context, models.Migration,
+                        (func.count(models.Migration.id),
+                         func.max(changed_at)))
+    query = query.filter(or_(and_(models.Migration.source_compute == host,
+                                  models.Migration.source_node == node),
+                             and_(models.Migration.dest_compute == host,
+                                  models.Migration.dest_node == node))).\
+        filter(~models.Migration.status.in_(['confirmed', 'reverted',
+                                             'error']))
+    return tuple(query.one())
+
+
 def migration_get_all_by_filters(context, filters):
     query = model_query(context, models.Migration)
     if "status" in filters:
@@ -4947,22 +5389,17 @@ def instance_metadata_update(context, instance_uuid, metadata, delete):
                 filter(~models.InstanceMetadata.key.in_(all_keys)).\
                 soft_delete(synchronize_session=False)
 
-        already_existing_keys = []
-        meta_refs = _instance_metadata_get_query(context, instance_uuid,
-                                                 session=session).\
-            filter(models.InstanceMetadata.key.in_(all_keys)).\
-            all()
-
-        for meta_ref in meta_refs:
-            already_existing_keys.append(meta_ref.key)
-            meta_ref.update({"value": metadata[meta_ref.key]})
-
-        new_keys = set(all_keys) - set(already_existing_keys)
-        for key in new_keys:
-            meta_ref = models.InstanceMetadata()
-            meta_ref.update({"key": key, "value": metadata[key],
-                             "instance_uuid": instance_uuid})
-            session.add(meta_ref)
+        existing = dict(_instance_metadata_get_query(context, instance_uuid,
+                                                     session=session).
+                        filter(models.InstanceMetadata.key.in_(all_keys)).
+                        with_entities(models.InstanceMetadata.key,
+                                      models.InstanceMetadata.value))
+        updates = {key: metadata[key] for key in existing
+                   if existing[key] != metadata[key]}
+        inserts = {key: metadata[key] for key in all_keys
+                   if key not in existing}
+        _instance_metadata_write(context, session, models.InstanceMetadata,
+                                 instance_uuid, updates, inserts)
 
         return metadata
 
@@ -5005,22 +5442,17 @@ def instance_system_metadata_update(context, instance_uuid, metadata, delete):
                 filter(~models.InstanceSystemMetadata.key.in_(all_keys)).\
                 soft_delete(synchronize_session=False)
 
-        already_existing_keys = []
-        meta_refs = _instance_system_metadata_get_query(context, instance_uuid,
-                                                        session=session).\
-            filter(models.InstanceSystemMetadata.key.in_(all_keys)).\
-            all()
-
-        for meta_ref in meta_refs:
-            already_existing_keys.append(meta_ref.key)
-            meta_ref.update({"value": metadata[meta_ref.key]})
-
-        new_keys = set(all_keys) - set(already_existing_keys)
-        for key in new_keys:
-            meta_ref = models.InstanceSystemMetadata()
-            meta_ref.update({"key": key, "value": metadata[key],
-                             "instance_uuid": instance_uuid})
-            session.add(meta_ref)
+        model = models.InstanceSystemMetadata
+        existing = dict(_instance_system_metadata_get_query(
+                            context, instance_uuid, session=session).
+                        filter(model.key.in_(all_keys)).
+                        with_entities(model.key, model.value))
+        updates = {key: metadata[key] for key in existing
+                   if existing[key] != metadata[key]}
+        inserts = {key: metadata[key] for key in all_keys
+                   if key not in existing}
+        _instance_metadata_write(context, session, model, instance_uuid,
+                                 updates, inserts)
 
         return metadata
 
@@ -5909,41 +6341,49 @@ def _get_default_deleted_value(table):
         return None
 
 
-@require_admin_context
-def archive_deleted_rows_for_table(context, tablename, max_rows):
-    """Move up to max_rows rows from one tables to the corresponding
-    shadow table. The context argument is only used for the decorator.
+def _get_archive_key(table):
+    if table.name in ("dns_domains", _SHADOW_TABLE_PREFIX + "dns_domains"):
+        # We have one table (dns_domains) where the key is called
+        # "domain" rather than "id"
+        return table.c.domain
+    return table.c.id
+
+
+def _get_shadow_table(engine, tablename):
+    """Return the shadow table of a table, None if it has none."""
+    metadata = MetaData()
+    metadata.bind = engine
+    try:
+        return Table(_SHADOW_TABLE_PREFIX + tablename, metadata,
+                     autoload=True)
+    except NoSuchTableError:
+        return None
+
+
+def _archive_deleted_rows_for_table(tablename, max_rows):
+    """Move up to max_rows rows from one table to its shadow table.
 
     :returns: number of rows archived
+    :raises: DBError if a row can't be deleted, usually because a row of
+             another table which is not deleted references it.
     """
     # NOTE(guochbo): There is a circular import, nova.db.sqlalchemy.utils
     # imports nova.db.sqlalchemy.api.
     from nova.db.sqlalchemy import utils as db_utils
 
     engine = get_engine()
-    conn = engine.connect()
-    metadata = MetaData()
-    metadata.bind = engine
     # NOTE(tdurakov): table metadata should be received
     # from models, not db tables. Default value specified by SoftDeleteMixin
     # is known only by models, not DB layer.
     # IMPORTANT: please do not change source of metadata information for table.
     table = models.BASE.metadata.tables[tablename]
 
-    shadow_tablename = _SHADOW_TABLE_PREFIX + tablename
-    rows_archived = 0
-    try:
-        shadow_table = Table(shadow_tablename, metadata, autoload=True)
-    except NoSuchTableError:
+    shadow_table = _get_shadow_table(engine, tablename)
+    if shadow_table is None:
         # No corresponding shadow table; skip it.
-        return rows_archived
+        return 0
 
-    if tablename == "dns_domains":
-        # We have one table (dns_domains) where the key is called
-        # "domain" rather than "id"
-        column = table.c.domain
-    else:
-        column = table.c.id
+    column = _get_archive_key(table)
     # NOTE(guochbo): Use DeleteFromSelect to avoid
     # database's limit of maximum parameter in one SQL statement.
     deleted_column = table.c.deleted
@@ -5958,11 +6398,26 @@ def archive_deleted_rows_for_table(context, tablename, max_rows):
                           order_by(column).limit(max_rows)
 
     delete_statement = db_utils.DeleteFromSelect(table, query_delete, column)
+    conn = engine.connect()
     try:
         # Group the insert and delete in a transaction.
         with conn.begin():
             conn.execute(insert)
             result_delete = conn.execute(delete_statement)
+    finally:
+        conn.close()
+    return result_delete.rowcount
+
+
+@require_admin_context
+def archive_deleted_rows_for_table(context, tablename, max_rows):
+    """Move up to max_rows rows from one tables to the corresponding
+    shadow table. The context argument is only used for the decorator.
+
+    :returns: number of rows archived
+    """
+    try:
+        return _archive_deleted_rows_for_table(tablename, max_rows)
     except db_exc.DBError:
         # TODO(ekudryashova): replace by DBReferenceError when db layer
         # raise it.
@@ -5971,11 +6426,14 @@ def archive_deleted_rows_for_table(context, tablename, max_rows):
         # skip this table for now; we'll come back to it later.
         msg = _("IntegrityError detected when archiving table %s") % tablename
         LOG.warn(msg)
-        return rows_archived
+        return 0
 
-    rows_archived = result_delete.rowcount
 
-    return rows_archived
+def _get_archive_levels():
+    """Return the names of the soft-deleted tables by dependency level."""
+    tables = [table for table in models.BASE.metadata.tables.values()
+              if 'deleted' in table.c]
+    return archive.get_levels(tables)
 
 
 @require_admin_context
@@ -5986,19 +6444,83 @@ def archive_deleted_rows(context, max_rows=None):
     :returns: Number of rows archived.
     """
     # The context argument is only used for the decorator.
-    tablenames = []
-    for model_class in six.itervalues(models.__dict__):
-        if hasattr(model_class, "__tablename__"):
-            tablenames.append(model_class.__tablename__)
     rows_archived = 0
-    for tablename in tablenames:
-        rows_archived += archive_deleted_rows_for_table(context, tablename,
-                                         max_rows=max_rows - rows_archived)
-        if rows_archived >= max_rows:
-            break
+    # The tables referencing others are archived first, for their rows not
+    # to keep the rows they reference from being archived.
+    for level in _get_archive_levels():
+        for tablename in level:
+            remaining = None
+            if max_rows is not None:
+                remaining = max_rows - rows_archived
+            rows_archived += archive_deleted_rows_for_table(
+                context, tablename, max_rows=remaining)
+            if max_rows is not None and rows_archived >= max_rows:
+                return rows_archived
     return rows_archived
 
 
+@require_admin_context
+def archive_deleted_rows_parallel(context, batch_size=1000, workers=4,
+                                  max_rows=None, state=None, progress=None):
+    """Move the deleted rows to the shadow tables, in dependency order.
+
+    The independent tables are archived in parallel by up to workers green
+    threads, batch_size rows per transaction. state is the progress of a
+    previous run to resume, progress a function called with the table name
+    and its progress after each batch.
+
+    :returns: the state, with the progress of each table.
+    """
+    archiver = archive.Archiver(_archive_deleted_rows_for_table,
+                                batch_size=batch_size, workers=workers,
+                                max_rows=max_rows, state=state,
+                                progress=progress)
+    return archiver.run(_get_archive_levels())
+
+
+def _purge_shadow_table(tablename, before, max_rows):
+    """Delete up to max_rows rows deleted before a date from a shadow table.
+
+    :returns: number of rows deleted
+    """
+    from nova.db.sqlalchemy import utils as db_utils
+
+    engine = get_engine()
+    shadow_table = _get_shadow_table(engine, tablename)
+    if shadow_table is None:
+        return 0
+    column = _get_archive_key(shadow_table)
+    query_delete = sql.select([column],
+                              shadow_table.c.deleted_at < before).\
+        order_by(column).limit(max_rows)
+    delete_statement = db_utils.DeleteFromSelect(shadow_table, query_delete,
+                                                 column)
+    conn = engine.connect()
+    try:
+        with conn.begin():
+            result_delete = conn.execute(delete_statement)
+    finally:
+        conn.close()
+    return result_delete.rowcount
+
+
+@require_admin_context
+def purge_shadow_tables(context, before, batch_size=1000, workers=4,
+                        state=None, progress=None):
+    """Delete the rows deleted before a date from the shadow tables.
+
+    The arguments are those of archive_deleted_rows_parallel().
+
+    :returns: the state, with the progress of each table.
+    """
+    archiver = archive.Archiver(
+        lambda tablename, max_rows: _purge_shadow_table(tablename, before,
+                                                        max_rows),
+        batch_size=batch_size, workers=workers, state=state,
+        progress=progress)
+    return archiver.run(_get_archive_levels())
+
+
 ####################
 
 
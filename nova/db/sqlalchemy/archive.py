@@ -0,0 +1,171 @@
+# Copyright (c) 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Archiving of the soft-deleted rows, table by table in dependency order.
+
+The tables are grouped in levels by their foreign keys: a table is in a
+level after all the tables referencing it. Once the tables of the previous
+levels are archived, no archived row references the deleted rows of the
+tables of a level, which are then archived in parallel, in batches.
+
+The progress is recorded in a state dict which can be saved between the
+batches, and given back to resume an interrupted run where it stopped.
+"""
+
+import collections
+import threading
+import time
+
+import eventlet
+from oslo_db import exception as db_exc
+from oslo_log import log as logging
+import six
+
+from nova.i18n import _LW
+
+LOG = logging.getLogger(__name__)
+
+
+def get_levels(tables):
+    """Return the names of the tables grouped by dependency level.
+
+    The first level holds the tables which no other table references, each
+    following level the tables only referenced by those of the previous
+    levels.
+    """
+    names = set(table.name for table in tables)
+    referencing = collections.defaultdict(set)
+    for table in tables:
+        for fk in table.foreign_keys:
+            parent = fk.target_fullname.split('.')[0]
+            if parent != table.name and parent in names:
+                referencing[parent].add(table.name)
+
+    depths = {}
+
+    def _depth(name, seen):
+        if name not in depths:
+            # NOTE: A cycle can't be ordered, its tables are put in the
+            # same level as the first one met.
+            children = referencing[name] - seen
+            depths[name] = 1 + max([_depth(child, seen | set([name]))
+                                    for child in children] or [-1])
+        return depths[name]
+
+    levels = collections.defaultdict(list)
+    for name in sorted(names):
+        levels[_depth(name, set())].append(name)
+    return [levels[depth] for depth in sorted(levels)]
+
+
+class Archiver(object):
+    """Runs a batch function over the tables, level by level.
+
+    move_batch(tablename, max_rows) moves up to max_rows rows of a table
+    and returns their number, fewer than max_rows meaning that the table is
+    done. The tables of a level are processed by up to workers green
+    threads. max_rows bounds the total number of rows moved.
+
+    The state is a dict with the progress of each table: the number of
+    rows moved, the seconds spent, whether it is done and the error which
+    stopped it. progress is called with the table name and its progress
+    after each batch.
+    """
+
+    def __init__(self, move_batch, batch_size=1000, workers=4,
+                 max_rows=None, state=None, progress=None):
+        self.move_batch = move_batch
+        self.batch_size = batch_size
+        self.workers = workers
+        self.remaining = max_rows
+        self.state = state if state is not None else {}
+        self.state.setdefault('tables', {})
+        self.progress = progress
+        # Rows of the batches in progress, given back if not moved
+        self._reserved = 0
+        self._condition = threading.Condition()
+
+    def _take(self):
+        """Return the size of the next batch, 0 once max_rows is reached."""
+        if self.remaining is None:
+            return self.batch_size
+        with self._condition:
+            # The batches in progress may not use all their rows
+            while not self.remaining and self._reserved:
+                self._condition.wait()
+            size = min(self.batch_size, self.remaining)
+            self.remaining -= size
+            self._reserved += size
+            return size
+
+    def _give_back(self, size, rows):
+        """Release a batch of size rows which moved rows."""
+        if self.remaining is None:
+            return
+        with self._condition:
+            self._reserved -= size
+            self.remaining += size - rows
+            self._condition.notify_all()
+
+    def _run_table(self, tablename):
+        progress = self.state['tables'].setdefault(
+            tablename, {'rows': 0, 'seconds': 0.0, 'done': False})
+        if progress['done']:
+            return
+        progress.pop('error', None)
+        while True:
+            size = self._take()
+            if not size:
+                return
+            start = time.time()
+            try:
+                rows = self.move_batch(tablename, size)
+            except db_exc.DBError as e:
+                self._give_back(size, 0)
+                # NOTE: Usually a foreign key from a row which is not
+                # deleted, the table is retried on the next run.
+                LOG.warning(_LW('Error archiving table %(table)s, it is '
+                                'skipped: %(error)s'),
+                            {'table': tablename, 'error': e})
+                progress['error'] = six.text_type(e)
+                return
+            self._give_back(size, rows)
+            progress['rows'] += rows
+            progress['seconds'] += time.time() - start
+            if rows < size:
+                progress['done'] = True
+            if self.progress is not None:
+                self.progress(tablename, progress)
+            if progress['done']:
+                return
+
+    def run(self, levels):
+        """Process the tables of each level in turn and return the state.
+
+        The state is complete once all the tables are done.
+        """
+        pool = eventlet.GreenPool(self.workers)
+        for level in levels:
+            for tablename in level:
+                pool.spawn_n(self._run_table, tablename)
+            pool.waitall()
+            if self.remaining == 0:
+                break
+        tables = self.state['tables']
+        self.state['complete'] = all(
+            tables.get(tablename, {}).get('done')
+            for level in levels for tablename in level)
+        return self.state
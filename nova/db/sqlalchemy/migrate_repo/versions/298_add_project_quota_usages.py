@@ -0,0 +1,33 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import sqlalchemy as sa
+
+
+def upgrade(migrate_engine):
+    meta = sa.MetaData(bind=migrate_engine)
+
+    # The totals of the projects are counted again from quota_usages when
+    # they are missing, so the table starts empty.
+    project_quota_usages = sa.Table(
+        'project_quota_usages', meta,
+        sa.Column('id', sa.Integer, primary_key=True, nullable=False),
+        sa.Column('project_id', sa.String(255), nullable=False),
+        sa.Column('resource', sa.String(255), nullable=False),
+        sa.Column('total', sa.Integer),
+        sa.Column('generation', sa.Integer, nullable=False),
+        sa.UniqueConstraint(
+            'project_id', 'resource',
+            name='uniq_project_quota_usages0project_id0resource'),
+        mysql_engine='InnoDB',
+        mysql_charset='utf8')
+    project_quota_usages.create()
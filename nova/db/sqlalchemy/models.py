@@ -192,6 +192,10 @@ class Instance(BASE, NovaBase):
         Index('uuid', 'uuid', unique=True),
         Index('instances_project_id_deleted_idx',
               'project_id', 'deleted'),
+        Index('instances_project_id_deleted_created_at_id_idx',
+              'project_id', 'deleted', 'created_at', 'id'),
+        Index('instances_deleted_created_at_id_idx',
+              'deleted', 'created_at', 'id'),
         Index('instances_reservation_id_idx',
               'reservation_id'),
         Index('instances_terminated_at_launched_at_idx',
@@ -488,6 +492,28 @@ class QuotaUsage(BASE, NovaBase):
     until_refresh = Column(Integer)
 
 
+class ProjectQuotaUsage(BASE, models.ModelBase):
+    """Represents the total usage of a resource by all the users of a
+    project, for the compare-and-swap quota reservations.
+
+    The total is never lower than the sum of the quota usages of the
+    project. It is None when the quota usages were changed by the locking
+    quota reservations, and must then be counted again.
+    """
+
+    __tablename__ = 'project_quota_usages'
+    __table_args__ = (
+        schema.UniqueConstraint(
+            'project_id', 'resource',
+            name='uniq_project_quota_usages0project_id0resource'),
+    )
+    id = Column(Integer, primary_key=True)
+    project_id = Column(String(255), nullable=False)
+    resource = Column(String(255), nullable=False)
+    total = Column(Integer)
+    generation = Column(Integer, nullable=False, default=0)
+
+
 class Reservation(BASE, NovaBase):
     """Represents a resource reservation for quotas."""
 
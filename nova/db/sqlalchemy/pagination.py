@@ -0,0 +1,135 @@
+# Copyright (c) 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Keyset (seek) pagination of queries.
+
+Instead of looking up the row of the previous page's marker to get its sort
+values, the sort values of the last row are carried by an opaque
+continuation token, see nova.pagination. The next page is then
+selected with a comparison on the sort columns, which the database can
+resolve by seeking in an index on them.
+"""
+
+import sqlite3
+
+from oslo_db import exception as db_exc
+import sqlalchemy
+from sqlalchemy import inspect
+
+
+def _supports_row_values(query):
+    bind = query.session.get_bind() if query.session else None
+    if bind is None:
+        return False
+    name = bind.dialect.name
+    if name == 'sqlite':
+        return sqlite3.sqlite_version_info >= (3, 15, 0)
+    return name in ('mysql', 'postgresql')
+
+
+def _nulls_first(query, sort_dir):
+    """Return True if the NULL values come first in the sort direction.
+
+    PostgreSQL sorts them after all the other values, MySQL and SQLite
+    before.
+    """
+    bind = query.session.get_bind() if query.session else None
+    nulls_last = bind is not None and bind.dialect.name == 'postgresql'
+    return nulls_last == (sort_dir == 'desc')
+
+
+def _follows(column, sort_dir, value, nulls_first):
+    """Return the criterion selecting the values of column which follow
+    value in the sort direction.
+    """
+    if value is None:
+        if nulls_first:
+            return column.isnot(None)
+        return sqlalchemy.false()
+    if sort_dir == 'desc':
+        criterion = column < value
+    else:
+        criterion = column > value
+    if nulls_first:
+        return criterion
+    return sqlalchemy.or_(criterion, column.is_(None))
+
+
+def _seek_criteria(query, columns, sort_dirs, values):
+    """Return the criteria selecting the rows which follow values."""
+    nulls_first = [_nulls_first(query, sort_dir) for sort_dir in sort_dirs]
+    has_null = any(value is None for value in values)
+    if (not has_null and len(set(sort_dirs)) == 1 and all(nulls_first) and
+            _supports_row_values(query)):
+        # All the columns go the same way, a single row value comparison
+        # maps directly to a range scan of a composite index. The rows with
+        # NULL values sort before the marker, which the comparison excludes.
+        columns = sqlalchemy.tuple_(*columns)
+        values = sqlalchemy.tuple_(*[sqlalchemy.literal(value)
+                                     for value in values])
+        if sort_dirs[0] == 'desc':
+            return columns < values
+        return columns > values
+
+    criteria_list = []
+    for i in range(len(columns)):
+        # NOTE: == None is rendered as IS NULL
+        crit_attrs = [columns[j] == values[j] for j in range(i)]
+        crit_attrs.append(_follows(columns[i], sort_dirs[i], values[i],
+                                   nulls_first[i]))
+        criteria_list.append(sqlalchemy.and_(*crit_attrs))
+    criteria = sqlalchemy.or_(*criteria_list)
+    if has_null:
+        return criteria
+    # The expanded form is not sargable by itself, so also bound the
+    # leading column for the index to be used.
+    if sort_dirs[0] == 'desc':
+        bound = columns[0] <= values[0]
+    else:
+        bound = columns[0] >= values[0]
+    if not nulls_first[0]:
+        bound = sqlalchemy.or_(bound, columns[0].is_(None))
+    return sqlalchemy.and_(bound, criteria)
+
+
+def paginate_query(query, model, limit, sort_keys, sort_dirs,
+                   marker_values=None):
+    """Return a query sorted by sort_keys, following marker_values.
+
+    Like oslo.db's paginate_query(), but takes the sort values of the last
+    row of the previous page instead of the row itself. sort_keys must be
+    unique, which is the case when they end with the primary key.
+
+    :raises: oslo_db.exception.InvalidSortKey for an unknown sort key
+    """
+    columns = []
+    for sort_key, sort_dir in zip(sort_keys, sort_dirs):
+        if sort_key not in inspect(model).all_orm_descriptors:
+            raise db_exc.InvalidSortKey()
+        column = getattr(model, sort_key)
+        columns.append(column)
+        if sort_dir == 'desc':
+            query = query.order_by(sqlalchemy.desc(column))
+        else:
+            query = query.order_by(sqlalchemy.asc(column))
+
+    if marker_values is not None:
+        query = query.filter(
+            _seek_criteria(query, columns, sort_dirs, marker_values))
+
+    if limit is not None:
+        query = query.limit(limit)
+    return query
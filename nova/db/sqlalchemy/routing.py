@@ -0,0 +1,469 @@
+# Copyright (c) 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Routing of the database reads to the slave databases.
+
+The DB API functions are classified as read-only or read-write. The reads
+which asked for a slave with use_slave, and the bulk reads listed in
+ROUTED_READS when slave_read_routing is enabled, go to one of the healthy
+slaves whose replication lag is acceptable, in turn. The reads of a context
+which wrote recently stay on the master, unless a slave is known to have
+caught up with the write.
+"""
+
+import functools
+import itertools
+import threading
+import time
+import weakref
+
+from oslo_config import cfg
+from oslo_db.sqlalchemy import session as db_session
+from oslo_log import log as logging
+from sqlalchemy.engine import url as sqlalchemy_url
+
+import nova.context
+from nova.i18n import _LW
+
+
+routing_opts = [
+    cfg.ListOpt('slave_connections',
+                default=[],
+                secret=True,
+                help='Connection strings of additional slave databases. The '
+                     'reads sent to the slaves are spread over these and '
+                     'slave_connection. Setting it, or slave_read_routing, '
+                     'enables the health and replication lag checks of the '
+                     'slaves, which need the REPLICATION CLIENT privilege.'),
+    cfg.BoolOpt('slave_read_routing',
+                default=False,
+                help='Send the bulk reads of the DB API, such as the '
+                     'instance lists, to the slave databases even when the '
+                     'caller did not ask for it.'),
+    cfg.IntOpt('slave_max_lag',
+               default=10,
+               help='Maximum replication lag, in seconds, of a slave '
+                    'database the bulk reads are routed to, when the read '
+                    'does not have its own tolerance.'),
+    cfg.IntOpt('slave_read_after_write_delay',
+               default=5,
+               help='Number of seconds after a request context wrote to the '
+                    'database during which its reads are only sent to the '
+                    'slaves known to have replicated the write.'),
+    cfg.IntOpt('slave_health_check_interval',
+               default=30,
+               help='Number of seconds between the checks of the health and '
+                    'replication lag of each slave database.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(routing_opts, group='database')
+
+LOG = logging.getLogger(__name__)
+
+# Reads routed to the slaves when slave_read_routing is enabled, with the
+# replication lag they tolerate in seconds. None is slave_max_lag.
+ROUTED_READS = {
+    'aggregate_get_all': None,
+    'bw_usage_get_by_uuids': 60,
+    'compute_node_get_all': None,
+    'compute_node_statistics': 60,
+    'flavor_get_all': None,
+    'instance_count_active_by_window': 300,
+    'instance_fault_get_by_instance_uuids': None,
+    'instance_get_active_by_window_joined': 300,
+    'instance_get_all_by_filters': None,
+    'instance_get_all_by_filters_sort': None,
+    'migration_get_all_by_filters': None,
+    'security_group_get_all': None,
+    'service_get_all': None,
+    'task_log_get_all': 300,
+    'vol_get_usage_by_time': 60,
+}
+
+# The DB API functions which don't write. The other functions record a
+# write of their context, so that its next reads go to the master. Names
+# aren't enough to tell, instance_update_and_get_original() writes.
+_READ_ONLY = frozenset([
+    'action_event_get_by_id',
+    'action_events_get',
+    'action_get_by_request_id',
+    'actions_get',
+    'agent_build_get_all',
+    'agent_build_get_by_triple',
+    'aggregate_get',
+    'aggregate_get_all',
+    'aggregate_get_by_host',
+    'aggregate_get_by_metadata_key',
+    'aggregate_host_get_all',
+    'aggregate_metadata_get',
+    'aggregate_metadata_get_by_host',
+    'block_device_mapping_get_all_by_instance',
+    'block_device_mapping_get_by_volume_id',
+    'bw_usage_get',
+    'bw_usage_get_by_uuids',
+    'cell_get',
+    'cell_get_all',
+    'certificate_get_all_by_project',
+    'certificate_get_all_by_user',
+    'certificate_get_all_by_user_and_project',
+    'compute_node_get',
+    'compute_node_get_all',
+    'compute_node_get_all_by_host',
+    'compute_node_get_all_changed_since',
+    'compute_node_get_by_host_and_nodename',
+    'compute_node_search_by_hypervisor',
+    'compute_node_statistics',
+    'compute_nodes_get_by_service_id',
+    'console_get',
+    'console_get_all_by_instance',
+    'console_get_by_pool_instance',
+    'console_pool_get_all_by_host_type',
+    'console_pool_get_by_host_type',
+    'constraint',
+    'dnsdomain_get',
+    'dnsdomain_get_all',
+    'ec2_instance_get_by_id',
+    'ec2_instance_get_by_uuid',
+    'ec2_snapshot_get_by_ec2_id',
+    'ec2_snapshot_get_by_uuid',
+    'ec2_volume_get_by_id',
+    'ec2_volume_get_by_uuid',
+    'equal_any',
+    'fixed_ip_get',
+    'fixed_ip_get_all',
+    'fixed_ip_get_by_address',
+    'fixed_ip_get_by_floating_address',
+    'fixed_ip_get_by_host',
+    'fixed_ip_get_by_instance',
+    'fixed_ip_get_by_network_host',
+    'fixed_ips_by_virtual_interface',
+    'flavor_access_get_by_flavor_id',
+    'flavor_extra_specs_get',
+    'flavor_get',
+    'flavor_get_all',
+    'flavor_get_by_flavor_id',
+    'flavor_get_by_name',
+    'floating_ip_get',
+    'floating_ip_get_all',
+    'floating_ip_get_all_by_host',
+    'floating_ip_get_all_by_project',
+    'floating_ip_get_by_address',
+    'floating_ip_get_by_fixed_address',
+    'floating_ip_get_by_fixed_ip_id',
+    'floating_ip_get_pools',
+    'get_instance_uuid_by_ec2_id',
+    'instance_count_active_by_window',
+    'instance_extra_get_by_instance_uuid',
+    'instance_fault_get_by_instance_uuids',
+    'instance_floating_address_get_all',
+    'instance_get',
+    'instance_get_active_by_window_joined',
+    'instance_get_all',
+    'instance_get_all_by_filters',
+    'instance_get_all_by_filters_sort',
+    'instance_get_all_by_host',
+    'instance_get_all_by_host_and_node',
+    'instance_get_all_by_host_and_not_type',
+    'instance_get_by_uuid',
+    'instance_get_summary_by_host_and_node',
+    'instance_group_get',
+    'instance_group_get_all',
+    'instance_group_get_all_by_project_id',
+    'instance_group_get_by_instance',
+    'instance_group_members_get',
+    'instance_info_cache_get',
+    'instance_metadata_get',
+    'instance_pagination_marker',
+    'instance_system_metadata_get',
+    'instance_tag_exists',
+    'instance_tag_get_by_instance_uuid',
+    'key_pair_count_by_user',
+    'key_pair_get',
+    'key_pair_get_all_by_user',
+    'migration_get',
+    'migration_get_all_by_filters',
+    'migration_get_by_instance_and_status',
+    'migration_get_in_progress_by_host_and_node',
+    'migration_get_in_progress_summary_by_host_and_node',
+    'migration_get_unconfirmed_by_dest_compute',
+    'network_count_reserved_ips',
+    'network_get',
+    'network_get_all',
+    'network_get_all_by_host',
+    'network_get_all_by_uuids',
+    'network_get_associated_fixed_ips',
+    'network_get_by_cidr',
+    'network_get_by_uuid',
+    'network_in_use_on_host',
+    'not_equal',
+    'pci_device_get_all_by_instance_uuid',
+    'pci_device_get_all_by_node',
+    'pci_device_get_by_addr',
+    'pci_device_get_by_id',
+    'project_get_networks',
+    'provider_fw_rule_get_all',
+    'quota_class_get',
+    'quota_class_get_all_by_name',
+    'quota_class_get_default',
+    'quota_get',
+    'quota_get_all',
+    'quota_get_all_by_project',
+    'quota_get_all_by_project_and_user',
+    'quota_usage_get',
+    'quota_usage_get_all_by_project',
+    'quota_usage_get_all_by_project_and_user',
+    's3_image_get',
+    's3_image_get_by_uuid',
+    'security_group_default_rule_get',
+    'security_group_default_rule_list',
+    'security_group_get',
+    'security_group_get_all',
+    'security_group_get_by_instance',
+    'security_group_get_by_name',
+    'security_group_get_by_project',
+    'security_group_in_use',
+    'security_group_rule_count_by_group',
+    'security_group_rule_get',
+    'security_group_rule_get_by_security_group',
+    'security_group_rule_get_by_security_group_grantee',
+    'service_get',
+    'service_get_all',
+    'service_get_all_by_binary',
+    'service_get_all_by_host',
+    'service_get_all_by_topic',
+    'service_get_by_compute_host',
+    'service_get_by_host_and_binary',
+    'service_get_by_host_and_topic',
+    'task_log_get',
+    'task_log_get_all',
+    'virtual_interface_get',
+    'virtual_interface_get_all',
+    'virtual_interface_get_by_address',
+    'virtual_interface_get_by_instance',
+    'virtual_interface_get_by_instance_and_network',
+    'virtual_interface_get_by_uuid',
+    'vol_get_usage_by_time',
+])
+
+# Marks the calls which must use the master database
+MASTER = object()
+
+_local = threading.local()
+
+
+def is_read_only(name):
+    """Return True if the DB API function name doesn't write."""
+    return name in _READ_ONLY
+
+
+def current_replica():
+    """Return the slave chosen for the current call, MASTER or None.
+
+    None means that no routing decision was made, the caller's use_slave
+    applies.
+    """
+    return getattr(_local, 'replica', None)
+
+
+class Replica(object):
+    """A slave database, with its last known health and lag."""
+
+    def __init__(self, connection, conf):
+        self.connection = connection
+        url = sqlalchemy_url.make_url(connection)
+        self.name = '%s/%s' % (url.host or '', url.database or '')
+        self.conf = conf
+        self.engine = None
+        self.maker = None
+        self.healthy = False
+        self.lag = None
+        self.checked_at = None
+
+    def _connect(self):
+        conf = self.conf
+        # NOTE: Only try once, a slave which is down must not delay the
+        # requests, it is checked again later.
+        self.engine = db_session.create_engine(
+            self.connection,
+            mysql_sql_mode=conf.mysql_sql_mode,
+            idle_timeout=conf.idle_timeout,
+            connection_debug=conf.connection_debug,
+            max_pool_size=conf.max_pool_size,
+            max_overflow=conf.max_overflow,
+            pool_timeout=conf.pool_timeout,
+            sqlite_synchronous=conf.sqlite_synchronous,
+            connection_trace=conf.connection_trace,
+            max_retries=1)
+        self.maker = db_session.get_maker(self.engine, autocommit=True,
+                                          expire_on_commit=False)
+
+    def _get_lag(self, conn):
+        """Return the replication lag in seconds, None if unknown."""
+        if self.engine.name == 'mysql':
+            status = conn.execute('SHOW SLAVE STATUS').first()
+            if status is None:
+                return 0
+            # NOTE: This is NULL when the replication is stopped.
+            lag = status['Seconds_Behind_Master']
+            return float('inf') if lag is None else lag
+        if self.engine.name == 'postgresql':
+            return conn.execute(
+                'SELECT CASE WHEN pg_is_in_recovery() THEN '
+                'COALESCE(EXTRACT(EPOCH FROM now() - '
+                'pg_last_xact_replay_timestamp()), 0) ELSE 0 END').scalar()
+        conn.execute('SELECT 1')
+        return None
+
+    def check(self, now):
+        """Check that the replica can be used, and measure its lag."""
+        was_healthy = self.healthy or self.checked_at is None
+        self.checked_at = now
+        try:
+            if self.engine is None:
+                self._connect()
+            with self.engine.connect() as conn:
+                self.lag = self._get_lag(conn)
+            self.healthy = True
+        except Exception as e:
+            if was_healthy:
+                LOG.warning(_LW('Slave database %(name)s is not usable: '
+                                '%(error)s'),
+                            {'name': self.name, 'error': e})
+            self.healthy = False
+
+    def accepts(self, max_lag, since_write):
+        """Return True if the replica is recent enough for a read.
+
+        max_lag is the tolerated lag, None for any. since_write is the
+        number of seconds since the caller last wrote, when it did recently,
+        the replica must then be known to have replicated the write.
+        """
+        if not self.healthy:
+            return False
+        if (max_lag is not None and self.lag is not None and
+                self.lag > max_lag):
+            return False
+        if since_write is not None:
+            return self.lag is not None and self.lag < since_write
+        return True
+
+    def get_session(self, **kwargs):
+        return self.maker(**kwargs)
+
+
+class Router(object):
+    """Picks the slave database a read is sent to."""
+
+    def __init__(self, replicas):
+        self.replicas = replicas
+        self._counter = itertools.count()
+        self._last_writes = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def from_config(cls, conf):
+        connections = list(conf.slave_connections)
+        if conf.slave_connection:
+            connections.insert(0, conf.slave_connection)
+        return cls([Replica(connection, conf) for connection in connections])
+
+    def _check_replicas(self):
+        now = time.time()
+        interval = CONF.database.slave_health_check_interval
+        for replica in self.replicas:
+            if replica.checked_at is None or (
+                    now - replica.checked_at >= interval):
+                replica.check(now)
+
+    def pick(self, max_lag=None, context=None):
+        """Return the next replica suitable for a read, or None."""
+        if not self.replicas:
+            return None
+        self._check_replicas()
+        since_write = self.since_last_write(context)
+        replicas = [replica for replica in self.replicas
+                    if replica.accepts(max_lag, since_write)]
+        if not replicas:
+            return None
+        return replicas[next(self._counter) % len(replicas)]
+
+    def record_write(self, context):
+        if context is not None:
+            self._last_writes[context] = time.time()
+
+    def since_last_write(self, context):
+        """Return the seconds since a context wrote, if it did recently."""
+        if context is None or context not in self._last_writes:
+            return None
+        since_write = time.time() - self._last_writes[context]
+        if since_write >= CONF.database.slave_read_after_write_delay:
+            return None
+        return since_write
+
+
+def _get_context(args, kwargs):
+    context = args[0] if args else kwargs.get('context')
+    if isinstance(context, nova.context.RequestContext):
+        return context
+    return None
+
+
+class RoutingBackend(object):
+    """Wraps the DB API backend to route its reads to the slaves."""
+
+    def __init__(self, backend, get_router):
+        self._backend = backend
+        self._get_router = get_router
+        self._wrappers = {}
+
+    def _route(self, name, fn):
+        read_only = is_read_only(name)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            context = _get_context(args, kwargs)
+            router = self._get_router()
+            if not read_only:
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    router.record_write(context)
+            if kwargs.get('use_slave'):
+                max_lag = None
+            elif name in ROUTED_READS:
+                max_lag = ROUTED_READS[name]
+                if max_lag is None:
+                    max_lag = CONF.database.slave_max_lag
+            else:
+                return fn(*args, **kwargs)
+            previous = current_replica()
+            _local.replica = router.pick(max_lag, context) or MASTER
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _local.replica = previous
+
+        return wrapper
+
+    def __getattr__(self, name):
+        attr = getattr(self._backend, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+        wrapped, wrapper = self._wrappers.get(name, (None, None))
+        if wrapped is not attr:
+            wrapper = self._route(name, attr)
+            self._wrappers[name] = (attr, wrapper)
+        return wrapper
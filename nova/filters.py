@@ -17,6 +17,13 @@
 Filter support
 """
 
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from oslo_log import log as logging
 
 from nova.i18n import _LI
@@ -24,6 +31,11 @@ from nova import loadables
 
 LOG = logging.getLogger(__name__)
 
+# Number of objects a filter has to see before its statistics are used to
+# order it, and after which they start decaying so the order keeps adapting.
+STATS_MIN_OBJECTS = 100
+STATS_MAX_OBJECTS = 100000
+
 
 class BaseFilter(object):
     """Base class for all filter classes."""
@@ -48,6 +60,23 @@ class BaseFilter(object):
     # for each request rather than for each instance
     run_filter_once_per_request = False
 
+    # Set to False in a subclass if the result of the filter depends on
+    # the filters run before it, so the adaptive ordering never moves it.
+    reorderable = True
+
+    # Names of the object attributes used by filter_columns().  Set this in
+    # a subclass which is able to evaluate all the objects at once.
+    column_attrs = ()
+
+    def filter_columns(self, filter_obj_list, columns, filter_properties):
+        """Return a boolean array telling which objects pass the filter.
+
+        Only called for filters which define column_attrs.  'columns' maps
+        each of those attribute names to a numpy array holding the values of
+        the attribute, in the same order as filter_obj_list.
+        """
+        raise NotImplementedError()
+
     def run_filter_for_index(self, index):
         """Return True if the filter needs to be run for the "index-th"
         instance in a request.  Only need to override this if a filter
@@ -59,23 +88,174 @@ class BaseFilter(object):
             return True
 
 
+class FilterStats(object):
+    """Pass rate and cost of a filter, measured on the objects it saw."""
+
+    def __init__(self):
+        self.objs_in = 0
+        self.objs_out = 0
+        self.elapsed = 0.0
+
+    def record(self, objs_in, objs_out, elapsed):
+        self.objs_in += objs_in
+        self.objs_out += objs_out
+        self.elapsed += elapsed
+        if self.objs_in > STATS_MAX_OBJECTS:
+            # Give more weight to the recent runs
+            self.objs_in /= 2.0
+            self.objs_out /= 2.0
+            self.elapsed /= 2.0
+
+    @property
+    def pass_rate(self):
+        if not self.objs_in:
+            return 1.0
+        return self.objs_out / float(self.objs_in)
+
+    @property
+    def cost(self):
+        """Average time spent on each object, in seconds."""
+        if not self.objs_in:
+            return 0.0
+        return self.elapsed / self.objs_in
+
+    def rank(self):
+        """Return the average time spent per object removed.
+
+        Running filters by increasing rank minimizes the total cost of
+        filtering, as long as the filters are independent.
+        """
+        rejection_rate = 1.0 - self.pass_rate
+        if rejection_rate <= 0:
+            return float('inf')
+        return self.cost / rejection_rate
+
+    def to_dict(self):
+        return {'objs_in': self.objs_in,
+                'objs_out': self.objs_out,
+                'pass_rate': self.pass_rate,
+                'cost': self.cost}
+
+
 class BaseFilterHandler(loadables.BaseLoader):
     """Base class to handle loading filter classes.
 
     This class should be subclassed where one needs to use filters.
     """
 
-    def get_filtered_objects(self, filters, objs, filter_properties, index=0):
+    # Set to True to evaluate the filters defining column_attrs over numpy
+    # arrays of the object attributes rather than one object at a time.
+    vectorized = False
+
+    # Set to True to run the filters by increasing cost per object they
+    # remove, as measured on the previous requests, rather than in the
+    # given order.
+    adaptive_order = False
+
+    # Object with an observe(kind, name, seconds) method, such as
+    # nova.scheduler.timings.Timings, recording the time spent in each
+    # filter.
+    timings = None
+
+    def __init__(self, *args, **kwargs):
+        super(BaseFilterHandler, self).__init__(*args, **kwargs)
+        # FilterStats keyed by filter class name
+        self.filter_stats = {}
+
+    def get_filter_stats(self):
+        return {name: stats.to_dict()
+                for name, stats in self.filter_stats.items()}
+
+    def _record_filter_stats(self, filter_, objs_in, objs_out, elapsed):
+        cls_name = filter_.__class__.__name__
+        stats = self.filter_stats.get(cls_name)
+        if stats is None:
+            stats = self.filter_stats[cls_name] = FilterStats()
+        stats.record(objs_in, objs_out, elapsed)
+        if self.timings is not None:
+            self.timings.observe('filter', cls_name, elapsed)
+
+    def _order_filters(self, filters):
+        """Order the filters by rank, between the ones not reorderable.
+
+        Filters are kept in their given order until all of them have
+        enough statistics.
+        """
+        ordered = []
+        movable = []
+        for filter_ in filters:
+            if filter_.reorderable:
+                movable.append(filter_)
+            else:
+                ordered.extend(self._order_by_rank(movable))
+                ordered.append(filter_)
+                movable = []
+        ordered.extend(self._order_by_rank(movable))
+        return ordered
+
+    def _order_by_rank(self, filters):
+        ranks = {}
+        for filter_ in filters:
+            stats = self.filter_stats.get(filter_.__class__.__name__)
+            if stats is None or stats.objs_in < STATS_MIN_OBJECTS:
+                return filters
+            ranks[filter_] = stats.rank()
+        return sorted(filters, key=lambda filter_: ranks[filter_])
+
+    def _use_columns(self, filter_):
+        return self.vectorized and numpy is not None and filter_.column_attrs
+
+    @staticmethod
+    def _load_columns(columns, list_objs, attrs):
+        for attr in attrs:
+            if attr not in columns:
+                columns[attr] = numpy.array(
+                    [getattr(obj, attr) for obj in list_objs], dtype=float)
+
+    def get_filtered_objects(self, filters, objs, filter_properties, index=0,
+                             record_stats=True):
+        """Return the objects passing all the filters.
+
+        With record_stats False, the pass rates and the timings of the
+        filters are not recorded, so that the checks of a few objects don't
+        skew the statistics measured over the whole set of objects.
+        """
         list_objs = list(objs)
         LOG.debug("Starting with %d host(s)", len(list_objs))
+        # Attribute arrays shared by the vectorized filters, which are kept
+        # aligned with list_objs.
+        columns = {}
+        if self.adaptive_order:
+            filters = self._order_filters(filters)
         for filter_ in filters:
             if filter_.run_filter_for_index(index):
                 cls_name = filter_.__class__.__name__
-                objs = filter_.filter_all(list_objs, filter_properties)
-                if objs is None:
-                    LOG.debug("Filter %s says to stop filtering", cls_name)
-                    return
-                list_objs = list(objs)
+                objs_in = len(list_objs)
+                start = time.time()
+                if self._use_columns(filter_):
+                    self._load_columns(columns, list_objs,
+                                       filter_.column_attrs)
+                    mask = filter_.filter_columns(list_objs, columns,
+                                                  filter_properties)
+                    list_objs = [list_objs[i] for i in mask.nonzero()[0]]
+                    columns = {attr: values[mask]
+                               for attr, values in columns.items()}
+                else:
+                    objs = filter_.filter_all(list_objs, filter_properties)
+                    if objs is None:
+                        LOG.debug("Filter %s says to stop filtering",
+                                  cls_name)
+                        return
+                    new_objs = list(objs)
+                    if columns and (len(new_objs) != len(list_objs) or
+                            any(new is not old for new, old in
+                                zip(new_objs, list_objs))):
+                        columns = {}
+                    list_objs = new_objs
+                if record_stats:
+                    self._record_filter_stats(filter_, objs_in,
+                                              len(list_objs),
+                                              time.time() - start)
                 if not list_objs:
                     LOG.info(_LI("Filter %s returned 0 hosts"), cls_name)
                     break
@@ -21,6 +21,7 @@ from oslo_log import log as logging
 from oslo_utils import excutils
 
 from nova.db import base
+from nova import exception
 from nova import hooks
 from nova.i18n import _, _LE
 from nova.network import model as network_model
@@ -253,6 +254,30 @@ class NetworkAPI(base.Base):
         """Template method, so a subclass can implement for neutron/network."""
         raise NotImplementedError()
 
+    def heal_instance_info_caches(self, context, instances):
+        """Refresh the network info cache of instances.
+
+        This is done by the compute manager periodically, to heal the caches
+        which went stale. Returns the instances whose cache was refreshed,
+        all of them unless a subclass can tell which ones changed.
+        """
+        return self._refresh_instance_info_caches(context, instances)
+
+    def _refresh_instance_info_caches(self, context, instances):
+        refreshed = []
+        for instance in instances:
+            try:
+                self.get_instance_nw_info(context, instance)
+            except exception.InstanceNotFound:
+                LOG.debug('Instance no longer exists. Unable to refresh',
+                          instance=instance)
+            except Exception:
+                LOG.exception(_LE('An error occurred while refreshing the '
+                                  'network cache.'), instance=instance)
+            else:
+                refreshed.append(instance)
+        return refreshed
+
     def create_pci_requests_for_sriov_ports(self, context,
                                             pci_requests,
                                             requested_networks):
@@ -27,6 +27,7 @@ from neutronclient.v2_0 import client as clientv20
 from oslo_concurrency import lockutils
 from oslo_config import cfg
 from oslo_log import log as logging
+from oslo_serialization import jsonutils
 from oslo_utils import excutils
 from oslo_utils import uuidutils
 import six
@@ -129,6 +130,10 @@ soft_external_network_attach_authorize = extensions.soft_core_authorizer(
 _SESSION = None
 _ADMIN_AUTH = None
 
+# Number of instances whose ports are listed at once when healing the
+# network info caches, to keep the query strings of the requests bounded
+HEAL_INSTANCES_PER_REQUEST = 100
+
 
 def reset_state():
     global _ADMIN_AUTH
@@ -1482,19 +1487,40 @@ class API(base_api.NetworkAPI):
         """Force add a network to the project."""
         raise NotImplementedError()
 
+    def _get_floating_ips_by_ports(self, client, port_ids):
+        """Get the floatingips of ports, by port and fixed ip."""
+        try:
+            data = client.list_floatingips(port_id=port_ids)
+        # If a neutron plugin does not implement the L3 API a 404 from
+        # list_floatingips will be raised.
+        except neutron_client_exc.NeutronClientException as e:
+            if e.status_code == 404:
+                return {}
+            with excutils.save_and_reraise_exception():
+                LOG.exception(_LE('Unable to access floating IPs for ports '
+                                  '%s'), port_ids)
+        floating_ips = {}
+        for fip in data['floatingips']:
+            key = (fip['port_id'], fip['fixed_ip_address'])
+            floating_ips.setdefault(key, []).append(fip)
+        return floating_ips
+
     def _nw_info_get_ips(self, client, port):
         network_IPs = []
         for fixed_ip in port['fixed_ips']:
-            fixed = network_model.FixedIP(address=fixed_ip['ip_address'])
             floats = self._get_floating_ips_by_fixed_and_port(
                 client, fixed_ip['ip_address'], port['id'])
-            for ip in floats:
-                fip = network_model.IP(address=ip['floating_ip_address'],
-                                       type='floating')
-                fixed.add_floating_ip(fip)
-            network_IPs.append(fixed)
+            network_IPs.append(self._nw_info_build_ip(fixed_ip, floats))
         return network_IPs
 
+    def _nw_info_build_ip(self, fixed_ip, floats):
+        fixed = network_model.FixedIP(address=fixed_ip['ip_address'])
+        for ip in floats:
+            fip = network_model.IP(address=ip['floating_ip_address'],
+                                   type='floating')
+            fixed.add_floating_ip(fip)
+        return fixed
+
     def _nw_info_get_subnets(self, context, port, network_IPs):
         subnets = self._get_subnets_from_port(context, port)
         for subnet in subnets:
@@ -1563,6 +1589,33 @@ class API(base_api.NetworkAPI):
             network['should_create_bridge'] = should_create_bridge
         return network, ovs_interfaceid
 
+    def _nw_info_build_vif(self, port, networks, subnets,
+                           preexisting_port_ids):
+        vif_active = False
+        if port['admin_state_up'] is False or port['status'] == 'ACTIVE':
+            vif_active = True
+
+        devname = "tap" + port['id']
+        devname = devname[:network_model.NIC_NAME_LEN]
+
+        network, ovs_interfaceid = self._nw_info_build_network(
+            port, networks, subnets)
+        preserve_on_delete = port['id'] in preexisting_port_ids
+
+        return network_model.VIF(
+            id=port['id'],
+            address=port['mac_address'],
+            network=network,
+            vnic_type=port.get('binding:vnic_type',
+                               network_model.VNIC_TYPE_NORMAL),
+            type=port.get('binding:vif_type'),
+            profile=port.get('binding:profile'),
+            details=port.get('binding:vif_details'),
+            ovs_interfaceid=ovs_interfaceid,
+            devname=devname,
+            active=vif_active,
+            preserve_on_delete=preserve_on_delete)
+
     def _get_preexisting_port_ids(self, instance):
         """Retrieve the preexisting ports associated with the given instance.
         These ports were not created by nova and hence should not be
@@ -1629,39 +1682,14 @@ class API(base_api.NetworkAPI):
         for port_id in port_ids:
             current_neutron_port = current_neutron_port_map.get(port_id)
             if current_neutron_port:
-                vif_active = False
-                if (current_neutron_port['admin_state_up'] is False
-                    or current_neutron_port['status'] == 'ACTIVE'):
-                    vif_active = True
-
                 network_IPs = self._nw_info_get_ips(client,
                                                     current_neutron_port)
                 subnets = self._nw_info_get_subnets(context,
                                                     current_neutron_port,
                                                     network_IPs)
-
-                devname = "tap" + current_neutron_port['id']
-                devname = devname[:network_model.NIC_NAME_LEN]
-
-                network, ovs_interfaceid = (
-                    self._nw_info_build_network(current_neutron_port,
-                                                networks, subnets))
-                preserve_on_delete = (current_neutron_port['id'] in
-                                      preexisting_port_ids)
-
-                nw_info.append(network_model.VIF(
-                    id=current_neutron_port['id'],
-                    address=current_neutron_port['mac_address'],
-                    network=network,
-                    vnic_type=current_neutron_port.get('binding:vnic_type',
-                        network_model.VNIC_TYPE_NORMAL),
-                    type=current_neutron_port.get('binding:vif_type'),
-                    profile=current_neutron_port.get('binding:profile'),
-                    details=current_neutron_port.get('binding:vif_details'),
-                    ovs_interfaceid=ovs_interfaceid,
-                    devname=devname,
-                    active=vif_active,
-                    preserve_on_delete=preserve_on_delete))
+                nw_info.append(self._nw_info_build_vif(
+                    current_neutron_port, networks, subnets,
+                    preexisting_port_ids))
 
             elif nw_info_refresh:
                 LOG.info(_LI('Port %s from network info_cache is no '
@@ -1671,6 +1699,117 @@ class API(base_api.NetworkAPI):
 
         return nw_info
 
+    def heal_instance_info_caches(self, context, instances):
+        """Refresh the network info cache of the instances which changed.
+
+        The ports of the instances, their floating IPs, subnets, DHCP
+        ports and networks are listed at once for many instances, and the
+        network info built from them is compared with the cache of each
+        instance. Only the stale caches are refreshed, with
+        get_instance_nw_info() so that it is done under the lock.
+        """
+        client = get_client(context, admin=True)
+        instances = list(instances)
+        stale = []
+        for i in range(0, len(instances), HEAL_INSTANCES_PER_REQUEST):
+            batch = instances[i:i + HEAL_INSTANCES_PER_REQUEST]
+            stale.extend(self._get_stale_instances(client, batch))
+        return self._refresh_instance_info_caches(context, stale)
+
+    def _get_stale_instances(self, client, instances):
+        """Return the instances whose network info cache does not match
+        the state of Neutron.
+        """
+        search_opts = {'device_id': [instance.uuid for instance in instances]}
+        ports = client.list_ports(**search_opts).get('ports', [])
+
+        floating_ips = {}
+        ipam_subnets = []
+        dhcp_ports = {}
+        networks = []
+        if ports:
+            floating_ips = self._get_floating_ips_by_ports(
+                client, [port['id'] for port in ports])
+            subnet_ids = set(fixed_ip['subnet_id'] for port in ports
+                             for fixed_ip in port['fixed_ips'])
+            if subnet_ids:
+                search_opts = {'id': list(subnet_ids)}
+                data = client.list_subnets(**search_opts)
+                ipam_subnets = data.get('subnets', [])
+            if ipam_subnets:
+                search_opts = {'network_id': list(set(
+                                   subnet['network_id']
+                                   for subnet in ipam_subnets)),
+                               'device_owner': 'network:dhcp'}
+                for port in client.list_ports(**search_opts).get('ports',
+                                                                 []):
+                    dhcp_ports.setdefault(port['network_id'],
+                                          []).append(port)
+            search_opts = {'id': list(set(port['network_id']
+                                          for port in ports))}
+            networks = client.list_networks(**search_opts).get('networks',
+                                                               [])
+
+        instance_ports = {}
+        for port in ports:
+            instance_ports.setdefault(port['device_id'], []).append(port)
+
+        stale = []
+        for instance in instances:
+            current_neutron_port_map = {}
+            for port in instance_ports.get(instance.uuid, []):
+                if port['tenant_id'] == instance.project_id:
+                    current_neutron_port_map[port['id']] = port
+            nw_info = self._build_network_info_model_from_ports(
+                instance, current_neutron_port_map, floating_ips,
+                ipam_subnets, dhcp_ports, networks)
+            cached_nw_info = network_model.NetworkInfo()
+            if instance.info_cache is not None:
+                cached_nw_info = instance.info_cache.network_info
+            if (jsonutils.loads(nw_info.json()) !=
+                    jsonutils.loads(cached_nw_info.json())):
+                stale.append(instance)
+        return stale
+
+    def _build_network_info_model_from_ports(self, instance,
+                                             current_neutron_port_map,
+                                             floating_ips, ipam_subnets,
+                                             dhcp_ports, networks):
+        """Return the network info an instance would be refreshed with,
+        built from the listed ports, floating IPs, subnets, DHCP ports
+        by network and networks like _build_network_info_model() does.
+        """
+        port_ids = [vif['id'] for vif in
+                    compute_utils.get_nw_info_for_instance(instance)]
+        if not port_ids:
+            port_ids = current_neutron_port_map.keys()
+        preexisting_port_ids = set(self._get_preexisting_port_ids(instance))
+        nw_info = network_model.NetworkInfo()
+
+        for port_id in port_ids:
+            port = current_neutron_port_map.get(port_id)
+            if not port:
+                continue
+            network_IPs = [
+                self._nw_info_build_ip(fixed_ip, floating_ips.get(
+                    (port['id'], fixed_ip['ip_address']), []))
+                for fixed_ip in port['fixed_ips']]
+            subnet_ids = [fixed_ip['subnet_id']
+                          for fixed_ip in port['fixed_ips']]
+            subnets = []
+            for subnet in ipam_subnets:
+                if subnet['id'] in subnet_ids:
+                    subnet_object = self._nw_info_build_subnet(
+                        subnet, dhcp_ports.get(subnet['network_id'], []))
+                    subnet_object['ips'] = [
+                        fixed_ip for fixed_ip in network_IPs
+                        if fixed_ip.is_in_subnet(subnet_object)]
+                    subnets.append(subnet_object)
+            nw_info.append(self._nw_info_build_vif(
+                port, networks, subnets, preexisting_port_ids))
+
+        return network_model.NetworkInfo.hydrate(nw_info)
+
     def _get_subnets_from_port(self, context, port):
         """Return the subnets for a given port."""
 
@@ -1688,38 +1827,43 @@ class API(base_api.NetworkAPI):
         subnets = []
 
         for subnet in ipam_subnets:
-            subnet_dict = {'cidr': subnet['cidr'],
-                           'gateway': network_model.IP(
-                                address=subnet['gateway_ip'],
-                                type='gateway'),
-            }
-
             # attempt to populate DHCP server field
             search_opts = {'network_id': subnet['network_id'],
                            'device_owner': 'network:dhcp'}
             data = get_client(context).list_ports(**search_opts)
             dhcp_ports = data.get('ports', [])
-            for p in dhcp_ports:
-                for ip_pair in p['fixed_ips']:
-                    if ip_pair['subnet_id'] == subnet['id']:
-                        subnet_dict['dhcp_server'] = ip_pair['ip_address']
-                        break
-
-            subnet_object = network_model.Subnet(**subnet_dict)
-            for dns in subnet.get('dns_nameservers', []):
-                subnet_object.add_dns(
-                    network_model.IP(address=dns, type='dns'))
-
-            for route in subnet.get('host_routes', []):
-                subnet_object.add_route(
-                    network_model.Route(cidr=route['destination'],
-                                        gateway=network_model.IP(
-                                            address=route['nexthop'],
-                                            type='gateway')))
-
-            subnets.append(subnet_object)
+            subnets.append(self._nw_info_build_subnet(subnet, dhcp_ports))
         return subnets
 
+    def _nw_info_build_subnet(self, subnet, dhcp_ports):
+        """Return the model of a subnet, given the DHCP ports of its
+        network.
+        """
+        subnet_dict = {'cidr': subnet['cidr'],
+                       'gateway': network_model.IP(
+                            address=subnet['gateway_ip'],
+                            type='gateway'),
+        }
+
+        for p in dhcp_ports:
+            for ip_pair in p['fixed_ips']:
+                if ip_pair['subnet_id'] == subnet['id']:
+                    subnet_dict['dhcp_server'] = ip_pair['ip_address']
+                    break
+
+        subnet_object = network_model.Subnet(**subnet_dict)
+        for dns in subnet.get('dns_nameservers', []):
+            subnet_object.add_dns(
+                network_model.IP(address=dns, type='dns'))
+
+        for route in subnet.get('host_routes', []):
+            subnet_object.add_route(
+                network_model.Route(cidr=route['destination'],
+                                    gateway=network_model.IP(
+                                        address=route['nexthop'],
+                                        type='gateway')))
+        return subnet_object
+
     def get_dns_domains(self, context):
         """Return a list of available dns domains.
 
@@ -14,18 +14,23 @@
 
 """Nova common internal object model"""
 
+import collections
 import contextlib
 import copy
 import datetime
 import functools
+import re
 import traceback
 
+import iso8601
 import netaddr
 from oslo_log import log as logging
 import oslo_messaging as messaging
 from oslo_utils import timeutils
 from oslo_utils import versionutils
 from oslo_versionedobjects import base as ovoo_base
+from oslo_versionedobjects import exception as ovoo_exc
+from oslo_versionedobjects import fields as ovoo_fields
 import six
 
 from nova import context
@@ -46,12 +51,222 @@ def get_attrname(name):
     return '_obj_' + name
 
 
+class _Unset(object):
+    """The value of the fields which are not set."""
+
+    def __reduce__(self):
+        # NOTE: Unpickled as the same object
+        return '_UNSET'
+
+
+_UNSET = _Unset()
+
+
+def _make_field_property(index, name, field):
+    bit = 1 << index
+
+    def getter(self):
+        value = self._field_values[index]
+        if value is _UNSET:
+            self.obj_load_attr(name)
+            value = self._field_values[index]
+            if value is _UNSET:
+                raise AttributeError("'%s' object has no attribute '%s'" %
+                                     (self.obj_name(), get_attrname(name)))
+        return value
+
+    def setter(self, value):
+        field_value = field.coerce(self, name, value)
+        values = self._field_values
+        if field.read_only and values[index] is not _UNSET:
+            # Note(yjiang5): _from_db_object() may iterate
+            # every field and write, no exception in such situation.
+            if values[index] != field_value:
+                raise ovoo_exc.ReadOnlyFieldError(field=name)
+            return
+        self._changed_bits |= bit
+        values[index] = field_value
+
+    def deleter(self):
+        if self._field_values[index] is _UNSET:
+            raise AttributeError("No such attribute `%s'" % name)
+        self._field_values[index] = _UNSET
+
+    return property(getter, setter, deleter)
+
+
+# The types whose coercion returns a value of the given type unchanged
+_COERCED_TYPES = {
+    ovoo_fields.Boolean: bool,
+    ovoo_fields.Float: float,
+    ovoo_fields.Integer: int,
+    ovoo_fields.String: six.text_type,
+    ovoo_fields.UUID: str,
+}
+
+
+def _is_passthrough(field_type, method):
+    """Return True if a method of a field type returns its value as is."""
+    return (getattr(type(field_type), method) is
+            getattr(ovoo_fields.FieldType, method))
+
+
+def _make_field_encoder(field):
+    """Return the function encoding the set value of a field, or None.
+
+    None means that the value is its own primitive.
+    """
+    field_type = field._type
+    if _is_passthrough(field_type, 'to_primitive'):
+        return None
+    return field_type.to_primitive
+
+
+# The format of the datetimes encoded by timeutils.isotime()
+_ISOTIME_RE = re.compile(r'^(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)Z$')
+
+
+def _make_datetime_decoder(field_type):
+    """Return the from_primitive() of a DateTime type, with a fast path for
+    the UTC datetimes we encode.
+    """
+    tzinfo = iso8601.iso8601.UTC if field_type.tzinfo_aware else None
+
+    def from_primitive(obj, attr, value):
+        if isinstance(value, six.string_types):
+            match = _ISOTIME_RE.match(value)
+            if match:
+                try:
+                    return datetime.datetime(
+                        *[int(part) for part in match.groups()],
+                        tzinfo=tzinfo)
+                except ValueError:
+                    pass
+        return field_type.from_primitive(obj, attr, value)
+
+    return from_primitive
+
+
+def _make_field_decoder(name, field):
+    """Return the function decoding the primitive of a field.
+
+    The decoded value is coerced like when it is set, unless the coercion
+    would return it unchanged: when it already has the exact type the
+    coercion returns, or the type coerced it when decoding it.
+    """
+    field_type = field._type
+    nullable = field.nullable
+    from_primitive = None
+    if not _is_passthrough(field_type, 'from_primitive'):
+        from_primitive = field_type.from_primitive
+    coerced_type = _COERCED_TYPES.get(type(field_type))
+    # NOTE: DateTime.from_primitive() ends with coerce()
+    coerced = type(field_type) is ovoo_fields.DateTime
+    if coerced:
+        from_primitive = _make_datetime_decoder(field_type)
+
+    def decoder(obj, value):
+        if value is None:
+            if nullable:
+                return None
+            return field.coerce(obj, name, None)
+        if from_primitive is not None:
+            value = from_primitive(obj, name, value)
+        if coerced or type(value) is coerced_type:
+            return value
+        return field.coerce(obj, name, value)
+
+    return decoder
+
+
+def _make_class_properties(cls):
+    """Generate the properties of the fields of an object class.
+
+    The values of the fields are stored in a list in each object, in the
+    order of the sorted field names, rather than as attributes, and whether
+    they changed in a bitmap of the same order.
+
+    The sub-object fields, and the functions encoding and decoding the
+    primitives of the fields, are computed once for the class.
+    """
+    ovoo_base._make_class_properties(cls)
+    cls._obj_field_names = tuple(sorted(cls.fields))
+    cls._obj_field_index = {name: index for index, name
+                            in enumerate(cls._obj_field_names)}
+    for index, name in enumerate(cls._obj_field_names):
+        setattr(cls, name, _make_field_property(index, name,
+                                                cls.fields[name]))
+    cls._obj_object_fields = tuple(
+        name for name in cls._obj_field_names
+        if isinstance(cls.fields[name], (obj_fields.ObjectField,
+                                         obj_fields.ListOfObjectsField)))
+    cls._obj_encoders = tuple(
+        (name, _make_field_encoder(cls.fields[name]))
+        for name in cls._obj_field_names)
+    cls._obj_decoders = tuple(
+        (name, _make_field_decoder(name, cls.fields[name]))
+        for name in cls._obj_field_names)
+
+
 class NovaObjectRegistry(ovoo_base.VersionedObjectRegistry):
     def registration_hook(self, cls, index):
         # NOTE(danms): Set the *latest* version of this class
         newest = self._registry._obj_classes[cls.obj_name()][0]
         setattr(objects, cls.obj_name(), newest)
 
+    def _register_class(self, cls):
+        super(NovaObjectRegistry, self)._register_class(cls)
+        _make_class_properties(cls)
+
+    @classmethod
+    def register_if(cls, condition):
+        def wraps(obj_cls):
+            if condition:
+                cls.register(obj_cls)
+            else:
+                _make_class_properties(obj_cls)
+            return obj_cls
+        return wraps
+
+
+class _ChangedFields(collections.MutableSet):
+    """The names of the changed fields of an object, a view of its bitmap."""
+
+    __slots__ = ('_obj',)
+
+    def __init__(self, obj):
+        self._obj = obj
+
+    def __contains__(self, name):
+        index = self._obj._obj_field_index.get(name)
+        return index is not None and bool(self._obj._changed_bits >> index & 1)
+
+    def __iter__(self):
+        bits = self._obj._changed_bits
+        for name in self._obj._obj_field_names:
+            if not bits:
+                return
+            if bits & 1:
+                yield name
+            bits >>= 1
+
+    def __len__(self):
+        return bin(self._obj._changed_bits).count('1')
+
+    def add(self, name):
+        self._obj._changed_bits |= 1 << self._obj._obj_field_index[name]
+
+    def discard(self, name):
+        index = self._obj._obj_field_index.get(name)
+        if index is not None:
+            self._obj._changed_bits &= ~(1 << index)
+
+    def clear(self):
+        self._obj._changed_bits = 0
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, sorted(self))
+
 
 # These are decorators that mark an object's method as remotable.
 # If the metaclass is configured to forward object methods to an
@@ -181,12 +396,64 @@ class NovaObject(object):
     # Temporary until we inherit from o.vo.base.VersionedObject
     indirection_api = None
 
+    # The names of the fields in the order of their values, the index of
+    # each, the names of the sub-object fields, and the encoding and
+    # decoding functions of the fields, set when the class is registered.
+    _obj_field_names = ()
+    _obj_field_index = {}
+    _obj_object_fields = ()
+    _obj_encoders = ()
+    _obj_decoders = ()
+
+    # NOTE: The objects of the large lists, like the instances or compute
+    # nodes, only need an attribute dict for the extra state of a few
+    # classes.
+    __slots__ = ('_context', '_field_values', '_changed_bits', '__dict__',
+                 '__weakref__')
+
     def __init__(self, context=None, **kwargs):
-        self._changed_fields = set()
+        self._field_values = [_UNSET] * len(self._obj_field_names)
+        self._changed_bits = 0
         self._context = context
         for key in kwargs.keys():
             setattr(self, key, kwargs[key])
 
+    def __getattr__(self, name):
+        # NOTE: Keep the code reading the value of a field by the name of
+        # its storage, get_attrname(), working.
+        if name.startswith('_obj_'):
+            index = self._obj_field_index.get(name[len('_obj_'):])
+            if index is not None:
+                value = self._field_values[index]
+                if value is not _UNSET:
+                    return value
+        raise AttributeError("'%s' object has no attribute '%s'" %
+                             (self.obj_name(), name))
+
+    def __copy__(self):
+        nobj = self.__class__.__new__(self.__class__)
+        nobj.__dict__.update(self.__dict__)
+        nobj._context = self._context
+        nobj._field_values = list(self._field_values)
+        nobj._changed_bits = self._changed_bits
+        return nobj
+
+    def __reduce_ex__(self, protocol):
+        # NOTE: Only the protocol 2 pickles the __slots__, which the older
+        # protocols can unpickle too.
+        return super(NovaObject, self).__reduce_ex__(2)
+
+    @property
+    def _changed_fields(self):
+        return _ChangedFields(self)
+
+    @_changed_fields.setter
+    def _changed_fields(self, names):
+        bits = 0
+        for name in names:
+            bits |= 1 << self._obj_field_index[name]
+        self._changed_bits = bits
+
     def __repr__(self):
         return '%s(%s)' % (
             self.obj_name(),
@@ -241,11 +508,16 @@ class NovaObject(object):
         self.VERSION = objver
         objdata = primitive['nova_object.data']
         changes = primitive.get('nova_object.changes', [])
-        for name, field in self.fields.items():
+        values = self._field_values
+        for index, (name, decoder) in enumerate(self._obj_decoders):
             if name in objdata:
-                setattr(self, name, field.from_primitive(self, name,
-                                                         objdata[name]))
-        self._changed_fields = set([x for x in changes if x in self.fields])
+                values[index] = decoder(self, objdata[name])
+        field_index = self._obj_field_index
+        bits = 0
+        for name in changes:
+            if name in field_index:
+                bits |= 1 << field_index[name]
+        self._changed_bits = bits
         return self
 
     @classmethod
@@ -277,7 +549,7 @@ class NovaObject(object):
             if self.obj_attr_is_set(name):
                 nval = copy.deepcopy(getattr(self, name), memo)
                 setattr(nobj, name, nval)
-        nobj._changed_fields = set(self._changed_fields)
+        nobj._changed_bits = self._changed_bits
         return nobj
 
     def obj_clone(self):
@@ -384,10 +656,7 @@ class NovaObject(object):
         :raises: nova.exception.UnsupportedObjectError if conversion
         is not possible for some reason
         """
-        for key, field in self.fields.items():
-            if not isinstance(field, (obj_fields.ObjectField,
-                                      obj_fields.ListOfObjectsField)):
-                continue
+        for key in self._obj_object_fields:
             if not self.obj_attr_is_set(key):
                 continue
             if key not in self.obj_relationships:
@@ -404,18 +673,23 @@ class NovaObject(object):
         This calls to_primitive() for each item in fields.
         """
         primitive = dict()
-        for name, field in self.fields.items():
-            if self.obj_attr_is_set(name):
-                primitive[name] = field.to_primitive(self, name,
-                                                     getattr(self, name))
+        for value, (name, encoder) in zip(self._field_values,
+                                          self._obj_encoders):
+            if value is _UNSET:
+                continue
+            if encoder is None or value is None:
+                primitive[name] = value
+            else:
+                primitive[name] = encoder(self, name, value)
         if target_version:
             self.obj_make_compatible(primitive, target_version)
         obj = {'nova_object.name': self.obj_name(),
                'nova_object.namespace': 'nova',
                'nova_object.version': target_version or self.VERSION,
                'nova_object.data': primitive}
-        if self.obj_what_changed():
-            obj['nova_object.changes'] = list(self.obj_what_changed())
+        changes = self.obj_what_changed()
+        if changes:
+            obj['nova_object.changes'] = list(changes)
         return obj
 
     def obj_set_defaults(self, *attrs):
@@ -452,11 +726,9 @@ class NovaObject(object):
     def obj_what_changed(self):
         """Returns a set of fields that have been modified."""
         changes = set(self._changed_fields)
-        for field in self.fields:
-            if (self.obj_attr_is_set(field) and
-                    isinstance(getattr(self, field), NovaObject) and
-                    getattr(self, field).obj_what_changed()):
-                changes.add(field)
+        for name, value in zip(self._obj_field_names, self._field_values):
+            if isinstance(value, NovaObject) and value.obj_what_changed():
+                changes.add(name)
         return changes
 
     def obj_get_changes(self):
@@ -507,7 +779,7 @@ class NovaObject(object):
         if fields:
             self._changed_fields -= set(fields)
         else:
-            self._changed_fields.clear()
+            self._changed_bits = 0
 
     def obj_attr_is_set(self, attrname):
         """Test object to see if attrname is present.
@@ -516,6 +788,9 @@ class NovaObject(object):
         False if not. Raises AttributeError if attrname is not
         a valid attribute for this object.
         """
+        index = self._obj_field_index.get(attrname)
+        if index is not None:
+            return self._field_values[index] is not _UNSET
         if attrname not in self.obj_fields:
             raise AttributeError(
                 _("%(objname)s object has no attribute '%(attrname)s'") %
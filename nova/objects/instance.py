@@ -13,6 +13,7 @@
 #    under the License.
 
 import contextlib
+import copy
 
 from oslo_config import cfg
 from oslo_db import exception as db_exc
@@ -32,6 +33,7 @@ from nova import notifications
 from nova import objects
 from nova.objects import base
 from nova.objects import fields
+from nova import pagination
 from nova import utils
 
 
@@ -58,6 +60,9 @@ INSTANCE_OPTIONAL_ATTRS = (_INSTANCE_OPTIONAL_JOINED_FIELDS +
 INSTANCE_DEFAULT_FIELDS = ['metadata', 'system_metadata',
                            'info_cache', 'security_groups']
 
+# Number of instances loaded at once by the InstanceList iterators
+CHUNK_SIZE = 1000
+
 
 def _expected_cols(expected_attrs):
     """Return expected_attrs that are columns needing joining.
@@ -636,7 +641,7 @@ class Instance(base.NovaPersistentObject, base.NovaObject,
         if cell_type == 'compute':
             cells_api = cells_rpcapi.CellsAPI()
             cells_api.instance_destroy_at_top(self._context, stale_instance)
-        delattr(self, base.get_attrname('id'))
+        del self.id
 
     def _save_info_cache(self, context):
         if self.info_cache:
@@ -1144,6 +1149,23 @@ def _make_instance_list(context, inst_list, db_inst_list, expected_attrs):
     return inst_list
 
 
+def _make_projected_instance_list(context, inst_list, db_inst_list, fields):
+    inst_list.objects = []
+    for db_inst in db_inst_list:
+        inst_obj = objects.Instance(context)
+        for field in fields:
+            if field == 'deleted':
+                inst_obj.deleted = db_inst['deleted'] == db_inst['id']
+            elif field == 'cleaned':
+                inst_obj.cleaned = db_inst['cleaned'] == 1
+            else:
+                inst_obj[field] = db_inst[field]
+        inst_obj.obj_reset_changes()
+        inst_list.objects.append(inst_obj)
+    inst_list.obj_reset_changes()
+    return inst_list
+
+
 @base.NovaObjectRegistry.register
 class InstanceList(base.ObjectListBase, base.NovaObject):
     # Version 1.0: Initial version
@@ -1167,7 +1189,11 @@ class InstanceList(base.ObjectListBase, base.NovaObject):
     # Version 1.17: Instance <= version 1.20
     # Version 1.18: Instance <= version 1.21
     # Version 1.19: Removed get_hung_in_rebooting()
-    VERSION = '1.19'
+    # Version 1.20: Added limit and marker to get_active_by_window_joined,
+    #               added get_count_active_by_window()
+    # Version 1.21: Added get_projected_by_filters()
+    # Version 1.22: Added get_summary_by_host_and_node()
+    VERSION = '1.22'
 
     fields = {
         'objects': fields.ListOfObjectsField('Instance'),
@@ -1193,6 +1219,9 @@ class InstanceList(base.ObjectListBase, base.NovaObject):
         '1.17': '1.20',
         '1.18': '1.21',
         '1.19': '1.21',
+        '1.20': '1.21',
+        '1.21': '1.21',
+        '1.22': '1.21',
         }
 
     @base.remotable_classmethod
@@ -1245,18 +1274,87 @@ class InstanceList(base.ObjectListBase, base.NovaObject):
         return _make_instance_list(context, cls(), db_instances,
                                    expected_attrs)
 
+    @base.remotable_classmethod
+    def get_projected_by_filters(cls, context, filters, fields,
+                                 sort_keys=None, sort_dirs=None, limit=None,
+                                 marker=None, use_slave=False):
+        """Get the instances matching filters, with only some fields set.
+
+        Only the columns of the given fields are read from the database,
+        and the related tables are not joined, so this is much lighter than
+        get_by_filters() for callers which need a few fields. Any other
+        field is unset on the returned instances and can't be lazy-loaded,
+        except the optional ones.
+        """
+        for field in fields:
+            if (field in INSTANCE_OPTIONAL_ATTRS or
+                    field not in objects.Instance.fields):
+                raise exception.ObjectActionError(
+                    action='get_projected_by_filters',
+                    reason='field %s can not be projected' % field)
+        db_inst_list = db.instance_get_all_by_filters_sort(
+            context, filters, limit=limit, marker=marker,
+            use_slave=use_slave, sort_keys=sort_keys, sort_dirs=sort_dirs,
+            columns=list(fields))
+        return _make_projected_instance_list(context, cls(), db_inst_list,
+                                             fields)
+
+    @classmethod
+    def get_projected_by_host(cls, context, host, fields, use_slave=False):
+        """Get the instances of a host, with only some fields set.
+
+        See get_projected_by_filters().
+        """
+        filters = {'host': host, 'deleted': False, 'soft_deleted': True}
+        return cls.get_projected_by_filters(context, filters, fields,
+                                            use_slave=use_slave)
+
+    @classmethod
+    def iter_by_filters(cls, context, filters, sort_keys=None,
+                        sort_dirs=None, expected_attrs=None,
+                        use_slave=False, chunk_size=CHUNK_SIZE):
+        """Yield the instances matching filters, a chunk at a time.
+
+        Unlike get_by_filters(), only chunk_size instances are loaded at
+        once, so the memory used doesn't grow with the number of instances.
+        Each chunk is fetched from where the previous one ended, using a
+        continuation token as marker.
+        """
+        sort_keys = sort_keys or ['id']
+        sort_dirs = sort_dirs or ['asc']
+        marker = None
+        while True:
+            # NOTE: _make_instance_list() modifies expected_attrs, so each
+            # chunk gets its own copy.
+            chunk = cls.get_by_filters(
+                context, filters, limit=chunk_size, marker=marker,
+                expected_attrs=copy.copy(expected_attrs),
+                use_slave=use_slave, sort_keys=sort_keys,
+                sort_dirs=sort_dirs)
+            for instance in chunk:
+                yield instance
+            if len(chunk) < chunk_size:
+                return
+            # NOTE: The token is built here rather than by the database
+            # API, which the services calling through the conductor can't
+            # access.
+            marker = pagination.get_marker(chunk[-1], sort_keys=sort_keys,
+                                           sort_dirs=sort_dirs)
+
     @base.remotable_classmethod
     def _get_active_by_window_joined(cls, context, begin, end=None,
                                     project_id=None, host=None,
                                     expected_attrs=None,
-                                    use_slave=False):
+                                    use_slave=False, limit=None,
+                                    marker=None):
         # NOTE(mriedem): We need to convert the begin/end timestamp strings
         # to timezone-aware datetime objects for the DB API call.
         begin = timeutils.parse_isotime(begin)
         end = timeutils.parse_isotime(end) if end else None
         db_inst_list = db.instance_get_active_by_window_joined(
             context, begin, end, project_id, host,
-            columns_to_join=_expected_cols(expected_attrs))
+            columns_to_join=_expected_cols(expected_attrs),
+            limit=limit, marker=marker)
         return _make_instance_list(context, cls(), db_inst_list,
                                    expected_attrs)
 
@@ -1264,7 +1362,8 @@ class InstanceList(base.ObjectListBase, base.NovaObject):
     def get_active_by_window_joined(cls, context, begin, end=None,
                                     project_id=None, host=None,
                                     expected_attrs=None,
-                                    use_slave=False):
+                                    use_slave=False, limit=None,
+                                    marker=None):
         """Get instances and joins active during a certain time window.
 
         :param:context: nova request context
@@ -1275,6 +1374,9 @@ class InstanceList(base.ObjectListBase, base.NovaObject):
         :param:expected_attrs: list of related fields that can be joined
         in the database layer when querying for instances
         :param use_slave if True, ship this query off to a DB slave
+        :param:limit: maximum number of instances to return, sorted by id
+        :param:marker: continuation token of the last instance of the
+        previous page
         :returns: InstanceList
 
         """
@@ -1285,7 +1387,73 @@ class InstanceList(base.ObjectListBase, base.NovaObject):
         return cls._get_active_by_window_joined(context, begin, end,
                                                 project_id, host,
                                                 expected_attrs,
-                                                use_slave=use_slave)
+                                                use_slave=use_slave,
+                                                limit=limit, marker=marker)
+
+    @classmethod
+    def iter_active_by_window_joined(cls, context, begin, end=None,
+                                     project_id=None, host=None,
+                                     expected_attrs=None, use_slave=False,
+                                     chunk_size=CHUNK_SIZE):
+        """Yield the instances active during a time window, by chunks.
+
+        The streaming variant of get_active_by_window_joined(), see
+        iter_by_filters().
+        """
+        marker = None
+        while True:
+            chunk = cls.get_active_by_window_joined(
+                context, begin, end, project_id, host,
+                expected_attrs=copy.copy(expected_attrs),
+                use_slave=use_slave, limit=chunk_size, marker=marker)
+            for instance in chunk:
+                yield instance
+            if len(chunk) < chunk_size:
+                return
+            marker = pagination.get_marker(chunk[-1], sort_keys=['id'],
+                                           sort_dirs=['asc'])
+
+    @base.remotable_classmethod
+    def _get_count_active_by_window(cls, context, begin, end=None,
+                                    project_id=None, host=None,
+                                    use_slave=False):
+        begin = timeutils.parse_isotime(begin)
+        end = timeutils.parse_isotime(end) if end else None
+        return db.instance_count_active_by_window(context, begin, end,
+                                                  project_id, host,
+                                                  use_slave=use_slave)
+
+    @classmethod
+    def get_count_active_by_window(cls, context, begin, end=None,
+                                   project_id=None, host=None,
+                                   use_slave=False):
+        """Get the number of instances active during a time window."""
+        begin = timeutils.isotime(begin)
+        end = timeutils.isotime(end) if end else None
+        return cls._get_count_active_by_window(context, begin, end,
+                                               project_id, host,
+                                               use_slave=use_slave)
+
+    @base.remotable_classmethod
+    def _get_summary_by_host_and_node(cls, context, host, node):
+        count, changed_at = db.instance_get_summary_by_host_and_node(
+            context, host, node)
+        changed_at = timeutils.isotime(changed_at) if changed_at else None
+        return count, changed_at
+
+    @classmethod
+    def get_summary_by_host_and_node(cls, context, host, node):
+        """Get the number of instances of a node and the time the last of
+        them was created or updated, with a second precision.
+
+        This is a single aggregate query, much cheaper than listing the
+        instances to find out whether any of them changed.
+        """
+        count, changed_at = cls._get_summary_by_host_and_node(context, host,
+                                                               node)
+        if changed_at:
+            changed_at = timeutils.parse_isotime(changed_at)
+        return count, changed_at
 
     @base.remotable_classmethod
     def get_by_security_group_id(cls, context, security_group_id):
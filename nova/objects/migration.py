@@ -12,6 +12,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from oslo_utils import timeutils
+
 from nova import db
 from nova import exception
 from nova import objects
@@ -122,7 +124,8 @@ class MigrationList(base.ObjectListBase, base.NovaObject):
     #              Migration <= 1.1
     # Version 1.1: Added use_slave to get_unconfirmed_by_dest_compute
     # Version 1.2: Migration version 1.2
-    VERSION = '1.2'
+    # Version 1.3: Added get_in_progress_summary_by_host_and_node()
+    VERSION = '1.3'
 
     fields = {
         'objects': fields.ListOfObjectsField('Migration'),
@@ -132,6 +135,7 @@ class MigrationList(base.ObjectListBase, base.NovaObject):
         # NOTE(danms): Migration was at 1.1 before we added this
         '1.1': '1.1',
         '1.2': '1.2',
+        '1.3': '1.2',
         }
 
     @base.remotable_classmethod
@@ -149,6 +153,26 @@ class MigrationList(base.ObjectListBase, base.NovaObject):
         return base.obj_make_list(context, cls(context), objects.Migration,
                                   db_migrations)
 
+    @base.remotable_classmethod
+    def _get_in_progress_summary_by_host_and_node(cls, context, host, node):
+        count, changed_at = (
+            db.migration_get_in_progress_summary_by_host_and_node(
+                context, host, node))
+        changed_at = timeutils.isotime(changed_at) if changed_at else None
+        return count, changed_at
+
+    @classmethod
+    def get_in_progress_summary_by_host_and_node(cls, context, host, node):
+        """Get the number of the migrations in progress of a node and the
+        time the last of them was created or updated, with a second
+        precision.
+        """
+        count, changed_at = cls._get_in_progress_summary_by_host_and_node(
+            context, host, node)
+        if changed_at:
+            changed_at = timeutils.parse_isotime(changed_at)
+        return count, changed_at
+
     @base.remotable_classmethod
     def get_by_filters(cls, context, filters):
         db_migrations = db.migration_get_all_by_filters(context, filters)
@@ -0,0 +1,173 @@
+# Copyright (c) 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Continuation tokens of the keyset pagination of instance lists.
+
+A token carries the sort keys, the sort directions and the sort values of
+the last row of a page. It is built and read without a database, so that
+the services without database access can continue a listing from the last
+object they received, see nova.db.sqlalchemy.pagination for the queries.
+"""
+
+import base64
+import datetime
+
+from oslo_serialization import jsonutils
+from oslo_utils import timeutils
+import six
+
+from nova import exception
+from nova.i18n import _
+
+TOKEN_PREFIX = 'ks1.'
+
+_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+_DATETIME_TAG = '__datetime__'
+
+
+def is_marker_token(marker):
+    """Return True if a marker is a continuation token."""
+    return (isinstance(marker, six.string_types) and
+            marker.startswith(TOKEN_PREFIX))
+
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        value = timeutils.normalize_time(value)
+        return {_DATETIME_TAG: value.strftime(_DATETIME_FORMAT)}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        return timeutils.parse_strtime(value[_DATETIME_TAG],
+                                       _DATETIME_FORMAT)
+    return value
+
+
+def encode_marker(sort_keys, sort_dirs, values):
+    """Return the continuation token following a row's sort values."""
+    data = {'keys': list(sort_keys),
+            'dirs': list(sort_dirs),
+            'values': [_encode_value(value) for value in values]}
+    token = base64.urlsafe_b64encode(
+        jsonutils.dumps(data, separators=(',', ':')).encode('utf-8'))
+    return TOKEN_PREFIX + token.decode('ascii').rstrip('=')
+
+
+def decode_marker(marker, sort_keys, sort_dirs):
+    """Return the sort values carried by a continuation token.
+
+    :raises: MarkerNotFound if the token is malformed or was built for
+             another sort order.
+    """
+    token = marker[len(TOKEN_PREFIX):]
+    token += '=' * (-len(token) % 4)
+    try:
+        data = jsonutils.loads(
+            base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+        if (data['keys'] != list(sort_keys) or
+                data['dirs'] != list(sort_dirs) or
+                len(data['values']) != len(sort_keys)):
+            raise ValueError()
+        return [_decode_value(value) for value in data['values']]
+    except (TypeError, ValueError, KeyError, UnicodeError):
+        raise exception.MarkerNotFound(marker=marker)
+
+
+def marker_values(row, sort_keys):
+    """Return the sort values of a row, an instance dict or object."""
+    return [row[sort_key] for sort_key in sort_keys]
+
+
+def process_sort_params(sort_keys, sort_dirs,
+                        default_keys=['created_at', 'id'],
+                        default_dir='asc'):
+    """Process the sort parameters to include default keys.
+
+    Creates a list of sort keys and a list of sort directions. Adds the default
+    keys to the end of the list if they are not already included.
+
+    When adding the default keys to the sort keys list, the associated
+    direction is:
+    1) The first element in the 'sort_dirs' list (if specified), else
+    2) 'default_dir' value (Note that 'asc' is the default value since this is
+    the default in sqlalchemy.utils.paginate_query)
+
+    :param sort_keys: List of sort keys to include in the processed list
+    :param sort_dirs: List of sort directions to include in the processed list
+    :param default_keys: List of sort keys that need to be included in the
+                         processed list, they are added at the end of the list
+                         if not already specified.
+    :param default_dir: Sort direction associated with each of the default
+                        keys that are not supplied, used when they are added
+                        to the processed list
+    :returns: list of sort keys, list of sort directions
+    :raise exception.InvalidInput: If more sort directions than sort keys
+                                   are specified or if an invalid sort
+                                   direction is specified
+    """
+    # Determine direction to use for when adding default keys
+    if sort_dirs and len(sort_dirs) != 0:
+        default_dir_value = sort_dirs[0]
+    else:
+        default_dir_value = default_dir
+
+    # Create list of keys (do not modify the input list)
+    if sort_keys:
+        result_keys = list(sort_keys)
+    else:
+        result_keys = []
+
+    # If a list of directions is not provided, use the default sort direction
+    # for all provided keys
+    if sort_dirs:
+        result_dirs = []
+        # Verify sort direction
+        for sort_dir in sort_dirs:
+            if sort_dir not in ('asc', 'desc'):
+                msg = _("Unknown sort direction, must be 'desc' or 'asc'")
+                raise exception.InvalidInput(reason=msg)
+            result_dirs.append(sort_dir)
+    else:
+        result_dirs = [default_dir_value for _sort_key in result_keys]
+
+    # Ensure that the key and direction length match
+    while len(result_dirs) < len(result_keys):
+        result_dirs.append(default_dir_value)
+    # Unless more direction are specified, which is an error
+    if len(result_dirs) > len(result_keys):
+        msg = _("Sort direction size exceeds sort key size")
+        raise exception.InvalidInput(reason=msg)
+
+    # Ensure defaults are included
+    for key in default_keys:
+        if key not in result_keys:
+            result_keys.append(key)
+            result_dirs.append(default_dir_value)
+
+    return result_keys, result_dirs
+
+
+def get_marker(row, sort_keys=None, sort_dirs=None):
+    """Return the continuation token of the page following a row.
+
+    The sort keys and directions are completed like
+    instance_get_all_by_filters_sort() does.
+    """
+    sort_keys, sort_dirs = process_sort_params(sort_keys, sort_dirs,
+                                               default_dir='desc')
+    return encode_marker(sort_keys, sort_dirs, marker_values(row, sort_keys))
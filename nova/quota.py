@@ -24,6 +24,7 @@ from oslo_utils import importutils
 from oslo_utils import timeutils
 import six
 
+import nova.context
 from nova import db
 from nova import exception
 from nova.i18n import _LE
@@ -93,15 +94,78 @@ quota_opts = [
                     'Note that quotas are not updated on a periodic task, '
                     'they will update on a new reservation if max_age has '
                     'passed since the last reservation'),
+    cfg.IntOpt('quota_limit_cache_ttl',
+               default=0,
+               help='Number of seconds the quota limits read from the '
+                    'database, of the default and other quota classes, the '
+                    'projects and the users, are cached by each process. '
+                    'The cache is emptied when the limits are changed '
+                    'through the same process, the other processes see the '
+                    'change once their cache expires. 0 disables the '
+                    'cache.'),
     cfg.StrOpt('quota_driver',
                default='nova.quota.DbQuotaDriver',
-               help='Default driver to use for quota checks'),
+               help='Default driver to use for quota checks. '
+                    'nova.quota.CasQuotaDriver avoids locking the quota '
+                    'usages of the projects during the reservations.'),
     ]
 
 CONF = cfg.CONF
 CONF.register_opts(quota_opts)
 
 
+class LimitCache(object):
+    """Per-process cache of the quota limits read from the database.
+
+    The entries expire after quota_limit_cache_ttl seconds. The callers get
+    copies of the cached dictionaries, which they can modify.
+    """
+
+    def __init__(self):
+        self._entries = {}
+
+    def _get(self, key, fetch, *args):
+        ttl = CONF.quota_limit_cache_ttl
+        if ttl <= 0:
+            return fetch(*args)
+        entry = self._entries.get(key)
+        if entry is None or timeutils.is_older_than(entry[0], ttl):
+            entry = (timeutils.utcnow(), fetch(*args))
+            self._entries[key] = entry
+        return dict(entry[1])
+
+    def get_default(self, context):
+        """Return the limits of the default quota class."""
+        return self._get(('default',), db.quota_class_get_default, context)
+
+    def get_class(self, context, quota_class):
+        """Return the limits of a quota class."""
+        # NOTE: The database API checks that the context can read the
+        # class, which must also be done when the limits are cached.
+        if CONF.quota_limit_cache_ttl > 0:
+            nova.context.authorize_quota_class_context(context, quota_class)
+        return self._get(('class', quota_class),
+                         db.quota_class_get_all_by_name, context, quota_class)
+
+    def get_project(self, context, project_id):
+        """Return the limits set for a project."""
+        return self._get(('project', project_id),
+                         db.quota_get_all_by_project, context, project_id)
+
+    def get_user(self, context, project_id, user_id):
+        """Return the limits set for a user of a project."""
+        return self._get(('user', project_id, user_id),
+                         db.quota_get_all_by_project_and_user, context,
+                         project_id, user_id)
+
+    def clear(self):
+        """Forget all the cached limits, after they were changed."""
+        self._entries.clear()
+
+
+LIMIT_CACHE = LimitCache()
+
+
 class DbQuotaDriver(object):
     """Driver to perform necessary checks to enforce quotas and obtain
     quota information.  The default driver utilizes the local
@@ -134,7 +198,7 @@ class DbQuotaDriver(object):
         """
 
         quotas = {}
-        default_quotas = db.quota_class_get_default(context)
+        default_quotas = LIMIT_CACHE.get_default(context)
         for resource in resources.values():
             quotas[resource.name] = default_quotas.get(resource.name,
                                                        resource.default)
@@ -156,7 +220,7 @@ class DbQuotaDriver(object):
         """
 
         quotas = {}
-        class_quotas = db.quota_class_get_all_by_name(context, quota_class)
+        class_quotas = LIMIT_CACHE.get_class(context, quota_class)
         for resource in resources.values():
             if defaults or resource.name in class_quotas:
                 quotas[resource.name] = class_quotas.get(resource.name,
@@ -175,7 +239,7 @@ class DbQuotaDriver(object):
         if project_id == context.project_id:
             quota_class = context.quota_class
         if quota_class:
-            class_quotas = db.quota_class_get_all_by_name(context, quota_class)
+            class_quotas = LIMIT_CACHE.get_class(context, quota_class)
         else:
             class_quotas = {}
 
@@ -241,12 +305,10 @@ class DbQuotaDriver(object):
         if user_quotas:
             user_quotas = user_quotas.copy()
         else:
-            user_quotas = db.quota_get_all_by_project_and_user(context,
-                                                               project_id,
-                                                               user_id)
+            user_quotas = LIMIT_CACHE.get_user(context, project_id, user_id)
         # Use the project quota for default user quota.
-        proj_quotas = project_quotas or db.quota_get_all_by_project(
-            context, project_id)
+        proj_quotas = project_quotas or LIMIT_CACHE.get_project(context,
+                                                                project_id)
         for key, value in six.iteritems(proj_quotas):
             if key not in user_quotas.keys():
                 user_quotas[key] = value
@@ -283,8 +345,8 @@ class DbQuotaDriver(object):
                         will be returned.
         :param project_quotas: Quotas dictionary for the specified project.
         """
-        project_quotas = project_quotas or db.quota_get_all_by_project(
-            context, project_id)
+        project_quotas = project_quotas or LIMIT_CACHE.get_project(context,
+                                                                   project_id)
         project_usages = None
         if usages:
             LOG.debug('Getting all quota usages for project: %s', project_id)
@@ -459,7 +521,7 @@ class DbQuotaDriver(object):
             user_id = context.user_id
 
         # Get the applicable quotas
-        project_quotas = db.quota_get_all_by_project(context, project_id)
+        project_quotas = LIMIT_CACHE.get_project(context, project_id)
         quotas = self._get_quotas(context, resources, values.keys(),
                                   has_sync=False, project_id=project_id,
                                   project_quotas=project_quotas)
@@ -553,7 +615,7 @@ class DbQuotaDriver(object):
         # NOTE(Vek): We're not worried about races at this point.
         #            Yes, the admin may be in the process of reducing
         #            quotas, but that's a pretty rare thing.
-        project_quotas = db.quota_get_all_by_project(context, project_id)
+        project_quotas = LIMIT_CACHE.get_project(context, project_id)
         LOG.debug('Quota limits for project %(project_id)s: '
                   '%(project_quotas)s', {'project_id': project_id,
                                          'project_quotas': project_quotas})
@@ -577,6 +639,11 @@ class DbQuotaDriver(object):
         #            which means access to the session.  Since the
         #            session isn't available outside the DBAPI, we
         #            have to do the work there.
+        return self._quota_reserve(context, resources, quotas, user_quotas,
+                                   deltas, expire, project_id, user_id)
+
+    def _quota_reserve(self, context, resources, quotas, user_quotas, deltas,
+                       expire, project_id, user_id):
         return db.quota_reserve(context, resources, quotas, user_quotas,
                                 deltas, expire,
                                 CONF.until_refresh, CONF.max_age,
@@ -690,6 +757,49 @@ class DbQuotaDriver(object):
         db.reservation_expire(context)
 
 
+class CasQuotaDriver(DbQuotaDriver):
+    """Driver using the local database like DbQuotaDriver, but without
+    locking the quota usages in the common case.
+
+    The usages of all the resources of a reservation are updated by one
+    statement which checks the user quotas itself, and the project quotas
+    are checked the same way against a total per project and resource. The
+    commits and rollbacks only apply relative changes, so concurrent
+    reservations in a project don't wait for each other's locks. The usages
+    which must be created or refreshed, including all of them when
+    until_refresh is set, still go through the locking DbQuotaDriver path.
+    """
+
+    def _quota_reserve(self, context, resources, quotas, user_quotas, deltas,
+                       expire, project_id, user_id):
+        return db.quota_reserve_cas(context, resources, quotas, user_quotas,
+                                    deltas, expire,
+                                    CONF.until_refresh, CONF.max_age,
+                                    project_id=project_id, user_id=user_id)
+
+    def commit(self, context, reservations, project_id=None, user_id=None):
+        """Commit reservations.
+
+        :param context: The request context, for access checks.
+        :param reservations: A list of the reservation UUIDs, as
+                             returned by the reserve() method.
+        :param project_id: Ignored, the reservations are enough.
+        :param user_id: Ignored, the reservations are enough.
+        """
+        db.reservation_commit_cas(context, reservations)
+
+    def rollback(self, context, reservations, project_id=None, user_id=None):
+        """Roll back reservations.
+
+        :param context: The request context, for access checks.
+        :param reservations: A list of the reservation UUIDs, as
+                             returned by the reserve() method.
+        :param project_id: Ignored, the reservations are enough.
+        :param user_id: Ignored, the reservations are enough.
+        """
+        db.reservation_rollback_cas(context, reservations)
+
+
 class NoopQuotaDriver(object):
     """Driver that turns quotas calls into no-ops and pretends that quotas
     for all resources are unlimited.  This can be used if you do not
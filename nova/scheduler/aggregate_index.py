@@ -0,0 +1,128 @@
+# Copyright (c) 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Index of the aggregate metadata, used by the aggregate based filters.
+"""
+
+import collections
+
+import six
+
+
+class AggregateMetadataIndex(object):
+    """Inverted index of the aggregate metadata.
+
+    Maps each metadata key and value to the hosts which belong to an
+    aggregate having it. Like aggregate_metadata_get_by_host(), the comma
+    separated metadata values are split.
+    """
+
+    def __init__(self):
+        # (hosts, metadata items) of each aggregate, keyed by aggregate ID
+        self._aggregates = {}
+        # {key: {value: {host: number of aggregates of the host with it}}}
+        self._index = collections.defaultdict(
+            lambda: collections.defaultdict(collections.Counter))
+        # {key: {host: number of aggregates of the host with it}}
+        self._hosts_by_key = collections.defaultdict(collections.Counter)
+        # Merged metadata of each host, computed when first requested
+        self._host_metadata = {}
+
+    @staticmethod
+    def _split_metadata(metadata):
+        return set((key, value.strip())
+                   for key, values in six.iteritems(metadata)
+                   for value in values.split(','))
+
+    def update(self, aggregate):
+        """Adds or updates an aggregate."""
+        self.remove(aggregate.id)
+        hosts = set(aggregate.hosts)
+        items = set()
+        if aggregate.obj_attr_is_set('metadata'):
+            items = self._split_metadata(aggregate.metadata)
+        self._aggregates[aggregate.id] = (hosts, items)
+        for key, value in items:
+            self._index[key][value].update(hosts)
+        for key in set(key for key, value in items):
+            self._hosts_by_key[key].update(hosts)
+        for host in hosts:
+            self._host_metadata.pop(host, None)
+
+    @staticmethod
+    def _discard_hosts(counter, hosts):
+        """Decrements the count of hosts, returns True if none is left."""
+        counter.subtract(hosts)
+        for host in hosts:
+            if counter[host] <= 0:
+                del counter[host]
+        return not counter
+
+    def remove(self, aggregate_id):
+        """Removes an aggregate, if known."""
+        if aggregate_id not in self._aggregates:
+            return
+        hosts, items = self._aggregates.pop(aggregate_id)
+        for key, value in items:
+            if self._discard_hosts(self._index[key][value], hosts):
+                del self._index[key][value]
+            if not self._index[key]:
+                del self._index[key]
+        for key in set(key for key, value in items):
+            if self._discard_hosts(self._hosts_by_key[key], hosts):
+                del self._hosts_by_key[key]
+        for host in hosts:
+            self._host_metadata.pop(host, None)
+
+    def get_hosts(self, key, value=None):
+        """Returns the set of hosts in an aggregate with a metadata key.
+
+        If value is given, only the hosts in an aggregate where the key has
+        this value are returned.
+        """
+        if value is None:
+            return set(self._hosts_by_key.get(key, ()))
+        return set(self._index.get(key, {}).get(value, ()))
+
+    def host_has(self, host, key, value=None):
+        """Returns True if a host is in an aggregate with a metadata key.
+
+        If value is given, the key must have this value in the aggregate.
+        """
+        if value is None:
+            return host in self._hosts_by_key.get(key, ())
+        return host in self._index.get(key, {}).get(value, ())
+
+    def get_metadata(self, host, key=None):
+        """Returns the merged metadata of the aggregates of a host.
+
+        The result is a dict of sets of values keyed by metadata key, the
+        same as aggregate_metadata_get_by_host() returns, and must not be
+        modified. If key is given, only this key is returned.
+        """
+        metadata = self._host_metadata.get(host)
+        if metadata is None:
+            metadata = collections.defaultdict(set)
+            for hosts, items in six.itervalues(self._aggregates):
+                if host in hosts:
+                    for item_key, value in items:
+                        metadata[item_key].add(value)
+            metadata = self._host_metadata[host] = dict(metadata)
+        if key is None:
+            return metadata
+        if key not in metadata:
+            return {}
+        return {key: metadata[key]}
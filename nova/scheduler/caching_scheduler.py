@@ -13,7 +13,19 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_utils import importutils
+from oslo_utils import timeutils
+
+from nova.i18n import _LW
 from nova.scheduler import filter_scheduler
+from nova.scheduler import host_state_cache
+
+CONF = cfg.CONF
+CONF.import_opt('scheduler_driver_task_period', 'nova.scheduler.manager')
+
+LOG = logging.getLogger(__name__)
 
 
 class CachingScheduler(filter_scheduler.FilterScheduler):
@@ -44,6 +56,12 @@ class CachingScheduler(filter_scheduler.FilterScheduler):
     copy of the cache. So if you run multiple schedulers, you will get
     more retries, because the data stored on any additional scheduler will
     be more out of date, than if it was fetched from the database.
+    Setting scheduler_host_state_cache_driver makes the workers share the
+    resources consumed on each host through a host state cache, the
+    claims are published with a version check so concurrent claims on the
+    same host are not lost. The workers then take turns to load the hosts
+    from the database in the periodic task, the others read the resources
+    the loading worker published.
 
     In a similar way, if you have a high number of server deletes, the
     extra capacity from those deletes will not show up until the cache is
@@ -53,14 +71,58 @@ class CachingScheduler(filter_scheduler.FilterScheduler):
     def __init__(self, *args, **kwargs):
         super(CachingScheduler, self).__init__(*args, **kwargs)
         self.all_host_states = None
+        self.shared_cache = None
+        if CONF.scheduler_host_state_cache_driver:
+            self.shared_cache = importutils.import_object(
+                CONF.scheduler_host_state_cache_driver)
+        # Generation of the shared cache when it was last read, and the
+        # version of the entry of each host
+        self._shared_generation = None
+        self._shared_versions = {}
+        # When this worker last loaded the hosts from the database
+        self._loaded_at = None
 
     def run_periodic_tasks(self, context):
         """Called from a periodic tasks in the manager."""
         elevated = context.elevated()
+        if self.shared_cache is None:
+            self._load_hosts(elevated)
+            return
+        if self.shared_cache.start_refresh(CONF.scheduler_driver_task_period):
+            keys = None
+            try:
+                self._load_hosts(elevated)
+                keys = self._get_host_keys()
+            finally:
+                self.shared_cache.finish_refresh(keys)
+        elif self._can_follow_shared_cache():
+            # Another worker loads the hosts in this period, only read the
+            # resources it published
+            self._sync_shared_cache()
+        else:
+            self._load_hosts(elevated)
+
+    def _load_hosts(self, context):
         # NOTE(johngarbutt) Fetching the list of hosts before we get
         # a user request, so no user requests have to wait while we
         # fetch the list of hosts.
-        self.all_host_states = self._get_up_hosts(elevated)
+        self.all_host_states = self._get_up_hosts(context)
+        self._loaded_at = timeutils.utcnow()
+        self._sync_shared_cache(publish=True)
+
+    def _can_follow_shared_cache(self):
+        """Return True if the hosts loaded by another worker are the ones
+        we loaded, recently enough.
+        """
+        if self.all_host_states is None or timeutils.is_older_than(
+                self._loaded_at, CONF.scheduler_host_state_cache_max_age):
+            return False
+        keys = self.shared_cache.get_refreshed_keys()
+        return keys is not None and set(keys) == set(self._get_host_keys())
+
+    def _get_host_keys(self):
+        return [host_state_cache.host_state_key(host_state)
+                for host_state in self.all_host_states]
 
     def _get_all_host_states(self, context):
         """Called from the filter scheduler, in a template pattern."""
@@ -69,9 +131,82 @@ class CachingScheduler(filter_scheduler.FilterScheduler):
             # comes in before the first run of the periodic task.
             # Rather than raise an error, we fetch the list of hosts.
             self.all_host_states = self._get_up_hosts(context)
+            self._loaded_at = timeutils.utcnow()
 
+        self._sync_shared_cache()
         return self.all_host_states
 
+    def _sync_shared_cache(self, publish=False):
+        """Merge the shared host states with the ones of this scheduler.
+
+        The entries more recent than our host states are applied to them.
+        When publish is True, our host states which are more recent than
+        their entry, i.e. freshly loaded from the database, are written to
+        the shared cache.
+        """
+        if self.shared_cache is None:
+            return
+        generation = self.shared_cache.get_generation()
+        if not publish and generation == self._shared_generation:
+            return
+        self._shared_generation = generation
+        keys = {host_state_cache.host_state_key(host_state): host_state
+                for host_state in self.all_host_states}
+        entries = self.shared_cache.get_many(keys.keys())
+        for key, host_state in keys.items():
+            entry = entries.get(key)
+            version = entry['version'] if entry else 0
+            if entry and host_state_cache.is_newer(entry, host_state):
+                host_state_cache.update_host_state(host_state, entry)
+            elif publish and (entry is None or
+                              host_state_cache.is_older(entry, host_state)):
+                entry = host_state_cache.entry_from_host_state(host_state)
+                if self._compare_and_set(key, entry, version):
+                    version += 1
+            self._shared_versions[key] = version
+
+    def _compare_and_set(self, key, entry, version):
+        """Write an entry to the shared cache, see compare_and_set().
+
+        If nobody else wrote to the cache since we read it, our own write
+        doesn't need to be read back.
+        """
+        generation = self.shared_cache.compare_and_set(key, entry, version)
+        if generation is None:
+            return False
+        if (self._shared_generation is not None and
+                generation == self._shared_generation + 1):
+            self._shared_generation = generation
+        return True
+
+    def _consume_from_instance(self, host_state, instance_properties):
+        """Consume from the host state and publish it to the shared cache.
+
+        If another scheduler updated the host since we last read it, its
+        entry is applied to the host state and the instance is consumed
+        again, until the claim is written or we run out of retries.
+        """
+        host_state.consume_from_instance(instance_properties)
+        if self.shared_cache is None:
+            return
+        key = host_state_cache.host_state_key(host_state)
+        for attempt in range(CONF.scheduler_host_state_cache_claim_retries):
+            version = self._shared_versions.get(key, 0)
+            entry = host_state_cache.entry_from_host_state(host_state)
+            if self._compare_and_set(key, entry, version):
+                self._shared_versions[key] = version + 1
+                return
+            entry = self.shared_cache.get(key)
+            if entry is not None:
+                # Start again from the resources left by the others
+                host_state_cache.update_host_state(host_state, entry)
+                self._shared_versions[key] = entry['version']
+                host_state.consume_from_instance(instance_properties)
+        LOG.warning(_LW("Unable to share the resources consumed on host "
+                        "%(host)s, other schedulers will not see them before "
+                        "they are refreshed from the database."),
+                    {'host': host_state})
+
     def _get_up_hosts(self, context):
         all_hosts_iterator = self.host_manager.get_all_host_states(context)
         return list(all_hosts_iterator)
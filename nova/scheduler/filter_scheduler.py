@@ -19,6 +19,8 @@ You can customize this scheduler by specifying your own Host Filters and
 Weighing Functions.
 """
 
+import functools
+import heapq
 import random
 
 from oslo_config import cfg
@@ -30,6 +32,8 @@ from nova.i18n import _
 from nova import rpc
 from nova.scheduler import driver
 from nova.scheduler import scheduler_options
+from nova.scheduler import timings
+from nova.scheduler import weights
 
 
 CONF = cfg.CONF
@@ -64,8 +68,13 @@ class FilterScheduler(driver.Scheduler):
                            dict(request_spec=request_spec))
 
         num_instances = request_spec['num_instances']
-        selected_hosts = self._schedule(context, request_spec,
-                                        filter_properties)
+        # Duration of each phase of this request, in seconds
+        durations = {}
+        with self.host_manager.timings.timed(timings.PHASE, 'total',
+                                             durations):
+            selected_hosts = self._schedule(context, request_spec,
+                                            filter_properties,
+                                            durations=durations)
 
         # Couldn't fulfill the request_spec
         if len(selected_hosts) < num_instances:
@@ -92,7 +101,8 @@ class FilterScheduler(driver.Scheduler):
                       limits=host.obj.limits) for host in selected_hosts]
 
         self.notifier.info(context, 'scheduler.select_destinations.end',
-                           dict(request_spec=request_spec))
+                           dict(request_spec=request_spec,
+                                timings=durations))
         return dests
 
     def _get_configuration_options(self):
@@ -109,10 +119,16 @@ class FilterScheduler(driver.Scheduler):
         filter_properties['project_id'] = project_id
         filter_properties['os_type'] = os_type
 
-    def _schedule(self, context, request_spec, filter_properties):
+    def _schedule(self, context, request_spec, filter_properties,
+                  durations=None):
         """Returns a list of hosts that meet the required specs,
         ordered by their fitness.
+
+        The duration of each phase is stored in the durations dict, if one
+        is given.
         """
+        timed = functools.partial(self.host_manager.timings.timed,
+                                  timings.PHASE, durations=durations)
         elevated = context.elevated()
         instance_properties = request_spec['instance_properties']
         instance_type = request_spec.get("instance_type", None)
@@ -129,47 +145,78 @@ class FilterScheduler(driver.Scheduler):
         self.populate_filter_properties(request_spec,
                                         filter_properties)
 
-        # Find our local list of acceptable hosts by repeatedly
-        # filtering and weighing our options. Each time we choose a
-        # host, we virtually consume resources on it so subsequent
-        # selections can adjust accordingly.
+        # Find our local list of acceptable hosts by filtering and weighing
+        # all the hosts once. Each time we choose a host, we virtually
+        # consume resources on it, which only changes the chosen host. So
+        # only that host is weighed again, and the best candidates are
+        # filtered again for each subsequent instance before being chosen.
 
         # Note: remember, we are using an iterator here. So only
         # traverse this list once. This can bite you if the hosts
         # are being scanned in a filter or weighing function.
-        hosts = self._get_all_host_states(elevated)
+        with timed('host_states'):
+            hosts = self._get_all_host_states(elevated)
 
         selected_hosts = []
         num_instances = request_spec.get('num_instances', 1)
-        for num in range(num_instances):
-            # Filter local hosts based on requirements ...
-            hosts = self.host_manager.get_filtered_hosts(hosts,
-                    filter_properties, index=num)
-            if not hosts:
-                # Can't get any more locally.
-                break
-
-            LOG.debug("Filtered %(hosts)s", {'hosts': hosts})
 
+        with timed('filtering'):
+            hosts = self.host_manager.get_filtered_hosts(hosts,
+                    filter_properties, index=0)
+        if not hosts:
+            return selected_hosts
+
+        LOG.debug("Filtered %(hosts)s", {'hosts': hosts})
+
+        # A single instance is placed on one of the best subset of hosts,
+        # so the other hosts don't need to be sorted
+        limit = None
+        if num_instances == 1:
+            limit = max(CONF.scheduler_host_subset_size, 1)
+        with timed('weighing'):
             weighed_hosts = self.host_manager.get_weighed_hosts(hosts,
-                    filter_properties)
+                    filter_properties, limit=limit)
 
-            LOG.debug("Weighed %(hosts)s", {'hosts': weighed_hosts})
+        LOG.debug("Weighed %(hosts)s", {'hosts': weighed_hosts})
 
-            scheduler_host_subset_size = CONF.scheduler_host_subset_size
-            if scheduler_host_subset_size > len(weighed_hosts):
-                scheduler_host_subset_size = len(weighed_hosts)
-            if scheduler_host_subset_size < 1:
-                scheduler_host_subset_size = 1
+        with timed('selection'):
+            self._select_hosts(weighed_hosts, selected_hosts,
+                               instance_properties, filter_properties,
+                               num_instances, update_group_hosts)
+        return selected_hosts
 
-            chosen_host = random.choice(
-                weighed_hosts[0:scheduler_host_subset_size])
+    def _select_hosts(self, weighed_hosts, selected_hosts,
+                      instance_properties, filter_properties, num_instances,
+                      update_group_hosts):
+        """Choose a host for each instance among the weighed hosts, and
+        append it to selected_hosts.
+        """
+        candidates = _WeighedHostHeap(weighed_hosts)
+        scheduler_host_subset_size = max(CONF.scheduler_host_subset_size, 1)
+        for num in range(num_instances):
+            # Get the best hosts still passing the filters for this instance
+            best_hosts = []
+            while len(best_hosts) < scheduler_host_subset_size:
+                weighed_host = candidates.pop()
+                if weighed_host is None:
+                    break
+                # NOTE: The single host checks are not recorded, as they
+                # would skew the filter statistics of the whole host set.
+                if num == 0 or self.host_manager.get_filtered_hosts(
+                        [weighed_host.obj], filter_properties, index=num,
+                        record_stats=False):
+                    best_hosts.append(weighed_host)
+            if not best_hosts:
+                # Can't get any more locally.
+                break
+
+            chosen_host = random.choice(best_hosts)
             LOG.debug("Selected host: %(host)s", {'host': chosen_host})
             selected_hosts.append(chosen_host)
 
             # Now consume the resources so the filter/weights
             # will change for the next instance.
-            chosen_host.obj.consume_from_instance(instance_properties)
+            self._consume_from_instance(chosen_host.obj, instance_properties)
             if update_group_hosts is True:
                 # NOTE(sbauza): Group details are serialized into a list now
                 # that they are populated by the conductor, we need to
@@ -178,8 +225,59 @@ class FilterScheduler(driver.Scheduler):
                     filter_properties['group_hosts'] = set(
                         filter_properties['group_hosts'])
                 filter_properties['group_hosts'].add(chosen_host.obj.host)
-        return selected_hosts
+
+            # Keep the chosen host as a candidate for the next instances,
+            # with its own weight recomputed. The WeighedHost is copied as it
+            # is part of the result.
+            chosen_copy = weights.WeighedHost(chosen_host.obj,
+                                              chosen_host.weight)
+            best_hosts[best_hosts.index(chosen_host)] = chosen_copy
+            bounds_changed = self.host_manager.update_host_weights(
+                [chosen_copy], filter_properties)
+            for weighed_host in best_hosts:
+                candidates.push(weighed_host)
+            if bounds_changed:
+                # The weights of the other candidates were normalized
+                # differently, so weigh all of them again
+                weighed_hosts = candidates.items()
+                self.host_manager.update_host_weights(weighed_hosts,
+                                                      filter_properties)
+                candidates = _WeighedHostHeap(weighed_hosts)
 
     def _get_all_host_states(self, context):
         """Template method, so a subclass can implement caching."""
         return self.host_manager.get_all_host_states(context)
+
+    def _consume_from_instance(self, host_state, instance_properties):
+        """Template method, so a subclass can share consumed resources."""
+        host_state.consume_from_instance(instance_properties)
+
+
+class _WeighedHostHeap(object):
+    """Heap of WeighedHosts, popping the ones with the greatest weight first.
+
+    Hosts of equal weight are popped in the order they were first added.
+    """
+
+    def __init__(self, weighed_hosts):
+        self._order = {}
+        self._heap = []
+        for weighed_host in weighed_hosts:
+            self.push(weighed_host)
+
+    def push(self, weighed_host):
+        order = self._order.setdefault(id(weighed_host.obj),
+                                       len(self._order))
+        heapq.heappush(self._heap, (-weighed_host.weight, order,
+                                    weighed_host))
+
+    def pop(self):
+        """Return the WeighedHost of greatest weight, None if empty."""
+        if not self._heap:
+            return None
+        return heapq.heappop(self._heap)[-1]
+
+    def items(self):
+        """Return the WeighedHosts in the heap, in the order first added."""
+        return [entry[-1] for entry in sorted(self._heap,
+                                              key=lambda entry: entry[1])]
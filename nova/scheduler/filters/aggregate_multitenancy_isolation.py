@@ -40,6 +40,16 @@ class AggregateMultiTenancyIsolation(filters.BaseHostFilter):
         props = spec.get('instance_properties', {})
         tenant_id = props.get('project_id')
 
+        index = host_state.aggregate_index
+        if index is not None:
+            if not index.host_has(host_state.host, "filter_tenant_id"):
+                return True
+            if tenant_id is not None and index.host_has(
+                    host_state.host, "filter_tenant_id", tenant_id):
+                return True
+            LOG.debug("%s fails tenant id on aggregate", host_state)
+            return False
+
         metadata = utils.aggregate_metadata_get_by_host(host_state,
                                                         key="filter_tenant_id")
 
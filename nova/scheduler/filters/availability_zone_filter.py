@@ -44,6 +44,11 @@ class AvailabilityZoneFilter(filters.BaseHostFilter):
         if not availability_zone:
             return True
 
+        index = host_state.aggregate_index
+        if index is not None and index.host_has(
+                host_state.host, 'availability_zone', availability_zone):
+            return True
+
         metadata = utils.aggregate_metadata_get_by_host(
                 host_state, key='availability_zone')
 
@@ -15,6 +15,11 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from oslo_config import cfg
 from oslo_log import log as logging
 
@@ -77,9 +82,32 @@ class BaseCoreFilter(filters.BaseHostFilter):
 class CoreFilter(BaseCoreFilter):
     """CoreFilter filters based on CPU core utilization."""
 
+    column_attrs = ('vcpus_total', 'vcpus_used')
+
     def _get_cpu_allocation_ratio(self, host_state, filter_properties):
         return CONF.cpu_allocation_ratio
 
+    def filter_columns(self, host_states, columns, filter_properties):
+        """Return which hosts have sufficient CPU cores."""
+        host_vcpus = columns['vcpus_total']
+        instance_type = filter_properties.get('instance_type')
+        if not instance_type:
+            return numpy.ones(len(host_states), dtype=bool)
+
+        # Fail safe for the hosts not reporting their VCPUs
+        unset = host_vcpus == 0
+        if unset.any():
+            LOG.warning(_LW("VCPUs not set; assuming CPU collection broken"))
+
+        vcpus_total = host_vcpus * CONF.cpu_allocation_ratio
+        # Only provide a VCPU limit to compute if the virt driver is reporting
+        # an accurate count of installed VCPUs. (XenServer driver does not)
+        for i in (vcpus_total > 0).nonzero()[0]:
+            host_states[i].limits['vcpu'] = float(vcpus_total[i])
+
+        free_vcpus = vcpus_total - columns['vcpus_used']
+        return unset | (free_vcpus >= instance_type['vcpus'])
+
 
 class AggregateCoreFilter(BaseCoreFilter):
     """AggregateCoreFilter with per-aggregate CPU subscription flag.
@@ -32,9 +32,27 @@ CONF.register_opt(disk_allocation_ratio_opt)
 class DiskFilter(filters.BaseHostFilter):
     """Disk Filter with over subscription flag."""
 
+    column_attrs = ('free_disk_mb', 'total_usable_disk_gb')
+
     def _get_disk_allocation_ratio(self, host_state, filter_properties):
         return CONF.disk_allocation_ratio
 
+    def filter_columns(self, host_states, columns, filter_properties):
+        """Filter based on disk usage."""
+        instance_type = filter_properties.get('instance_type')
+        requested_disk = (1024 * (instance_type['root_gb'] +
+                                 instance_type['ephemeral_gb']) +
+                         instance_type['swap'])
+        total_usable_disk_mb = columns['total_usable_disk_gb'] * 1024
+
+        disk_mb_limit = total_usable_disk_mb * CONF.disk_allocation_ratio
+        used_disk_mb = total_usable_disk_mb - columns['free_disk_mb']
+        passes = disk_mb_limit - used_disk_mb >= requested_disk
+
+        for i in passes.nonzero()[0]:
+            host_states[i].limits['disk_gb'] = float(disk_mb_limit[i]) / 1024
+        return passes
+
     def host_passes(self, host_state, filter_properties):
         """Filter based on disk usage."""
         instance_type = filter_properties.get('instance_type')
@@ -72,6 +90,9 @@ class AggregateDiskFilter(DiskFilter):
     found.
     """
 
+    # The allocation ratio is looked up per host
+    column_attrs = ()
+
     def _get_disk_allocation_ratio(self, host_state, filter_properties):
         aggregate_vals = utils.aggregate_values_from_key(
             host_state,
@@ -36,9 +36,14 @@ CONF.register_opt(max_io_ops_per_host_opt)
 class IoOpsFilter(filters.BaseHostFilter):
     """Filter out hosts with too many concurrent I/O operations."""
 
+    column_attrs = ('num_io_ops',)
+
     def _get_max_io_ops_per_host(self, host_state, filter_properties):
         return CONF.max_io_ops_per_host
 
+    def filter_columns(self, host_states, columns, filter_properties):
+        return columns['num_io_ops'] < CONF.max_io_ops_per_host
+
     def host_passes(self, host_state, filter_properties):
         """Use information about current vm and task states collected from
         compute node statistics to decide whether to filter.
@@ -61,6 +66,9 @@ class AggregateIoOpsFilter(IoOpsFilter):
     Fall back to global max_io_ops_per_host if no per-aggregate setting found.
     """
 
+    # The maximum number of I/O operations is looked up per host
+    column_attrs = ()
+
     def _get_max_io_ops_per_host(self, host_state, filter_properties):
         aggregate_vals = utils.aggregate_values_from_key(
             host_state,
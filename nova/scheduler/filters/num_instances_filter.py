@@ -33,9 +33,14 @@ CONF.register_opt(max_instances_per_host_opt)
 class NumInstancesFilter(filters.BaseHostFilter):
     """Filter out hosts with too many instances."""
 
+    column_attrs = ('num_instances',)
+
     def _get_max_instances_per_host(self, host_state, filter_properties):
         return CONF.max_instances_per_host
 
+    def filter_columns(self, host_states, columns, filter_properties):
+        return columns['num_instances'] < CONF.max_instances_per_host
+
     def host_passes(self, host_state, filter_properties):
         num_instances = host_state.num_instances
         max_instances = self._get_max_instances_per_host(
@@ -56,6 +61,9 @@ class AggregateNumInstancesFilter(NumInstancesFilter):
     found.
     """
 
+    # The maximum number of instances is looked up per host
+    column_attrs = ()
+
     def _get_max_instances_per_host(self, host_state, filter_properties):
         aggregate_vals = utils.aggregate_values_from_key(
             host_state,
@@ -68,9 +68,26 @@ class BaseRamFilter(filters.BaseHostFilter):
 class RamFilter(BaseRamFilter):
     """Ram Filter with over subscription flag."""
 
+    column_attrs = ('free_ram_mb', 'total_usable_ram_mb')
+
     def _get_ram_allocation_ratio(self, host_state, filter_properties):
         return CONF.ram_allocation_ratio
 
+    def filter_columns(self, host_states, columns, filter_properties):
+        """Only return hosts with sufficient available RAM."""
+        instance_type = filter_properties.get('instance_type')
+        requested_ram = instance_type['memory_mb']
+        total_usable_ram_mb = columns['total_usable_ram_mb']
+
+        memory_mb_limit = total_usable_ram_mb * CONF.ram_allocation_ratio
+        used_ram_mb = total_usable_ram_mb - columns['free_ram_mb']
+        passes = memory_mb_limit - used_ram_mb >= requested_ram
+
+        # save oversubscription limit for compute node to test against:
+        for i in passes.nonzero()[0]:
+            host_states[i].limits['memory_mb'] = float(memory_mb_limit[i])
+        return passes
+
 
 class AggregateRamFilter(BaseRamFilter):
     """AggregateRamFilter with per-aggregate ram subscription flag.
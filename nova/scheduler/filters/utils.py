@@ -36,7 +36,12 @@ def aggregate_values_from_key(host_state, key_name):
 def aggregate_metadata_get_by_host(host_state, key=None):
     """Returns a dict of all metadata based on a metadata key for a specific
     host. If the key is not provided, returns a dict of all metadata.
+
+    The precomputed metadata of the aggregate index of the host state is
+    used when it has one, in which case the result must not be modified.
     """
+    if host_state.aggregate_index is not None:
+        return host_state.aggregate_index.get_metadata(host_state.host, key)
     aggrlist = host_state.aggregates
     metadata = collections.defaultdict(set)
     for aggr in aggrlist:
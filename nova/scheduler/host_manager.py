@@ -18,6 +18,7 @@ Manage hosts in the current zone.
 """
 
 import collections
+import datetime
 import time
 try:
     from collections import UserDict as IterableUserDict   # Python 3
@@ -38,8 +39,11 @@ from nova import context as context_module
 from nova import exception
 from nova.i18n import _, _LI, _LW
 from nova import objects
+from nova import pagination
 from nova.pci import stats as pci_stats
+from nova.scheduler import aggregate_index
 from nova.scheduler import filters
+from nova.scheduler import timings
 from nova.scheduler import weights
 from nova import utils
 from nova.virt import hardware
@@ -71,6 +75,36 @@ host_manager_opts = [
                default=True,
                help='Determines if the Scheduler tracks changes to instances '
                     'to help with its filtering decisions.'),
+    cfg.BoolOpt('scheduler_incremental_host_refresh',
+               default=False,
+               help='Determines if the Scheduler only fetches the compute '
+                    'nodes which changed since its previous poll, instead '
+                    'of reading all the compute nodes for each request.'),
+    cfg.IntOpt('scheduler_instance_info_page_size',
+               default=1000,
+               help='Number of instances read per database query when the '
+                    'Scheduler loads the instances of the hosts in bulk, '
+                    'if scheduler_tracks_instance_changes is set.'),
+    cfg.BoolOpt('scheduler_vectorized_filters',
+               default=False,
+               help='Determines if the filters which support it are '
+                    'evaluated over arrays of the host attributes for all '
+                    'the hosts at once. Requires numpy, the hosts are '
+                    'filtered one at a time if it is not installed.'),
+    cfg.BoolOpt('scheduler_vectorized_weighers',
+               default=False,
+               help='Determines if the weights of all the weighers are '
+                    'normalized and combined at once over an array of the '
+                    'raw weights of all the hosts. Requires numpy, the '
+                    'weighers are applied one at a time if it is not '
+                    'installed.'),
+    cfg.BoolOpt('scheduler_adaptive_filter_order',
+               default=False,
+               help='Determines if the filters are run by increasing cost '
+                    'per rejected host, as measured on the previous '
+                    'requests, rather than in the order of '
+                    'scheduler_default_filters. Filters which reject many '
+                    'hosts cheaply then run before the expensive ones.'),
 ]
 
 CONF = cfg.CONF
@@ -79,6 +113,16 @@ CONF.register_opts(host_manager_opts)
 LOG = logging.getLogger(__name__)
 HOST_INSTANCE_SEMAPHORE = "host_instance"
 
+# Instance fields used by the filters, the only ones read from the database
+# when loading the instances of the hosts.
+INSTANCE_INFO_FIELDS = ['uuid', 'host', 'instance_type_id']
+# The fields read when loading the instances page by page, which include the
+# sort values the next page starts from.
+INSTANCE_INFO_PAGE_FIELDS = INSTANCE_INFO_FIELDS + ['id', 'created_at']
+# Window by which successive incremental polls of the compute nodes overlap,
+# so that rows committed while the previous poll was running are not missed.
+COMPUTE_POLL_OVERLAP = datetime.timedelta(seconds=5)
+
 
 class ReadOnlyDict(IterableUserDict):
     """A read-only dict."""
@@ -153,6 +197,8 @@ class HostState(object):
 
         # List of aggregates the host belongs to
         self.aggregates = []
+        # AggregateMetadataIndex of the HostManager, if any
+        self.aggregate_index = None
 
         # Instances on this host
         self.instances = {}
@@ -316,12 +362,19 @@ class HostManager(object):
     def __init__(self):
         self.host_state_map = {}
         self.filter_handler = filters.HostFilterHandler()
+        self.filter_handler.vectorized = CONF.scheduler_vectorized_filters
+        self.filter_handler.adaptive_order = (
+            CONF.scheduler_adaptive_filter_order)
+        self.timings = timings.Timings()
+        self.filter_handler.timings = self.timings
         filter_classes = self.filter_handler.get_matching_classes(
                 CONF.scheduler_available_filters)
         self.filter_cls_map = {cls.__name__: cls for cls in filter_classes}
         self.filter_obj_map = {}
         self.default_filters = self._choose_host_filters(self._load_filters())
         self.weight_handler = weights.HostWeightHandler()
+        self.weight_handler.timings = self.timings
+        self.weight_handler.vectorized = CONF.scheduler_vectorized_weighers
         weigher_classes = self.weight_handler.get_matching_classes(
                 CONF.scheduler_weight_classes)
         self.weighers = [cls() for cls in weigher_classes]
@@ -330,7 +383,16 @@ class HostManager(object):
         # Dict of set of aggregate IDs keyed by the name of the host belonging
         # to those aggregates
         self.host_aggregates_map = collections.defaultdict(set)
+        # Inverted index of the aggregate metadata, for the filters
+        self.aggregate_index = aggregate_index.AggregateMetadataIndex()
         self._init_aggregates()
+        self.incremental_host_refresh = CONF.scheduler_incremental_host_refresh
+        # Time of the last poll of the compute nodes, used as a lower bound
+        # for fetching the changed compute nodes when incrementally refreshing
+        self._last_compute_poll = None
+        # Number of compute node records refreshed by the last call to
+        # get_all_host_states()
+        self.refreshed_compute_nodes = 0
         self.tracks_instance_changes = CONF.scheduler_tracks_instance_changes
         # Dict of instances and status, keyed by host
         self._instance_info = {}
@@ -347,6 +409,7 @@ class HostManager(object):
             self.aggs_by_id[agg.id] = agg
             for host in agg.hosts:
                 self.host_aggregates_map[host].add(agg.id)
+            self.aggregate_index.update(agg)
 
     def update_aggregates(self, aggregates):
         """Updates internal HostManager information about aggregates."""
@@ -358,6 +421,7 @@ class HostManager(object):
 
     def _update_aggregate(self, aggregate):
         self.aggs_by_id[aggregate.id] = aggregate
+        self.aggregate_index.update(aggregate)
         for host in aggregate.hosts:
             self.host_aggregates_map[host].add(aggregate.id)
         # Refreshing the mapping dict to remove all hosts that are no longer
@@ -372,6 +436,7 @@ class HostManager(object):
         """
         if aggregate.id in self.aggs_by_id:
             del self.aggs_by_id[aggregate.id]
+        self.aggregate_index.remove(aggregate.id)
         for host in aggregate.hosts:
             if aggregate.id in self.host_aggregates_map[host]:
                 self.host_aggregates_map[host].remove(aggregate.id)
@@ -388,39 +453,92 @@ class HostManager(object):
         def _async_init_instance_info():
             context = context_module.get_admin_context()
             LOG.debug("START:_async_init_instance_info")
-            self._instance_info = {}
             compute_nodes = objects.ComputeNodeList.get_all(context).objects
             LOG.debug("Total number of compute nodes: %s", len(compute_nodes))
-            # Break the queries into batches of 10 to reduce the total number
-            # of calls to the DB.
-            batch_size = 10
-            start_node = 0
-            end_node = batch_size
-            while start_node <= len(compute_nodes):
-                curr_nodes = compute_nodes[start_node:end_node]
-                start_node += batch_size
-                end_node += batch_size
-                filters = {"host": [curr_node.host
-                                    for curr_node in curr_nodes]}
-                result = objects.InstanceList.get_by_filters(context,
-                                                             filters)
-                instances = result.objects
-                LOG.debug("Adding %s instances for hosts %s-%s",
-                          len(instances), start_node, end_node)
-                for instance in instances:
-                    host = instance.host
-                    if host not in self._instance_info:
-                        self._instance_info[host] = {"instances": {},
-                                                     "updated": False}
-                    inst_dict = self._instance_info[host]
-                    inst_dict["instances"][instance.uuid] = instance
-                # Call sleep() to cooperatively yield
-                time.sleep(0)
+            # Read the instances of all the hosts at once, page by page,
+            # instead of querying each host separately.
+            loaded = self._load_instance_info(context)
+            for compute in compute_nodes:
+                if compute.host not in loaded:
+                    loaded[compute.host] = self._new_host_info({}, False)
+            self._merge_instance_info(loaded)
             LOG.debug("END:_async_init_instance_info")
 
         # Run this async so that we don't block the scheduler start-up
         utils.spawn_n(_async_init_instance_info)
 
+    @staticmethod
+    def _new_host_info(inst_dict, updated):
+        return {"instances": inst_dict,
+                "updated": updated}
+
+    def _load_instance_info(self, context, hosts=None):
+        """Reads the instances of some hosts, or of all of them if hosts is
+        None, with as few queries as the page size allows.
+
+        Returns a dict of host infos keyed by host name. The requested hosts
+        without any instance get an empty one.
+        """
+        filters = {'deleted': False, 'soft_deleted': True}
+        if hosts is not None:
+            filters['host'] = list(hosts)
+        inst_dicts = {host: {} for host in hosts or ()}
+        page_size = CONF.scheduler_instance_info_page_size
+        marker = None
+        while True:
+            instances = objects.InstanceList.get_projected_by_filters(
+                context, filters, INSTANCE_INFO_PAGE_FIELDS,
+                sort_keys=['id'], sort_dirs=['asc'], limit=page_size,
+                marker=marker).objects
+            for instance in instances:
+                if instance.host:
+                    inst_dicts.setdefault(instance.host, {})[
+                        instance.uuid] = instance
+            LOG.debug("Loaded %s instances", len(instances))
+            if len(instances) < page_size:
+                break
+            # NOTE: The pages are sorted by id, so continue from the sort
+            # values of the last instance rather than looking it up by uuid.
+            marker = pagination.get_marker(instances[-1], sort_keys=['id'],
+                                           sort_dirs=['asc'])
+            # Call sleep() to cooperatively yield
+            time.sleep(0)
+        return {host: self._new_host_info(inst_dict, False)
+                for host, inst_dict in six.iteritems(inst_dicts)}
+
+    @utils.synchronized(HOST_INSTANCE_SEMAPHORE)
+    def _merge_instance_info(self, loaded):
+        """Stores the host infos read from the db, unless the compute nodes
+        sent their own view of the host in the meantime.
+        """
+        for host, host_info in six.iteritems(loaded):
+            current = self._instance_info.get(host)
+            if current is None or not current.get("updated"):
+                self._instance_info[host] = host_info
+
+    def _prefetch_instance_info(self, context, hosts):
+        """Loads in bulk the instances of the hosts the scheduler doesn't
+        know about yet, for example while _init_instance_info() is running,
+        so that they aren't read host by host.
+        """
+        if not self.tracks_instance_changes:
+            return
+        missing = set(hosts) - set(self._instance_info)
+        if missing:
+            self._merge_instance_info(
+                self._load_instance_info(context, missing))
+
+    def refresh_instance_info(self, context):
+        """Reloads in bulk the instances of the hosts whose compute node
+        doesn't send instance updates.
+        """
+        if not self.tracks_instance_changes:
+            return
+        stale = [host for host, host_info in six.iteritems(self._instance_info)
+                 if not host_info.get("updated")]
+        if stale:
+            self._merge_instance_info(self._load_instance_info(context, stale))
+
     def _choose_host_filters(self, filter_cls_names):
         """Since the caller may specify which filters to use we need
         to have an authoritative list of what is permissible. This
@@ -446,8 +564,12 @@ class HostManager(object):
         return good_filters
 
     def get_filtered_hosts(self, hosts, filter_properties,
-            filter_class_names=None, index=0):
-        """Filter hosts and return only ones passing all filters."""
+            filter_class_names=None, index=0, record_stats=True):
+        """Filter hosts and return only ones passing all filters.
+
+        record_stats is False for the checks which should not count in the
+        measured selectivity and timings of the filters.
+        """
 
         def _strip_ignore_hosts(host_map, hosts_to_ignore):
             ignored_hosts = []
@@ -520,52 +642,105 @@ class HostManager(object):
             hosts = six.itervalues(name_to_cls_map)
 
         return self.filter_handler.get_filtered_objects(filters,
-                hosts, filter_properties, index)
+                hosts, filter_properties, index, record_stats=record_stats)
+
+    def get_filter_stats(self):
+        """Returns the pass rate and cost per host measured for each filter,
+        keyed by filter class name.
+        """
+        return self.filter_handler.get_filter_stats()
+
+    def get_timings(self, reset=False):
+        """Returns the timing histograms of the scheduler phases, filters and
+        weighers, optionally resetting them.
+        """
+        result = self.timings.to_dict()
+        if reset:
+            self.timings.reset()
+        return result
 
-    def get_weighed_hosts(self, hosts, weight_properties):
-        """Weigh the hosts."""
+    def get_weighed_hosts(self, hosts, weight_properties, limit=None):
+        """Weigh the hosts.
+
+        If limit is given, only the limit best weighed hosts are returned.
+        """
         return self.weight_handler.get_weighed_objects(self.weighers,
-                hosts, weight_properties)
+                hosts, weight_properties, limit=limit)
+
+    def update_host_weights(self, weighed_hosts, weight_properties):
+        """Weigh again some already weighed hosts.
+
+        Returns True if the normalization bounds of the weighers changed
+        while doing so, meaning that the weights of the other weighed hosts
+        are not comparable with the updated ones anymore.
+        """
+        bounds = [(weigher.minval, weigher.maxval)
+                  for weigher in self.weighers]
+        self.weight_handler.update_weights(self.weighers, weighed_hosts,
+                                           weight_properties)
+        return bounds != [(weigher.minval, weigher.maxval)
+                          for weigher in self.weighers]
 
     def get_all_host_states(self, context):
         """Returns a list of HostStates that represents all the hosts
         the HostManager knows about. Also, each of the consumable resources
         in HostState are pre-populated and adjusted based on data in the db.
+
+        If scheduler_incremental_host_refresh is set, only the compute nodes
+        which changed since the previous call are read from the db and merged
+        into the known host states.
         """
 
         service_refs = {service.host: service
                         for service in objects.ServiceList.get_by_binary(
                             context, 'nova-compute')}
         # Get resource usage across the available compute nodes:
-        compute_nodes = objects.ComputeNodeList.get_all(context)
-        seen_nodes = set()
+        poll_time = timeutils.utcnow()
+        incremental = self._can_refresh_incrementally()
+        if incremental:
+            compute_nodes = objects.ComputeNodeList.get_all_changed_since(
+                context, self._last_compute_poll - COMPUTE_POLL_OVERLAP)
+            seen_nodes = set(self.host_state_map.keys())
+        else:
+            compute_nodes = objects.ComputeNodeList.get_all(context)
+            seen_nodes = set()
+        self.refreshed_compute_nodes = len(compute_nodes)
+        LOG.debug("Refreshed %(count)d compute node(s) %(mode)s",
+                  {'count': self.refreshed_compute_nodes,
+                   'mode': 'incrementally' if incremental else 'fully'})
+
+        # (HostState, service) of the host states to refresh
+        to_refresh = []
         for compute in compute_nodes:
-            service = service_refs.get(compute.host)
+            host = compute.host
+            node = compute.hypervisor_hostname
+            state_key = (host, node)
+            if incremental and compute.deleted:
+                seen_nodes.discard(state_key)
+                continue
 
+            service = service_refs.get(host)
             if not service:
                 LOG.warning(_LW(
                     "No compute service record found for host %(host)s"),
-                    {'host': compute.host})
+                    {'host': host})
+                seen_nodes.discard(state_key)
                 continue
-            host = compute.host
-            node = compute.hypervisor_hostname
-            state_key = (host, node)
             host_state = self.host_state_map.get(state_key)
             if host_state:
                 host_state.update_from_compute_node(compute)
             else:
                 host_state = self.host_state_cls(host, node, compute=compute)
                 self.host_state_map[state_key] = host_state
-            # We force to update the aggregates info each time a new request
-            # comes in, because some changes on the aggregates could have been
-            # happening after setting this field for the first time
-            host_state.aggregates = [self.aggs_by_id[agg_id] for agg_id in
-                                     self.host_aggregates_map[
-                                         host_state.host]]
-            host_state.update_service(dict(service))
-            self._add_instance_info(context, compute, host_state)
+            if not incremental:
+                to_refresh.append((host_state, service))
             seen_nodes.add(state_key)
 
+        if incremental:
+            # The services can go away without their compute nodes changing
+            seen_nodes = set(state_key for state_key in seen_nodes
+                             if state_key[0] in service_refs)
+
         # remove compute nodes from host_state_map if they are not active
         dead_nodes = set(self.host_state_map.keys()) - seen_nodes
         for state_key in dead_nodes:
@@ -574,25 +749,61 @@ class HostManager(object):
                          "from scheduler"), {'host': host, 'node': node})
             del self.host_state_map[state_key]
 
+        if incremental:
+            to_refresh = [(state, service_refs[state.host])
+                          for state in six.itervalues(self.host_state_map)]
+        self._prefetch_instance_info(
+            context, set(state.host for state, _ in to_refresh))
+        for host_state, service in to_refresh:
+            self._refresh_host_state(context, host_state, service)
+
+        self._last_compute_poll = poll_time
         return six.itervalues(self.host_state_map)
 
-    def _add_instance_info(self, context, compute, host_state):
+    def _can_refresh_incrementally(self):
+        """Returns True if only the changed compute nodes need to be read.
+
+        HostStates whose 'updated' field was reset, for example after a failed
+        multiple create, need to be reloaded from the db even if their compute
+        node didn't change, so a full refresh is done in that case.
+        """
+        if not self.incremental_host_refresh or not self._last_compute_poll:
+            return False
+        return all(host_state.updated
+                   for host_state in six.itervalues(self.host_state_map))
+
+    def _refresh_host_state(self, context, host_state, service):
+        """Updates the aggregates, service and instances of a HostState."""
+        # We force to update the aggregates info each time a new request
+        # comes in, because some changes on the aggregates could have been
+        # happening after setting this field for the first time
+        host_state.aggregates = [self.aggs_by_id[agg_id] for agg_id in
+                                 self.host_aggregates_map[
+                                     host_state.host]]
+        host_state.aggregate_index = self.aggregate_index
+        host_state.update_service(dict(service))
+        self._add_instance_info(context, host_state.host, host_state)
+
+    def _add_instance_info(self, context, host_name, host_state):
         """Adds the host instance info to the host_state object.
 
         Some older compute nodes may not be sending instance change updates to
         the Scheduler; other sites may disable this feature for performance
         reasons. In either of these cases, there will either be no information
         for the host, or the 'updated' value for that host dict will be False.
-        In those cases, we need to grab the current InstanceList instead of
-        relying on the version in _instance_info.
+        When tracking instance changes, the instances read in bulk from the db
+        are used anyway and refresh_instance_info() periodically reloads them.
+        Otherwise, we need to grab the current InstanceList instead of relying
+        on the version in _instance_info.
         """
-        host_name = compute.host
         host_info = self._instance_info.get(host_name)
-        if host_info and host_info.get("updated"):
+        if host_info and (host_info.get("updated") or
+                          self.tracks_instance_changes):
             inst_dict = host_info["instances"]
         else:
             # Host is running old version, or updates aren't flowing.
-            inst_list = objects.InstanceList.get_by_host(context, host_name)
+            inst_list = objects.InstanceList.get_projected_by_host(
+                context, host_name, INSTANCE_INFO_FIELDS)
             inst_dict = {instance.uuid: instance
                          for instance in inst_list.objects}
         host_state.instances = inst_dict
@@ -601,11 +812,10 @@ class HostManager(object):
         """Get the InstanceList for the specified host, and store it in the
         _instance_info dict.
         """
-        instances = objects.InstanceList.get_by_host(context, host_name)
+        instances = objects.InstanceList.get_projected_by_host(
+            context, host_name, INSTANCE_INFO_FIELDS)
         inst_dict = {instance.uuid: instance for instance in instances}
-        host_info = self._instance_info[host_name] = {}
-        host_info["instances"] = inst_dict
-        host_info["updated"] = False
+        self._instance_info[host_name] = self._new_host_info(inst_dict, False)
 
     @utils.synchronized(HOST_INSTANCE_SEMAPHORE)
     def update_instance_info(self, context, host_name, instance_info):
@@ -626,10 +836,8 @@ class HostManager(object):
             instances = instance_info.objects
             if len(instances) > 1:
                 # This is a host sending its full instance list, so use it.
-                host_info = self._instance_info[host_name] = {}
-                host_info["instances"] = {instance.uuid: instance
-                                          for instance in instances}
-                host_info["updated"] = True
+                self._instance_info[host_name] = self._new_host_info(
+                    {instance.uuid: instance for instance in instances}, True)
             else:
                 self._recreate_instance_info(context, host_name)
                 LOG.info(_LI("Received an update from an unknown host '%s'. "
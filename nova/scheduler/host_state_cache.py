@@ -0,0 +1,374 @@
+# Copyright (c) 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Host state caches that can be shared between scheduler workers.
+
+Each entry holds the consumable resources of one compute node, as seen by
+the last scheduler that refreshed or claimed on it, together with a version
+number. Writers must pass the version they last read, so two schedulers
+claiming on the same node at the same time can't overwrite each other.
+"""
+
+import copy
+import errno
+import fcntl
+import os
+import time
+
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_serialization import jsonutils
+from oslo_utils import timeutils
+import six
+
+from nova.i18n import _LW
+from nova.openstack.common import memorycache
+from nova.pci import stats as pci_stats
+
+
+host_state_cache_opts = [
+    cfg.StrOpt('scheduler_host_state_cache_driver',
+               help='Full class name of the cache used by the caching '
+                    'scheduler to share host states between scheduler '
+                    'workers, for example '
+                    'nova.scheduler.host_state_cache.FileHostStateCache or '
+                    'nova.scheduler.host_state_cache.MemcachedHostStateCache.'
+                    ' When unset, each scheduler worker keeps its own '
+                    'private cache.'),
+    cfg.StrOpt('scheduler_host_state_cache_path',
+               default='/dev/shm/nova-scheduler',
+               help='Directory used by FileHostStateCache. It must be shared '
+                    'by all the scheduler workers of a host.'),
+    cfg.IntOpt('scheduler_host_state_cache_lock_timeout',
+               default=10,
+               help='Number of seconds after which the lock of a '
+                    'MemcachedHostStateCache entry expires, in case its '
+                    'holder died while updating it.'),
+    cfg.IntOpt('scheduler_host_state_cache_claim_retries',
+               default=3,
+               help='Number of times the caching scheduler retries to '
+                    'publish the resources consumed on a host to the shared '
+                    'host state cache, when other schedulers updated the '
+                    'host at the same time.'),
+    cfg.IntOpt('scheduler_host_state_cache_max_age',
+               default=600,
+               help='Number of seconds a caching scheduler worker keeps the '
+                    'hosts it loaded from the database, while another '
+                    'worker refreshes their resources in the shared host '
+                    'state cache. Past that age, the worker loads the hosts '
+                    'again, with their services and aggregates.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(host_state_cache_opts)
+
+LOG = logging.getLogger(__name__)
+
+GENERATION_KEY = 'generation'
+REFRESH_KEY = 'refresh'
+
+_RESOURCE_FIELDS = ('free_ram_mb', 'free_disk_mb', 'vcpus_used',
+                    'num_instances', 'num_io_ops')
+
+
+def host_state_key(host_state):
+    return '%s@%s' % (host_state.nodename, host_state.host)
+
+
+def entry_from_host_state(host_state):
+    """Return the serializable resource view of a host state."""
+    entry = {field: getattr(host_state, field) for field in _RESOURCE_FIELDS}
+    entry['updated'] = None
+    if host_state.updated:
+        entry['updated'] = timeutils.isotime(host_state.updated,
+                                             subsecond=True)
+    numa_topology = host_state.numa_topology
+    if numa_topology is not None and not isinstance(numa_topology,
+                                                   six.string_types):
+        numa_topology = numa_topology._to_json()
+    entry['numa_topology'] = numa_topology
+    entry['pci_stats'] = None
+    if host_state.pci_stats is not None:
+        entry['pci_stats'] = copy.deepcopy(host_state.pci_stats.pools)
+    return entry
+
+
+def update_host_state(host_state, entry):
+    """Apply the resource view of a cache entry to a host state."""
+    for field in _RESOURCE_FIELDS:
+        setattr(host_state, field, entry[field])
+    host_state.updated = None
+    if entry['updated']:
+        host_state.updated = timeutils.parse_isotime(entry['updated'])
+    host_state.numa_topology = entry['numa_topology']
+    if entry['pci_stats'] is not None:
+        host_state.pci_stats = pci_stats.PciDeviceStats()
+        host_state.pci_stats.pools = copy.deepcopy(entry['pci_stats'])
+
+
+def _entry_updated(entry):
+    if not entry['updated']:
+        return None
+    return timeutils.normalize_time(timeutils.parse_isotime(entry['updated']))
+
+
+def is_newer(entry, host_state):
+    """Return True if a cache entry is more recent than a host state."""
+    updated = _entry_updated(entry)
+    if updated is None:
+        return False
+    if not host_state.updated:
+        return True
+    return updated > timeutils.normalize_time(host_state.updated)
+
+
+def is_older(entry, host_state):
+    """Return True if a cache entry is older than a host state."""
+    if not host_state.updated:
+        return False
+    updated = _entry_updated(entry)
+    if updated is None:
+        return True
+    return updated < timeutils.normalize_time(host_state.updated)
+
+
+class HostStateCache(object):
+    """Base class for the host state caches.
+
+    Subclasses provide raw access to the stored values and a per key lock,
+    this class implements the versioning on top of them.
+    """
+
+    def _get(self, key):
+        """Return the value stored for a key, or None."""
+        raise NotImplementedError()
+
+    def _set(self, key, value):
+        """Store the value of a key."""
+        raise NotImplementedError()
+
+    def _lock(self, key, blocking=False):
+        """Lock a key, return False if it is already locked."""
+        raise NotImplementedError()
+
+    def _unlock(self, key):
+        raise NotImplementedError()
+
+    def _bump_generation(self):
+        """Increment the generation and return its new value."""
+        self._lock(GENERATION_KEY, blocking=True)
+        try:
+            generation = self.get_generation() + 1
+            self._set(GENERATION_KEY, generation)
+        finally:
+            self._unlock(GENERATION_KEY)
+        return generation
+
+    def get_generation(self):
+        """Return a number which changes every time an entry is updated."""
+        return self._get(GENERATION_KEY) or 0
+
+    def get(self, key):
+        """Return the entry of a key, or None."""
+        return self._get(key)
+
+    def get_many(self, keys):
+        """Return a dict of the entries found for the given keys."""
+        entries = {}
+        for key in keys:
+            entry = self._get(key)
+            if entry is not None:
+                entries[key] = entry
+        return entries
+
+    def compare_and_set(self, key, entry, version):
+        """Store an entry if the current one still has the given version.
+
+        A missing entry has the version 0. The stored entry gets the next
+        version number. Returns the generation of the cache after the
+        write, or None if the entry was changed or is being changed by
+        someone else, in which case the caller should read it again and
+        retry.
+        """
+        if not self._lock(key):
+            return None
+        try:
+            current = self._get(key)
+            current_version = current['version'] if current else 0
+            if current_version != version:
+                return None
+            entry = dict(entry, version=version + 1)
+            self._set(key, entry)
+        finally:
+            self._unlock(key)
+        return self._bump_generation()
+
+    def start_refresh(self, interval):
+        """Take the turn to load the hosts from the database.
+
+        Returns False if another worker is loading them, or loaded them less
+        than interval seconds ago. Otherwise, the caller must publish the
+        host states it loads and then call finish_refresh().
+        """
+        if not self._lock(REFRESH_KEY):
+            return False
+        refresh = self._get(REFRESH_KEY)
+        if refresh and time.time() - refresh['time'] < interval:
+            self._unlock(REFRESH_KEY)
+            return False
+        return True
+
+    def finish_refresh(self, keys):
+        """Record the keys of the hosts loaded since start_refresh().
+
+        keys is None when the hosts could not be loaded.
+        """
+        try:
+            if keys is not None:
+                self._set(REFRESH_KEY, {'time': time.time(),
+                                        'keys': sorted(keys)})
+        finally:
+            self._unlock(REFRESH_KEY)
+
+    def get_refreshed_keys(self):
+        """Return the keys of the hosts loaded by the last refresh, or
+        None.
+        """
+        refresh = self._get(REFRESH_KEY)
+        return refresh['keys'] if refresh else None
+
+
+class FileHostStateCache(HostStateCache):
+    """Host state cache shared by the scheduler workers of a single host.
+
+    Every entry is a JSON file in scheduler_host_state_cache_path, which
+    should be on a memory backed file system such as /dev/shm.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or CONF.scheduler_host_state_cache_path
+        self._locks = {}
+        try:
+            os.makedirs(self.path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def _get(self, key):
+        try:
+            with open(os.path.join(self.path, key)) as f:
+                return jsonutils.load(f)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        except ValueError:
+            LOG.warning(_LW("Ignoring corrupted host state cache entry %s"),
+                        key)
+        return None
+
+    def _set(self, key, value):
+        # NOTE: Write a temporary file and rename it, so readers never see
+        # a partial entry and don't need to take the lock.
+        filename = os.path.join(self.path, key)
+        tmp_filename = '%s.%d.tmp' % (filename, os.getpid())
+        with open(tmp_filename, 'w') as f:
+            jsonutils.dump(value, f)
+        os.rename(tmp_filename, filename)
+
+    def _lock(self, key, blocking=False):
+        lock_file = open(os.path.join(self.path, '%s.lock' % key), 'a')
+        flags = fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(lock_file, flags)
+        except IOError as e:
+            lock_file.close()
+            if e.errno in (errno.EACCES, errno.EAGAIN):
+                return False
+            raise
+        self._locks[key] = lock_file
+        return True
+
+    def _unlock(self, key):
+        lock_file = self._locks.pop(key)
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+
+class MemcachedHostStateCache(HostStateCache):
+    """Host state cache stored in memcached.
+
+    It can be shared by scheduler workers running on different hosts. When
+    memcached_servers is unset, the in process cache of memorycache is used,
+    so nothing is shared.
+    """
+
+    KEY_PREFIX = 'nova-scheduler-host-state-'
+
+    def __init__(self):
+        self.client = memorycache.get_client()
+
+    def _key(self, key):
+        return str(self.KEY_PREFIX + key)
+
+    def _get(self, key):
+        value = self.client.get(self._key(key))
+        if value is None:
+            return None
+        return jsonutils.loads(value)
+
+    def _set(self, key, value):
+        self.client.set(self._key(key), jsonutils.dumps(value))
+
+    def _lock(self, key, blocking=False):
+        # NOTE: add is atomic, it fails if the key already exists. The lock
+        # expires in case its holder dies before releasing it.
+        lock_key = self._key(key + '.lock')
+        timeout = CONF.scheduler_host_state_cache_lock_timeout
+        while not self.client.add(lock_key, '1', time=timeout):
+            if not blocking:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def _unlock(self, key):
+        self.client.delete(self._key(key + '.lock'))
+
+    def _bump_generation(self):
+        # NOTE: memcached has an atomic increment, no need for the lock.
+        key = self._key(GENERATION_KEY)
+        generation = self.client.incr(key)
+        if generation is None:
+            if self.client.add(key, '1'):
+                return 1
+            generation = self.client.incr(key)
+        return int(generation)
+
+    def get_generation(self):
+        return int(self.client.get(self._key(GENERATION_KEY)) or 0)
+
+    def get_many(self, keys):
+        get_multi = getattr(self.client, 'get_multi', None)
+        if get_multi is None:
+            return super(MemcachedHostStateCache, self).get_many(keys)
+        values = get_multi([self._key(key) for key in keys])
+        entries = {}
+        for key in keys:
+            value = values.get(self._key(key))
+            if value is not None:
+                entries[key] = jsonutils.loads(value)
+        return entries
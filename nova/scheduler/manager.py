@@ -26,10 +26,12 @@ from oslo_serialization import jsonutils
 from oslo_utils import importutils
 
 from nova import exception
+from nova.i18n import _LI
 from nova import manager
 from nova import objects
 from nova.openstack.common import periodic_task
 from nova import quota
+from nova import rpc
 
 
 LOG = logging.getLogger(__name__)
@@ -45,6 +47,24 @@ scheduler_driver_opts = [
                     'Please note this is likely to interact with the value '
                     'of service_down_time, but exactly how they interact '
                     'will depend on your choice of scheduler driver.'),
+    cfg.IntOpt('scheduler_filter_stats_interval',
+               default=-1,
+               help='How often (in seconds) to log the pass rate and cost '
+                    'per host measured for each scheduler filter. A '
+                    'negative value disables it.'),
+    cfg.IntOpt('scheduler_timings_notification_interval',
+               default=-1,
+               help='How often (in seconds) to emit a scheduler.timings '
+                    'notification with the timing histograms of the '
+                    'scheduler phases, filters and weighers. A negative '
+                    'value disables it.'),
+    cfg.IntOpt('scheduler_instance_info_refresh_interval',
+               default=60,
+               help='How often (in seconds) to reload from the database the '
+                    'instances of the hosts which do not send instance '
+                    'updates to the scheduler, when '
+                    'scheduler_tracks_instance_changes is set. A negative '
+                    'value disables it.'),
 ]
 CONF = cfg.CONF
 CONF.register_opts(scheduler_driver_opts)
@@ -55,7 +75,7 @@ QUOTAS = quota.QUOTAS
 class SchedulerManager(manager.Manager):
     """Chooses a host to run instances on."""
 
-    target = messaging.Target(version='4.2')
+    target = messaging.Target(version='4.3')
 
     def __init__(self, scheduler_driver=None, *args, **kwargs):
         if not scheduler_driver:
@@ -74,6 +94,26 @@ class SchedulerManager(manager.Manager):
     def _run_periodic_tasks(self, context):
         self.driver.run_periodic_tasks(context)
 
+    @periodic_task.periodic_task(spacing=CONF.scheduler_filter_stats_interval)
+    def _dump_filter_stats(self, context):
+        filter_stats = self.driver.host_manager.get_filter_stats()
+        for name, stats in sorted(filter_stats.items()):
+            LOG.info(_LI("Filter %(name)s: %(objs_in)d host(s) filtered, "
+                         "pass rate %(pass_rate).3f, %(cost).6f seconds per "
+                         "host"), dict(stats, name=name))
+
+    @periodic_task.periodic_task(
+        spacing=CONF.scheduler_timings_notification_interval)
+    def _emit_timings_notification(self, context):
+        notifier = rpc.get_notifier('scheduler', self.host)
+        notifier.info(context, 'scheduler.timings',
+                      self.driver.host_manager.get_timings())
+
+    @periodic_task.periodic_task(
+        spacing=CONF.scheduler_instance_info_refresh_interval)
+    def _refresh_instance_info(self, context):
+        self.driver.host_manager.refresh_instance_info(context)
+
     @messaging.expected_exceptions(exception.NoValidHost)
     def select_destinations(self, context, request_spec, filter_properties):
         """Returns destinations(s) best suited for this request_spec and
@@ -126,6 +166,12 @@ class SchedulerManager(manager.Manager):
         self.driver.host_manager.sync_instance_info(context, host_name,
                                                     instance_uuids)
 
+    def get_timings(self, context, reset=False):
+        """Returns the timing histograms of the scheduler phases, filters
+        and weighers, keyed by kind and name.
+        """
+        return self.driver.host_manager.get_timings(reset=reset)
+
 
 class _SchedulerManagerV3Proxy(object):
 
@@ -0,0 +1,117 @@
+# Copyright (c) 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Timing histograms of the scheduler.
+
+The time spent in each phase of a request, in each filter and in each
+weigher is recorded in a histogram, so the scheduling latency can be
+attributed without attaching a profiler.
+"""
+
+import bisect
+import contextlib
+import time
+
+# Upper bounds, in seconds, of the histogram buckets.  The last bucket holds
+# everything above the last bound.
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+PHASE = 'phase'
+FILTER = 'filter'
+WEIGHER = 'weigher'
+
+
+def percentile(histogram, fraction):
+    """Return the upper bound of the bucket holding a percentile.
+
+    histogram is the dict returned by Histogram.to_dict(), and fraction is
+    between 0 and 1. Returns None when the percentile is above the last
+    bound, or when the histogram is empty.
+    """
+    rank = fraction * histogram['count']
+    seen = 0
+    for bound, count in histogram['buckets']:
+        seen += count
+        if count and seen >= rank:
+            return bound
+    return None
+
+
+class Histogram(object):
+    """Distribution of durations."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.counts = [0] * (len(BUCKETS) + 1)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+
+    def to_dict(self):
+        """Return the histogram as a serializable dict.
+
+        The buckets are a list of [upper bound, count] pairs, the upper
+        bound of the last one is None.
+        """
+        return {'count': self.count,
+                'total': self.total,
+                'max': self.max,
+                'buckets': [[bound, count] for bound, count in
+                            zip(BUCKETS + (None,), self.counts)]}
+
+
+class Timings(object):
+    """Timing histograms keyed by kind and name."""
+
+    def __init__(self):
+        self.histograms = {}
+
+    def observe(self, kind, name, seconds):
+        histogram = self.histograms.get((kind, name))
+        if histogram is None:
+            histogram = self.histograms[(kind, name)] = Histogram()
+        histogram.observe(seconds)
+
+    @contextlib.contextmanager
+    def timed(self, kind, name, durations=None):
+        """Time the enclosed block.
+
+        The duration is also stored under name in the durations dict, when
+        one is given.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            self.observe(kind, name, elapsed)
+            if durations is not None:
+                durations[name] = elapsed
+
+    def reset(self):
+        self.histograms = {}
+
+    def to_dict(self):
+        """Return the histograms as a dict of dicts keyed by kind and name."""
+        result = {}
+        for (kind, name), histogram in self.histograms.items():
+            result.setdefault(kind, {})[name] = histogram.to_dict()
+        return result
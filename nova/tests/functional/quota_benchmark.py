@@ -0,0 +1,241 @@
+# Copyright (c) 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark of the quota drivers under contention.
+
+Workers, each a green thread, reserve instances, cores and ram in a single
+project like the API does for the server boots, hold the reservations for a
+while, then commit them and release the resources, or roll them back. The
+number of reservations per second, their latency and the number of
+reservations refused because the quota was reached are reported for each
+quota driver.
+
+Run it with:
+
+    python -m nova.tests.functional.quota_benchmark --workers 50
+
+The in-memory sqlite database used by default runs the database calls one
+at a time. To measure the contention between the transactions, give the
+connection string of an empty MySQL or PostgreSQL database with
+--connection, it is migrated first.
+"""
+
+from __future__ import print_function
+
+import argparse
+import random
+import sys
+import time
+
+import eventlet
+import fixtures
+from oslo_config import cfg
+from oslo_db import exception as db_exc
+from oslo_serialization import jsonutils
+from oslo_utils import importutils
+
+from nova import context as nova_context
+from nova import db
+from nova.db import migration
+from nova import exception
+from nova import quota
+from nova.tests import fixtures as nova_fixtures
+from nova.tests.functional import scheduler_benchmark
+from nova.tests.unit import conf_fixture
+
+CONF = cfg.CONF
+
+DRIVERS = {
+    'db': 'nova.quota.DbQuotaDriver',
+    'cas': 'nova.quota.CasQuotaDriver',
+}
+
+RESOURCES = [
+    quota.ReservableResource('instances', '_sync_instances',
+                             'quota_instances'),
+    quota.ReservableResource('cores', '_sync_instances', 'quota_cores'),
+    quota.ReservableResource('ram', '_sync_instances', 'quota_ram'),
+]
+
+# (vcpus, memory_mb) of the flavors of the booted servers
+FLAVORS = ((1, 2048), (2, 4096), (4, 8192))
+
+
+class BenchmarkEnvironment(fixtures.Fixture):
+    """Configuration and database needed to run the quota drivers outside
+    of the test runner.
+    """
+
+    def __init__(self, connection=None):
+        super(BenchmarkEnvironment, self).__init__()
+        self.connection = connection
+
+    def setUp(self):
+        super(BenchmarkEnvironment, self).setUp()
+        self.useFixture(conf_fixture.ConfFixture(CONF))
+        if self.connection:
+            self.useFixture(nova_fixtures.ConfPatcher(
+                connection=self.connection, group='database'))
+            migration.db_sync()
+        else:
+            self.useFixture(nova_fixtures.Database())
+
+
+def set_limits(context, project_id, instances):
+    """Set the quotas of a project, cores and ram follow the instances."""
+    db.quota_create(context, project_id, 'instances', instances)
+    db.quota_create(context, project_id, 'cores', instances * 4)
+    db.quota_create(context, project_id, 'ram', instances * 8192)
+
+
+def _worker(engine, context, num_reservations, hold, commit_ratio, rng,
+            results):
+    for num in range(num_reservations):
+        vcpus, memory_mb = rng.choice(FLAVORS)
+        start = time.time()
+        try:
+            reservations = engine.reserve(context, instances=1, cores=vcpus,
+                                          ram=memory_mb)
+        except exception.OverQuota:
+            results['over_quota'] += 1
+            continue
+        except db_exc.DBError:
+            results['errors'] += 1
+            continue
+        finally:
+            results['latencies'].append(time.time() - start)
+        # Each reservation holds one instance of the project quota
+        results['held'] += 1
+        results['max_held'] = max(results['max_held'], results['held'])
+        # The time the server takes to be built
+        eventlet.sleep(hold)
+        try:
+            if rng.random() < commit_ratio:
+                engine.commit(context, reservations)
+                reservations = engine.reserve(context, instances=-1,
+                                              cores=-vcpus, ram=-memory_mb)
+                engine.commit(context, reservations)
+            else:
+                engine.rollback(context, reservations)
+        except db_exc.DBError:
+            results['errors'] += 1
+        results['held'] -= 1
+        results['reserved'] += 1
+
+
+def run_benchmark(context, driver, project_id, num_workers,
+                  num_reservations, num_users=1, hold=0.0, commit_ratio=0.5,
+                  seed=0):
+    """Reserve quotas from concurrent workers and return the measurements.
+
+    Each of the num_workers workers makes num_reservations reservations, as
+    one of num_users users of the project. max_held is the largest number
+    of instances the workers reserved at the same time, which the instances
+    quota of the project must bound.
+    """
+    engine = quota.QuotaEngine(quota_driver_class=driver)
+    engine.register_resources(RESOURCES)
+    results = {'reserved': 0, 'over_quota': 0, 'errors': 0, 'held': 0,
+               'max_held': 0, 'latencies': []}
+    pool = eventlet.GreenPool(num_workers)
+    start = time.time()
+    for num in range(num_workers):
+        user_context = nova_context.RequestContext(
+            'user%d' % (num % num_users), project_id, is_admin=False)
+        pool.spawn(_worker, engine, user_context, num_reservations, hold,
+                   commit_ratio, random.Random(seed + num), results)
+    pool.waitall()
+    elapsed = time.time() - start
+
+    del results['held']
+    latencies = sorted(results.pop('latencies'))
+    total = num_workers * num_reservations
+    results.update({
+        'workers': num_workers,
+        'reservations': total,
+        'elapsed': elapsed,
+        'reservations_per_second': total / elapsed if elapsed else 0,
+        'latency': {
+            'p50': scheduler_benchmark._percentile(latencies, 0.5),
+            'p99': scheduler_benchmark._percentile(latencies, 0.99),
+            'max': latencies[-1] if latencies else None}})
+    return results
+
+
+def print_results(results, out=sys.stdout):
+    print('%-8s %8s %12s %10s %8s %8s %8s %12s %12s %12s' % (
+        'Driver', 'Workers', 'Reservations', 'OverQuota', 'MaxHeld',
+        'Errors', 'Per sec', 'p50(ms)', 'p99(ms)', 'max(ms)'), file=out)
+    for name, result in sorted(results.items()):
+        latency = result['latency']
+        print('%-8s %8d %12d %10d %8d %8d %8.1f %12s %12s %12s' % (
+            name, result['workers'], result['reservations'],
+            result['over_quota'], result['max_held'], result['errors'],
+            result['reservations_per_second'],
+            scheduler_benchmark._ms(latency['p50']),
+            scheduler_benchmark._ms(latency['p99']),
+            scheduler_benchmark._ms(latency['max'])), file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the quota drivers under contention.')
+    parser.add_argument('--driver', action='append',
+                        choices=sorted(DRIVERS),
+                        help='Quota driver to benchmark, all by default.')
+    parser.add_argument('--workers', type=int, default=20,
+                        help='Number of concurrent workers.')
+    parser.add_argument('--reservations', type=int, default=50,
+                        help='Number of reservations of each worker.')
+    parser.add_argument('--users', type=int, default=1,
+                        help='Number of users of the project the workers '
+                             'act as.')
+    parser.add_argument('--limit', type=int, default=1000,
+                        help='Instances quota of the project, the cores '
+                             'and ram quotas follow it.')
+    parser.add_argument('--hold', type=float, default=0.0,
+                        help='Seconds the reservations are held before '
+                             'being committed or rolled back.')
+    parser.add_argument('--commit-ratio', type=float, default=0.5,
+                        help='Fraction of the reservations committed '
+                             'rather than rolled back.')
+    parser.add_argument('--connection',
+                        help='Connection string of an empty database to '
+                             'use instead of an in-memory sqlite one.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true',
+                        help='Print the results as JSON, to compare runs.')
+    args = parser.parse_args(argv)
+
+    results = {}
+    with BenchmarkEnvironment(args.connection):
+        context = nova_context.get_admin_context()
+        for name in args.driver or sorted(DRIVERS):
+            project_id = 'quota-benchmark-%s' % name
+            set_limits(context, project_id, args.limit)
+            driver = importutils.import_object(DRIVERS[name])
+            results[name] = run_benchmark(
+                context, driver, project_id, args.workers,
+                args.reservations, num_users=args.users, hold=args.hold,
+                commit_ratio=args.commit_ratio, seed=args.seed)
+    if args.json:
+        print(jsonutils.dumps(results, indent=2, sort_keys=True))
+    else:
+        print_results(results)
+
+
+if __name__ == '__main__':
+    main()
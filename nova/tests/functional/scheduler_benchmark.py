@@ -0,0 +1,384 @@
+# Copyright (c) 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark of the scheduler drivers over synthetic fleets.
+
+A fleet of compute nodes, with NUMA topologies, PCI device pools, metrics
+and aggregates, is created in an in-memory sqlite database. A mix of
+requests is then sent to select_destinations(), and the latency of the
+requests, the number of decisions per second and the time spent in each
+filter and weigher are reported.
+
+Run it with:
+
+    python -m nova.tests.functional.scheduler_benchmark --hosts 1000
+
+The scheduler options, such as the filters and the weighers to compare, can
+be given in a nova.conf style file with --config-file.
+"""
+
+from __future__ import print_function
+
+import argparse
+import random
+import sys
+import time
+import uuid
+
+import fixtures
+from oslo_config import cfg
+from oslo_serialization import jsonutils
+from oslo_utils import importutils
+from oslo_utils import timeutils
+
+from nova import context as nova_context
+from nova import exception
+from nova import objects
+from nova.scheduler import timings
+from nova.tests import fixtures as nova_fixtures
+from nova.tests.unit import conf_fixture
+
+CONF = cfg.CONF
+
+DRIVERS = {
+    'filter_scheduler': 'nova.scheduler.filter_scheduler.FilterScheduler',
+    'caching_scheduler': 'nova.scheduler.caching_scheduler.CachingScheduler',
+}
+
+# (vcpus, memory_mb, local_gb) of the models of compute nodes in the fleet
+HOST_MODELS = ((16, 65536, 500), (32, 131072, 1000), (48, 262144, 2000))
+
+# (vcpus, memory_mb, root_gb) of the requested flavors
+FLAVORS = {
+    'm1.small': (1, 2048, 20),
+    'm1.medium': (2, 4096, 40),
+    'm1.large': (4, 8192, 80),
+    'm1.xlarge': (8, 16384, 160),
+}
+
+# (weight, flavor, number of instances, with a NUMA topology, with a PCI
+# device) of the kinds of requests sent to the scheduler
+REQUEST_MIX = (
+    (50, 'm1.small', 1, False, False),
+    (20, 'm1.medium', 1, False, False),
+    (10, 'm1.large', 3, False, False),
+    (10, 'm1.medium', 1, True, False),
+    (5, 'm1.large', 1, False, True),
+    (5, 'm1.xlarge', 1, True, True),
+)
+
+PCI_VENDOR_ID = '8086'
+PCI_PRODUCT_ID = '1520'
+
+
+class BenchmarkEnvironment(fixtures.Fixture):
+    """Configuration, in-memory database and fake messaging needed to run
+    the scheduler outside of the test runner.
+    """
+
+    def __init__(self, config_files=None):
+        super(BenchmarkEnvironment, self).__init__()
+        self.config_files = config_files or []
+
+    def setUp(self):
+        super(BenchmarkEnvironment, self).setUp()
+        self.useFixture(conf_fixture.ConfFixture(CONF))
+        if self.config_files:
+            args = []
+            for config_file in self.config_files:
+                args.extend(['--config-file', config_file])
+            CONF(args, project='nova', default_config_files=[])
+        # The synthetic services must stay up however long the benchmark
+        # runs, as they never report.
+        self.useFixture(nova_fixtures.ConfPatcher(service_down_time=86400))
+        self.useFixture(nova_fixtures.RPCFixture())
+        self.useFixture(nova_fixtures.Database())
+
+
+def _numa_topology(vcpus, memory_mb):
+    cells = []
+    for cell_id in range(2):
+        cpus = range(cell_id * vcpus // 2, (cell_id + 1) * vcpus // 2)
+        cells.append(objects.NUMACell(
+            id=cell_id, cpuset=set(cpus), memory=memory_mb // 2,
+            cpu_usage=0, memory_usage=0, mempages=[], siblings=[],
+            pinned_cpus=set()))
+    return objects.NUMATopology(cells=cells)._to_json()
+
+
+def _pci_device_pools(count):
+    return objects.PciDevicePoolList(objects=[objects.PciDevicePool(
+        vendor_id=PCI_VENDOR_ID, product_id=PCI_PRODUCT_ID, numa_node=0,
+        tags={}, count=count)])
+
+
+def build_fleet(context, num_hosts, num_aggregates=10, numa_ratio=0.5,
+                pci_ratio=0.2, seed=0):
+    """Create the services, compute nodes and aggregates of a fleet.
+
+    Each host belongs to one aggregate, the aggregates being spread over
+    half as many availability zones and half of them having ssd=true in
+    their metadata. numa_ratio and pci_ratio are the fractions of the hosts
+    having a NUMA topology and PCI devices. The hosts are partially used.
+    """
+    rng = random.Random(seed)
+    num_zones = max(num_aggregates // 2, 1)
+    aggregates = []
+    for num in range(num_aggregates):
+        aggregate = objects.Aggregate(context, name='aggregate%d' % num,
+                                      metadata={
+            'availability_zone': 'az%d' % (num % num_zones),
+            'ssd': 'true' if num % 2 else 'false'})
+        aggregate.create()
+        aggregates.append(aggregate)
+
+    now = timeutils.utcnow().isoformat()
+    for num in range(num_hosts):
+        host = 'compute%05d' % num
+        service = objects.Service(context, host=host, binary='nova-compute',
+                                  topic='compute', report_count=0)
+        service.create()
+
+        vcpus, memory_mb, local_gb = rng.choice(HOST_MODELS)
+        usage = rng.uniform(0, 0.7)
+        vcpus_used = int(vcpus * usage)
+        memory_mb_used = int(memory_mb * usage)
+        local_gb_used = int(local_gb * usage)
+        numa_topology = None
+        if rng.random() < numa_ratio:
+            numa_topology = _numa_topology(vcpus, memory_mb)
+        pci_device_pools = None
+        if rng.random() < pci_ratio:
+            pci_device_pools = _pci_device_pools(rng.randint(2, 8))
+        metrics = [{'name': 'cpu.percent', 'value': rng.randint(0, 100),
+                    'timestamp': now, 'source': 'benchmark'}]
+        compute = objects.ComputeNode(
+            context, service_id=service.id, host=host,
+            hypervisor_hostname=host, hypervisor_type='fake',
+            hypervisor_version=1000, cpu_info='',
+            host_ip='10.%d.%d.%d' % (num >> 16, (num >> 8) & 255, num & 255),
+            vcpus=vcpus, memory_mb=memory_mb, local_gb=local_gb,
+            vcpus_used=vcpus_used, memory_mb_used=memory_mb_used,
+            local_gb_used=local_gb_used,
+            free_ram_mb=memory_mb - memory_mb_used,
+            free_disk_gb=local_gb - local_gb_used,
+            disk_available_least=local_gb - local_gb_used,
+            current_workload=0, running_vms=vcpus_used,
+            stats={'num_instances': str(vcpus_used),
+                   'io_workload': str(rng.randint(0, 4))},
+            metrics=jsonutils.dumps(metrics), numa_topology=numa_topology,
+            pci_device_pools=pci_device_pools, supported_hv_specs=[])
+        compute.create()
+        if aggregates:
+            aggregates[num % num_aggregates].add_host(host)
+
+
+def make_request(rng, zones=(), with_pci=True):
+    """Return the request spec and filter properties of a random request.
+
+    The kind of request is drawn from REQUEST_MIX, and some of them ask for
+    one of the given availability zones or for the ssd aggregates. The
+    requests for PCI devices are left out unless with_pci is True, as they
+    can only be placed when PciPassthroughFilter is enabled.
+    """
+    mix = [kind for kind in REQUEST_MIX if with_pci or not kind[4]]
+    choice = rng.uniform(0, sum(kind[0] for kind in mix))
+    for weight, flavor_name, num_instances, numa, pci in mix:
+        choice -= weight
+        if choice <= 0:
+            break
+    vcpus, memory_mb, root_gb = FLAVORS[flavor_name]
+    extra_specs = {}
+    if rng.random() < 0.2:
+        extra_specs['aggregate_instance_extra_specs:ssd'] = 'true'
+    instance_type = {'name': flavor_name, 'flavorid': flavor_name,
+                     'vcpus': vcpus, 'memory_mb': memory_mb,
+                     'root_gb': root_gb, 'ephemeral_gb': 0,
+                     'extra_specs': extra_specs}
+    instance_uuids = [str(uuid.uuid4()) for num in range(num_instances)]
+    instance_properties = {'uuid': instance_uuids[0],
+                           'project_id': 'benchmark',
+                           'vcpus': vcpus, 'memory_mb': memory_mb,
+                           'root_gb': root_gb, 'ephemeral_gb': 0,
+                           'os_type': 'linux', 'availability_zone': None,
+                           'numa_topology': None, 'pci_requests': None}
+    filter_properties = {'instance_type': instance_type,
+                         'scheduler_hints': {}}
+    if zones and rng.random() < 0.3:
+        instance_properties['availability_zone'] = rng.choice(zones)
+    if numa:
+        cells = [objects.InstanceNUMACell(
+            id=cell_id, cpuset=set(range(cell_id * vcpus // 2,
+                                         (cell_id + 1) * vcpus // 2)),
+            memory=memory_mb // 2) for cell_id in range(2)]
+        instance_properties['numa_topology'] = objects.InstanceNUMATopology(
+            cells=cells)
+    if pci:
+        request = {'count': 1, 'alias_name': 'benchmark',
+                   'spec': [{'vendor_id': PCI_VENDOR_ID,
+                             'product_id': PCI_PRODUCT_ID}]}
+        instance_properties['pci_requests'] = {
+            'instance_uuid': instance_uuids[0], 'requests': [request]}
+        filter_properties['pci_requests'] = objects.InstancePCIRequests(
+            instance_uuid=instance_uuids[0],
+            requests=[objects.InstancePCIRequest(**request)])
+    request_spec = {'instance_properties': instance_properties,
+                    'instance_type': instance_type,
+                    'instance_uuids': instance_uuids,
+                    'num_instances': num_instances,
+                    'image': {'properties': {}}}
+    return request_spec, filter_properties
+
+
+def _percentile(values, fraction):
+    """Return the nearest-rank percentile of a sorted list."""
+    if not values:
+        return None
+    rank = max(int(round(fraction * len(values))) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def run_benchmark(context, driver, num_requests, warmup=10, seed=0):
+    """Send requests to a scheduler driver and return the measurements.
+
+    The first warmup requests are not measured. The timing histograms of
+    the driver's host manager are reset after them, and are included in the
+    result.
+    """
+    rng = random.Random(seed)
+    zones = sorted(set(
+        aggregate.metadata['availability_zone']
+        for aggregate in objects.AggregateList.get_all(context)
+        if 'availability_zone' in aggregate.metadata))
+    with_pci = 'PciPassthroughFilter' in CONF.scheduler_default_filters
+    driver.run_periodic_tasks(context)
+
+    latencies = []
+    placed = 0
+    no_valid_host = 0
+    start = time.time()
+    for num in range(warmup + num_requests):
+        if num == warmup:
+            driver.host_manager.get_timings(reset=True)
+            start = time.time()
+        request_spec, filter_properties = make_request(rng, zones, with_pci)
+        request_start = time.time()
+        try:
+            dests = driver.select_destinations(context, request_spec,
+                                               filter_properties)
+        except exception.NoValidHost:
+            dests = None
+        if num < warmup:
+            continue
+        latencies.append(time.time() - request_start)
+        if dests is None:
+            no_valid_host += 1
+        else:
+            placed += len(dests)
+    elapsed = time.time() - start
+
+    latencies.sort()
+    return {'requests': num_requests,
+            'placed': placed,
+            'no_valid_host': no_valid_host,
+            'elapsed': elapsed,
+            'decisions_per_second': num_requests / elapsed if elapsed else 0,
+            'latency': {'p50': _percentile(latencies, 0.5),
+                        'p99': _percentile(latencies, 0.99),
+                        'max': latencies[-1] if latencies else None},
+            'timings': driver.host_manager.get_timings()}
+
+
+def _ms(seconds):
+    if seconds is None:
+        return '-'
+    return '%.3f' % (seconds * 1000)
+
+
+def print_results(results, out=sys.stdout):
+    print('Requests: %(requests)d, instances placed: %(placed)d, '
+          'no valid host: %(no_valid_host)d' % results, file=out)
+    print('Decisions per second: %.1f' % results['decisions_per_second'],
+          file=out)
+    latency = results['latency']
+    print('Latency (ms): p50 %s, p99 %s, max %s' % (
+        _ms(latency['p50']), _ms(latency['p99']), _ms(latency['max'])),
+        file=out)
+    print(file=out)
+    print('%-8s %-40s %8s %12s %12s' % ('Kind', 'Name', 'Count',
+                                       'Average(ms)', '99%(ms)'), file=out)
+    for kind in (timings.PHASE, timings.FILTER, timings.WEIGHER):
+        histograms = results['timings'].get(kind, {})
+        for name, histogram in sorted(histograms.items()):
+            count = histogram['count']
+            average = histogram['total'] / count if count else None
+            print('%-8s %-40s %8d %12s %12s' % (
+                kind, name, count, _ms(average),
+                _ms(timings.percentile(histogram, 0.99))), file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the scheduler over a synthetic fleet.')
+    parser.add_argument('--hosts', type=int, default=1000,
+                        help='Number of compute nodes in the fleet.')
+    parser.add_argument('--aggregates', type=int, default=10,
+                        help='Number of host aggregates.')
+    parser.add_argument('--numa-ratio', type=float, default=0.5,
+                        help='Fraction of the hosts with a NUMA topology.')
+    parser.add_argument('--pci-ratio', type=float, default=0.2,
+                        help='Fraction of the hosts with PCI devices.')
+    parser.add_argument('--requests', type=int, default=500,
+                        help='Number of measured requests.')
+    parser.add_argument('--warmup', type=int, default=10,
+                        help='Number of requests sent before measuring.')
+    parser.add_argument('--driver', choices=sorted(DRIVERS),
+                        default='filter_scheduler')
+    parser.add_argument('--filters',
+                        help='Comma separated scheduler_default_filters.')
+    parser.add_argument('--weighers',
+                        help='Comma separated scheduler_weight_classes.')
+    parser.add_argument('--config-file', action='append',
+                        help='nova.conf style file with the scheduler '
+                             'options to benchmark.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true',
+                        help='Print the results as JSON, to compare runs.')
+    args = parser.parse_args(argv)
+
+    objects.register_all()
+    with BenchmarkEnvironment(args.config_file) as env:
+        if args.filters:
+            env.useFixture(nova_fixtures.ConfPatcher(
+                scheduler_default_filters=args.filters.split(',')))
+        if args.weighers:
+            env.useFixture(nova_fixtures.ConfPatcher(
+                scheduler_weight_classes=args.weighers.split(',')))
+        context = nova_context.get_admin_context()
+        build_fleet(context, args.hosts, num_aggregates=args.aggregates,
+                    numa_ratio=args.numa_ratio, pci_ratio=args.pci_ratio,
+                    seed=args.seed)
+        driver = importutils.import_object(DRIVERS[args.driver])
+        results = run_benchmark(context, driver, args.requests,
+                                warmup=args.warmup, seed=args.seed)
+    if args.json:
+        print(jsonutils.dumps(results, indent=2, sort_keys=True))
+    else:
+        print_results(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+# Copyright (c) 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark of the encoding of the objects sent over RPC.
+
+Instances, instance lists and compute nodes, with their metadata, flavors
+and sub-objects set like they are when sent between the services, are
+serialized and deserialized with the NovaObjectSerializer. The number of
+payloads and objects encoded and decoded per second is reported for each.
+
+Run it with:
+
+    python -m nova.tests.functional.serializer_benchmark --instances 200
+
+The primitives are decoded after a JSON round trip, so that they have the
+types they have when received from the message bus.
+"""
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import sys
+import time
+import uuid
+
+from oslo_serialization import jsonutils
+
+from nova import context as nova_context
+from nova import objects
+from nova.objects import base as objects_base
+from nova.tests.functional import scheduler_benchmark
+from nova.tests.unit import fake_instance
+
+PAYLOADS = ('Instance', 'InstanceList', 'ComputeNode')
+
+
+def make_instance(context, num):
+    """Return an instance as built by the compute manager."""
+    image_ref = str(uuid.uuid4())
+    system_metadata = {'image_base_image_ref': image_ref,
+                       'image_container_format': 'bare',
+                       'image_disk_format': 'qcow2',
+                       'image_min_disk': '1',
+                       'image_min_ram': '0',
+                       'image_hw_disk_bus': 'virtio',
+                       'image_hw_vif_model': 'virtio',
+                       'owner_user_name': 'benchmark-user',
+                       'owner_project_name': 'benchmark-project'}
+    launched_at = datetime.datetime(2015, 6, 1, 12, 0, num % 60)
+    return fake_instance.fake_instance_obj(
+        context, id=num + 1, hostname='server-%d' % num,
+        display_name='server-%d' % num, image_ref=image_ref,
+        host='compute-%d' % (num % 100), node='compute-%d' % (num % 100),
+        vm_state='active', power_state=1, memory_mb=2048, vcpus=2,
+        root_gb=20, launched_at=launched_at, updated_at=launched_at,
+        availability_zone='nova', key_name='benchmark-key',
+        metadata={'role': 'web', 'tier': 'frontend'},
+        system_metadata=system_metadata,
+        expected_attrs=['metadata', 'system_metadata'])
+
+
+def make_compute_node(context, num):
+    """Return a compute node as reported by the resource tracker."""
+    numa_topology = scheduler_benchmark._numa_topology(32, 131072)
+    node = objects.ComputeNode(
+        context, id=num + 1, service_id=num + 1, host='compute-%d' % num,
+        vcpus=32, memory_mb=131072, local_gb=2048, vcpus_used=4,
+        memory_mb_used=8192, local_gb_used=80, hypervisor_type='QEMU',
+        hypervisor_version=2001000,
+        hypervisor_hostname='compute-%d' % num, free_ram_mb=122880,
+        free_disk_gb=1968, current_workload=0, running_vms=2,
+        cpu_info=jsonutils.dumps({'arch': 'x86_64', 'model': 'Haswell',
+                                  'vendor': 'Intel',
+                                  'topology': {'cores': 8, 'threads': 2,
+                                               'sockets': 2}}),
+        disk_available_least=1900, metrics='[]',
+        stats={'num_instances': '2', 'num_vm_active': '2',
+               'num_task_None': '2', 'io_workload': '0',
+               'num_proj_benchmark-project': '2'},
+        host_ip='192.168.%d.%d' % (num // 250 % 250, num % 250 + 1),
+        numa_topology=numa_topology,
+        supported_hv_specs=[
+            objects.HVSpec(arch='x86_64', hv_type='kvm', vm_mode='hvm'),
+            objects.HVSpec(arch='i686', hv_type='kvm', vm_mode='hvm')],
+        pci_device_pools=scheduler_benchmark._pci_device_pools(8))
+    node.obj_reset_changes(recursive=True)
+    return node
+
+
+def make_payloads(context, num_instances):
+    instances = [make_instance(context, num) for num in range(num_instances)]
+    instance_list = objects.InstanceList(context, objects=instances)
+    instance_list.obj_reset_changes()
+    return {'Instance': (make_instance(context, 0), 1),
+            'InstanceList': (instance_list, num_instances),
+            'ComputeNode': (make_compute_node(context, 0), 1)}
+
+
+def _measure(fn, arg, iterations):
+    start = time.time()
+    for num in range(iterations):
+        fn(arg)
+    return time.time() - start
+
+
+def run_benchmark(context, num_instances, iterations, payloads=PAYLOADS):
+    """Encode and decode each payload and return the measurements."""
+    serializer = objects_base.NovaObjectSerializer()
+    results = {}
+    for name, (payload, num_objects) in sorted(
+            make_payloads(context, num_instances).items()):
+        if name not in payloads:
+            continue
+        primitive = serializer.serialize_entity(context, payload)
+        # As received from the message bus
+        primitive = jsonutils.loads(jsonutils.dumps(primitive))
+        decoded = serializer.deserialize_entity(context, primitive)
+        assert decoded.obj_to_primitive() == payload.obj_to_primitive()
+
+        # The lists are measured fewer times, for the same number of objects
+        payload_iterations = max(iterations // num_objects, 1)
+        encode = _measure(
+            lambda obj: serializer.serialize_entity(context, obj),
+            payload, payload_iterations)
+        decode = _measure(
+            lambda prim: serializer.deserialize_entity(context, prim),
+            primitive, payload_iterations)
+        results[name] = {
+            'objects': num_objects,
+            'iterations': payload_iterations,
+            'bytes': len(jsonutils.dumps(primitive)),
+            'encode_per_second': payload_iterations / encode,
+            'decode_per_second': payload_iterations / decode,
+            'encode_objects_per_second': (
+                payload_iterations * num_objects / encode),
+            'decode_objects_per_second': (
+                payload_iterations * num_objects / decode)}
+    return results
+
+
+def print_results(results, out=sys.stdout):
+    print('%-14s %8s %10s %12s %12s %14s %14s' % (
+        'Payload', 'Objects', 'Bytes', 'Encode/s', 'Decode/s',
+        'Objs enc/s', 'Objs dec/s'), file=out)
+    for name, result in sorted(results.items()):
+        print('%-14s %8d %10d %12.1f %12.1f %14.1f %14.1f' % (
+            name, result['objects'], result['bytes'],
+            result['encode_per_second'], result['decode_per_second'],
+            result['encode_objects_per_second'],
+            result['decode_objects_per_second']), file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the encoding of the objects sent over RPC.')
+    parser.add_argument('--payload', action='append', choices=PAYLOADS,
+                        help='Payload to benchmark, all by default.')
+    parser.add_argument('--instances', type=int, default=200,
+                        help='Number of instances of the InstanceList.')
+    parser.add_argument('--iterations', type=int, default=2000,
+                        help='Number of objects encoded and decoded for '
+                             'each payload.')
+    parser.add_argument('--json', action='store_true',
+                        help='Print the results as JSON, to compare runs.')
+    args = parser.parse_args(argv)
+
+    objects.register_all()
+    context = nova_context.get_admin_context()
+    results = run_benchmark(context, args.instances, args.iterations,
+                            payloads=args.payload or PAYLOADS)
+    if args.json:
+        print(jsonutils.dumps(results, indent=2, sort_keys=True))
+    else:
+        print_results(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# Copyright (c) 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from oslo_utils import importutils
+import six
+
+from nova import context
+from nova import db
+from nova import test
+from nova.tests.functional import quota_benchmark
+
+
+class QuotaBenchmarkTestCase(test.TestCase):
+
+    def setUp(self):
+        super(QuotaBenchmarkTestCase, self).setUp()
+        self.context = context.get_admin_context()
+
+    def _run(self, driver_name, limit, hold=0.0, num_users=2):
+        project_id = 'project-%s' % driver_name
+        quota_benchmark.set_limits(self.context, project_id, limit)
+        driver = importutils.import_object(
+            quota_benchmark.DRIVERS[driver_name])
+        results = quota_benchmark.run_benchmark(
+            self.context, driver, project_id, 4, 5, num_users=num_users,
+            hold=hold)
+        self.assertEqual(20, results['reservations'])
+        self.assertEqual(0, results['errors'])
+        self.assertEqual(20, results['reserved'] + results['over_quota'])
+        self.assertTrue(results['max_held'] <= limit)
+        self.assertTrue(results['latency']['p50'] <=
+                        results['latency']['p99'])
+
+        # All the reservations were committed and released or rolled back
+        usages = db.quota_usage_get_all_by_project(self.context, project_id)
+        for resource in ('instances', 'cores', 'ram'):
+            self.assertEqual({'in_use': 0, 'reserved': 0}, usages[resource])
+
+        output = six.StringIO()
+        quota_benchmark.print_results({driver_name: results}, out=output)
+        self.assertIn(driver_name, output.getvalue())
+        return results
+
+    def test_db_quota_driver(self):
+        results = self._run('db', 100)
+        self.assertEqual(0, results['over_quota'])
+
+    def test_cas_quota_driver(self):
+        results = self._run('cas', 100)
+        self.assertEqual(0, results['over_quota'])
+
+    def test_cas_quota_driver_over_quota(self):
+        # The workers hold more reservations than the quota allows
+        results = self._run('cas', 2, hold=0.01)
+        self.assertTrue(results['over_quota'] > 0)
+
+    def test_cas_quota_driver_project_quota(self):
+        # Each worker is a different user of the project, only the project
+        # quota bounds the reservations
+        results = self._run('cas', 2, hold=0.01, num_users=4)
+        self.assertTrue(results['over_quota'] > 0)
+        self.assertEqual(2, results['max_held'])
@@ -0,0 +1,75 @@
+# Copyright (c) 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import random
+
+from oslo_utils import importutils
+import six
+
+from nova import context
+from nova import objects
+from nova import test
+from nova.tests.functional import scheduler_benchmark
+
+
+class SchedulerBenchmarkTestCase(test.TestCase):
+
+    def setUp(self):
+        super(SchedulerBenchmarkTestCase, self).setUp()
+        self.flags(service_down_time=86400)
+        self.context = context.get_admin_context()
+        scheduler_benchmark.build_fleet(self.context, 20, num_aggregates=4)
+
+    def test_build_fleet(self):
+        compute_nodes = objects.ComputeNodeList.get_all(self.context)
+        self.assertEqual(20, len(compute_nodes))
+        aggregates = objects.AggregateList.get_all(self.context)
+        self.assertEqual(4, len(aggregates))
+        self.assertEqual(20, sum(len(aggregate.hosts)
+                                 for aggregate in aggregates))
+
+    def test_make_request_without_pci(self):
+        rng = random.Random(0)
+        for num in range(50):
+            request_spec, filter_properties = (
+                scheduler_benchmark.make_request(rng, ['az0'],
+                                                 with_pci=False))
+            self.assertNotIn('pci_requests', filter_properties)
+            self.assertEqual(request_spec['num_instances'],
+                             len(request_spec['instance_uuids']))
+
+    def _run(self, driver_name):
+        driver = importutils.import_object(
+            scheduler_benchmark.DRIVERS[driver_name])
+        results = scheduler_benchmark.run_benchmark(self.context, driver, 10,
+                                                    warmup=2)
+        self.assertEqual(10, results['requests'])
+        self.assertTrue(results['placed'] > 0)
+        self.assertTrue(results['latency']['p50'] <=
+                        results['latency']['p99'])
+        self.assertEqual(10, results['timings']['phase']['total']['count'])
+
+        output = six.StringIO()
+        scheduler_benchmark.print_results(results, out=output)
+        self.assertIn('RamFilter', output.getvalue())
+
+    def test_filter_scheduler(self):
+        self._run('filter_scheduler')
+
+    def test_caching_scheduler(self):
+        self.flags(scheduler_default_filters=['RamFilter', 'ComputeFilter',
+                                              'NUMATopologyFilter',
+                                              'PciPassthroughFilter'])
+        self._run('caching_scheduler')
@@ -0,0 +1,38 @@
+# Copyright (c) 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import six
+
+from nova import context
+from nova import test
+from nova.tests.functional import serializer_benchmark
+
+
+class SerializerBenchmarkTestCase(test.NoDBTestCase):
+
+    def test_run_benchmark(self):
+        results = serializer_benchmark.run_benchmark(
+            context.get_admin_context(), 5, 10)
+        self.assertEqual(set(serializer_benchmark.PAYLOADS), set(results))
+        self.assertEqual(5, results['InstanceList']['objects'])
+        self.assertEqual(2, results['InstanceList']['iterations'])
+        self.assertEqual(10, results['Instance']['iterations'])
+        for result in results.values():
+            self.assertTrue(result['encode_per_second'] > 0)
+            self.assertTrue(result['decode_objects_per_second'] > 0)
+
+        output = six.StringIO()
+        serializer_benchmark.print_results(results, out=output)
+        self.assertIn('ComputeNode', output.getvalue())
@@ -224,6 +224,24 @@ class ComputeManagerUnitTestCase(test.NoDBTestCase):
         self.assertFalse(mock_save.called)
         self.assertEqual('True', instance.system_metadata['network_allocated'])
 
+    @mock.patch.object(network_api.API, 'allocate_for_instance')
+    def test_allocate_network_in_build_stage(self, mock_allocate):
+        stage = self.compute._build_stages['network']
+
+        def fake_allocate(*args, **kwargs):
+            self.assertEqual(1, stage.running)
+            return 'meow'
+
+        mock_allocate.side_effect = fake_allocate
+        instance = fake_instance.fake_instance_obj(
+                       self.context, expected_attrs=['system_metadata'])
+        res = self.compute._allocate_network_async(self.context, instance,
+                                                   None, None, None, False,
+                                                   None)
+        self.assertEqual('meow', res)
+        self.assertEqual(0, stage.running)
+        self.assertEqual(1, stage.completed)
+
     def test_allocate_network_fails(self):
         self.flags(network_allocate_retries=0)
 
@@ -340,6 +358,31 @@ class ComputeManagerUnitTestCase(test.NoDBTestCase):
         self.assertIsInstance(compute._build_semaphore,
                               compute_utils.UnlimitedSemaphore)
 
+    def test_build_stages(self):
+        self.flags(max_concurrent_image_prefetches=3,
+                   max_concurrent_network_allocations=20,
+                   max_concurrent_block_device_preps=0,
+                   max_concurrent_spawns=5)
+        stages = manager.ComputeManager()._build_stages
+        self.assertEqual(3, stages['image']._semaphore.balance)
+        self.assertEqual(20, stages['network']._semaphore.balance)
+        self.assertIsNone(stages['block_device']._semaphore)
+        self.assertEqual(5, stages['spawn']._semaphore.balance)
+
+    @mock.patch.object(manager, 'LOG')
+    def test_log_build_stage_stats(self, mock_log):
+        self.flags(max_concurrent_image_prefetches=0,
+                   max_concurrent_network_allocations=0,
+                   max_concurrent_block_device_preps=0,
+                   max_concurrent_spawns=5)
+        compute = manager.ComputeManager()
+        with compute._build_stages['spawn']:
+            compute._log_build_stage_stats(self.context)
+        self.assertEqual(1, mock_log.info.call_count)
+        self.assertEqual({'stage': 'spawn', 'limit': 5, 'waiting': 0,
+                          'max_waiting': 0, 'running': 1, 'completed': 0},
+                         mock_log.info.call_args[0][1])
+
     def test_init_host(self):
         our_host = self.compute.host
         inst = fake_instance.fake_db_instance(
@@ -1174,8 +1217,15 @@ class ComputeManagerUnitTestCase(test.NoDBTestCase):
         self.flags(instance_usage_audit=True)
         self.stubs.Set(compute_utils, 'has_audit_been_run',
                        lambda *a, **k: False)
+
+        @classmethod
+        def fake_count(*a, **k):
+            return len(instances)
+
         self.stubs.Set(objects.InstanceList,
                        'get_active_by_window_joined', fake_get)
+        self.stubs.Set(objects.InstanceList,
+                       'get_count_active_by_window', fake_count)
         self.stubs.Set(compute_utils, 'start_instance_usage_audit',
                        lambda *a, **k: None)
         self.stubs.Set(compute_utils, 'finish_instance_usage_audit',
@@ -1199,6 +1249,127 @@ class ComputeManagerUnitTestCase(test.NoDBTestCase):
                                         use_slave=True)
             mock_spawn.assert_called_once_with(mock.ANY, instance)
 
+    @mock.patch.object(objects.InstanceList, 'get_by_host')
+    @mock.patch('nova.virt.fake.FakeDriver.get_num_instances')
+    @mock.patch('nova.virt.fake.FakeDriver.get_power_states')
+    def test_sync_power_states_bulk(self, mock_power_states, mock_num,
+                                    mock_get):
+        def _instance(uuid, vm_state, power_state, task_state=None):
+            return objects.Instance(uuid=uuid, vm_state=vm_state,
+                                    power_state=power_state,
+                                    task_state=task_state)
+
+        running = _instance('running', vm_states.ACTIVE, power_state.RUNNING)
+        stopped = _instance('stopped', vm_states.ACTIVE, power_state.RUNNING)
+        missing = _instance('missing', vm_states.ACTIVE, power_state.RUNNING)
+        updated = _instance('updated', vm_states.STOPPED,
+                            power_state.RUNNING)
+        pending = _instance('pending', vm_states.ACTIVE, power_state.RUNNING,
+                            task_state=task_states.REBOOTING)
+        mock_get.return_value = [running, stopped, missing, updated, pending]
+        mock_power_states.return_value = {'running': power_state.RUNNING,
+                                          'stopped': power_state.SHUTDOWN,
+                                          'updated': power_state.SHUTDOWN,
+                                          'pending': power_state.SHUTDOWN}
+        with mock.patch.object(self.compute._sync_power_pool,
+                               'spawn_n') as mock_spawn:
+            self.compute._sync_power_states(mock.sentinel.context)
+        self.assertFalse(mock_num.called)
+        self.assertEqual([mock.call(mock.ANY, stopped),
+                          mock.call(mock.ANY, missing),
+                          mock.call(mock.ANY, updated)],
+                         mock_spawn.call_args_list)
+
+    def test_power_state_in_sync(self):
+        def _check(vm_state, db_power_state, vm_power_state):
+            instance = objects.Instance(vm_state=vm_state,
+                                        power_state=db_power_state)
+            return self.compute._power_state_in_sync(instance,
+                                                     vm_power_state)
+
+        self.assertTrue(_check(vm_states.ACTIVE, power_state.RUNNING,
+                               power_state.RUNNING))
+        self.assertFalse(_check(vm_states.ACTIVE, power_state.RUNNING,
+                                power_state.PAUSED))
+        self.assertFalse(_check(vm_states.ACTIVE, power_state.SHUTDOWN,
+                                power_state.SHUTDOWN))
+        self.assertTrue(_check(vm_states.STOPPED, power_state.SHUTDOWN,
+                               power_state.SHUTDOWN))
+        self.assertFalse(_check(vm_states.STOPPED, power_state.RUNNING,
+                                power_state.RUNNING))
+        self.assertTrue(_check(vm_states.PAUSED, power_state.PAUSED,
+                               power_state.PAUSED))
+        self.assertFalse(_check(vm_states.PAUSED, power_state.CRASHED,
+                                power_state.CRASHED))
+        self.assertTrue(_check(vm_states.DELETED, power_state.NOSTATE,
+                               power_state.NOSTATE))
+        self.assertFalse(_check(vm_states.SOFT_DELETED, power_state.RUNNING,
+                                power_state.RUNNING))
+        self.assertTrue(_check(vm_states.ERROR, power_state.RUNNING,
+                               power_state.RUNNING))
+
+    @mock.patch.object(objects.InstanceList, 'get_by_filters')
+    @mock.patch.object(objects.InstanceList, 'get_by_host')
+    def test_heal_instance_info_caches(self, mock_get_by_host,
+                                       mock_get_by_filters):
+        self.flags(heal_instance_info_cache_interval=10,
+                   heal_instance_info_cache_rate=0.25)
+
+        def _instance(uuid, host=self.compute.host, vm_state=vm_states.ACTIVE,
+                      task_state=None):
+            return objects.Instance(uuid=uuid, host=host, vm_state=vm_state,
+                                    task_state=task_state)
+
+        active = _instance('active')
+        migrated = _instance('migrated', host='other-host')
+        building = _instance('building', vm_state=vm_states.BUILDING)
+        deleting = _instance('deleting', task_state=task_states.DELETING)
+        last = _instance('last')
+        mock_get_by_host.return_value = [active, migrated, building,
+                                         deleting, last]
+        mock_get_by_filters.side_effect = [
+            [active, migrated], [building, deleting], [last]]
+
+        with mock.patch.object(self.compute.network_api,
+                               'heal_instance_info_caches',
+                               return_value=[]) as mock_heal:
+            self.compute._heal_instance_info_cache(self.context)
+            self.compute._heal_instance_info_cache(self.context)
+            self.compute._heal_instance_info_cache(self.context)
+            self.assertEqual([mock.call(self.context, [active]),
+                              mock.call(self.context, []),
+                              mock.call(self.context, [last])],
+                             mock_heal.call_args_list)
+
+        expected_attrs = ['system_metadata', 'info_cache']
+        self.assertEqual(
+            [mock.call(self.context,
+                       {'uuid': ['active', 'migrated'], 'deleted': False},
+                       expected_attrs=expected_attrs, use_slave=True),
+             mock.call(self.context,
+                       {'uuid': ['building', 'deleting'], 'deleted': False},
+                       expected_attrs=expected_attrs, use_slave=True),
+             mock.call(self.context, {'uuid': ['last'], 'deleted': False},
+                       expected_attrs=expected_attrs, use_slave=True)],
+            mock_get_by_filters.call_args_list)
+        self.assertEqual(1, mock_get_by_host.call_count)
+
+    @mock.patch.object(objects.InstanceList, 'get_by_filters')
+    @mock.patch.object(objects.InstanceList, 'get_by_host')
+    def test_heal_instance_info_caches_error(self, mock_get_by_host,
+                                             mock_get_by_filters):
+        self.flags(heal_instance_info_cache_rate=100)
+        instance = objects.Instance(uuid='uuid', host=self.compute.host,
+                                    vm_state=vm_states.ACTIVE,
+                                    task_state=None)
+        mock_get_by_host.return_value = [instance]
+        mock_get_by_filters.return_value = [instance]
+        with mock.patch.object(self.compute.network_api,
+                               'heal_instance_info_caches',
+                               side_effect=test.TestingException):
+            self.compute._heal_instance_info_cache(self.context)
+        self.assertEqual([], self.compute._instance_uuids_to_heal)
+
     def _get_sync_instance(self, power_state, vm_state, task_state=None,
                            shutdown_terminate=False):
         instance = objects.Instance()
@@ -3461,6 +3632,123 @@ class ComputeManagerBuildInstanceTestCase(test.NoDBTestCase):
                     mock_notify.call_count - 1]
             self.assertEqual(expected_call, create_end_call)
 
+    @mock.patch.object(conductor_rpcapi.ConductorAPI, 'instance_update')
+    def test_build_and_run_instance_in_build_stages(self,
+            mock_instance_update):
+        stages = self.compute._build_stages
+
+        def fake_prep_block_device(*args, **kwargs):
+            self.assertEqual(1, stages['block_device'].running)
+            return self.block_device_info
+
+        def fake_spawn(*args, **kwargs):
+            self.assertEqual(0, stages['block_device'].running)
+            self.assertEqual(1, stages['spawn'].running)
+
+        with mock.patch.object(self.compute, '_build_networks_for_instance',
+                               return_value=[]):
+            with mock.patch.object(self.compute, '_prep_block_device',
+                                   side_effect=fake_prep_block_device):
+                with mock.patch.object(self.compute.driver, 'spawn',
+                                       side_effect=fake_spawn) as mock_spawn:
+                    with mock.patch.object(self.instance, 'save'):
+                        self.compute._build_and_run_instance(self.context,
+                                self.instance, self.image,
+                                self.injected_files, self.admin_pass,
+                                self.requested_networks,
+                                self.security_groups,
+                                self.block_device_mapping, self.node,
+                                self.limits, self.filter_properties)
+        self.assertTrue(mock_spawn.called)
+        self.assertEqual(1, stages['block_device'].completed)
+        self.assertEqual(0, stages['spawn'].running)
+        self.assertEqual(1, stages['spawn'].completed)
+
+    @mock.patch.object(conductor_rpcapi.ConductorAPI, 'instance_update')
+    def _test_build_slot_released_before_spawn(self, spawn_limit,
+                                               mock_instance_update):
+        self.flags(max_concurrent_builds=1, max_concurrent_spawns=spawn_limit)
+        self.compute = importutils.import_object(CONF.compute_manager)
+        semaphore = self.compute._build_semaphore
+        balances = []
+
+        def fake_build_and_run_instance(*args, **kwargs):
+            balances.append(semaphore.balance)
+            self.compute._build_and_run_instance(self.context,
+                    self.instance, self.image, self.injected_files,
+                    self.admin_pass, self.requested_networks,
+                    self.security_groups, self.block_device_mapping,
+                    self.node, self.limits, self.filter_properties)
+
+        def fake_spawn(*args, **kwargs):
+            balances.append(semaphore.balance)
+
+        with contextlib.nested(
+            mock.patch('nova.utils.spawn_n',
+                       side_effect=lambda f, *a, **k: f(*a, **k)),
+            mock.patch.object(self.compute, '_do_build_and_run_instance',
+                              side_effect=fake_build_and_run_instance),
+            mock.patch.object(self.compute, '_build_resources'),
+            mock.patch.object(self.compute, '_get_resource_tracker'),
+            mock.patch.object(self.compute.driver, 'spawn',
+                              side_effect=fake_spawn),
+            mock.patch.object(self.instance, 'save')
+        ) as (mock_spawn_n, mock_dbari, mock_build_resources, mock_get_rt,
+              mock_driver_spawn, mock_save):
+            mock_build_resources.return_value.__enter__.return_value = {
+                'block_device_info': self.block_device_info,
+                'network_info': network_model.NetworkInfo()}
+            self.compute.build_and_run_instance(self.context, self.instance,
+                    self.image, mock.sentinel.request_spec,
+                    self.filter_properties)
+        self.assertEqual(1, semaphore.balance)
+        self.assertEqual({}, self.compute._build_slots)
+        return balances
+
+    def test_build_slot_released_before_limited_spawn(self):
+        self.assertEqual([0, 1],
+                         self._test_build_slot_released_before_spawn(5))
+
+    def test_build_slot_held_during_unlimited_spawn(self):
+        self.assertEqual([0, 0],
+                         self._test_build_slot_released_before_spawn(0))
+
+    def test_prefetch_image(self):
+        self.instance.image_ref = 'fake-image-ref'
+        stage = self.compute._build_stages['image']
+
+        def fake_prefetch_image(context, instance, image_meta):
+            self.assertEqual(1, stage.running)
+
+        with mock.patch.object(self.compute.driver, 'prefetch_image',
+                               side_effect=fake_prefetch_image) as mock_pf:
+            self.compute._prefetch_image(self.context, self.instance,
+                                         self.image, []).wait()
+        mock_pf.assert_called_once_with(self.context, self.instance,
+                                        self.image)
+        self.assertEqual(1, stage.completed)
+
+    def test_prefetch_image_failure_logged(self):
+        self.instance.image_ref = 'fake-image-ref'
+        with contextlib.nested(
+            mock.patch.object(self.compute.driver, 'prefetch_image',
+                              side_effect=test.TestingException()),
+            mock.patch.object(manager.LOG, 'warning')
+        ) as (mock_pf, mock_warning):
+            self.compute._prefetch_image(self.context, self.instance,
+                                         self.image, []).wait()
+        self.assertTrue(mock_warning.called)
+        self.assertEqual(0, self.compute._build_stages['image'].running)
+
+    def test_prefetch_image_booted_from_volume(self):
+        self.instance.image_ref = 'fake-image-ref'
+        bdms = [{'boot_index': 0, 'destination_type': 'volume'}]
+        with mock.patch.object(self.compute.driver,
+                               'prefetch_image') as mock_pf:
+            self.assertIsNone(self.compute._prefetch_image(self.context,
+                    self.instance, self.image, bdms))
+        self.assertFalse(mock_pf.called)
+
     @mock.patch.object(conductor_rpcapi.ConductorAPI, 'instance_update')
     def test_create_end_on_instance_delete(self, mock_instance_update):
 
@@ -20,6 +20,7 @@ import copy
 import string
 import uuid
 
+import eventlet
 import mock
 from oslo_config import cfg
 from oslo_serialization import jsonutils
@@ -686,3 +687,77 @@ class ComputeUtilsTestCase(test.NoDBTestCase):
             addresses = compute_utils.get_machine_ips()
             self.assertEqual([], addresses)
         mock_ifaddresses.assert_called_once_with(iface)
+
+
+class BuildStageTestCase(test.NoDBTestCase):
+    def test_limited(self):
+        stage = compute_utils.BuildStage('spawn', 1)
+        entered = []
+
+        def _build(num):
+            with stage:
+                entered.append(num)
+
+        with stage:
+            self.assertEqual(1, stage.running)
+            threads = [eventlet.spawn(_build, num) for num in range(2)]
+            eventlet.sleep(0)
+            self.assertEqual([], entered)
+            self.assertEqual(2, stage.waiting)
+            self.assertEqual(2, stage.max_waiting)
+        for thread in threads:
+            thread.wait()
+
+        self.assertEqual([0, 1], entered)
+        self.assertEqual(0, stage.waiting)
+        self.assertEqual(2, stage.max_waiting)
+        self.assertEqual(0, stage.running)
+        self.assertEqual(3, stage.completed)
+
+    def test_unlimited(self):
+        stage = compute_utils.BuildStage('spawn', 0)
+        with stage:
+            with stage:
+                self.assertEqual(2, stage.running)
+        self.assertEqual(0, stage.max_waiting)
+        self.assertEqual(2, stage.completed)
+
+    def test_exception(self):
+        stage = compute_utils.BuildStage('spawn', 1)
+
+        def _build():
+            with stage:
+                raise test.TestingException()
+
+        self.assertRaises(test.TestingException, _build)
+        self.assertEqual(0, stage.running)
+        with stage:
+            self.assertEqual(1, stage.running)
+
+    def test_get_stats(self):
+        stage = compute_utils.BuildStage('network', 2)
+        with stage:
+            self.assertEqual({'limit': 2, 'waiting': 0, 'max_waiting': 0,
+                              'running': 1, 'completed': 0},
+                             stage.get_stats())
+        self.assertEqual({'limit': 2, 'waiting': 0, 'max_waiting': 0,
+                          'running': 0, 'completed': 1}, stage.get_stats())
+        self.assertEqual(0, compute_utils.BuildStage('spawn', -1).limit)
+
+
+class BuildSlotTestCase(test.NoDBTestCase):
+    def test_release(self):
+        semaphore = eventlet.semaphore.Semaphore(1)
+        with compute_utils.BuildSlot(semaphore) as slot:
+            self.assertTrue(slot.held)
+            self.assertEqual(0, semaphore.balance)
+            slot.release()
+            self.assertFalse(slot.held)
+            self.assertEqual(1, semaphore.balance)
+            slot.release()
+            self.assertEqual(1, semaphore.balance)
+        self.assertEqual(1, semaphore.balance)
+
+    def test_unlimited(self):
+        with compute_utils.BuildSlot(compute_utils.UnlimitedSemaphore()):
+            pass
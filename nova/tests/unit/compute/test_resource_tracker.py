@@ -16,6 +16,7 @@
 """Tests for compute resource tracking."""
 
 import copy
+import datetime
 import six
 import uuid
 
@@ -63,6 +64,7 @@ FAKE_VIRT_STATS = {'virt_stat': 10}
 FAKE_VIRT_STATS_COERCED = {'virt_stat': '10'}
 FAKE_VIRT_STATS_JSON = jsonutils.dumps(FAKE_VIRT_STATS)
 RESOURCE_NAMES = ['vcpu']
+CREATED_AT = datetime.datetime(2015, 6, 1, 12, 0, 5)
 CONF = cfg.CONF
 
 
@@ -1373,6 +1375,178 @@ class TrackerPeriodicTestCase(BaseTrackerTestCase):
         _test()
 
 
+class IncrementalTrackerTestCase(BaseTrackerTestCase):
+
+    def _init_tracker(self):
+        self.flags(incremental_resource_tracking=True)
+        self.stubs.Set(objects.InstanceList, 'get_summary_by_host_and_node',
+                       self._fake_instance_get_summary_by_host_and_node)
+        self.stubs.Set(objects.MigrationList,
+                       'get_in_progress_summary_by_host_and_node',
+                       self._fake_migration_get_summary_by_host_and_node)
+        super(IncrementalTrackerTestCase, self)._init_tracker()
+
+    def _fake_instance_obj(self, **kwargs):
+        kwargs.setdefault('created_at', CREATED_AT)
+        return super(IncrementalTrackerTestCase, self)._fake_instance_obj(
+            **kwargs)
+
+    @staticmethod
+    def _fake_summary(rows):
+        changed_at = [(row['updated_at'] or row['created_at']).replace(
+                          microsecond=0) for row in rows]
+        return len(changed_at), max(changed_at) if changed_at else None
+
+    def _fake_instance_get_summary_by_host_and_node(self, context, host,
+                                                    node):
+        return self._fake_summary(
+            [instance for instance in self._instances.values()
+             if instance.host == host and
+             instance.vm_state != vm_states.DELETED])
+
+    def _fake_migration_get_summary_by_host_and_node(self, context, host,
+                                                     node):
+        return self._fake_summary(
+            [migration for migration in self._migrations.values()
+             if migration.status not in ('confirmed', 'reverted', 'error')])
+
+    def _claim(self, **kwargs):
+        instance = self._fake_instance_obj(**kwargs)
+        with mock.patch.object(instance, 'save'):
+            self.tracker.instance_claim(self.context, instance, self.limits)
+        return instance
+
+    def _audit(self):
+        with mock.patch.object(
+                self.tracker, '_update_usage_from_node',
+                wraps=self.tracker._update_usage_from_node) as mock_update:
+            self.tracker.update_available_resource(self.context)
+        return mock_update.called
+
+    @mock.patch('nova.objects.InstancePCIRequests.get_by_instance_uuid',
+                return_value=objects.InstancePCIRequests(requests=[]))
+    def test_audit_keeps_claimed_usage(self, mock_get):
+        self._claim(task_state=task_states.SCHEDULING)
+        self._assert(FAKE_VIRT_MEMORY_WITH_OVERHEAD, 'memory_mb_used')
+        self.assertEqual(1, self.tracker.stats.num_instances)
+
+        # the claimed instance is read back once
+        self.assertTrue(self._audit())
+        self.assertFalse(self._audit())
+        self._assert(FAKE_VIRT_MEMORY_WITH_OVERHEAD, 'memory_mb_used')
+        self._assert(FAKE_VIRT_LOCAL_GB, 'local_gb_used')
+        self._assert(FAKE_VIRT_VCPUS, 'vcpus_used')
+        self._assert(1, 'running_vms')
+        self._assert(1, 'current_workload')
+        self.assertEqual(1, self.tracker.stats.num_instances)
+
+    @mock.patch('nova.objects.InstancePCIRequests.get_by_instance_uuid',
+                return_value=objects.InstancePCIRequests(requests=[]))
+    def test_audit_keeps_dropped_usage(self, mock_get):
+        instance = self._claim(task_state=task_states.SCHEDULING)
+        self.assertTrue(self._audit())
+
+        instance.vm_state = vm_states.DELETED
+        self.tracker.update_usage(self.context, instance)
+        del self._instances[instance.uuid]
+
+        self.assertFalse(self._audit())
+        self._assert(0, 'memory_mb_used')
+        self._assert(0, 'running_vms')
+
+    @mock.patch('nova.objects.InstancePCIRequests.get_by_instance_uuid',
+                return_value=objects.InstancePCIRequests(requests=[]))
+    def test_audit_recomputes_changed_instance(self, mock_get):
+        instance = self._claim(task_state=task_states.SCHEDULING)
+        self.assertTrue(self._audit())
+        # not reported to the tracker
+        instance.task_state = None
+        instance.updated_at = CREATED_AT + datetime.timedelta(seconds=1)
+
+        self.assertTrue(self._audit())
+        self._assert(FAKE_VIRT_MEMORY_WITH_OVERHEAD, 'memory_mb_used')
+        self._assert(0, 'current_workload')
+        self.assertFalse(self._audit())
+
+    def test_audit_recomputes_new_instance(self):
+        self._fake_instance_obj(host=self.host)
+
+        with mock.patch.object(
+                objects.InstanceList, 'get_by_host_and_node',
+                wraps=objects.InstanceList.get_by_host_and_node) as mock_get:
+            self.assertTrue(self._audit())
+        # the instances are only listed to recompute the usage
+        self.assertEqual(1, mock_get.call_count)
+        self._assert(FAKE_VIRT_MEMORY_WITH_OVERHEAD, 'memory_mb_used')
+        self.assertFalse(self._audit())
+
+    def test_audit_reads_summaries(self):
+        self._fake_instance_obj(host=self.host)
+        self.assertTrue(self._audit())
+
+        with test.nested(
+                mock.patch.object(objects.InstanceList,
+                                  'get_by_host_and_node'),
+                mock.patch.object(objects.MigrationList,
+                                  'get_in_progress_by_host_and_node')
+        ) as (mock_get_instances, mock_get_migrations):
+            self.assertFalse(self._audit())
+        self.assertFalse(mock_get_instances.called)
+        self.assertFalse(mock_get_migrations.called)
+
+    def test_audit_recomputes_changed_resources(self):
+        self.tracker.driver.memory_mb += 1
+
+        self.assertTrue(self._audit())
+        self._assert(FAKE_VIRT_MEMORY_MB + 1, 'free_ram_mb')
+
+    def test_audit_recomputes_orphans(self):
+        usage = {'1-2-3-4-5': {'memory_mb': FAKE_VIRT_MEMORY_MB,
+                               'uuid': '1-2-3-4-5'}}
+        with mock.patch.object(self.tracker.driver, 'get_per_instance_usage',
+                               return_value=usage):
+            self.assertTrue(self._audit())
+        self._assert(FAKE_VIRT_MEMORY_WITH_OVERHEAD, 'memory_mb_used')
+
+    @mock.patch('nova.objects.InstancePCIRequests.get_by_instance_uuid',
+                return_value=objects.InstancePCIRequests(requests=[]))
+    def test_audit_keeps_move_claim(self, mock_get):
+        instance = self._fake_instance_obj()
+        self.tracker.resize_claim(self.context, instance,
+                                  self._fake_flavor_create(id=2), self.limits)
+        migration = self.tracker.tracked_migrations[instance.uuid][0]
+        self._migrations[migration.id] = migration
+
+        with test.nested(
+                mock.patch.object(objects.MigrationList,
+                                  'get_in_progress_by_host_and_node',
+                                  return_value=[migration]),
+                mock.patch.object(objects.Instance, 'get_by_uuid',
+                                  return_value=instance)):
+            # the claimed migration is read back once
+            self.assertTrue(self._audit())
+            self.assertFalse(self._audit())
+        self._assert(FAKE_VIRT_MEMORY_WITH_OVERHEAD, 'memory_mb_used')
+
+        # the migration is confirmed and no longer in progress
+        migration.status = 'confirmed'
+        self.tracker.drop_move_claim(self.context, instance)
+
+        self.assertFalse(self._audit())
+        self._assert(0, 'memory_mb_used')
+
+    def test_no_update_resource(self):
+        self.assertFalse(self._audit())
+        self.assertEqual(1, self.update_call_count)
+
+
+class IncrementalMoveClaimTestCase(MoveClaimTestCase):
+
+    def _init_tracker(self):
+        self.flags(incremental_resource_tracking=True)
+        super(IncrementalMoveClaimTestCase, self)._init_tracker()
+
+
 class StatsDictTestCase(BaseTrackerTestCase):
     """Test stats handling for a virt driver that provides
     stats as a dictionary.
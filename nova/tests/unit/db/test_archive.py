@@ -0,0 +1,118 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the archiving of the deleted rows in dependency order."""
+
+from oslo_db import exception as db_exc
+import sqlalchemy
+
+from nova.db.sqlalchemy import archive
+from nova.db.sqlalchemy import models
+from nova import test
+
+
+def _table(metadata, name, *foreign_keys):
+    columns = [sqlalchemy.Column('id', sqlalchemy.Integer, primary_key=True)]
+    for foreign_key in foreign_keys:
+        columns.append(sqlalchemy.Column(foreign_key.replace('.', '_'),
+                                         sqlalchemy.Integer,
+                                         sqlalchemy.ForeignKey(foreign_key)))
+    return sqlalchemy.Table(name, metadata, *columns)
+
+
+class GetLevelsTestCase(test.NoDBTestCase):
+
+    def test_get_levels(self):
+        metadata = sqlalchemy.MetaData()
+        tables = [
+            _table(metadata, 'parent'),
+            _table(metadata, 'child', 'parent.id'),
+            _table(metadata, 'grandchild', 'child.id', 'parent.id'),
+            _table(metadata, 'other'),
+            _table(metadata, 'tree', 'tree.id'),
+        ]
+        self.assertEqual([['grandchild', 'other', 'tree'], ['child'],
+                          ['parent']],
+                         archive.get_levels(tables))
+
+    def test_get_levels_models(self):
+        levels = archive.get_levels(models.BASE.metadata.tables.values())
+        position = {tablename: i for i, level in enumerate(levels)
+                    for tablename in level}
+        for child, parent in (('consoles', 'console_pools'),
+                              ('instance_actions_events', 'instance_actions'),
+                              ('instance_actions', 'instances'),
+                              ('instance_system_metadata', 'instances'),
+                              ('reservations', 'quota_usages')):
+            self.assertLess(position[child], position[parent])
+
+
+class ArchiverTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(ArchiverTestCase, self).setUp()
+        self.rows = {'a': 5, 'b': 3, 'c': 0}
+        self.calls = []
+
+    def _move_batch(self, tablename, max_rows):
+        self.calls.append((tablename, max_rows))
+        rows = min(self.rows[tablename], max_rows)
+        self.rows[tablename] -= rows
+        return rows
+
+    def test_run(self):
+        progress = []
+        archiver = archive.Archiver(
+            self._move_batch, batch_size=2,
+            progress=lambda tablename, p: progress.append(
+                (tablename, p['rows'], p['done'])))
+        state = archiver.run([['a', 'b'], ['c']])
+        self.assertTrue(state['complete'])
+        self.assertEqual({'a': 0, 'b': 0, 'c': 0}, self.rows)
+        self.assertEqual([('c', 0, True)], progress[-1:])
+        self.assertEqual([('a', 2, False), ('a', 4, False), ('a', 5, True)],
+                         [item for item in progress if item[0] == 'a'])
+        self.assertEqual(5, state['tables']['a']['rows'])
+
+    def test_run_max_rows(self):
+        archiver = archive.Archiver(self._move_batch, batch_size=2,
+                                    workers=1, max_rows=3)
+        state = archiver.run([['a', 'b'], ['c']])
+        self.assertFalse(state['complete'])
+        self.assertEqual([('a', 2), ('a', 1)], self.calls)
+        self.assertEqual(3, state['tables']['a']['rows'])
+        self.assertNotIn('c', state['tables'])
+
+    def test_run_resume(self):
+        state = {'tables': {'a': {'rows': 5, 'seconds': 1.0,
+                                  'done': True}}}
+        archiver = archive.Archiver(self._move_batch, batch_size=10,
+                                    state=state)
+        self.assertIs(state, archiver.run([['a', 'b'], ['c']]))
+        self.assertTrue(state['complete'])
+        self.assertEqual([('b', 10), ('c', 10)], self.calls)
+        self.assertEqual(5, self.rows['a'])
+
+    def test_run_error(self):
+        def move_batch(tablename, max_rows):
+            if tablename == 'a':
+                raise db_exc.DBError('fk')
+            return self._move_batch(tablename, max_rows)
+
+        archiver = archive.Archiver(move_batch, max_rows=10)
+        state = archiver.run([['a', 'b'], ['c']])
+        self.assertFalse(state['complete'])
+        self.assertEqual('fk', state['tables']['a']['error'])
+        self.assertFalse(state['tables']['a']['done'])
+        self.assertTrue(state['tables']['b']['done'])
+        # The failed batch doesn't count
+        self.assertEqual(7, archiver.remaining)
@@ -37,6 +37,7 @@ import six
 from six.moves import range
 from sqlalchemy import Column
 from sqlalchemy.dialects import sqlite
+from sqlalchemy import event
 from sqlalchemy.exc import OperationalError
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy import inspect
@@ -402,6 +403,87 @@ class UnsupportedDbRegexpTestCase(DbTestCase):
                     marker = insts[-1]['uuid']
                     self.assertEqual(correct[-1]['uuid'], marker)
 
+    def test_instance_get_all_by_filters_sort_keys_paginate_token(self,
+            mock_get_regexp):
+        '''Verifies pagination with continuation tokens.'''
+        insts = [self.create_instance_with_args(
+                     display_name='test%d' % (i % 2),
+                     vm_state=(vm_states.ACTIVE, vm_states.ERROR)[i % 3 % 2])
+                 for i in range(6)]
+        for sort_keys, sort_dirs in ((None, None),
+                                     (['display_name', 'vm_state'],
+                                      ['asc', 'desc'])):
+            correct_order = db.instance_get_all_by_filters_sort(
+                self.context, {}, sort_keys=sort_keys, sort_dirs=sort_dirs)
+            self.assertEqual(len(insts), len(correct_order))
+            marker = None
+            for i in range(0, len(insts), 4):
+                page = self._assert_equals_inst_order(
+                    correct_order[i:i + 4], {},
+                    sort_keys=sort_keys, sort_dirs=sort_dirs,
+                    limit=4, marker=marker)
+                marker = db.instance_pagination_marker(
+                    page[-1], sort_keys=sort_keys, sort_dirs=sort_dirs)
+            self._assert_equals_inst_order(
+                [], {}, sort_keys=sort_keys, sort_dirs=sort_dirs,
+                limit=4, marker=marker)
+
+    def test_instance_get_all_by_filters_sort_keys_paginate_nulls(self,
+            mock_get_regexp):
+        '''Verifies pagination across NULL sort values.'''
+        for i in range(6):
+            self.create_instance_with_args(
+                display_name=(None, 'test1', 'test2')[i % 3],
+                host=(None, 'host1')[i % 2])
+        for sort_dir in ('asc', 'desc'):
+            sort_keys = ['display_name', 'host']
+            sort_dirs = [sort_dir, 'asc']
+            correct_order = db.instance_get_all_by_filters_sort(
+                self.context, {}, sort_keys=sort_keys, sort_dirs=sort_dirs)
+            self.assertEqual(6, len(correct_order))
+            for use_token in (False, True):
+                marker = None
+                for i in range(0, 6, 2):
+                    page = self._assert_equals_inst_order(
+                        correct_order[i:i + 2], {},
+                        sort_keys=sort_keys, sort_dirs=sort_dirs,
+                        limit=2, marker=marker)
+                    if use_token:
+                        marker = db.instance_pagination_marker(
+                            page[-1], sort_keys=sort_keys,
+                            sort_dirs=sort_dirs)
+                    else:
+                        marker = page[-1]['uuid']
+                self._assert_equals_inst_order(
+                    [], {}, sort_keys=sort_keys, sort_dirs=sort_dirs,
+                    limit=2, marker=marker)
+
+    def test_instance_get_all_by_filters_sort_keys_paginate_bad_token(self,
+            mock_get_regexp):
+        inst = self.create_instance_with_args()
+        marker = db.instance_pagination_marker(inst)
+        # Tokens are only valid for the sort order they were built for
+        self.assertRaises(exception.MarkerNotFound,
+                          db.instance_get_all_by_filters_sort,
+                          self.context, {}, marker=marker,
+                          sort_keys=['display_name'])
+        self.assertRaises(exception.MarkerNotFound,
+                          db.instance_get_all_by_filters_sort,
+                          self.context, {}, marker=marker[:-4])
+
+    def test_instance_get_all_by_filters_sort_columns(self,
+            mock_get_regexp):
+        inst = self.create_instance_with_args(display_name='test1',
+                                              metadata={'foo': 'bar'})
+        result = db.instance_get_all_by_filters_sort(
+            self.context, {'display_name': 'test1'},
+            columns=['uuid', 'vm_state'])
+        self.assertEqual([{'id': inst['id'], 'uuid': inst['uuid'],
+                           'vm_state': inst['vm_state']}], result)
+        self.assertRaises(exception.InvalidInput,
+                          db.instance_get_all_by_filters_sort,
+                          self.context, {}, columns=['metadata'])
+
     def test_instance_get_deleted_by_filters_sort_keys_paginate(self,
             mock_get_regexp):
         '''Verifies sort order with pagination for deleted instances.'''
@@ -1095,6 +1177,32 @@ class SqlAlchemyDbApiTestCase(DbTestCase):
         self.assertIn('info_cache', result[0])
         self.assertEqual(network_info, result[0]['info_cache']['network_info'])
 
+    def test_instance_get_active_by_window_joined_paginate(self):
+        now = datetime.datetime(2013, 10, 10, 17, 16, 37, 156701)
+        ctxt = context.get_admin_context()
+        insts = [self.create_instance_with_args(launched_at=now)
+                 for i in range(5)]
+        self.create_instance_with_args(
+            launched_at=now, terminated_at=now - datetime.timedelta(1))
+        self.assertEqual(5, sqlalchemy_api.instance_count_active_by_window(
+            ctxt, begin=now))
+
+        uuids = []
+        marker = None
+        while True:
+            result = sqlalchemy_api.instance_get_active_by_window_joined(
+                ctxt, begin=now, limit=2, marker=marker)
+            uuids.extend(inst['uuid'] for inst in result)
+            if len(result) < 2:
+                break
+            marker = sqlalchemy_api.instance_pagination_marker(
+                result[-1], sort_keys=['id'], sort_dirs=['asc'])
+        self.assertEqual([inst['uuid'] for inst in insts], uuids)
+
+        self.assertRaises(exception.MarkerNotFound,
+                          sqlalchemy_api.instance_get_active_by_window_joined,
+                          ctxt, begin=now, marker=insts[0]['uuid'])
+
     @mock.patch('nova.db.sqlalchemy.api.instance_get_all_by_filters_sort')
     def test_instance_get_all_by_filters_calls_sort(self,
                                                     mock_get_all_filters_sort):
@@ -1293,6 +1401,18 @@ class MigrationTestCase(test.TestCase):
         self.assertEqual(3, len(migrations))
         self._assert_in_progress(migrations)
 
+    def test_in_progress_summary(self):
+        migrations = db.migration_get_in_progress_by_host_and_node(self.ctxt,
+                'host1', 'a')
+        self.assertEqual(
+            (3, max(migration['created_at'] for migration in migrations)),
+            db.migration_get_in_progress_summary_by_host_and_node(self.ctxt,
+                'host1', 'a'))
+        self.assertEqual(
+            (0, None),
+            db.migration_get_in_progress_summary_by_host_and_node(self.ctxt,
+                'host1', 'b'))
+
     def test_instance_join(self):
         migrations = db.migration_get_in_progress_by_host_and_node(self.ctxt,
                 'host2', 'b')
@@ -1458,6 +1578,25 @@ class InstanceSystemMetadataTestCase(test.TestCase):
                                                    self.instance['uuid'])
         self.assertEqual(metadata, {'new_key': 'new_value'})
 
+    def test_instance_system_metadata_update_many(self):
+        inserts = {'key%d' % i: 'value%d' % i for i in range(10)}
+        metadata = dict(inserts, key='value')
+        with mock.patch.object(sqlalchemy_api, '_instance_metadata_write',
+                               wraps=sqlalchemy_api._instance_metadata_write
+                               ) as mock_write:
+            db.instance_system_metadata_update(
+                self.ctxt, self.instance['uuid'], metadata, False)
+            db.instance_system_metadata_update(
+                self.ctxt, self.instance['uuid'],
+                dict(metadata, key0='changed', key1='changed'), False)
+        self.assertEqual(
+            [({}, inserts),
+             ({'key0': 'changed', 'key1': 'changed'}, {})],
+            [call[0][4:] for call in mock_write.call_args_list])
+        metadata.update(key0='changed', key1='changed')
+        self.assertEqual(metadata, db.instance_system_metadata_get(
+            self.ctxt, self.instance['uuid']))
+
     @test.testtools.skip("bug 1189462")
     def test_instance_system_metadata_update_nonexistent(self):
         self.assertRaises(exception.InstanceNotFound,
@@ -1534,6 +1673,196 @@ class ReservationTestCase(test.TestCase, ModelsObjectComparatorMixin):
                                             self.ctxt, 'project1', 'user1'))
 
 
+class QuotaReserveCasTestCase(test.TestCase):
+
+    """Tests for db.api.quota_reserve_cas and reservation_*_cas methods."""
+
+    def setUp(self):
+        super(QuotaReserveCasTestCase, self).setUp()
+        self.ctxt = context.get_admin_context()
+        self.reservations = _quota_reserve(self.ctxt, 'project1', 'user1')
+        self.quotas = {'resource0': 1, 'resource1': 2, 'fixed_ips': 4}
+        self.expire = timeutils.utcnow() + datetime.timedelta(days=1)
+
+    def _reserve(self, deltas, user_id='user1', until_refresh=0,
+                 project_quotas=None):
+        return db.quota_reserve_cas(self.ctxt, {},
+                                    project_quotas or self.quotas,
+                                    self.quotas, deltas, self.expire,
+                                    until_refresh, 0, project_id='project1',
+                                    user_id=user_id)
+
+    def _get_usages(self):
+        return db.quota_usage_get_all_by_project_and_user(
+            self.ctxt, 'project1', 'user1')
+
+    def test_quota_reserve_cas(self):
+        reservations = self._reserve({'resource0': 1, 'resource1': -1})
+        self.assertEqual(2, len(reservations))
+        deltas = {}
+        for reservation_uuid in reservations:
+            reservation = _reservation_get(self.ctxt, reservation_uuid)
+            self.assertEqual('project1', reservation.project_id)
+            self.assertEqual('user1', reservation.user_id)
+            deltas[reservation.resource] = reservation.delta
+        self.assertEqual({'resource0': 1, 'resource1': -1}, deltas)
+        expected = {'project_id': 'project1', 'user_id': 'user1',
+                    'resource0': {'reserved': 1, 'in_use': 0},
+                    'resource1': {'reserved': 1, 'in_use': 1},
+                    'fixed_ips': {'reserved': 2, 'in_use': 2}}
+        self.assertEqual(expected, self._get_usages())
+
+    def test_quota_reserve_cas_over_quota(self):
+        self.assertRaises(exception.OverQuota, self._reserve,
+                          {'resource0': 1, 'resource1': 1})
+        expected = {'project_id': 'project1', 'user_id': 'user1',
+                    'resource0': {'reserved': 0, 'in_use': 0},
+                    'resource1': {'reserved': 1, 'in_use': 1},
+                    'fixed_ips': {'reserved': 2, 'in_use': 2}}
+        self.assertEqual(expected, self._get_usages())
+
+    @mock.patch.object(sqlalchemy_api, '_calculate_overquota',
+                       return_value=[])
+    def test_quota_reserve_cas_concurrent(self, mock_overquota):
+        # The quotas were used since the usages were read, the update of
+        # the usage of resource0 must be rolled back.
+        project_quotas = {'resource0': 10, 'resource1': 10, 'fixed_ips': 10}
+        self.assertRaises(exception.OverQuota, self._reserve,
+                          {'resource0': 1, 'resource1': 1},
+                          project_quotas=project_quotas)
+        self.assertEqual(6, mock_overquota.call_count)
+        self.assertEqual({'reserved': 0, 'in_use': 0},
+                         self._get_usages()['resource0'])
+
+    @mock.patch.object(sqlalchemy_api, '_calculate_overquota',
+                       return_value=[])
+    def test_quota_reserve_cas_project_quota(self, mock_overquota):
+        sqlalchemy_api._quota_usage_create('project1', 'user2', 'resource0',
+                                           1, 0, None)
+        self.assertRaises(exception.OverQuota, self._reserve,
+                          {'resource0': 1})
+        self.assertEqual({'reserved': 0, 'in_use': 0},
+                         self._get_usages()['resource0'])
+
+    def _reserve_concurrent_users(self, user_quotas):
+        # user2 reserves the last resource0 of the project after user1 read
+        # the usages, the project quota must still hold.
+        sqlalchemy_api._quota_usage_create('project1', 'user2', 'resource0',
+                                           0, 0, None)
+        project_quotas = {'resource0': 1, 'resource1': 2, 'fixed_ips': 4}
+        get_usages = sqlalchemy_api._get_project_user_quota_usages
+        user2_reservations = []
+
+        def fake_get_usages(context, session, project_id, user_id, **kwargs):
+            usages = get_usages(context, session, project_id, user_id,
+                                **kwargs)
+            if user_id == 'user1' and not user2_reservations:
+                user2_reservations.extend(db.quota_reserve_cas(
+                    self.ctxt, {}, project_quotas, user_quotas,
+                    {'resource0': 1}, self.expire, 0, 0,
+                    project_id='project1', user_id='user2'))
+            return usages
+
+        with mock.patch.object(sqlalchemy_api,
+                               '_get_project_user_quota_usages',
+                               side_effect=fake_get_usages):
+            self.assertRaises(exception.OverQuota, db.quota_reserve_cas,
+                              self.ctxt, {}, project_quotas, user_quotas,
+                              {'resource0': 1}, self.expire, 0, 0,
+                              project_id='project1', user_id='user1')
+        self.assertEqual(1, len(user2_reservations))
+
+        usages = db.quota_usage_get_all_by_project(self.ctxt, 'project1')
+        self.assertEqual({'reserved': 1, 'in_use': 0}, usages['resource0'])
+
+    def test_quota_reserve_cas_project_quota_concurrent_users(self):
+        self._reserve_concurrent_users(
+            {'resource0': 1, 'resource1': 2, 'fixed_ips': 4})
+
+    def test_quota_reserve_cas_project_quota_unlimited_users(self):
+        self._reserve_concurrent_users(
+            {'resource0': -1, 'resource1': -1, 'fixed_ips': -1})
+
+    def _get_project_totals(self):
+        session = sqlalchemy_api.get_session()
+        return {row.resource: row.total
+                for row in session.query(models.ProjectQuotaUsage).
+                filter_by(project_id='project1')}
+
+    def test_project_quota_usages(self):
+        self.quotas['fixed_ips'] = 10
+        reservations = self._reserve({'resource0': 1, 'resource1': -1})
+        self.assertEqual({'resource0': 1}, self._get_project_totals())
+
+        # The totals aren't locked once known
+        with mock.patch.object(query.Query, 'with_lockmode') as mock_lock:
+            more = self._reserve({'fixed_ips': 1})
+        self.assertFalse(mock_lock.called)
+        self.assertEqual({'resource0': 1, 'fixed_ips': 5},
+                         self._get_project_totals())
+
+        db.reservation_rollback_cas(self.ctxt, more)
+        db.reservation_commit_cas(self.ctxt, reservations)
+        self.assertEqual({'resource0': 1, 'fixed_ips': 4},
+                         self._get_project_totals())
+
+        # The totals changed without a compare-and-swap are counted again
+        db.quota_usage_update(self.ctxt, 'project1', 'user1', 'resource0',
+                              in_use=0)
+        self.assertEqual({'resource0': None, 'fixed_ips': None},
+                         self._get_project_totals())
+        self._reserve({'resource0': 1})
+        self.assertEqual({'resource0': 1, 'fixed_ips': None},
+                         self._get_project_totals())
+        self.assertRaises(exception.OverQuota, self._reserve,
+                          {'resource0': 1}, until_refresh=5)
+        self.assertEqual({'resource0': None, 'fixed_ips': None},
+                         self._get_project_totals())
+
+        db.quota_destroy_all_by_project(self.ctxt, 'project1')
+        self.assertEqual({}, self._get_project_totals())
+
+    @mock.patch.object(sqlalchemy_api, 'quota_reserve')
+    def test_quota_reserve_cas_refresh(self, mock_reserve):
+        result = self._reserve({'resource0': 1}, until_refresh=5)
+        self.assertEqual(mock_reserve.return_value, result)
+        mock_reserve.reset_mock()
+        result = self._reserve({'resource0': 1}, user_id='user2')
+        self.assertEqual(mock_reserve.return_value, result)
+        mock_reserve.assert_called_once_with(
+            self.ctxt, {}, self.quotas, self.quotas, {'resource0': 1},
+            self.expire, 0, 0, project_id='project1', user_id='user2')
+
+    def test_reservation_commit_cas(self):
+        reservations = self._reserve({'resource0': 1, 'resource1': -1})
+        db.reservation_commit_cas(self.ctxt, reservations + self.reservations)
+        for reservation_uuid in reservations + self.reservations:
+            self.assertRaises(exception.ReservationNotFound,
+                              _reservation_get, self.ctxt, reservation_uuid)
+        expected = {'project_id': 'project1', 'user_id': 'user1',
+                    'resource0': {'reserved': 0, 'in_use': 1},
+                    'resource1': {'reserved': 0, 'in_use': 1},
+                    'fixed_ips': {'reserved': 0, 'in_use': 4}}
+        self.assertEqual(expected, self._get_usages())
+
+        # The reservations are only applied once
+        db.reservation_commit_cas(self.ctxt, reservations)
+        self.assertEqual(expected, self._get_usages())
+
+    def test_reservation_rollback_cas(self):
+        reservations = self._reserve({'resource0': 1, 'resource1': -1})
+        db.reservation_rollback_cas(self.ctxt,
+                                    reservations + self.reservations)
+        for reservation_uuid in reservations + self.reservations:
+            self.assertRaises(exception.ReservationNotFound,
+                              _reservation_get, self.ctxt, reservation_uuid)
+        expected = {'project_id': 'project1', 'user_id': 'user1',
+                    'resource0': {'reserved': 0, 'in_use': 0},
+                    'resource1': {'reserved': 0, 'in_use': 1},
+                    'fixed_ips': {'reserved': 0, 'in_use': 2}}
+        self.assertEqual(expected, self._get_usages())
+
+
 class SecurityGroupRuleTestCase(test.TestCase, ModelsObjectComparatorMixin):
     def setUp(self):
         super(SecurityGroupRuleTestCase, self).setUp()
@@ -2423,6 +2752,22 @@ class InstanceTestCase(test.TestCase, ModelsObjectComparatorMixin):
         self.assertEqual('bar', result[0]['system_metadata'][0]['value'])
         self.assertEqual(instance['uuid'], result[0]['extra']['instance_uuid'])
 
+    def test_instance_get_summary_by_host_and_node(self):
+        self.assertEqual(
+            (0, None),
+            db.instance_get_summary_by_host_and_node(self.ctxt, 'h1', 'n1'))
+        instance = self.create_instance_with_args()
+        self.create_instance_with_args()
+        self.create_instance_with_args(vm_state=vm_states.DELETED)
+        self.create_instance_with_args(node='n2')
+        db.instance_destroy(self.ctxt,
+                            self.create_instance_with_args()['uuid'])
+        instance = db.instance_update(self.ctxt, instance['uuid'],
+                                      {'task_state': 'foo'})
+        self.assertEqual(
+            (2, instance['updated_at']),
+            db.instance_get_summary_by_host_and_node(self.ctxt, 'h1', 'n1'))
+
     @mock.patch('nova.db.sqlalchemy.api._instances_fill_metadata')
     @mock.patch('nova.db.sqlalchemy.api._instance_get_all_query')
     def test_instance_get_all_by_host_and_node_fills_manually(self,
@@ -2627,6 +2972,51 @@ class InstanceTestCase(test.TestCase, ModelsObjectComparatorMixin):
         self.assertNotIn('gigawatts',
             db.instance_system_metadata_get(self.ctxt, instance.uuid))
 
+    def _count_writes(self, tablename):
+        writes = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters,
+                                  context, executemany):
+            if (tablename in statement and
+                    statement.split()[0] in ('INSERT', 'UPDATE', 'DELETE')):
+                writes.append(statement.split()[0])
+
+        engine = sqlalchemy_api.get_engine()
+        event.listen(engine, 'before_cursor_execute',
+                                before_cursor_execute)
+        self.addCleanup(event.remove, engine,
+                        'before_cursor_execute', before_cursor_execute)
+        return writes
+
+    def _test_instance_update_metadata_bulk(self, metadata_type, tablename,
+                                            delete):
+        meta = {'key%d' % i: 'value%d' % i for i in range(20)}
+        instance = self.create_instance_with_args(**{metadata_type: meta})
+        for i in range(10):
+            meta['key%d' % i] = 'changed%d' % i
+        for i in range(15, 20):
+            del meta['key%d' % i]
+        for i in range(20, 25):
+            meta['key%d' % i] = 'value%d' % i
+        writes = self._count_writes(tablename)
+        inst = db.instance_update(self.ctxt, instance['uuid'],
+                                  {metadata_type: dict(meta)})
+        self.assertEqual(meta, utils.metadata_to_dict(inst[metadata_type]))
+        self.assertEqual(sorted([delete, 'INSERT', 'UPDATE']),
+                         sorted(writes))
+        inst = db.instance_get_by_uuid(self.ctxt, instance['uuid'])
+        self.assertEqual(meta, utils.metadata_to_dict(inst[metadata_type],
+                                                      filter_deleted=True))
+
+    def test_instance_update_system_metadata_bulk(self):
+        self._test_instance_update_metadata_bulk(
+            'system_metadata', 'instance_system_metadata', 'DELETE')
+
+    def test_instance_update_metadata_bulk(self):
+        # The deleted keys are soft deleted
+        self._test_instance_update_metadata_bulk(
+            'metadata', 'instance_metadata', 'UPDATE')
+
     def test_security_group_in_use(self):
         db.instance_create(self.ctxt, dict(host='foo'))
 
@@ -6741,6 +7131,31 @@ class ComputeNodeTestCase(test.TestCase, ModelsObjectComparatorMixin):
             # Clean up the service
             db.service_destroy(self.ctxt, service['id'])
 
+    def test_compute_node_get_all_changed_since(self):
+        created_at = self.item['created_at']
+        before = created_at - datetime.timedelta(seconds=1)
+        after = created_at + datetime.timedelta(seconds=1)
+        nodes = db.compute_node_get_all_changed_since(self.ctxt, before)
+        self.assertEqual([self.item['id']], [node['id'] for node in nodes])
+        nodes = db.compute_node_get_all_changed_since(self.ctxt, after)
+        self.assertEqual([], nodes)
+
+        timeutils.set_time_override(after + datetime.timedelta(seconds=1))
+        self.addCleanup(timeutils.clear_time_override)
+        db.compute_node_update(self.ctxt, self.item['id'], {'vcpus': 4})
+        nodes = db.compute_node_get_all_changed_since(self.ctxt, after)
+        self.assertEqual(1, len(nodes))
+        self.assertEqual(4, nodes[0]['vcpus'])
+
+    def test_compute_node_get_all_changed_since_deleted(self):
+        since = self.item['created_at'] + datetime.timedelta(seconds=1)
+        timeutils.set_time_override(since + datetime.timedelta(seconds=1))
+        self.addCleanup(timeutils.clear_time_override)
+        db.compute_node_delete(self.ctxt, self.item['id'])
+        nodes = db.compute_node_get_all_changed_since(self.ctxt, since)
+        self.assertEqual(1, len(nodes))
+        self.assertTrue(nodes[0]['deleted'])
+
     def test_compute_node_get_all_mult_compute_nodes_one_service_entry(self):
         service_data = self.service_dict.copy()
         service_data['host'] = 'host2'
@@ -7667,6 +8082,11 @@ class ArchiveTestCase(test.TestCase):
             if table_name == 'tags':
                 continue
 
+            # NOTE: migration 298 introduced project_quota_usages, whose rows
+            # are never soft deleted
+            if table_name == 'project_quota_usages':
+                continue
+
             if table_name.startswith("shadow_"):
                 self.assertIn(table_name[7:], metadata.tables)
                 continue
@@ -7922,6 +8342,87 @@ class ArchiveTestCase(test.TestCase):
             'shadow_instance_id_mappings'
         )
 
+    def test_archive_deleted_rows_no_max_rows(self):
+        for uuidstr in self.uuidstrs:
+            self.conn.execute(self.instance_id_mappings.insert().values(
+                uuid=uuidstr, deleted=1))
+        self.assertEqual(6, db.archive_deleted_rows(self.context))
+        self._assert_shadow_tables_empty_except(
+            'shadow_instance_id_mappings')
+
+    def _create_deleted_consoles(self, count):
+        result = self.conn.execute(
+            self.console_pools.insert().values(deleted=1))
+        pool_id = result.inserted_primary_key[0]
+        for i in range(count):
+            self.conn.execute(
+                self.consoles.insert().values(deleted=1, pool_id=pool_id))
+
+    def test_archive_deleted_rows_parallel(self):
+        self._create_deleted_consoles(3)
+        progress = []
+        state = db.archive_deleted_rows_parallel(
+            self.context, batch_size=2,
+            progress=lambda tablename, p: progress.append(
+                (tablename, p['rows'])))
+        # consoles references console_pools, it is archived before
+        self.assertEqual([('consoles', 2), ('consoles', 3),
+                          ('console_pools', 1)],
+                         [item for item in progress if item[1]])
+        self.assertTrue(state['complete'])
+        self.assertEqual({'rows': 3, 'done': True},
+                         {key: state['tables']['consoles'][key]
+                          for key in ('rows', 'done')})
+        self._assert_shadow_tables_empty_except(
+            'shadow_console_pools', 'shadow_consoles')
+
+    def test_archive_deleted_rows_parallel_resume(self):
+        self._create_deleted_consoles(3)
+        state = db.archive_deleted_rows_parallel(self.context, batch_size=2,
+                                                 max_rows=2)
+        self.assertFalse(state['complete'])
+        self.assertEqual(2, state['tables']['consoles']['rows'])
+        self.assertFalse(state['tables']['consoles']['done'])
+        self.assertNotIn('console_pools', state['tables'])
+
+        state = db.archive_deleted_rows_parallel(self.context, batch_size=2,
+                                                 state=state)
+        self.assertTrue(state['complete'])
+        self.assertEqual(3, state['tables']['consoles']['rows'])
+        self.assertEqual(1, state['tables']['console_pools']['rows'])
+
+    def test_archive_deleted_rows_parallel_error(self):
+        def fake_archive(tablename, max_rows):
+            if tablename == 'consoles':
+                raise db_exc.DBReferenceError('consoles', 'fk', 'pool_id',
+                                              'console_pools')
+            return 0
+
+        with mock.patch.object(sqlalchemy_api,
+                               '_archive_deleted_rows_for_table',
+                               side_effect=fake_archive):
+            state = db.archive_deleted_rows_parallel(self.context)
+        self.assertFalse(state['complete'])
+        self.assertFalse(state['tables']['consoles']['done'])
+        self.assertIn('error', state['tables']['consoles'])
+        self.assertTrue(state['tables']['console_pools']['done'])
+
+    def test_purge_shadow_tables(self):
+        now = timeutils.utcnow()
+        for days, uuidstr in enumerate(self.uuidstrs):
+            self.conn.execute(self.shadow_instance_id_mappings.insert().values(
+                uuid=uuidstr, deleted=1,
+                deleted_at=now - datetime.timedelta(days=days)))
+        state = db.purge_shadow_tables(
+            self.context, now - datetime.timedelta(days=2, hours=12),
+            batch_size=2)
+        self.assertTrue(state['complete'])
+        self.assertEqual(3, state['tables']['instance_id_mappings']['rows'])
+        rows = self.conn.execute(
+            sql.select([self.shadow_instance_id_mappings.c.uuid])).fetchall()
+        self.assertEqual(sorted(self.uuidstrs[:3]),
+                         sorted(row[0] for row in rows))
+
 
 class InstanceGroupDBApiTestCase(test.TestCase, ModelsObjectComparatorMixin):
     def setUp(self):
@@ -758,6 +758,32 @@ class NovaMigrationsCheckers(test_migrations.ModelsMigrationsSync,
             fkey_names = [fkey['name'] for fkey in fkeys]
             self.assertIn('fk_instance_extra_instance_uuid', fkey_names)
 
+    def _pre_upgrade_297(self, engine):
+        self.assertIndexNotExists(
+            engine, 'instances',
+            'instances_project_id_deleted_created_at_id_idx')
+        self.assertIndexNotExists(engine, 'instances',
+                                  'instances_deleted_created_at_id_idx')
+
+    def _check_297(self, engine, data):
+        self.assertIndexMembers(
+            engine, 'instances',
+            'instances_project_id_deleted_created_at_id_idx',
+            ['project_id', 'deleted', 'created_at', 'id'])
+        self.assertIndexMembers(engine, 'instances',
+                                'instances_deleted_created_at_id_idx',
+                                ['deleted', 'created_at', 'id'])
+
+    def _check_298(self, engine, data):
+        self.assertColumnExists(engine, 'project_quota_usages', 'project_id')
+        self.assertColumnExists(engine, 'project_quota_usages', 'resource')
+        self.assertColumnExists(engine, 'project_quota_usages', 'total')
+        self.assertColumnExists(engine, 'project_quota_usages', 'generation')
+        self.assertTableNotExists(engine, 'shadow_project_quota_usages')
+        table = oslodbutils.get_table(engine, 'project_quota_usages')
+        self.assertTrue(table.c.total.nullable)
+        self.assertFalse(table.c.generation.nullable)
+
 
 class TestNovaMigrationsSQLite(NovaMigrationsCheckers,
                                test_base.DbTestCase,
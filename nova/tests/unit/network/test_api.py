@@ -549,6 +549,19 @@ class ApiTestCase(test.TestCase):
                                             update_cells=False)
         self.assertEqual(fake_result, result)
 
+    @mock.patch.object(api.API, 'get_instance_nw_info')
+    def test_heal_instance_info_caches(self, mock_get):
+        instances = [fake_instance.fake_instance_obj(self.context)
+                     for i in range(3)]
+        mock_get.side_effect = [None, exception.InstanceNotFound(
+            instance_id=instances[1].uuid), test.TestingException]
+        self.assertEqual(instances[:1],
+                         self.network_api.heal_instance_info_caches(
+                             self.context, instances))
+        self.assertEqual([mock.call(self.context, instance)
+                          for instance in instances],
+                         mock_get.call_args_list)
+
 
 @mock.patch('nova.network.api.API')
 @mock.patch('nova.db.instance_info_cache_update', return_value=fake_info_cache)
@@ -3417,6 +3417,158 @@ class TestNeutronv2WithMock(test.TestCase):
                                             mock_client)
 
 
+class TestNeutronv2HealInstanceInfoCaches(test.NoDBTestCase):
+    """Used to test the batched healing of the network info caches."""
+
+    def setUp(self):
+        super(TestNeutronv2HealInstanceInfoCaches, self).setUp()
+        self.api = neutronapi.API()
+        self.context = context.RequestContext('fake-user', 'fake-project')
+        self.networks = [{'id': 'net-1', 'name': 'private',
+                          'tenant_id': 'fake-project', 'shared': False}]
+        self.subnets = [{'id': 'subnet-1', 'network_id': 'net-1',
+                         'cidr': '10.0.0.0/24', 'gateway_ip': '10.0.0.1',
+                         'dns_nameservers': ['8.8.8.8'],
+                         'host_routes': []}]
+        self.ports = [
+            {'id': 'dhcp-port', 'network_id': 'net-1',
+             'device_id': 'dhcp', 'device_owner': 'network:dhcp',
+             'tenant_id': 'fake-project',
+             'fixed_ips': [{'subnet_id': 'subnet-1',
+                            'ip_address': '10.0.0.2'}]}]
+        self.floatingips = []
+        self.instances = []
+        for i in range(3):
+            instance = objects.Instance(
+                uuid=str(uuid.uuid4()), project_id='fake-project',
+                info_cache=objects.InstanceInfoCache(
+                    network_info=model.NetworkInfo()))
+            self.instances.append(instance)
+            address = '10.0.0.%d' % (i + 3)
+            self.ports.append(
+                {'id': 'port-%d' % i, 'network_id': 'net-1',
+                 'device_id': instance.uuid, 'device_owner': 'compute:nova',
+                 'tenant_id': 'fake-project', 'admin_state_up': True,
+                 'status': 'ACTIVE', 'mac_address': 'de:ad:be:ef:00:0%d' % i,
+                 'binding:vif_type': model.VIF_TYPE_OVS,
+                 'binding:vif_details': {},
+                 'fixed_ips': [{'subnet_id': 'subnet-1',
+                                'ip_address': address}]})
+            self.floatingips.append(
+                {'port_id': 'port-%d' % i, 'fixed_ip_address': address,
+                 'floating_ip_address': '172.24.4.%d' % (i + 3)})
+
+        self.client = mock.Mock()
+        self.client.list_ports.side_effect = (
+            lambda **kw: {'ports': self._filter(self.ports, kw)})
+        self.client.list_subnets.side_effect = (
+            lambda **kw: {'subnets': self._filter(self.subnets, kw)})
+        self.client.list_networks.side_effect = (
+            lambda **kw: {'networks': self._filter(self.networks, kw)})
+        self.client.list_floatingips.side_effect = (
+            lambda **kw: {'floatingips': self._filter(self.floatingips, kw)})
+        self.stub_out_client = mock.patch.object(
+            neutronapi, 'get_client', return_value=self.client)
+        self.stub_out_client.start()
+        self.addCleanup(self.stub_out_client.stop)
+
+    @staticmethod
+    def _filter(items, search_opts):
+        def _match(item):
+            for key, value in search_opts.items():
+                if not isinstance(value, list):
+                    value = [value]
+                if item.get(key) not in value:
+                    return False
+            return True
+        return [item for item in items if _match(item)]
+
+    def _cache_nw_info(self):
+        # Build the caches like the refresh of each instance does, the cache
+        # is reloaded from its JSON like when read from the database
+        for instance in self.instances:
+            nw_info = self.api._get_instance_nw_info(self.context, instance)
+            instance.info_cache.network_info = model.NetworkInfo.hydrate(
+                jsonutils.loads(nw_info.json()))
+        self.client.reset_mock()
+
+    @mock.patch.object(neutronapi.API, 'get_instance_nw_info')
+    def test_heal_instance_info_caches_unchanged(self, mock_get):
+        self._cache_nw_info()
+        vif = self.instances[0].info_cache.network_info[0]
+        self.assertEqual('private', vif['network']['label'])
+        self.assertEqual('10.0.0.2',
+                         vif['network']['subnets'][0]['meta']['dhcp_server'])
+        self.assertEqual(['172.24.4.3'],
+                         [ip['address'] for ip in vif.floating_ips()])
+        self.assertEqual([], self.api.heal_instance_info_caches(
+            self.context, self.instances))
+        self.assertFalse(mock_get.called)
+        self.assertEqual(2, self.client.list_ports.call_count)
+        self.assertEqual(1, self.client.list_floatingips.call_count)
+        self.assertEqual(1, self.client.list_subnets.call_count)
+        self.assertEqual(1, self.client.list_networks.call_count)
+
+    @mock.patch.object(neutronapi.API, 'get_instance_nw_info')
+    def test_heal_instance_info_caches_changed(self, mock_get):
+        self._cache_nw_info()
+        self.floatingips.pop(1)
+        self.ports[3]['status'] = 'DOWN'
+        self.assertEqual(self.instances[1:],
+                         self.api.heal_instance_info_caches(
+                             self.context, self.instances))
+        self.assertEqual([mock.call(self.context, self.instances[1]),
+                          mock.call(self.context, self.instances[2])],
+                         mock_get.call_args_list)
+
+    @mock.patch.object(neutronapi.API, 'get_instance_nw_info')
+    def test_heal_instance_info_caches_port_removed(self, mock_get):
+        self._cache_nw_info()
+        self.ports.pop(1)
+        self.assertEqual(self.instances[:1],
+                         self.api.heal_instance_info_caches(
+                             self.context, self.instances))
+
+    @mock.patch.object(neutronapi.API, 'get_instance_nw_info')
+    def test_heal_instance_info_caches_empty_cache(self, mock_get):
+        self.ports = self.ports[:2]
+        self.instances[2].info_cache = None
+        self.assertEqual(self.instances[:1],
+                         self.api.heal_instance_info_caches(
+                             self.context, self.instances))
+        mock_get.assert_called_once_with(self.context, self.instances[0])
+
+    @mock.patch.object(neutronapi.API, 'get_instance_nw_info')
+    def test_heal_instance_info_caches_no_l3(self, mock_get):
+        self.client.list_floatingips.side_effect = (
+            exceptions.NeutronClientException(status_code=404))
+        self._cache_nw_info()
+        self.assertEqual([], self.api.heal_instance_info_caches(
+            self.context, self.instances))
+
+    @mock.patch.object(neutronapi, 'HEAL_INSTANCES_PER_REQUEST', 2)
+    @mock.patch.object(neutronapi.API, 'get_instance_nw_info')
+    def test_heal_instance_info_caches_requests(self, mock_get):
+        self._cache_nw_info()
+        self.assertEqual([], self.api.heal_instance_info_caches(
+            self.context, self.instances))
+        self.assertEqual(
+            [[instance.uuid for instance in self.instances[:2]],
+             [self.instances[2].uuid]],
+            [kwargs['device_id']
+             for args, kwargs in self.client.list_ports.call_args_list
+             if 'device_id' in kwargs])
+
+    @mock.patch.object(neutronapi.API, 'get_instance_nw_info')
+    def test_heal_instance_info_caches_refresh_fails(self, mock_get):
+        self.floatingips = []
+        mock_get.side_effect = [exception.InstanceNotFound(instance_id='x'),
+                                test.TestingException, None]
+        self.assertEqual(self.instances[2:],
+                         self.api.heal_instance_info_caches(
+                             self.context, self.instances))
+
+
 class TestNeutronv2ModuleMethods(test.NoDBTestCase):
 
     def test_gather_port_ids_and_networks_wrong_params(self):
@@ -13,6 +13,8 @@
 #    under the License.
 
 import copy
+
+import iso8601
 import mock
 import netaddr
 from oslo_serialization import jsonutils
@@ -380,6 +382,19 @@ class _TestComputeNodeObject(object):
                          subs=self.subs(),
                          comparators=self.comparators())
 
+    def test_get_all_changed_since(self):
+        since = NOW.replace(tzinfo=iso8601.iso8601.Utc())
+        self.mox.StubOutWithMock(db, 'compute_node_get_all_changed_since')
+        db.compute_node_get_all_changed_since(self.context, since).AndReturn(
+            [fake_compute_node])
+        self.mox.ReplayAll()
+        computes = compute_node.ComputeNodeList.get_all_changed_since(
+            self.context, since)
+        self.assertEqual(1, len(computes))
+        self.compare_obj(computes[0], fake_compute_node,
+                         subs=self.subs(),
+                         comparators=self.comparators())
+
     def test_get_by_hypervisor(self):
         self.mox.StubOutWithMock(db, 'compute_node_search_by_hypervisor')
         db.compute_node_search_by_hypervisor(self.context, 'hyper').AndReturn(
@@ -14,6 +14,7 @@
 
 import datetime
 
+import fixtures
 import iso8601
 import mock
 from mox3 import mox
@@ -34,6 +35,7 @@ from nova.objects import instance
 from nova.objects import instance_info_cache
 from nova.objects import pci_device
 from nova.objects import security_group
+from nova import pagination
 from nova import test
 from nova.tests.unit.api.openstack import fakes
 from nova.tests.unit import fake_instance
@@ -1568,11 +1570,14 @@ class _TestInstanceListObject(object):
 
         def fake_instance_get_active_by_window_joined(context, begin, end,
                                                       project_id, host,
-                                                      columns_to_join):
+                                                      columns_to_join,
+                                                      limit, marker):
             # make sure begin is tz-aware
             self.assertIsNotNone(begin.utcoffset())
             self.assertIsNone(end)
             self.assertEqual(['metadata'], columns_to_join)
+            self.assertIsNone(limit)
+            self.assertIsNone(marker)
             return fakes
 
         with mock.patch.object(db, 'instance_get_active_by_window_joined',
@@ -1584,6 +1589,160 @@ class _TestInstanceListObject(object):
             self.assertIsInstance(obj, instance.Instance)
             self.assertEqual(obj.uuid, fake['uuid'])
 
+    @mock.patch.object(db, 'instance_get_all_by_filters_sort')
+    def test_get_projected_by_filters(self, mock_get):
+        mock_get.return_value = [
+            {'id': 1, 'uuid': 'fake-uuid1', 'host': 'host1', 'deleted': 0},
+            {'id': 2, 'uuid': 'fake-uuid2', 'host': 'host1', 'deleted': 2}]
+
+        inst_list = instance.InstanceList.get_projected_by_filters(
+            self.context, {'foo': 'bar'}, ['uuid', 'deleted'])
+
+        mock_get.assert_called_once_with(
+            self.context, {'foo': 'bar'}, limit=None, marker=None,
+            use_slave=False, sort_keys=None, sort_dirs=None,
+            columns=['uuid', 'deleted'])
+        self.assertEqual(['fake-uuid1', 'fake-uuid2'],
+                         [inst.uuid for inst in inst_list])
+        self.assertEqual([False, True], [inst.deleted for inst in inst_list])
+        for inst in inst_list:
+            self.assertFalse(inst.obj_attr_is_set('host'))
+            self.assertEqual(set(), inst.obj_what_changed())
+
+    def test_get_projected_by_filters_optional_field(self):
+        self.assertRaises(exception.ObjectActionError,
+                          instance.InstanceList.get_projected_by_filters,
+                          self.context, {}, ['uuid', 'metadata'])
+
+    @mock.patch.object(instance.InstanceList, 'get_projected_by_filters')
+    def test_get_projected_by_host(self, mock_get):
+        instance.InstanceList.get_projected_by_host(self.context, 'host1',
+                                                    ['uuid'])
+        mock_get.assert_called_once_with(
+            self.context,
+            {'host': 'host1', 'deleted': False, 'soft_deleted': True},
+            ['uuid'], use_slave=False)
+
+    @mock.patch.object(db, 'instance_get_all_by_filters_sort')
+    def test_iter_by_filters(self, mock_get):
+        fakes = [self.fake_instance(1), self.fake_instance(2),
+                 self.fake_instance(3)]
+        mock_get.side_effect = [fakes[:2], fakes[2:]]
+
+        insts = list(instance.InstanceList.iter_by_filters(
+            self.context, {'foo': 'bar'}, expected_attrs=['metadata'],
+            chunk_size=2))
+
+        self.assertEqual([fake['uuid'] for fake in fakes],
+                         [inst.uuid for inst in insts])
+        marker = pagination.get_marker(fakes[1], sort_keys=['id'],
+                                       sort_dirs=['asc'])
+        mock_get.assert_has_calls([
+            mock.call(self.context, {'foo': 'bar'}, limit=2, marker=marker,
+                      columns_to_join=['metadata'], use_slave=False,
+                      sort_keys=['id'], sort_dirs=['asc'])
+            for marker in (None, marker)])
+
+    @mock.patch.object(db, 'instance_get_active_by_window_joined')
+    def test_iter_active_by_window_joined(self, mock_get):
+        fakes = [self.fake_instance(1), self.fake_instance(2)]
+        mock_get.side_effect = [fakes, []]
+        dt = timeutils.utcnow()
+
+        insts = list(instance.InstanceList.iter_active_by_window_joined(
+            self.context, dt, host='host', chunk_size=2))
+
+        self.assertEqual([fake['uuid'] for fake in fakes],
+                         [inst.uuid for inst in insts])
+        self.assertEqual(2, mock_get.call_count)
+        marker = pagination.get_marker(fakes[1], sort_keys=['id'],
+                                       sort_dirs=['asc'])
+        self.assertEqual({'columns_to_join': None, 'limit': 2,
+                          'marker': marker},
+                         mock_get.call_args[1])
+
+    def _get_chunks(self, num_instances, chunk_size):
+        created_at = datetime.datetime(2015, 6, 1,
+                                       tzinfo=iso8601.iso8601.Utc())
+        insts = [objects.Instance(
+                     id=i, uuid='fake-uuid-%d' % i,
+                     created_at=created_at + datetime.timedelta(seconds=i))
+                 for i in range(1, num_instances + 1)]
+        return insts, [
+            objects.InstanceList(objects=insts[i:i + chunk_size])
+            for i in range(0, num_instances + 1, chunk_size)]
+
+    def test_iter_without_db(self):
+        # The services calling through the conductor have no database
+        # access, the iterators must not need one between the chunks.
+        class NoDB(object):
+            def __getattr__(self, attr):
+                raise exception.DBNotAllowed('nova-compute')
+
+        self.useFixture(fixtures.MonkeyPatch('nova.db.api.IMPL', NoDB()))
+        dt = timeutils.utcnow()
+        for method, name, args, sort_keys, sort_dirs in (
+                ('iter_by_filters', 'get_by_filters', ({},), None, None),
+                ('iter_by_filters', 'get_by_filters', ({},),
+                 ['created_at'], ['desc']),
+                ('iter_active_by_window_joined',
+                 'get_active_by_window_joined', (dt,), ['id'], ['asc'])):
+            insts, chunks = self._get_chunks(5, 2)
+            kwargs = {}
+            if method == 'iter_by_filters' and sort_keys:
+                kwargs = {'sort_keys': sort_keys, 'sort_dirs': sort_dirs}
+            with mock.patch.object(instance.InstanceList, name,
+                                   side_effect=chunks) as mock_get:
+                result = list(getattr(instance.InstanceList, method)(
+                    self.context, *args, chunk_size=2, **kwargs))
+            self.assertEqual(insts, result)
+            self.assertEqual(3, mock_get.call_count)
+            markers = [call[1]['marker'] for call in mock_get.call_args_list]
+            self.assertIsNone(markers[0])
+            processed_keys, processed_dirs = pagination.process_sort_params(
+                sort_keys or ['id'], sort_dirs or ['asc'])
+            for marker, inst in zip(markers[1:], (insts[1], insts[3])):
+                values = pagination.decode_marker(marker, processed_keys,
+                                                  processed_dirs)
+                self.assertEqual(inst.id, values[processed_keys.index('id')])
+                self.assertEqual(
+                    timeutils.normalize_time(inst.created_at),
+                    values[processed_keys.index('created_at')])
+
+    @mock.patch.object(db, 'instance_count_active_by_window')
+    def test_get_count_active_by_window(self, mock_count):
+        mock_count.return_value = 3
+        dt = timeutils.utcnow()
+
+        count = instance.InstanceList.get_count_active_by_window(
+            self.context, dt, host='host')
+
+        self.assertEqual(3, count)
+        mock_count.assert_called_once_with(self.context, mock.ANY, None,
+                                           None, 'host', use_slave=False)
+        self.assertIsNotNone(mock_count.call_args[0][1].utcoffset())
+
+    @mock.patch.object(db, 'instance_get_summary_by_host_and_node')
+    def test_get_summary_by_host_and_node(self, mock_summary):
+        changed_at = datetime.datetime(2015, 6, 1, 12, 0, 5)
+        mock_summary.return_value = (2, changed_at)
+
+        count, result = instance.InstanceList.get_summary_by_host_and_node(
+            self.context, 'host', 'node')
+
+        self.assertEqual(2, count)
+        self.assertEqual(changed_at, timeutils.normalize_time(result))
+        self.assertIsNotNone(result.utcoffset())
+        mock_summary.assert_called_once_with(self.context, 'host', 'node')
+
+    @mock.patch.object(db, 'instance_get_summary_by_host_and_node')
+    def test_get_summary_by_host_and_node_empty(self, mock_summary):
+        mock_summary.return_value = (0, None)
+        self.assertEqual(
+            (0, None),
+            instance.InstanceList.get_summary_by_host_and_node(
+                self.context, 'host', 'node'))
+
     def test_with_fault(self):
         fake_insts = [
             fake_instance.fake_db_instance(uuid='fake-uuid', host='host'),
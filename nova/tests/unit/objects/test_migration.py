@@ -12,6 +12,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import datetime
+
 import mock
 from oslo_utils import timeutils
 
@@ -163,6 +165,19 @@ class _TestMigrationObject(object):
         for index, db_migration in enumerate(db_migrations):
             self.compare_obj(migrations[index], db_migration)
 
+    @mock.patch.object(db,
+                       'migration_get_in_progress_summary_by_host_and_node')
+    def test_get_in_progress_summary_by_host_and_node(self, mock_summary):
+        ctxt = context.get_admin_context()
+        changed_at = datetime.datetime(2015, 6, 1, 12, 0, 5)
+        mock_summary.return_value = (2, changed_at)
+        count, result = (
+            migration.MigrationList.get_in_progress_summary_by_host_and_node(
+                ctxt, 'host', 'node'))
+        self.assertEqual(2, count)
+        self.assertEqual(changed_at, timeutils.normalize_time(result))
+        mock_summary.assert_called_once_with(ctxt, 'host', 'node')
+
     def test_get_by_filters(self):
         ctxt = context.get_admin_context()
         fake_migration = fake_db_migration()
@@ -19,6 +19,7 @@ import datetime
 import hashlib
 import inspect
 import os
+import pickle
 import pprint
 
 import fixtures
@@ -482,6 +483,39 @@ class _TestObject(object):
         obj2.obj_reset_changes()
         self.assertEqual(obj2.obj_what_changed(), set())
 
+    def _primitive(self, **data):
+        return {'nova_object.name': 'MyObj',
+                'nova_object.namespace': 'nova',
+                'nova_object.version': '1.6',
+                'nova_object.data': data}
+
+    def test_obj_from_primitive_coerces(self):
+        primitive = self._primitive(
+            foo='123', bar=42, created_at='2015-06-01T12:00:05Z',
+            updated_at='2015-06-01T12:00:05.123456+02:00')
+        obj = MyObj.obj_from_primitive(primitive)
+        self.assertEqual(123, obj.foo)
+        self.assertIsInstance(obj.bar, six.text_type)
+        self.assertEqual(u'42', obj.bar)
+        self.assertEqual(timeutils.parse_isotime('2015-06-01T12:00:05Z'),
+                         obj.created_at)
+        self.assertIsNotNone(obj.created_at.tzinfo)
+        self.assertEqual(
+            timeutils.parse_isotime('2015-06-01T12:00:05.123456+02:00'),
+            obj.updated_at)
+        self.assertEqual(set(), obj.obj_what_changed())
+
+    def test_obj_from_primitive_skips_redundant_coercion(self):
+        primitive = self._primitive(foo=123, bar=u'text', rel_objects=None)
+        with mock.patch.object(MyObj.fields['foo'], 'coerce') as mock_foo:
+            with mock.patch.object(MyObj.fields['bar'], 'coerce') as mock_bar:
+                obj = MyObj.obj_from_primitive(primitive)
+        self.assertFalse(mock_foo.called)
+        self.assertFalse(mock_bar.called)
+        self.assertEqual(123, obj.foo)
+        self.assertEqual(u'text', obj.bar)
+        self.assertIsNone(obj.rel_objects)
+
     def test_obj_class_from_name(self):
         obj = base.NovaObject.obj_class_from_name('MyObj', '1.5')
         self.assertEqual('1.5', obj.VERSION)
@@ -862,6 +896,48 @@ class _TestObject(object):
         obj = MyObj()
         self.assertRaises(AttributeError, delattr, obj, 'bar')
 
+    def test_field_storage(self):
+        obj = MyObj(foo=1, bar='bar')
+        # The values are not stored as attributes
+        self.assertEqual({}, obj.__dict__)
+        self.assertEqual(1, getattr(obj, base.get_attrname('foo')))
+        self.assertTrue(hasattr(obj, base.get_attrname('bar')))
+        self.assertFalse(hasattr(obj, base.get_attrname('missing')))
+        self.assertFalse(hasattr(obj, base.get_attrname('unknown')))
+
+    def test_changed_fields(self):
+        obj = MyObj(foo=1, bar='bar')
+        self.assertEqual(set(['foo', 'bar']), set(obj._changed_fields))
+        self.assertIn('foo', obj._changed_fields)
+        self.assertNotIn('missing', obj._changed_fields)
+        self.assertEqual(2, len(obj._changed_fields))
+        obj._changed_fields.discard('foo')
+        obj._changed_fields.add('missing')
+        self.assertEqual(set(['bar', 'missing']), obj.obj_what_changed())
+        obj._changed_fields = set(['foo'])
+        self.assertEqual(set(['foo']), obj.obj_what_changed())
+        obj.obj_reset_changes()
+        self.assertEqual(0, len(obj._changed_fields))
+
+    def test_copy(self):
+        obj = MyObj(foo=1)
+        obj.obj_reset_changes()
+        obj_copy = copy.copy(obj)
+        obj_copy.foo = 2
+        self.assertEqual(1, obj.foo)
+        self.assertEqual(set(), obj.obj_what_changed())
+        self.assertEqual(set(['foo']), obj_copy.obj_what_changed())
+
+    def test_pickle(self):
+        obj = MyObj(foo=1, bar='text')
+        obj.obj_reset_changes(['foo'])
+        for protocol in (0, 2):
+            obj2 = pickle.loads(pickle.dumps(obj, protocol=protocol))
+            self.assertEqual(1, obj2.foo)
+            self.assertEqual('text', obj2.bar)
+            self.assertFalse(obj2.obj_attr_is_set('missing'))
+            self.assertEqual(set(['bar']), obj2.obj_what_changed())
+
 
 class TestObject(_LocalTest, _TestObject):
     def test_set_defaults(self):
@@ -1063,7 +1139,7 @@ object_data = {
     'BlockDeviceMappingList': '1.14-ff39c726181b66dfdf54d7c73abf5ffb',
     'CellMapping': '1.0-7f1a7e85a22bbb7559fc730ab658b9bd',
     'ComputeNode': '1.11-71784d2e6f2814ab467d4e0f69286843',
-    'ComputeNodeList': '1.11-8d269636229e8a39fef1c3514f77d0c0',
+    'ComputeNodeList': '1.12-cac525053a0bb1cc7c4507a415885a09',
     'DNSDomain': '1.0-7b0b2dab778454b6a7b6c66afe163a1a',
     'DNSDomainList': '1.0-f876961b1a6afe400b49cf940671db86',
     'EC2Ids': '1.0-474ee1094c7ec16f8ce657595d8c49d9',
@@ -1091,7 +1167,7 @@ object_data = {
     'InstanceGroup': '1.9-a413a4ec0ff391e3ef0faa4e3e2a96d0',
     'InstanceGroupList': '1.6-1e383df73d9bd224714df83d9a9983bb',
     'InstanceInfoCache': '1.5-cd8b96fefe0fc8d4d337243ba0bf0e1e',
-    'InstanceList': '1.19-f5832b018649c2bd8bb00df788df0aad',
+    'InstanceList': '1.22-114495a898ab993bedc4c9525d3fad89',
     'InstanceMapping': '1.0-47ef26034dfcbea78427565d9177fe50',
     'InstanceMappingList': '1.0-b7b108f6a56bd100c20a3ebd5f3801a1',
     'InstanceNUMACell': '1.2-535ef30e0de2d6a0d26a71bd58ecafc4',
@@ -1101,7 +1177,7 @@ object_data = {
     'KeyPair': '1.3-bfaa2a8b148cdf11e0c72435d9dd097a',
     'KeyPairList': '1.2-60f984184dc5a8eba6e34e20cbabef04',
     'Migration': '1.2-8784125bedcea0a9227318511904e853',
-    'MigrationList': '1.2-5e79c0693d7ebe4e9ac03b5db11ab243',
+    'MigrationList': '1.3-ab50afd4f3b7af08421e02e5e308a480',
     'MonitorMetric': '1.0-4fe7f3fb1777567883ac842120ec5800',
     'MonitorMetricList': '1.0-1b54e51ad0fc1f3a8878f5010e7e16dc',
     'NUMACell': '1.2-74fc993ac5c83005e76e34e8487f1c05',
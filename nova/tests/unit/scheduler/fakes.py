@@ -18,6 +18,7 @@ Fakes For Scheduler tests.
 
 import six
 
+from nova import filters
 from nova import objects
 from nova.scheduler import host_manager
 
@@ -92,3 +93,12 @@ class FakeHostState(host_manager.HostState):
             self.instances = {}
         for (key, val) in six.iteritems(attribute_dict):
             setattr(self, key, val)
+
+
+def filter_columns(filter_obj, host_states, filter_properties):
+    """Return the hosts passing a filter evaluated over their attributes."""
+    columns = {}
+    filters.BaseFilterHandler._load_columns(columns, host_states,
+                                            filter_obj.column_attrs)
+    mask = filter_obj.filter_columns(host_states, columns, filter_properties)
+    return [host for host, passes in zip(host_states, mask) if passes]
@@ -12,6 +12,8 @@
 
 import mock
 
+from nova import objects
+from nova.scheduler import aggregate_index
 from nova.scheduler.filters import aggregate_multitenancy_isolation as ami
 from nova import test
 from nova.tests.unit.scheduler import fakes
@@ -72,3 +74,27 @@ class TestAggregateMultitenancyIsolationFilter(test.NoDBTestCase):
                                      'project_id': 'my_tenantid'}}}
         host = fakes.FakeHostState('host1', 'compute', {})
         self.assertTrue(self.filt_cls.host_passes(host, filter_properties))
+
+    def test_aggregate_multi_tenancy_isolation_with_index(self, agg_mock):
+        index = aggregate_index.AggregateMetadataIndex()
+        index.update(objects.Aggregate(
+            id=1, hosts=['host1'],
+            metadata={'filter_tenant_id': 'my_tenantid, mytenantid2'}))
+        filter_properties = {'context': mock.sentinel.ctx,
+                             'request_spec': {
+                                 'instance_properties': {
+                                     'project_id': 'my_tenantid'}}}
+        hosts = [fakes.FakeHostState('host%d' % i, 'compute',
+                                     {'aggregate_index': index})
+                 for i in (1, 2)]
+        self.assertTrue(self.filt_cls.host_passes(hosts[0],
+                                                  filter_properties))
+        self.assertTrue(self.filt_cls.host_passes(hosts[1],
+                                                  filter_properties))
+        filter_properties['request_spec']['instance_properties'][
+            'project_id'] = 'other_tenantid'
+        self.assertFalse(self.filt_cls.host_passes(hosts[0],
+                                                   filter_properties))
+        self.assertTrue(self.filt_cls.host_passes(hosts[1],
+                                                  filter_properties))
+        self.assertFalse(agg_mock.called)
@@ -33,6 +33,28 @@ class TestCoreFilter(test.NoDBTestCase):
         host = fakes.FakeHostState('host1', 'node1', {})
         self.assertTrue(self.filt_cls.host_passes(host, filter_properties))
 
+    def test_core_filter_columns(self):
+        self.filt_cls = core_filter.CoreFilter()
+        filter_properties = {'instance_type': {'vcpus': 1}}
+        self.flags(cpu_allocation_ratio=2)
+        host1 = fakes.FakeHostState('host1', 'node1',
+                {'vcpus_total': 4, 'vcpus_used': 7})
+        host2 = fakes.FakeHostState('host2', 'node2',
+                {'vcpus_total': 4, 'vcpus_used': 8})
+        host3 = fakes.FakeHostState('host3', 'node3', {})
+        self.assertEqual([host1, host3], fakes.filter_columns(
+            self.filt_cls, [host1, host2, host3], filter_properties))
+        self.assertEqual(8, host1.limits['vcpu'])
+        self.assertEqual(8, host2.limits['vcpu'])
+        self.assertNotIn('vcpu', host3.limits)
+
+    def test_core_filter_columns_no_instance_type(self):
+        self.filt_cls = core_filter.CoreFilter()
+        host = fakes.FakeHostState('host1', 'node1',
+                {'vcpus_total': 4, 'vcpus_used': 8})
+        self.assertEqual([host], fakes.filter_columns(
+            self.filt_cls, [host], {}))
+
     def test_core_filter_fails(self):
         self.filt_cls = core_filter.CoreFilter()
         filter_properties = {'instance_type': {'vcpus': 1}}
@@ -45,6 +45,18 @@ class TestRamFilter(test.NoDBTestCase):
         self.assertTrue(self.filt_cls.host_passes(host, filter_properties))
         self.assertEqual(2048 * 2.0, host.limits['memory_mb'])
 
+    def test_ram_filter_columns(self):
+        self.flags(ram_allocation_ratio=2.0)
+        filter_properties = {'instance_type': {'memory_mb': 1024}}
+        host1 = fakes.FakeHostState('host1', 'node1',
+                {'free_ram_mb': -1024, 'total_usable_ram_mb': 2048})
+        host2 = fakes.FakeHostState('host2', 'node2',
+                {'free_ram_mb': -1025, 'total_usable_ram_mb': 2048})
+        self.assertEqual([host1], fakes.filter_columns(
+            self.filt_cls, [host1, host2], filter_properties))
+        self.assertEqual(2048 * 2.0, host1.limits['memory_mb'])
+        self.assertNotIn('memory_mb', host2.limits)
+
 
 @mock.patch('nova.scheduler.filters.utils.aggregate_values_from_key')
 class TestAggregateRamFilter(test.NoDBTestCase):
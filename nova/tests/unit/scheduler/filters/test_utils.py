@@ -14,6 +14,7 @@
 #    under the License.
 
 from nova import objects
+from nova.scheduler import aggregate_index
 from nova.scheduler.filters import utils
 from nova import test
 from nova.tests.unit.scheduler import fakes
@@ -88,6 +89,22 @@ class TestUtils(test.NoDBTestCase):
 
         self.assertEqual({}, metadata)
 
+    def test_aggregate_metadata_get_by_host_with_index(self):
+        index = aggregate_index.AggregateMetadataIndex()
+        for aggregate in _AGGREGATE_FIXTURES:
+            index.update(aggregate)
+        host_state = fakes.FakeHostState(
+            'fake-host', 'node', {'aggregates': [],
+                                  'aggregate_index': index})
+
+        metadata = utils.aggregate_metadata_get_by_host(host_state)
+
+        self.assertEqual({'k1': set(['1', '3', '7', '6']),
+                          'k2': set(['9', '8', '2', '4'])}, metadata)
+        self.assertEqual({'k1': set(['1', '3', '7', '6'])},
+                         utils.aggregate_metadata_get_by_host(host_state,
+                                                              'k1'))
+
     def test_validate_num_values(self):
         f = utils.validate_num_values
 
@@ -0,0 +1,97 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests For the aggregate metadata index.
+"""
+
+from nova import objects
+from nova.scheduler import aggregate_index
+from nova import test
+
+
+class AggregateMetadataIndexTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(AggregateMetadataIndexTestCase, self).setUp()
+        self.index = aggregate_index.AggregateMetadataIndex()
+        self.agg1 = objects.Aggregate(id=1, hosts=['host1', 'host2'],
+                                      metadata={'availability_zone': 'az1',
+                                                'k1': '1, 2'})
+        self.agg2 = objects.Aggregate(id=2, hosts=['host2', 'host3'],
+                                      metadata={'k1': '2,3'})
+        self.index.update(self.agg1)
+        self.index.update(self.agg2)
+
+    def test_get_hosts(self):
+        self.assertEqual(set(['host1', 'host2']),
+                         self.index.get_hosts('availability_zone'))
+        self.assertEqual(set(['host1', 'host2']),
+                         self.index.get_hosts('availability_zone', 'az1'))
+        self.assertEqual(set(), self.index.get_hosts('availability_zone',
+                                                     'az2'))
+        self.assertEqual(set(['host1', 'host2', 'host3']),
+                         self.index.get_hosts('k1'))
+        self.assertEqual(set(['host1', 'host2', 'host3']),
+                         self.index.get_hosts('k1', '2'))
+        self.assertEqual(set(['host2', 'host3']),
+                         self.index.get_hosts('k1', '3'))
+        self.assertEqual(set(), self.index.get_hosts('k2'))
+
+    def test_host_has(self):
+        self.assertTrue(self.index.host_has('host1', 'availability_zone'))
+        self.assertTrue(self.index.host_has('host1', 'k1', '1'))
+        self.assertFalse(self.index.host_has('host1', 'k1', '3'))
+        self.assertFalse(self.index.host_has('host3', 'availability_zone'))
+        self.assertFalse(self.index.host_has('host4', 'k1'))
+
+    def test_get_metadata(self):
+        self.assertEqual({'availability_zone': set(['az1']),
+                          'k1': set(['1', '2', '3'])},
+                         self.index.get_metadata('host2'))
+        self.assertEqual({'k1': set(['2', '3'])},
+                         self.index.get_metadata('host3'))
+        self.assertEqual({'k1': set(['2', '3'])},
+                         self.index.get_metadata('host3', 'k1'))
+        self.assertEqual({}, self.index.get_metadata('host3',
+                                                     'availability_zone'))
+        self.assertEqual({}, self.index.get_metadata('host4'))
+
+    def test_update(self):
+        self.index.get_metadata('host2')
+        self.agg1.hosts = ['host1']
+        self.agg1.metadata = {'k1': '4'}
+
+        self.index.update(self.agg1)
+
+        self.assertEqual(set(), self.index.get_hosts('availability_zone'))
+        self.assertEqual(set(['host2', 'host3']),
+                         self.index.get_hosts('k1', '2'))
+        self.assertEqual(set(['host1']), self.index.get_hosts('k1', '4'))
+        self.assertEqual({'k1': set(['2', '3'])},
+                         self.index.get_metadata('host2'))
+
+    def test_remove(self):
+        self.index.get_metadata('host2')
+
+        self.index.remove(2)
+        self.index.remove(3)
+
+        self.assertEqual(set(['host1', 'host2']), self.index.get_hosts('k1'))
+        self.assertEqual(set(), self.index.get_hosts('k1', '3'))
+        self.assertEqual({'availability_zone': set(['az1']),
+                          'k1': set(['1', '2'])},
+                         self.index.get_metadata('host2'))
+
+        self.index.remove(1)
+
+        self.assertEqual(set(), self.index.get_hosts('k1'))
+        self.assertEqual({}, self.index.get_metadata('host2'))
@@ -13,15 +13,22 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import datetime
+
+import fixtures
 import mock
+from oslo_config import cfg
 from oslo_utils import timeutils
 from six.moves import range
 
 from nova import exception
 from nova.scheduler import caching_scheduler
 from nova.scheduler import host_manager
+from nova.scheduler import host_state_cache
 from nova.tests.unit.scheduler import test_scheduler
 
+CONF = cfg.CONF
+
 ENABLE_PROFILER = False
 
 
@@ -188,6 +195,160 @@ class CachingSchedulerTestCase(test_scheduler.SchedulerTestCase):
         self.assertTrue(per_request_ms < 1000)
 
 
+class SharedCachingSchedulerTestCase(test_scheduler.SchedulerTestCase):
+    """Test case for Caching Scheduler with a shared host state cache."""
+
+    driver_cls = caching_scheduler.CachingScheduler
+
+    def setUp(self):
+        self.flags(scheduler_host_state_cache_driver='nova.scheduler.'
+                   'host_state_cache.FileHostStateCache',
+                   scheduler_host_state_cache_path=self.useFixture(
+                       fixtures.TempDir()).path)
+        super(SharedCachingSchedulerTestCase, self).setUp()
+        with mock.patch.object(host_manager.HostManager, '_init_aggregates'):
+            with mock.patch.object(host_manager.HostManager,
+                                   '_init_instance_info'):
+                self.other_driver = self.driver_cls()
+        self.updated = timeutils.utcnow()
+
+    def _get_host_state(self):
+        host_state = host_manager.HostState('host1', 'node1')
+        host_state.free_ram_mb = 4096
+        host_state.free_disk_mb = 10240
+        host_state.updated = self.updated
+        return host_state
+
+    def _load_hosts(self, driver):
+        with mock.patch.object(driver, '_get_up_hosts',
+                               return_value=[self._get_host_state()]):
+            driver.run_periodic_tasks(self.context)
+        return driver.all_host_states[0]
+
+    def test_shared_cache_loaded(self):
+        self.assertIsInstance(self.driver.shared_cache,
+                              host_state_cache.FileHostStateCache)
+
+    def test_run_periodic_tasks_publishes_hosts(self):
+        self._load_hosts(self.driver)
+
+        entry = self.driver.shared_cache.get('node1@host1')
+        self.assertEqual(1, entry['version'])
+        self.assertEqual(4096, entry['free_ram_mb'])
+        self.assertEqual({'node1@host1': 1}, self.driver._shared_versions)
+
+    def test_consume_visible_to_other_scheduler(self):
+        host_state = self._load_hosts(self.driver)
+        other_host_state = self._load_hosts(self.other_driver)
+
+        self.driver._consume_from_instance(host_state, {
+            'root_gb': 1, 'ephemeral_gb': 0, 'memory_mb': 512, 'vcpus': 1})
+        self.assertEqual(3584, host_state.free_ram_mb)
+
+        self.other_driver._get_all_host_states(self.context)
+        self.assertEqual(3584, other_host_state.free_ram_mb)
+        self.assertEqual(1, other_host_state.num_instances)
+        self.assertEqual(2, self.other_driver._shared_versions['node1@host1'])
+
+    def test_own_claim_not_read_back(self):
+        host_state = self._load_hosts(self.driver)
+        self._load_hosts(self.other_driver)
+
+        self.driver._consume_from_instance(host_state, {
+            'root_gb': 1, 'ephemeral_gb': 0, 'memory_mb': 512, 'vcpus': 1})
+        with mock.patch.object(self.driver.shared_cache,
+                               'get_many') as mock_get_many:
+            self.driver._get_all_host_states(self.context)
+        self.assertFalse(mock_get_many.called)
+
+        # a claim of the other scheduler is read
+        self.other_driver._consume_from_instance(
+            self.other_driver.all_host_states[0], {
+                'root_gb': 1, 'ephemeral_gb': 0, 'memory_mb': 512,
+                'vcpus': 1})
+        self.driver._get_all_host_states(self.context)
+        self.assertEqual(3072, host_state.free_ram_mb)
+
+    def test_run_periodic_tasks_one_worker_loads_hosts(self):
+        self._load_hosts(self.driver)
+        # the other worker has no hosts yet
+        other_host_state = self._load_hosts(self.other_driver)
+        self.driver._consume_from_instance(
+            self.driver.all_host_states[0], {
+                'root_gb': 1, 'ephemeral_gb': 0, 'memory_mb': 512,
+                'vcpus': 1})
+
+        for driver in (self.driver, self.other_driver):
+            with mock.patch.object(driver, '_get_up_hosts') as mock_get:
+                driver.run_periodic_tasks(self.context)
+            self.assertFalse(mock_get.called)
+        self.assertEqual(3584, other_host_state.free_ram_mb)
+
+        # the turn of the other worker in the next period
+        shared_cache = self.other_driver.shared_cache
+        with mock.patch.object(self.other_driver, '_get_up_hosts',
+                               return_value=[]) as mock_get:
+            with mock.patch.object(shared_cache, 'start_refresh',
+                                   return_value=True):
+                with mock.patch.object(shared_cache,
+                                       'finish_refresh') as mock_finish:
+                    self.other_driver.run_periodic_tasks(self.context)
+        self.assertTrue(mock_get.called)
+        mock_finish.assert_called_once_with([])
+
+    def test_run_periodic_tasks_loads_changed_hosts(self):
+        self._load_hosts(self.driver)
+        self._load_hosts(self.other_driver)
+        self.other_driver.all_host_states.append(
+            host_manager.HostState('host2', 'node2'))
+
+        with mock.patch.object(self.other_driver, '_get_up_hosts',
+                               return_value=[]) as mock_get:
+            self.other_driver.run_periodic_tasks(self.context)
+        self.assertTrue(mock_get.called)
+
+    def test_run_periodic_tasks_loads_old_hosts(self):
+        self._load_hosts(self.driver)
+        self._load_hosts(self.other_driver)
+        self.other_driver._loaded_at -= datetime.timedelta(
+            seconds=CONF.scheduler_host_state_cache_max_age + 1)
+
+        with mock.patch.object(self.other_driver, '_get_up_hosts',
+                               return_value=[]) as mock_get:
+            self.other_driver.run_periodic_tasks(self.context)
+        self.assertTrue(mock_get.called)
+
+    def test_concurrent_claims_not_lost(self):
+        host_state = self._load_hosts(self.driver)
+        other_host_state = self._load_hosts(self.other_driver)
+        instance = {'root_gb': 1, 'ephemeral_gb': 0, 'memory_mb': 512,
+                    'vcpus': 1}
+
+        self.driver._consume_from_instance(host_state, dict(instance))
+        # The other scheduler did not refresh its view before claiming
+        self.other_driver._consume_from_instance(other_host_state,
+                                                 dict(instance))
+
+        self.assertEqual(3072, other_host_state.free_ram_mb)
+        self.assertEqual(2, other_host_state.vcpus_used)
+        entry = self.driver.shared_cache.get('node1@host1')
+        self.assertEqual(3, entry['version'])
+        self.assertEqual(3072, entry['free_ram_mb'])
+
+    @mock.patch.object(host_state_cache.FileHostStateCache, 'compare_and_set',
+                       return_value=None)
+    def test_consume_gives_up_after_retries(self, mock_cas):
+        self.flags(scheduler_host_state_cache_claim_retries=2)
+        host_state = self._get_host_state()
+        self.driver.all_host_states = [host_state]
+
+        self.driver._consume_from_instance(host_state, {
+            'root_gb': 1, 'ephemeral_gb': 0, 'memory_mb': 512, 'vcpus': 1})
+
+        self.assertEqual(2, mock_cas.call_count)
+        self.assertEqual(3584, host_state.free_ram_mb)
+
+
 if __name__ == '__main__':
     # A handy tool to help profile the schedulers performance
     ENABLE_PROFILER = True
@@ -27,7 +27,8 @@ from nova.tests.unit.scheduler import fakes
 from nova.tests.unit.scheduler import test_scheduler
 
 
-def fake_get_filtered_hosts(hosts, filter_properties, index):
+def fake_get_filtered_hosts(hosts, filter_properties, index,
+                            record_stats=True):
     return list(hosts)
 
 
@@ -38,7 +39,7 @@ class FilterSchedulerTestCase(test_scheduler.SchedulerTestCase):
 
     @mock.patch('nova.objects.ServiceList.get_by_binary',
                 return_value=fakes.SERVICES)
-    @mock.patch('nova.objects.InstanceList.get_by_host')
+    @mock.patch('nova.objects.InstanceList.get_projected_by_filters')
     @mock.patch('nova.objects.ComputeNodeList.get_all',
                 return_value=fakes.COMPUTE_NODES)
     @mock.patch('nova.db.instance_extra_get_by_instance_uuid',
@@ -52,7 +53,7 @@ class FilterSchedulerTestCase(test_scheduler.SchedulerTestCase):
 
         self.next_weight = 1.0
 
-        def _fake_weigh_objects(_self, functions, hosts, options):
+        def _fake_weigh_objects(_self, functions, hosts, options, limit=None):
             self.next_weight += 2.0
             host_state = hosts[0]
             return [weights.WeighedHost(host_state, self.next_weight)]
@@ -79,6 +80,89 @@ class FilterSchedulerTestCase(test_scheduler.SchedulerTestCase):
         for weighed_host in weighed_hosts:
             self.assertIsNotNone(weighed_host.obj)
 
+    @mock.patch('nova.objects.ServiceList.get_by_binary',
+                return_value=fakes.SERVICES)
+    @mock.patch('nova.objects.InstanceList.get_projected_by_filters')
+    @mock.patch('nova.objects.ComputeNodeList.get_all',
+                return_value=fakes.COMPUTE_NODES)
+    @mock.patch('nova.db.instance_extra_get_by_instance_uuid',
+                return_value={'numa_topology': None,
+                              'pci_requests': None})
+    def test_schedule_multiple_instances(self, mock_get_extra, mock_get_all,
+                                         mock_by_host, mock_get_by_binary):
+        """Only the chosen hosts are filtered again for the next instances,
+        and the consumed resources are accounted when weighing them.
+        """
+        self.flags(scheduler_host_subset_size=1)
+        host_manager = self.driver.host_manager
+        get_filtered_hosts = host_manager.get_filtered_hosts
+        filtered_hosts = []
+
+        def _fake_get_filtered_hosts(hosts, filter_properties, index,
+                                     record_stats=True):
+            hosts = list(hosts)
+            filtered_hosts.append([host.host for host in hosts])
+            return get_filtered_hosts(hosts, filter_properties,
+                                      filter_class_names=['RamFilter'],
+                                      index=index, record_stats=record_stats)
+
+        self.stubs.Set(host_manager, 'get_filtered_hosts',
+                       _fake_get_filtered_hosts)
+        self.stubs.Set(host_manager, 'weighers',
+                       [weights.ram.RAMWeigher()])
+
+        instance_properties = {'project_id': 1,
+                               'root_gb': 1,
+                               'memory_mb': 3072,
+                               'ephemeral_gb': 0,
+                               'vcpus': 1,
+                               'os_type': 'Linux',
+                               'uuid': 'fake-uuid'}
+        request_spec = dict(instance_properties=instance_properties,
+                            instance_type={'memory_mb': 3072},
+                            num_instances=4)
+        self.flags(ram_allocation_ratio=1.0)
+        durations = {}
+        hosts = self.driver._schedule(self.context, request_spec, {},
+                                      durations=durations)
+
+        # host4 has 8192MB and host3 3072MB free, the others are filtered out
+        self.assertEqual(['host4', 'host4', 'host3'],
+                         [host.obj.host for host in hosts])
+        self.assertEqual(['host1', 'host2', 'host3', 'host4'],
+                         sorted(filtered_hosts[0]))
+        self.assertTrue(all(len(hosts) == 1 for hosts in filtered_hosts[1:]))
+        self.assertEqual(['filtering', 'host_states', 'selection',
+                          'weighing'], sorted(durations))
+        timings = host_manager.get_timings(reset=True)
+        self.assertEqual(1, timings['phase']['selection']['count'])
+        self.assertEqual(['RamFilter'], list(timings['filter']))
+        # Only the filtering of all the hosts is measured
+        self.assertEqual(1, timings['filter']['RamFilter']['count'])
+        self.assertEqual(
+            4, host_manager.get_filter_stats()['RamFilter']['objs_in'])
+        self.assertEqual(['RAMWeigher'], list(timings['weigher']))
+        self.assertEqual({}, host_manager.get_timings())
+
+    def test_weighed_host_heap(self):
+        hosts = [weights.WeighedHost(host_manager.HostState('host%d' % i,
+                                                            'node'), weight)
+                 for i, weight in enumerate([1.0, 2.0, 1.0, 3.0])]
+        heap = filter_scheduler._WeighedHostHeap(hosts)
+        self.assertEqual(hosts, heap.items())
+        self.assertEqual(hosts[3], heap.pop())
+        self.assertEqual(hosts[1], heap.pop())
+        # Hosts of the same weight are popped in their original order
+        self.assertEqual(hosts[0], heap.pop())
+        self.assertEqual([hosts[2]], heap.items())
+        heap.push(hosts[1])
+        heap.push(hosts[0])
+        self.assertEqual([hosts[0], hosts[1], hosts[2]], heap.items())
+        self.assertEqual(hosts[1], heap.pop())
+        self.assertEqual(hosts[0], heap.pop())
+        self.assertEqual(hosts[2], heap.pop())
+        self.assertIsNone(heap.pop())
+
     def test_max_attempts(self):
         self.flags(scheduler_max_attempts=4)
         self.assertEqual(4, scheduler_utils._max_attempts())
@@ -117,7 +201,7 @@ class FilterSchedulerTestCase(test_scheduler.SchedulerTestCase):
 
     @mock.patch('nova.objects.ServiceList.get_by_binary',
                 return_value=fakes.SERVICES)
-    @mock.patch('nova.objects.InstanceList.get_by_host')
+    @mock.patch('nova.objects.InstanceList.get_projected_by_filters')
     @mock.patch('nova.objects.ComputeNodeList.get_all',
                 return_value=fakes.COMPUTE_NODES)
     @mock.patch('nova.db.instance_extra_get_by_instance_uuid',
@@ -143,15 +227,20 @@ class FilterSchedulerTestCase(test_scheduler.SchedulerTestCase):
                             instance_type={})
         filter_properties = {}
         self.mox.ReplayAll()
-        hosts = self.driver._schedule(self.context, request_spec,
-                filter_properties=filter_properties)
+        host_manager = self.driver.host_manager
+        with mock.patch.object(host_manager, 'get_weighed_hosts',
+                               wraps=host_manager.get_weighed_hosts) as weigh:
+            hosts = self.driver._schedule(self.context, request_spec,
+                    filter_properties=filter_properties)
 
         # one host should be chosen
         self.assertEqual(len(hosts), 1)
+        # only the best subset of hosts needs to be sorted
+        self.assertEqual(2, weigh.call_args[1]['limit'])
 
     @mock.patch('nova.objects.ServiceList.get_by_binary',
                 return_value=fakes.SERVICES)
-    @mock.patch('nova.objects.InstanceList.get_by_host')
+    @mock.patch('nova.objects.InstanceList.get_projected_by_filters')
     @mock.patch('nova.objects.ComputeNodeList.get_all',
                 return_value=fakes.COMPUTE_NODES)
     @mock.patch('nova.db.instance_extra_get_by_instance_uuid',
@@ -185,6 +274,7 @@ class FilterSchedulerTestCase(test_scheduler.SchedulerTestCase):
         self.assertEqual(len(hosts), 1)
 
     @mock.patch('nova.scheduler.host_manager.HostManager._add_instance_info')
+    @mock.patch('nova.objects.InstanceList.get_projected_by_filters')
     @mock.patch('nova.objects.ServiceList.get_by_binary',
                 return_value=fakes.SERVICES)
     @mock.patch('nova.objects.ComputeNodeList.get_all',
@@ -194,6 +284,7 @@ class FilterSchedulerTestCase(test_scheduler.SchedulerTestCase):
                               'pci_requests': None})
     def test_schedule_chooses_best_host(self, mock_get_extra, mock_cn_get_all,
                                         mock_get_by_binary,
+                                        mock_get_by_filters,
                                         mock_add_inst_info):
         """If scheduler_host_subset_size is 1, the largest host with greatest
         weight should be returned.
@@ -205,7 +296,7 @@ class FilterSchedulerTestCase(test_scheduler.SchedulerTestCase):
 
         self.next_weight = 50
 
-        def _fake_weigh_objects(_self, functions, hosts, options):
+        def _fake_weigh_objects(_self, functions, hosts, options, limit=None):
             this_weight = self.next_weight
             self.next_weight = 0
             host_state = hosts[0]
@@ -237,7 +328,7 @@ class FilterSchedulerTestCase(test_scheduler.SchedulerTestCase):
 
     @mock.patch('nova.objects.ServiceList.get_by_binary',
                 return_value=fakes.SERVICES)
-    @mock.patch('nova.objects.InstanceList.get_by_host')
+    @mock.patch('nova.objects.InstanceList.get_projected_by_filters')
     @mock.patch('nova.objects.ComputeNodeList.get_all',
                 return_value=fakes.COMPUTE_NODES)
     @mock.patch('nova.db.instance_extra_get_by_instance_uuid',
@@ -256,7 +347,7 @@ class FilterSchedulerTestCase(test_scheduler.SchedulerTestCase):
         selected_hosts = []
         selected_nodes = []
 
-        def _fake_weigh_objects(_self, functions, hosts, options):
+        def _fake_weigh_objects(_self, functions, hosts, options, limit=None):
             self.next_weight += 2.0
             host_state = hosts[0]
             selected_hosts.append(host_state.host)
@@ -298,8 +389,10 @@ class FilterSchedulerTestCase(test_scheduler.SchedulerTestCase):
                 mock.call(self.context, 'scheduler.select_destinations.start',
                  dict(request_spec=request_spec)),
                 mock.call(self.context, 'scheduler.select_destinations.end',
-                 dict(request_spec=request_spec))]
+                 dict(request_spec=request_spec, timings=mock.ANY))]
             self.assertEqual(expected, mock_info.call_args_list)
+            self.assertEqual(['total'],
+                             list(mock_info.call_args[0][2]['timings']))
 
     def test_select_destinations_no_valid_host(self):
 
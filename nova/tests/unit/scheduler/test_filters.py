@@ -18,6 +18,7 @@ Tests For Scheduler Host Filters.
 import inspect
 import sys
 
+import mock
 from six.moves import range
 
 from nova import filters
@@ -35,6 +36,35 @@ class Filter2(filters.BaseFilter):
     pass
 
 
+class FakeObject(object):
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+
+
+class ColumnFilter(filters.BaseFilter):
+    """Test Filter class passing the objects bigger than a size."""
+    column_attrs = ('size',)
+
+    def __init__(self, min_size):
+        self.min_size = min_size
+
+    def _filter_one(self, obj, filter_properties):
+        return obj.size > self.min_size
+
+    def filter_columns(self, filter_obj_list, columns, filter_properties):
+        return columns['size'] > self.min_size
+
+
+class NameFilter(filters.BaseFilter):
+    """Test Filter class rejecting the objects with a given name."""
+    def __init__(self, name):
+        self.name = name
+
+    def _filter_one(self, obj, filter_properties):
+        return obj.name != self.name
+
+
 class FiltersTestCase(test.NoDBTestCase):
     def test_filter_all(self):
         filter_obj_list = ['obj1', 'obj2', 'obj3']
@@ -201,3 +231,137 @@ class FiltersTestCase(test.NoDBTestCase):
                                                      filter_objs_initial,
                                                      filter_properties)
         self.assertIsNone(result)
+
+    def test_get_filtered_objects_vectorized(self):
+        objs = [FakeObject('obj%d' % i, i) for i in range(6)]
+        with mock.patch.object(loadables.BaseLoader, '__init__',
+                               return_value=None):
+            filter_handler = filters.BaseFilterHandler(filters.BaseFilter)
+        filter_handler.vectorized = True
+        filter_objs = [ColumnFilter(0), NameFilter('obj2'), ColumnFilter(3),
+                       NameFilter('obj5'), ColumnFilter(1)]
+
+        with mock.patch.object(ColumnFilter, '_filter_one') as filter_one:
+            result = filter_handler.get_filtered_objects(filter_objs, objs,
+                                                         {})
+            self.assertFalse(filter_one.called)
+        self.assertEqual(['obj4'], [obj.name for obj in result])
+
+    def test_get_filtered_objects_vectorized_disabled(self):
+        objs = [FakeObject('obj%d' % i, i) for i in range(6)]
+        with mock.patch.object(loadables.BaseLoader, '__init__',
+                               return_value=None):
+            filter_handler = filters.BaseFilterHandler(filters.BaseFilter)
+        filter_objs = [ColumnFilter(0), NameFilter('obj2'), ColumnFilter(3)]
+
+        with mock.patch.object(ColumnFilter,
+                               'filter_columns') as filter_columns:
+            result = filter_handler.get_filtered_objects(filter_objs, objs,
+                                                         {})
+            self.assertFalse(filter_columns.called)
+        self.assertEqual(['obj4', 'obj5'], [obj.name for obj in result])
+
+    def _get_filter_handler(self):
+        with mock.patch.object(loadables.BaseLoader, '__init__',
+                               return_value=None):
+            return filters.BaseFilterHandler(filters.BaseFilter)
+
+    def test_get_filtered_objects_records_stats(self):
+        objs = [FakeObject('obj%d' % i, i) for i in range(6)]
+        filter_handler = self._get_filter_handler()
+        filter_objs = [NameFilter('obj2'), ColumnFilter(3)]
+
+        filter_handler.get_filtered_objects(filter_objs, objs, {})
+
+        stats = filter_handler.get_filter_stats()
+        self.assertEqual(['ColumnFilter', 'NameFilter'], sorted(stats))
+        self.assertEqual(6, stats['NameFilter']['objs_in'])
+        self.assertEqual(5, stats['NameFilter']['objs_out'])
+        self.assertEqual(5, stats['ColumnFilter']['objs_in'])
+        self.assertEqual(2, stats['ColumnFilter']['objs_out'])
+        self.assertAlmostEqual(0.4, stats['ColumnFilter']['pass_rate'])
+
+    def test_get_filtered_objects_without_stats(self):
+        objs = [FakeObject('obj%d' % i, i) for i in range(6)]
+        filter_handler = self._get_filter_handler()
+        filter_handler.timings = mock.Mock()
+        filter_objs = [NameFilter('obj2'), ColumnFilter(3)]
+
+        result = filter_handler.get_filtered_objects(filter_objs, objs, {},
+                                                     record_stats=False)
+
+        self.assertEqual(['obj4', 'obj5'], [obj.name for obj in result])
+        self.assertEqual({}, filter_handler.get_filter_stats())
+        self.assertFalse(filter_handler.timings.observe.called)
+
+    def test_filter_stats_rank(self):
+        stats = filters.FilterStats()
+        self.assertEqual(1.0, stats.pass_rate)
+        self.assertEqual(0.0, stats.cost)
+        self.assertEqual(float('inf'), stats.rank())
+
+        stats.record(100, 50, 2.0)
+        self.assertEqual(0.5, stats.pass_rate)
+        self.assertEqual(0.02, stats.cost)
+        self.assertEqual(0.04, stats.rank())
+
+    def test_filter_stats_decay(self):
+        stats = filters.FilterStats()
+        stats.record(filters.STATS_MAX_OBJECTS, 0, 1.0)
+        stats.record(2, 2, 1.0)
+        self.assertEqual((filters.STATS_MAX_OBJECTS + 2) / 2.0,
+                         stats.objs_in)
+        self.assertEqual(1.0, stats.objs_out)
+        self.assertEqual(1.0, stats.elapsed)
+
+    def test_order_filters(self):
+        filter_handler = self._get_filter_handler()
+        expensive, cheap = ColumnFilter(0), NameFilter('obj2')
+        barrier = Filter1()
+        barrier.reorderable = False
+        last = Filter2()
+        filter_handler._record_filter_stats(expensive, 1000, 100, 1.0)
+        filter_handler._record_filter_stats(cheap, 1000, 100, 0.1)
+        filter_handler._record_filter_stats(last, 1000, 900, 0.01)
+
+        self.assertEqual([cheap, expensive],
+                         filter_handler._order_filters([expensive, cheap]))
+        self.assertEqual([cheap, expensive, barrier, last],
+                         filter_handler._order_filters(
+                             [expensive, cheap, barrier, last]))
+        self.assertEqual([expensive, barrier, last, cheap],
+                         filter_handler._order_filters(
+                             [expensive, barrier, last, cheap]))
+        # Filter1 has no stats yet
+        unknown = Filter1()
+        self.assertEqual([expensive, cheap, unknown],
+                         filter_handler._order_filters(
+                             [expensive, cheap, unknown]))
+
+    def test_order_filters_not_enough_stats(self):
+        filter_handler = self._get_filter_handler()
+        expensive, cheap = ColumnFilter(0), NameFilter('obj2')
+        filter_handler._record_filter_stats(expensive, 1000, 100, 1.0)
+        filter_handler._record_filter_stats(
+            cheap, filters.STATS_MIN_OBJECTS - 1, 0, 0.0)
+
+        self.assertEqual([expensive, cheap],
+                         filter_handler._order_filters([expensive, cheap]))
+
+    def test_get_filtered_objects_adaptive_order(self):
+        objs = [FakeObject('obj%d' % i, i) for i in range(6)]
+        filter_handler = self._get_filter_handler()
+        filter_handler.adaptive_order = True
+        expensive, cheap = ColumnFilter(0), NameFilter('obj2')
+        filter_handler._record_filter_stats(expensive, 1000, 100, 1.0)
+        filter_handler._record_filter_stats(cheap, 1000, 100, 0.1)
+
+        with mock.patch.object(filter_handler, '_order_filters',
+                               return_value=[cheap, expensive]) as order:
+            result = filter_handler.get_filtered_objects([expensive, cheap],
+                                                         objs, {})
+        order.assert_called_once_with([expensive, cheap])
+        self.assertEqual(['obj1', 'obj3', 'obj4', 'obj5'],
+                         [obj.name for obj in result])
+        self.assertEqual(1006, filter_handler.filter_stats[
+            'NameFilter'].objs_in)
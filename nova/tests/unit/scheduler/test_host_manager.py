@@ -17,10 +17,13 @@ Tests For HostManager
 """
 
 import collections
+import datetime
 
+import iso8601
 import mock
 from oslo_config import cfg
 from oslo_serialization import jsonutils
+from oslo_utils import timeutils
 import six
 
 import nova
@@ -29,6 +32,7 @@ from nova.compute import vm_states
 from nova import exception
 from nova import objects
 from nova.objects import base as obj_base
+from nova import pagination
 from nova.pci import stats as pci_stats
 from nova.scheduler import filters
 from nova.scheduler import host_manager
@@ -75,21 +79,66 @@ class HostManagerTestCase(test.NoDBTestCase):
         filters = self.host_manager._load_filters()
         self.assertEqual(filters, ['FakeFilterClass1'])
 
-    @mock.patch.object(nova.objects.InstanceList, 'get_by_filters')
+    @mock.patch.object(nova.objects.InstanceList, 'get_projected_by_filters')
     @mock.patch.object(nova.objects.ComputeNodeList, 'get_all')
     @mock.patch('nova.utils.spawn_n')
-    def test_init_instance_info_batches(self, mock_spawn, mock_get_all,
-                                        mock_get_by_filters):
+    def test_init_instance_info_pages(self, mock_spawn, mock_get_all,
+                                      mock_get_by_filters):
+        self.flags(scheduler_instance_info_page_size=2)
         mock_spawn.side_effect = lambda f, *a, **k: f(*a, **k)
         cn_list = objects.ComputeNodeList()
         for num in range(22):
             host_name = 'host_%s' % num
             cn_list.objects.append(objects.ComputeNode(host=host_name))
         mock_get_all.return_value = cn_list
+        created_at = datetime.datetime(2015, 1, 1)
+        instances = [objects.Instance(host='host_%s' % (num % 2),
+                                      uuid='uuid%s' % num, id=num,
+                                      created_at=created_at)
+                     for num in range(5)]
+        mock_get_by_filters.side_effect = [
+            objects.InstanceList(objects=instances[0:2]),
+            objects.InstanceList(objects=instances[2:4]),
+            objects.InstanceList(objects=instances[4:])]
         self.host_manager._init_instance_info()
-        self.assertEqual(mock_get_by_filters.call_count, 3)
+        self.assertEqual(
+            [mock.call(mock.ANY, {'deleted': False, 'soft_deleted': True},
+                       host_manager.INSTANCE_INFO_PAGE_FIELDS,
+                       sort_keys=['id'], sort_dirs=['asc'], limit=2,
+                       marker=marker)
+             for marker in (None,
+                            pagination.encode_marker(['id', 'created_at'],
+                                                     ['asc', 'asc'],
+                                                     [1, created_at]),
+                            pagination.encode_marker(['id', 'created_at'],
+                                                     ['asc', 'asc'],
+                                                     [3, created_at]))],
+            mock_get_by_filters.call_args_list)
+        instance_info = self.host_manager._instance_info
+        self.assertEqual(22, len(instance_info))
+        self.assertEqual(set(['uuid0', 'uuid2', 'uuid4']),
+                         set(instance_info['host_0']['instances']))
+        self.assertEqual(set(['uuid1', 'uuid3']),
+                         set(instance_info['host_1']['instances']))
+        self.assertEqual({}, instance_info['host_2']['instances'])
+
+    @mock.patch.object(nova.objects.InstanceList, 'get_projected_by_filters')
+    @mock.patch.object(nova.objects.ComputeNodeList, 'get_all')
+    @mock.patch('nova.utils.spawn_n')
+    def test_init_instance_info_keeps_updates(self, mock_spawn, mock_get_all,
+                                              mock_get_by_filters):
+        mock_spawn.side_effect = lambda f, *a, **k: f(*a, **k)
+        mock_get_all.return_value = objects.ComputeNodeList(
+            objects=[objects.ComputeNode(host='host1')])
+        mock_get_by_filters.return_value = objects.InstanceList(
+            objects=[objects.Instance(host='host1', uuid='uuid1')])
+        inst2 = objects.Instance(host='host1', uuid='uuid2')
+        updated_info = {'instances': {'uuid2': inst2}, 'updated': True}
+        self.host_manager._instance_info = {'host1': updated_info}
+        self.host_manager._init_instance_info()
+        self.assertIs(updated_info, self.host_manager._instance_info['host1'])
 
-    @mock.patch.object(nova.objects.InstanceList, 'get_by_filters')
+    @mock.patch.object(nova.objects.InstanceList, 'get_projected_by_filters')
     @mock.patch.object(nova.objects.ComputeNodeList, 'get_all')
     @mock.patch('nova.utils.spawn_n')
     def test_init_instance_info(self, mock_spawn, mock_get_all,
@@ -153,6 +202,17 @@ class HostManagerTestCase(test.NoDBTestCase):
         self.assertEqual({'fake-host': set([1])},
                          self.host_manager.host_aggregates_map)
 
+    def test_update_aggregates_updates_index(self):
+        fake_agg = objects.Aggregate(id=1, hosts=['fake-host'],
+                                     metadata={'k1': 'v1'})
+        self.host_manager.update_aggregates([fake_agg])
+        self.assertEqual(set(['fake-host']),
+                         self.host_manager.aggregate_index.get_hosts('k1'))
+
+        self.host_manager.delete_aggregate(fake_agg)
+        self.assertEqual(set(),
+                         self.host_manager.aggregate_index.get_hosts('k1'))
+
     def test_update_aggregates_remove_hosts(self):
         fake_agg = objects.Aggregate(id=1, hosts=['fake-host'])
         self.host_manager.update_aggregates([fake_agg])
@@ -361,9 +421,9 @@ class HostManagerTestCase(test.NoDBTestCase):
                 fake_properties)
         self._verify_result(info, result, False)
 
-    @mock.patch.object(nova.objects.InstanceList, 'get_by_host')
-    def test_get_all_host_states(self, mock_get_by_host):
-        mock_get_by_host.return_value = objects.InstanceList()
+    @mock.patch.object(nova.objects.InstanceList, 'get_projected_by_filters')
+    def test_get_all_host_states(self, mock_get_by_filters):
+        mock_get_by_filters.return_value = objects.InstanceList()
         context = 'fake_context'
         self.mox.StubOutWithMock(objects.ServiceList, 'get_by_binary')
         self.mox.StubOutWithMock(objects.ComputeNodeList, 'get_all')
@@ -395,6 +455,8 @@ class HostManagerTestCase(test.NoDBTestCase):
             state_key = (host, node)
             self.assertEqual(host_states_map[state_key].service,
                     obj_base.obj_to_primitive(fakes.get_service_by_host(host)))
+            self.assertIs(self.host_manager.aggregate_index,
+                          host_states_map[state_key].aggregate_index)
         self.assertEqual(host_states_map[('host1', 'node1')].free_ram_mb,
                          512)
         # 511GB
@@ -421,35 +483,35 @@ class HostManagerTestCase(test.NoDBTestCase):
         self.assertEqual(host_states_map[('host4', 'node4')].free_disk_mb,
                          8388608)
 
-    @mock.patch.object(nova.objects.InstanceList, 'get_by_host')
+    @mock.patch.object(nova.objects.InstanceList, 'get_projected_by_filters')
     @mock.patch.object(host_manager.HostState, 'update_from_compute_node')
     @mock.patch.object(objects.ComputeNodeList, 'get_all')
     @mock.patch.object(objects.ServiceList, 'get_by_binary')
     def test_get_all_host_states_with_no_aggs(self, svc_get_by_binary,
                                               cn_get_all, update_from_cn,
-                                              mock_get_by_host):
+                                              mock_get_by_filters):
         svc_get_by_binary.return_value = [objects.Service(host='fake')]
         cn_get_all.return_value = [
             objects.ComputeNode(host='fake', hypervisor_hostname='fake')]
-        mock_get_by_host.return_value = objects.InstanceList()
+        mock_get_by_filters.return_value = objects.InstanceList()
         self.host_manager.host_aggregates_map = collections.defaultdict(set)
 
         self.host_manager.get_all_host_states('fake-context')
         host_state = self.host_manager.host_state_map[('fake', 'fake')]
         self.assertEqual([], host_state.aggregates)
 
-    @mock.patch.object(nova.objects.InstanceList, 'get_by_host')
+    @mock.patch.object(nova.objects.InstanceList, 'get_projected_by_filters')
     @mock.patch.object(host_manager.HostState, 'update_from_compute_node')
     @mock.patch.object(objects.ComputeNodeList, 'get_all')
     @mock.patch.object(objects.ServiceList, 'get_by_binary')
     def test_get_all_host_states_with_matching_aggs(self, svc_get_by_binary,
                                                     cn_get_all,
                                                     update_from_cn,
-                                                    mock_get_by_host):
+                                                    mock_get_by_filters):
         svc_get_by_binary.return_value = [objects.Service(host='fake')]
         cn_get_all.return_value = [
             objects.ComputeNode(host='fake', hypervisor_hostname='fake')]
-        mock_get_by_host.return_value = objects.InstanceList()
+        mock_get_by_filters.return_value = objects.InstanceList()
         fake_agg = objects.Aggregate(id=1)
         self.host_manager.host_aggregates_map = collections.defaultdict(
             set, {'fake': set([1])})
@@ -459,7 +521,7 @@ class HostManagerTestCase(test.NoDBTestCase):
         host_state = self.host_manager.host_state_map[('fake', 'fake')]
         self.assertEqual([fake_agg], host_state.aggregates)
 
-    @mock.patch.object(nova.objects.InstanceList, 'get_by_host')
+    @mock.patch.object(nova.objects.InstanceList, 'get_projected_by_filters')
     @mock.patch.object(host_manager.HostState, 'update_from_compute_node')
     @mock.patch.object(objects.ComputeNodeList, 'get_all')
     @mock.patch.object(objects.ServiceList, 'get_by_binary')
@@ -467,13 +529,13 @@ class HostManagerTestCase(test.NoDBTestCase):
                                                         svc_get_by_binary,
                                                         cn_get_all,
                                                         update_from_cn,
-                                                        mock_get_by_host):
+                                                        mock_get_by_filters):
         svc_get_by_binary.return_value = [objects.Service(host='fake'),
                                           objects.Service(host='other')]
         cn_get_all.return_value = [
             objects.ComputeNode(host='fake', hypervisor_hostname='fake'),
             objects.ComputeNode(host='other', hypervisor_hostname='other')]
-        mock_get_by_host.return_value = objects.InstanceList()
+        mock_get_by_filters.return_value = objects.InstanceList()
         fake_agg = objects.Aggregate(id=1)
         self.host_manager.host_aggregates_map = collections.defaultdict(
             set, {'other': set([1])})
@@ -485,7 +547,7 @@ class HostManagerTestCase(test.NoDBTestCase):
 
     @mock.patch('nova.objects.ServiceList.get_by_binary')
     @mock.patch('nova.objects.ComputeNodeList.get_all')
-    @mock.patch('nova.objects.InstanceList.get_by_host')
+    @mock.patch('nova.objects.InstanceList.get_projected_by_host')
     def test_get_all_host_states_updated(self, mock_get_by_host,
                                          mock_get_all_comp,
                                          mock_get_svc_by_binary):
@@ -500,14 +562,14 @@ class HostManagerTestCase(test.NoDBTestCase):
         host_state = host_manager.HostState('host1', cn1)
         self.assertFalse(host_state.instances)
         mock_get_by_host.return_value = None
-        hm._add_instance_info(context, cn1, host_state)
+        hm._add_instance_info(context, 'host1', host_state)
         self.assertFalse(mock_get_by_host.called)
         self.assertTrue(host_state.instances)
         self.assertEqual(host_state.instances['uuid1'], inst1)
 
     @mock.patch('nova.objects.ServiceList.get_by_binary')
     @mock.patch('nova.objects.ComputeNodeList.get_all')
-    @mock.patch('nova.objects.InstanceList.get_by_host')
+    @mock.patch('nova.objects.InstanceList.get_projected_by_host')
     def test_get_all_host_states_not_updated(self, mock_get_by_host,
                                              mock_get_all_comp,
                                              mock_get_svc_by_binary):
@@ -522,12 +584,93 @@ class HostManagerTestCase(test.NoDBTestCase):
         host_state = host_manager.HostState('host1', cn1)
         self.assertFalse(host_state.instances)
         mock_get_by_host.return_value = objects.InstanceList(objects=[inst1])
-        hm._add_instance_info(context, cn1, host_state)
-        mock_get_by_host.assert_called_once_with(context, cn1.host)
+        hm._add_instance_info(context, 'host1', host_state)
+        self.assertFalse(mock_get_by_host.called)
         self.assertTrue(host_state.instances)
         self.assertEqual(host_state.instances['uuid1'], inst1)
 
-    @mock.patch('nova.objects.InstanceList.get_by_host')
+    @mock.patch('nova.objects.InstanceList.get_projected_by_host')
+    def test_get_all_host_states_not_updated_no_tracking(self,
+                                                         mock_get_by_host):
+        context = 'fake_context'
+        hm = self.host_manager
+        hm.tracks_instance_changes = False
+        inst1 = objects.Instance(uuid='uuid1')
+        cn1 = objects.ComputeNode(host='host1')
+        hm._instance_info = {'host1': {'instances': {'uuid1': inst1},
+                                       'updated': False}}
+        host_state = host_manager.HostState('host1', cn1)
+        mock_get_by_host.return_value = objects.InstanceList(objects=[inst1])
+        hm._add_instance_info(context, 'host1', host_state)
+        mock_get_by_host.assert_called_once_with(
+            context, cn1.host, host_manager.INSTANCE_INFO_FIELDS)
+        self.assertEqual(host_state.instances['uuid1'], inst1)
+
+    @mock.patch('nova.objects.InstanceList.get_projected_by_host')
+    @mock.patch('nova.objects.InstanceList.get_projected_by_filters')
+    @mock.patch('nova.objects.ComputeNodeList.get_all')
+    @mock.patch('nova.objects.ServiceList.get_by_binary')
+    def test_get_all_host_states_prefetches_instance_info(
+            self, mock_get_svc_by_binary, mock_get_all_comp,
+            mock_get_by_filters, mock_get_by_host):
+        mock_get_all_comp.return_value = fakes.COMPUTE_NODES
+        mock_get_svc_by_binary.return_value = fakes.SERVICES
+        inst1 = objects.Instance(uuid='uuid1', host='host1')
+        inst2 = objects.Instance(uuid='uuid2', host='host2')
+        mock_get_by_filters.return_value = objects.InstanceList(
+            objects=[inst2])
+        hm = self.host_manager
+        hm._instance_info = {'host1': {'instances': {'uuid1': inst1},
+                                       'updated': True}}
+
+        hm.get_all_host_states('fake_context')
+
+        mock_get_by_filters.assert_called_once_with(
+            'fake_context',
+            {'deleted': False, 'soft_deleted': True, 'host': mock.ANY},
+            host_manager.INSTANCE_INFO_PAGE_FIELDS, sort_keys=['id'],
+            sort_dirs=['asc'], limit=CONF.scheduler_instance_info_page_size,
+            marker=None)
+        self.assertEqual(
+            set(['host2', 'host3', 'host4']),
+            set(mock_get_by_filters.call_args[0][1]['host']))
+        self.assertFalse(mock_get_by_host.called)
+        host_state_map = hm.host_state_map
+        self.assertEqual({'uuid1': inst1},
+                         host_state_map[('host1', 'node1')].instances)
+        self.assertEqual({'uuid2': inst2},
+                         host_state_map[('host2', 'node2')].instances)
+        self.assertEqual({}, host_state_map[('host3', 'node3')].instances)
+
+    @mock.patch('nova.objects.InstanceList.get_projected_by_filters')
+    def test_refresh_instance_info(self, mock_get_by_filters):
+        inst1 = objects.Instance(uuid='uuid1', host='host1')
+        inst2 = objects.Instance(uuid='uuid2', host='host2')
+        mock_get_by_filters.return_value = objects.InstanceList(
+            objects=[inst2])
+        hm = self.host_manager
+        updated_info = {'instances': {'uuid1': inst1}, 'updated': True}
+        hm._instance_info = {'host1': updated_info,
+                             'host2': {'instances': {}, 'updated': False}}
+
+        hm.refresh_instance_info('fake_context')
+
+        self.assertEqual(['host2'],
+                         mock_get_by_filters.call_args[0][1]['host'])
+        self.assertIs(updated_info, hm._instance_info['host1'])
+        self.assertEqual({'uuid2': inst2},
+                         hm._instance_info['host2']['instances'])
+        self.assertFalse(hm._instance_info['host2']['updated'])
+
+    @mock.patch('nova.objects.InstanceList.get_projected_by_filters')
+    def test_refresh_instance_info_no_tracking(self, mock_get_by_filters):
+        hm = self.host_manager
+        hm.tracks_instance_changes = False
+        hm._instance_info = {'host2': {'instances': {}, 'updated': False}}
+        hm.refresh_instance_info('fake_context')
+        self.assertFalse(mock_get_by_filters.called)
+
+    @mock.patch('nova.objects.InstanceList.get_projected_by_host')
     def test_recreate_instance_info(self, mock_get_by_host):
         host_name = 'fake_host'
         inst1 = fake_instance.fake_instance_obj('fake_context', uuid='aaa',
@@ -543,6 +686,8 @@ class HostManagerTestCase(test.NoDBTestCase):
                     'updated': True,
                 }}
         self.host_manager._recreate_instance_info('fake_context', host_name)
+        mock_get_by_host.assert_called_once_with(
+            'fake_context', host_name, host_manager.INSTANCE_INFO_FIELDS)
         new_info = self.host_manager._instance_info[host_name]
         self.assertEqual(len(new_info['instances']), len(new_inst_list))
         self.assertFalse(new_info['updated'])
@@ -673,6 +818,34 @@ class HostManagerTestCase(test.NoDBTestCase):
                 'fake_context', host_name)
         self.assertFalse(new_info['updated'])
 
+    def test_sync_instance_info_after_updates(self):
+        self.host_manager._recreate_instance_info = mock.MagicMock()
+        host_name = 'fake_host'
+        inst1 = fake_instance.fake_instance_obj('fake_context', uuid='aaa',
+                                                host=host_name)
+        inst2 = fake_instance.fake_instance_obj('fake_context', uuid='bbb',
+                                                host=host_name)
+        self.host_manager._instance_info = {
+                host_name: {
+                    'instances': {inst1.uuid: inst1},
+                    'updated': False,
+                }}
+        self.host_manager.update_instance_info(
+            'fake_context', host_name, objects.InstanceList(objects=[inst2]))
+        self.host_manager.update_instance_info(
+            'fake_context', host_name, objects.InstanceList(objects=[inst2]))
+        self.host_manager.delete_instance_info('fake_context', host_name,
+                                               'aaa')
+        self.host_manager.delete_instance_info('fake_context', host_name,
+                                               'aaa')
+        self.assertEqual(
+            ['bbb'], list(self.host_manager._instance_info[host_name][
+                'instances']))
+
+        self.host_manager.sync_instance_info('fake_context', host_name,
+                                             ['bbb'])
+        self.assertFalse(self.host_manager._recreate_instance_info.called)
+
 
 class HostManagerChangedNodesTestCase(test.NoDBTestCase):
     """Test case for HostManager class."""
@@ -689,9 +862,9 @@ class HostManagerChangedNodesTestCase(test.NoDBTestCase):
               host_manager.HostState('host4', 'node4')
             ]
 
-    @mock.patch('nova.objects.InstanceList.get_by_host')
-    def test_get_all_host_states(self, mock_get_by_host):
-        mock_get_by_host.return_value = objects.InstanceList()
+    @mock.patch('nova.objects.InstanceList.get_projected_by_filters')
+    def test_get_all_host_states(self, mock_get_by_filters):
+        mock_get_by_filters.return_value = objects.InstanceList()
         context = 'fake_context'
 
         self.mox.StubOutWithMock(objects.ServiceList, 'get_by_binary')
@@ -705,9 +878,9 @@ class HostManagerChangedNodesTestCase(test.NoDBTestCase):
         host_states_map = self.host_manager.host_state_map
         self.assertEqual(len(host_states_map), 4)
 
-    @mock.patch('nova.objects.InstanceList.get_by_host')
-    def test_get_all_host_states_after_delete_one(self, mock_get_by_host):
-        mock_get_by_host.return_value = objects.InstanceList()
+    @mock.patch('nova.objects.InstanceList.get_projected_by_filters')
+    def test_get_all_host_states_after_delete_one(self, mock_get_by_filters):
+        mock_get_by_filters.return_value = objects.InstanceList()
         context = 'fake_context'
 
         self.mox.StubOutWithMock(objects.ServiceList, 'get_by_binary')
@@ -729,9 +902,9 @@ class HostManagerChangedNodesTestCase(test.NoDBTestCase):
         host_states_map = self.host_manager.host_state_map
         self.assertEqual(len(host_states_map), 3)
 
-    @mock.patch('nova.objects.InstanceList.get_by_host')
-    def test_get_all_host_states_after_delete_all(self, mock_get_by_host):
-        mock_get_by_host.return_value = objects.InstanceList()
+    @mock.patch('nova.objects.InstanceList.get_projected_by_filters')
+    def test_get_all_host_states_after_delete_all(self, mock_get_by_filters):
+        mock_get_by_filters.return_value = objects.InstanceList()
         context = 'fake_context'
 
         self.mox.StubOutWithMock(objects.ServiceList, 'get_by_binary')
@@ -751,6 +924,102 @@ class HostManagerChangedNodesTestCase(test.NoDBTestCase):
         host_states_map = self.host_manager.host_state_map
         self.assertEqual(len(host_states_map), 0)
 
+    def _get_updated_compute_nodes(self, updated_at):
+        compute_nodes = []
+        for compute in fakes.COMPUTE_NODES[:4]:
+            compute = compute.obj_clone()
+            compute.updated_at = updated_at
+            compute.deleted = False
+            compute_nodes.append(compute)
+        return compute_nodes
+
+    @mock.patch('nova.objects.InstanceList.get_projected_by_filters')
+    @mock.patch('nova.objects.ComputeNodeList.get_all_changed_since')
+    @mock.patch('nova.objects.ComputeNodeList.get_all')
+    @mock.patch('nova.objects.ServiceList.get_by_binary')
+    def test_get_all_host_states_incremental(self, mock_get_svc,
+                                             mock_get_all, mock_get_changed,
+                                             mock_get_by_filters):
+        mock_get_by_filters.return_value = objects.InstanceList()
+        context = 'fake_context'
+        hm = self.host_manager
+        hm.incremental_host_refresh = True
+        now = timeutils.utcnow().replace(tzinfo=iso8601.iso8601.Utc())
+        mock_get_svc.return_value = fakes.SERVICES
+        mock_get_all.return_value = self._get_updated_compute_nodes(now)
+
+        hm.get_all_host_states(context)
+        self.assertFalse(mock_get_changed.called)
+        self.assertEqual(4, hm.refreshed_compute_nodes)
+
+        compute = self._get_updated_compute_nodes(
+            now + datetime.timedelta(seconds=1))[1]
+        compute.free_ram_mb = 256
+        mock_get_changed.return_value = [compute]
+        host_states = list(hm.get_all_host_states(context))
+
+        mock_get_all.assert_called_once_with(context)
+        mock_get_changed.assert_called_once_with(context, mock.ANY)
+        self.assertEqual(1, hm.refreshed_compute_nodes)
+        self.assertEqual(4, len(host_states))
+        host_state = hm.host_state_map[('host2', 'node2')]
+        self.assertEqual(256, host_state.free_ram_mb)
+        self.assertTrue(host_state.service['disabled'])
+        host_state = hm.host_state_map[('host1', 'node1')]
+        self.assertEqual(512, host_state.free_ram_mb)
+
+    @mock.patch('nova.objects.InstanceList.get_projected_by_filters')
+    @mock.patch('nova.objects.ComputeNodeList.get_all_changed_since')
+    @mock.patch('nova.objects.ComputeNodeList.get_all')
+    @mock.patch('nova.objects.ServiceList.get_by_binary')
+    def test_get_all_host_states_incremental_deleted(self, mock_get_svc,
+                                                     mock_get_all,
+                                                     mock_get_changed,
+                                                     mock_get_by_filters):
+        mock_get_by_filters.return_value = objects.InstanceList()
+        context = 'fake_context'
+        hm = self.host_manager
+        hm.incremental_host_refresh = True
+        now = timeutils.utcnow().replace(tzinfo=iso8601.iso8601.Utc())
+        mock_get_svc.return_value = fakes.SERVICES
+        mock_get_all.return_value = self._get_updated_compute_nodes(now)
+        hm.get_all_host_states(context)
+
+        compute = self._get_updated_compute_nodes(now)[3]
+        compute.deleted = True
+        mock_get_changed.return_value = [compute]
+        # host1 lost its service record
+        mock_get_svc.return_value = fakes.SERVICES[1:]
+        hm.get_all_host_states(context)
+
+        self.assertEqual(set([('host2', 'node2'), ('host3', 'node3')]),
+                         set(hm.host_state_map.keys()))
+
+    @mock.patch('nova.objects.InstanceList.get_projected_by_filters')
+    @mock.patch('nova.objects.ComputeNodeList.get_all_changed_since')
+    @mock.patch('nova.objects.ComputeNodeList.get_all')
+    @mock.patch('nova.objects.ServiceList.get_by_binary')
+    def test_get_all_host_states_incremental_reset_host(self, mock_get_svc,
+                                                        mock_get_all,
+                                                        mock_get_changed,
+                                                        mock_get_by_filters):
+        mock_get_by_filters.return_value = objects.InstanceList()
+        context = 'fake_context'
+        hm = self.host_manager
+        hm.incremental_host_refresh = True
+        now = timeutils.utcnow().replace(tzinfo=iso8601.iso8601.Utc())
+        mock_get_svc.return_value = fakes.SERVICES
+        mock_get_all.return_value = self._get_updated_compute_nodes(now)
+        hm.get_all_host_states(context)
+
+        # A failed multiple create resets the consumed host states
+        hm.host_state_map[('host1', 'node1')].updated = None
+        hm.get_all_host_states(context)
+
+        self.assertEqual(2, mock_get_all.call_count)
+        self.assertFalse(mock_get_changed.called)
+        self.assertEqual(4, hm.refreshed_compute_nodes)
+
 
 class HostStateTestCase(test.NoDBTestCase):
     """Test case for HostState class."""
@@ -0,0 +1,170 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests For the shared host state caches.
+"""
+
+import datetime
+
+import fixtures
+import iso8601
+
+from nova.pci import stats as pci_stats
+from nova.scheduler import host_manager
+from nova.scheduler import host_state_cache
+from nova import test
+
+
+class HostStateEntryTestCase(test.NoDBTestCase):
+
+    def test_entry_round_trip(self):
+        host_state = host_manager.HostState('host1', 'node1')
+        host_state.free_ram_mb = 1024
+        host_state.free_disk_mb = 2048
+        host_state.vcpus_used = 3
+        host_state.num_instances = 4
+        host_state.num_io_ops = 5
+        host_state.updated = datetime.datetime(2015, 1, 1, 12, 0, 0, 500,
+                                               tzinfo=iso8601.iso8601.Utc())
+        host_state.numa_topology = 'fake-numa-topology'
+        host_state.pci_stats = pci_stats.PciDeviceStats()
+        host_state.pci_stats.pools = [{'vendor_id': 'v1', 'count': 2}]
+
+        entry = host_state_cache.entry_from_host_state(host_state)
+        other = host_manager.HostState('host1', 'node1')
+        host_state_cache.update_host_state(other, entry)
+
+        self.assertEqual(1024, other.free_ram_mb)
+        self.assertEqual(2048, other.free_disk_mb)
+        self.assertEqual(3, other.vcpus_used)
+        self.assertEqual(4, other.num_instances)
+        self.assertEqual(5, other.num_io_ops)
+        self.assertEqual(host_state.updated, other.updated)
+        self.assertEqual('fake-numa-topology', other.numa_topology)
+        self.assertEqual(host_state.pci_stats.pools, other.pci_stats.pools)
+        self.assertIsNot(host_state.pci_stats.pools, other.pci_stats.pools)
+
+    def test_is_newer(self):
+        host_state = host_manager.HostState('host1', 'node1')
+        entry = host_state_cache.entry_from_host_state(host_state)
+        self.assertFalse(host_state_cache.is_newer(entry, host_state))
+
+        host_state.updated = datetime.datetime(2015, 1, 1, 12, 0, 0,
+                                               tzinfo=iso8601.iso8601.Utc())
+        entry = host_state_cache.entry_from_host_state(host_state)
+        self.assertFalse(host_state_cache.is_newer(entry, host_state))
+        self.assertFalse(host_state_cache.is_older(entry, host_state))
+
+        host_state.updated = datetime.datetime(2015, 1, 1, 11, 0, 0)
+        self.assertTrue(host_state_cache.is_newer(entry, host_state))
+        self.assertFalse(host_state_cache.is_older(entry, host_state))
+        host_state.updated = datetime.datetime(2015, 1, 1, 13, 0, 0)
+        self.assertFalse(host_state_cache.is_newer(entry, host_state))
+        self.assertTrue(host_state_cache.is_older(entry, host_state))
+        host_state.updated = None
+        self.assertTrue(host_state_cache.is_newer(entry, host_state))
+        self.assertFalse(host_state_cache.is_older(entry, host_state))
+
+
+class _HostStateCacheTestMixin(object):
+
+    def _get_cache(self):
+        raise NotImplementedError()
+
+    def setUp(self):
+        super(_HostStateCacheTestMixin, self).setUp()
+        self.cache = self._get_cache()
+
+    def test_compare_and_set(self):
+        self.assertIsNone(self.cache.get('node1@host1'))
+        self.assertTrue(self.cache.compare_and_set('node1@host1',
+                                                   {'free_ram_mb': 1}, 0))
+        self.assertEqual({'free_ram_mb': 1, 'version': 1},
+                         self.cache.get('node1@host1'))
+
+        self.assertFalse(self.cache.compare_and_set('node1@host1',
+                                                    {'free_ram_mb': 2}, 0))
+        self.assertEqual({'free_ram_mb': 1, 'version': 1},
+                         self.cache.get('node1@host1'))
+
+        self.assertTrue(self.cache.compare_and_set('node1@host1',
+                                                   {'free_ram_mb': 2}, 1))
+        self.assertEqual({'free_ram_mb': 2, 'version': 2},
+                         self.cache.get('node1@host1'))
+
+    def test_compare_and_set_locked(self):
+        self.assertTrue(self.cache._lock('node1@host1'))
+        self.assertFalse(self.cache.compare_and_set('node1@host1',
+                                                    {'free_ram_mb': 1}, 0))
+        self.cache._unlock('node1@host1')
+        self.assertTrue(self.cache.compare_and_set('node1@host1',
+                                                   {'free_ram_mb': 1}, 0))
+
+    def test_generation(self):
+        self.assertEqual(0, self.cache.get_generation())
+        self.assertEqual(1, self.cache.compare_and_set('node1@host1', {}, 0))
+        self.assertEqual(1, self.cache.get_generation())
+        self.assertIsNone(self.cache.compare_and_set('node1@host1', {}, 0))
+        self.assertEqual(1, self.cache.get_generation())
+        self.assertEqual(2, self.cache.compare_and_set('node2@host2', {}, 0))
+        self.assertEqual(2, self.cache.get_generation())
+
+    def test_refresh(self):
+        self.assertIsNone(self.cache.get_refreshed_keys())
+        self.assertTrue(self.cache.start_refresh(60))
+        # another worker is refreshing
+        self.assertFalse(self.cache.start_refresh(0))
+        self.cache.finish_refresh(['node2@host2', 'node1@host1'])
+        self.assertEqual(['node1@host1', 'node2@host2'],
+                         self.cache.get_refreshed_keys())
+
+        # refreshed less than 60 seconds ago
+        self.assertFalse(self.cache.start_refresh(60))
+        self.assertTrue(self.cache.start_refresh(0))
+        # the refresh failed
+        self.cache.finish_refresh(None)
+        self.assertEqual(['node1@host1', 'node2@host2'],
+                         self.cache.get_refreshed_keys())
+        self.assertTrue(self.cache.start_refresh(0))
+
+    def test_get_many(self):
+        self.cache.compare_and_set('node1@host1', {'free_ram_mb': 1}, 0)
+        self.cache.compare_and_set('node2@host2', {'free_ram_mb': 2}, 0)
+
+        entries = self.cache.get_many(['node1@host1', 'node3@host3'])
+
+        self.assertEqual({'node1@host1': {'free_ram_mb': 1, 'version': 1}},
+                         entries)
+
+
+class FileHostStateCacheTestCase(_HostStateCacheTestMixin,
+                                 test.NoDBTestCase):
+
+    def _get_cache(self):
+        path = self.useFixture(fixtures.TempDir()).path
+        return host_state_cache.FileHostStateCache(path)
+
+    def test_shared_between_instances(self):
+        other = host_state_cache.FileHostStateCache(self.cache.path)
+        self.cache.compare_and_set('node1@host1', {'free_ram_mb': 1}, 0)
+
+        self.assertEqual({'free_ram_mb': 1, 'version': 1},
+                         other.get('node1@host1'))
+        self.assertEqual(1, other.get_generation())
+        self.assertFalse(other.compare_and_set('node1@host1', {}, 0))
+
+
+class MemcachedHostStateCacheTestCase(_HostStateCacheTestMixin,
+                                      test.NoDBTestCase):
+
+    def _get_cache(self):
+        return host_state_cache.MemcachedHostStateCache()
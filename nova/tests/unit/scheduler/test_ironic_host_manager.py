@@ -76,7 +76,8 @@ class IronicHostManagerTestCase(test.NoDBTestCase):
             ironic_fakes.COMPUTE_NODES)
         self.mox.ReplayAll()
 
-        with mock.patch.object(nova.objects.InstanceList, 'get_by_host'):
+        with mock.patch.object(nova.objects.InstanceList,
+                               'get_projected_by_filters'):
             self.host_manager.get_all_host_states(context)
         host_states_map = self.host_manager.host_state_map
 
@@ -155,7 +156,8 @@ class IronicHostManagerChangedNodesTestCase(test.NoDBTestCase):
         objects.ComputeNodeList.get_all(context).AndReturn(running_nodes)
         self.mox.ReplayAll()
 
-        with mock.patch.object(nova.objects.InstanceList, 'get_by_host'):
+        with mock.patch.object(nova.objects.InstanceList,
+                               'get_projected_by_filters'):
             self.host_manager.get_all_host_states(context)
             self.host_manager.get_all_host_states(context)
         host_states_map = self.host_manager.host_state_map
@@ -177,7 +179,8 @@ class IronicHostManagerChangedNodesTestCase(test.NoDBTestCase):
         objects.ComputeNodeList.get_all(context).AndReturn([])
         self.mox.ReplayAll()
 
-        with mock.patch.object(nova.objects.InstanceList, 'get_by_host'):
+        with mock.patch.object(nova.objects.InstanceList,
+                               'get_projected_by_filters'):
             self.host_manager.get_all_host_states(context)
             self.host_manager.get_all_host_states(context)
         host_states_map = self.host_manager.host_state_map
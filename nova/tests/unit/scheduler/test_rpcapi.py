@@ -38,6 +38,8 @@ class SchedulerRpcAPITestCase(test.NoDBTestCase):
         expected_version = kwargs.pop('version', None)
         expected_fanout = kwargs.pop('fanout', None)
         expected_kwargs = kwargs.copy()
+        if 'host' in kwargs:
+            expected_kwargs.pop('host')
 
         self.mox.StubOutWithMock(rpcapi, 'client')
 
@@ -47,6 +49,8 @@ class SchedulerRpcAPITestCase(test.NoDBTestCase):
         prepare_kwargs = {}
         if expected_fanout:
             prepare_kwargs['fanout'] = True
+        if 'host' in kwargs:
+            prepare_kwargs['server'] = kwargs['host']
         if expected_version:
             prepare_kwargs['version'] = expected_version
         rpcapi.client.prepare(**prepare_kwargs).AndReturn(rpcapi.client)
@@ -101,3 +105,9 @@ class SchedulerRpcAPITestCase(test.NoDBTestCase):
                 instance_uuids=['fake1', 'fake2'],
                 fanout=True,
                 version='4.2')
+
+    def test_get_timings(self):
+        self._test_scheduler_api('get_timings', rpc_method='call',
+                host='fake_host',
+                reset=True,
+                version='4.3')
@@ -60,6 +60,40 @@ class SchedulerManagerTestCase(test.NoDBTestCase):
             self.manager.select_destinations(None, None, {})
             select_destinations.assert_called_once_with(None, None, {})
 
+    @mock.patch.object(manager.LOG, 'info')
+    def test_dump_filter_stats(self, mock_log):
+        stats = {'objs_in': 10, 'objs_out': 5, 'pass_rate': 0.5,
+                 'cost': 0.001}
+        with mock.patch.object(self.manager.driver.host_manager,
+                               'get_filter_stats',
+                               return_value={'RamFilter': stats}):
+            self.manager._dump_filter_stats(None)
+        self.assertEqual(1, mock_log.call_count)
+        self.assertEqual('RamFilter', mock_log.call_args[0][1]['name'])
+
+    def test_refresh_instance_info(self):
+        with mock.patch.object(self.manager.driver.host_manager,
+                               'refresh_instance_info') as refresh:
+            self.manager._refresh_instance_info(mock.sentinel.ctx)
+            refresh.assert_called_once_with(mock.sentinel.ctx)
+
+    def test_get_timings(self):
+        with mock.patch.object(self.manager.driver.host_manager,
+                               'get_timings') as get_timings:
+            result = self.manager.get_timings(None, reset=True)
+            get_timings.assert_called_once_with(reset=True)
+            self.assertEqual(get_timings.return_value, result)
+
+    @mock.patch('nova.rpc.get_notifier')
+    def test_emit_timings_notification(self, mock_get_notifier):
+        with mock.patch.object(self.manager.driver.host_manager,
+                               'get_timings') as get_timings:
+            self.manager._emit_timings_notification(self.context)
+        mock_get_notifier.assert_called_once_with('scheduler',
+                                                  self.manager.host)
+        mock_get_notifier.return_value.info.assert_called_once_with(
+            self.context, 'scheduler.timings', get_timings.return_value)
+
     def test_update_aggregates(self):
         with mock.patch.object(self.manager.driver.host_manager,
                                'update_aggregates'
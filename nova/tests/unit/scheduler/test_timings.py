@@ -0,0 +1,72 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests For the scheduler timing histograms.
+"""
+
+import mock
+
+from nova.scheduler import timings
+from nova import test
+
+
+class TimingsTestCase(test.NoDBTestCase):
+
+    def test_histogram(self):
+        histogram = timings.Histogram()
+        for seconds in (0.0002, 0.0004, 0.003, 10.0):
+            histogram.observe(seconds)
+
+        result = histogram.to_dict()
+
+        self.assertEqual(4, result['count'])
+        self.assertAlmostEqual(10.0036, result['total'])
+        self.assertEqual(10.0, result['max'])
+        self.assertEqual([[0.0001, 0], [0.0005, 2], [0.001, 0], [0.005, 1]],
+                         result['buckets'][:4])
+        self.assertEqual([None, 1], result['buckets'][-1])
+
+    def test_percentile(self):
+        histogram = timings.Histogram()
+        self.assertIsNone(timings.percentile(histogram.to_dict(), 0.5))
+        for seconds in (0.0002, 0.0004, 0.003, 10.0):
+            histogram.observe(seconds)
+
+        result = histogram.to_dict()
+
+        self.assertEqual(0.0005, timings.percentile(result, 0.5))
+        self.assertEqual(0.005, timings.percentile(result, 0.75))
+        self.assertIsNone(timings.percentile(result, 0.99))
+
+    @mock.patch('time.time', side_effect=[10.0, 10.5])
+    def test_timed(self, mock_time):
+        timer = timings.Timings()
+        durations = {}
+
+        with timer.timed(timings.PHASE, 'filtering', durations):
+            pass
+
+        self.assertEqual({'filtering': 0.5}, durations)
+        result = timer.to_dict()
+        self.assertEqual(['phase'], list(result))
+        self.assertEqual(1, result['phase']['filtering']['count'])
+        self.assertEqual(0.5, result['phase']['filtering']['total'])
+
+    def test_reset(self):
+        timer = timings.Timings()
+        timer.observe(timings.FILTER, 'RamFilter', 0.1)
+        timer.observe(timings.WEIGHER, 'RAMWeigher', 0.1)
+        self.assertEqual(['filter', 'weigher'], sorted(timer.to_dict()))
+
+        timer.reset()
+
+        self.assertEqual({}, timer.to_dict())
@@ -13,11 +13,13 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import os
 import StringIO
 import sys
 
 import fixtures
 import mock
+from oslo_serialization import jsonutils
 
 from nova.cmd import manage
 from nova import context
@@ -383,6 +385,70 @@ class DBCommandsTestCase(test.TestCase):
     def test_archive_deleted_rows_negative(self):
         self.assertEqual(1, self.commands.archive_deleted_rows(-1))
 
+    def test_archive_deleted_rows_negative_batch_size(self):
+        self.assertEqual(1, self.commands.archive_deleted_rows(batch_size=0))
+
+    def _fake_run(self, complete, tables):
+        def fake_run(context, *args, **kwargs):
+            kwargs['state'].update({'complete': complete, 'tables': tables})
+            for tablename, progress in tables.items():
+                kwargs['progress'](tablename, progress)
+            return kwargs['state']
+        return fake_run
+
+    @mock.patch.object(db, 'purge_shadow_tables')
+    @mock.patch.object(db, 'archive_deleted_rows_parallel')
+    def test_archive_deleted_rows(self, mock_archive, mock_purge):
+        mock_archive.side_effect = self._fake_run(True, {
+            'instances': {'rows': 10, 'seconds': 2.0, 'done': True},
+            'consoles': {'rows': 0, 'seconds': 0.5, 'done': True}})
+        mock_purge.side_effect = self._fake_run(True, {
+            'instances': {'rows': 4, 'seconds': 1.0, 'done': True}})
+        output = StringIO.StringIO()
+        self.useFixture(fixtures.MonkeyPatch('sys.stdout', output))
+        self.commands.archive_deleted_rows(max_rows='100', batch_size='5',
+                                           workers='2', purge_older_than='30')
+        mock_archive.assert_called_once_with(
+            mock.ANY, batch_size=5, workers=2, max_rows=100, state=mock.ANY,
+            progress=mock.ANY)
+        mock_purge.assert_called_once_with(
+            mock.ANY, mock.ANY, batch_size=5, workers=2, state=mock.ANY,
+            progress=mock.ANY)
+        lines = output.getvalue().splitlines()
+        self.assertEqual(3, len(lines))
+        self.assertEqual(['archive', 'instances', '10', '2.0', '5.0', 'done'],
+                         lines[1].split())
+        self.assertEqual(['purge', 'instances', '4', '1.0', '4.0', 'done'],
+                         lines[2].split())
+
+    @mock.patch.object(db, 'archive_deleted_rows_parallel')
+    def test_archive_deleted_rows_checkpoint(self, mock_archive):
+        self.useFixture(fixtures.MonkeyPatch('sys.stdout',
+                                             StringIO.StringIO()))
+        checkpoint = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                                  'checkpoint')
+        tables = {'instances': {'rows': 10, 'seconds': 2.0, 'done': False}}
+        mock_archive.side_effect = self._fake_run(False, tables)
+        self.commands.archive_deleted_rows(checkpoint=checkpoint)
+        with open(checkpoint) as f:
+            saved = jsonutils.load(f)
+        self.assertEqual({'archive': {'complete': False, 'tables': tables}},
+                         saved)
+
+        # The next run resumes from the checkpoint, which is removed once
+        # all the tables are done.
+        resumed = []
+
+        def fake_resume(context, *args, **kwargs):
+            resumed.append(dict(kwargs['state']))
+            kwargs['state']['complete'] = True
+            return kwargs['state']
+
+        mock_archive.side_effect = fake_resume
+        self.commands.archive_deleted_rows(checkpoint=checkpoint)
+        self.assertEqual([saved['archive']], resumed)
+        self.assertFalse(os.path.exists(checkpoint))
+
     @mock.patch.object(migration, 'db_null_instance_uuid_scan',
                        return_value={'foo': 0})
     def test_null_instance_uuid_scan_no_records_found(self, mock_scan):
@@ -440,6 +506,31 @@ class ApiDbCommandsTestCase(test.TestCase):
         sqla_sync.assert_called_once_with(version=4, database='api')
 
 
+class SchedulerCommandsTestCase(test.NoDBTestCase):
+    def setUp(self):
+        super(SchedulerCommandsTestCase, self).setUp()
+        self.commands = manage.SchedulerCommands()
+
+    @mock.patch('nova.scheduler.rpcapi.SchedulerAPI.get_timings')
+    def test_timings(self, mock_get_timings):
+        histogram = {'count': 4, 'total': 0.02, 'max': 0.008,
+                     'buckets': [[0.001, 1], [0.01, 3], [None, 0]]}
+        mock_get_timings.return_value = {'phase': {'total': histogram},
+                                         'filter': {'RamFilter': histogram}}
+        output = StringIO.StringIO()
+        self.useFixture(fixtures.MonkeyPatch('sys.stdout', output))
+
+        self.commands.timings('fake_host', reset=True)
+
+        mock_get_timings.assert_called_once_with(mock.ANY, 'fake_host',
+                                                 reset=True)
+        lines = output.getvalue().splitlines()
+        self.assertEqual(3, len(lines))
+        self.assertEqual(['phase', 'total', '4', '5.00', '8.00', '10.00',
+                          '10.00', '10.00'], lines[1].split())
+        self.assertEqual('filter', lines[2].split()[0])
+
+
 class ServiceCommandsTestCase(test.TestCase):
     def setUp(self):
         super(ServiceCommandsTestCase, self).setUp()
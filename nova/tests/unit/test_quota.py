@@ -16,6 +16,7 @@
 
 import datetime
 
+import mock
 from oslo_config import cfg
 from oslo_utils import timeutils
 from six.moves import range
@@ -800,6 +801,95 @@ class QuotaEngineTestCase(test.TestCase):
                           'test_resource3', 'test_resource4'])
 
 
+class LimitCacheTestCase(test.TestCase):
+    def setUp(self):
+        super(LimitCacheTestCase, self).setUp()
+        self.flags(quota_limit_cache_ttl=60)
+        self.addCleanup(quota.LIMIT_CACHE.clear)
+        self.context = context.get_admin_context()
+        self.useFixture(test.TimeOverride())
+        db.quota_create(self.context, 'test_project', 'instances', 5)
+        db.quota_create(self.context, 'test_project', 'cores', 7,
+                        user_id='fake_user')
+        db.quota_class_create(self.context, 'default', 'ram', 2048)
+
+    @mock.patch.object(db, 'quota_get_all_by_project',
+                       wraps=db.quota_get_all_by_project)
+    def test_get_project(self, mock_get):
+        limits = quota.LIMIT_CACHE.get_project(self.context, 'test_project')
+        self.assertEqual({'project_id': 'test_project', 'instances': 5},
+                         limits)
+        # The callers get copies of the cached limits
+        limits['instances'] = 42
+        self.assertEqual(5, quota.LIMIT_CACHE.get_project(
+            self.context, 'test_project')['instances'])
+        self.assertEqual(1, mock_get.call_count)
+
+        timeutils.advance_time_seconds(61)
+        quota.LIMIT_CACHE.get_project(self.context, 'test_project')
+        self.assertEqual(2, mock_get.call_count)
+
+    @mock.patch.object(db, 'quota_get_all_by_project',
+                       wraps=db.quota_get_all_by_project)
+    def test_get_project_disabled(self, mock_get):
+        self.flags(quota_limit_cache_ttl=0)
+        quota.LIMIT_CACHE.get_project(self.context, 'test_project')
+        quota.LIMIT_CACHE.get_project(self.context, 'test_project')
+        self.assertEqual(2, mock_get.call_count)
+
+    def test_get_user(self):
+        self.assertEqual({'project_id': 'test_project',
+                          'user_id': 'fake_user', 'cores': 7},
+                         quota.LIMIT_CACHE.get_user(self.context,
+                                                    'test_project',
+                                                    'fake_user'))
+        db.quota_update(self.context, 'test_project', 'cores', 8,
+                        user_id='fake_user')
+        self.assertEqual(8, quota.LIMIT_CACHE.get_user(
+            self.context, 'test_project', 'fake_user')['cores'])
+
+    def test_get_default(self):
+        self.assertEqual({'class_name': 'default', 'ram': 2048},
+                         quota.LIMIT_CACHE.get_default(self.context))
+        db.quota_class_update(self.context, 'default', 'ram', 4096)
+        self.assertEqual(4096, quota.LIMIT_CACHE.get_default(
+            self.context)['ram'])
+
+    def test_get_class(self):
+        db.quota_class_create(self.context, 'test_class', 'instances', 3)
+        self.assertEqual({'class_name': 'test_class', 'instances': 3},
+                         quota.LIMIT_CACHE.get_class(self.context,
+                                                     'test_class'))
+        # The access to the class is checked for the cached limits too
+        user_context = context.RequestContext('fake_user', 'test_project',
+                                              quota_class='other_class')
+        self.assertRaises(exception.Forbidden, quota.LIMIT_CACHE.get_class,
+                          user_context, 'test_class')
+
+    def test_invalidated_by_changes(self):
+        quota.LIMIT_CACHE.get_project(self.context, 'test_project')
+        db.quota_create(self.context, 'test_project', 'ram', 1024)
+        self.assertEqual(1024, quota.LIMIT_CACHE.get_project(
+            self.context, 'test_project')['ram'])
+        db.quota_destroy_all_by_project(self.context, 'test_project')
+        self.assertEqual({'project_id': 'test_project'},
+                         quota.LIMIT_CACHE.get_project(self.context,
+                                                       'test_project'))
+
+    def test_driver_get_user_quotas(self):
+        driver = quota.DbQuotaDriver()
+        resources = {'instances': quota.ReservableResource(
+            'instances', '_sync_instances', 'quota_instances')}
+        with mock.patch.object(db, 'quota_get_all_by_project',
+                               wraps=db.quota_get_all_by_project) as mock_get:
+            for i in range(3):
+                quotas = driver.get_user_quotas(self.context, resources,
+                                                'test_project', 'fake_user',
+                                                usages=False)
+                self.assertEqual({'instances': {'limit': 5}}, quotas)
+        self.assertEqual(1, mock_get.call_count)
+
+
 class DbQuotaDriverTestCase(test.TestCase):
     def setUp(self):
         super(DbQuotaDriverTestCase, self).setUp()
@@ -2472,6 +2562,8 @@ class QuotaReserveSqlAlchemyTestCase(test.TestCase):
                        fake_get_project_user_quota_usages)
         self.stubs.Set(sqa_api, '_quota_usage_create', fake_quota_usage_create)
         self.stubs.Set(sqa_api, '_reservation_create', fake_reservation_create)
+        self.stubs.Set(sqa_api, '_project_quota_usages_invalidate',
+                       lambda session, project_id: None)
 
         self.useFixture(test.TimeOverride())
 
@@ -2782,6 +2874,59 @@ class QuotaReserveSqlAlchemyTestCase(test.TestCase):
         self.compare_reservation(result, reservations_list)
 
 
+class CasQuotaDriverTestCase(test.TestCase):
+    def setUp(self):
+        super(CasQuotaDriverTestCase, self).setUp()
+        self.flags(reservation_expire=86400,
+                   until_refresh=0,
+                   max_age=0)
+        self.driver = quota.CasQuotaDriver()
+        self.calls = []
+        self.useFixture(test.TimeOverride())
+
+    def test_reserve(self):
+        def fake_quota_reserve_cas(context, resources, quotas, user_quotas,
+                                   deltas, expire, until_refresh, max_age,
+                                   project_id=None, user_id=None):
+            self.calls.append(('quota_reserve_cas', deltas, expire,
+                               project_id, user_id))
+            return ['resv-1']
+        self.stubs.Set(db, 'quota_reserve_cas', fake_quota_reserve_cas)
+
+        result = self.driver.reserve(FakeContext('test_project', 'test_class'),
+                                     quota.QUOTAS._resources,
+                                     dict(instances=2))
+
+        expire = timeutils.utcnow() + datetime.timedelta(seconds=86400)
+        self.assertEqual([('quota_reserve_cas', dict(instances=2), expire,
+                           'test_project', 'fake_user')], self.calls)
+        self.assertEqual(['resv-1'], result)
+
+    def test_commit(self):
+        def fake_reservation_commit_cas(context, reservations,
+                                        project_id=None, user_id=None):
+            self.calls.append(('reservation_commit_cas', reservations))
+        self.stubs.Set(db, 'reservation_commit_cas',
+                       fake_reservation_commit_cas)
+
+        self.driver.commit(FakeContext('test_project', 'test_class'),
+                           ['resv-1', 'resv-2'])
+        self.assertEqual([('reservation_commit_cas', ['resv-1', 'resv-2'])],
+                         self.calls)
+
+    def test_rollback(self):
+        def fake_reservation_rollback_cas(context, reservations,
+                                          project_id=None, user_id=None):
+            self.calls.append(('reservation_rollback_cas', reservations))
+        self.stubs.Set(db, 'reservation_rollback_cas',
+                       fake_reservation_rollback_cas)
+
+        self.driver.rollback(FakeContext('test_project', 'test_class'),
+                             ['resv-1', 'resv-2'])
+        self.assertEqual([('reservation_rollback_cas', ['resv-1', 'resv-2'])],
+                         self.calls)
+
+
 class NoopQuotaDriverTestCase(test.TestCase):
     def setUp(self):
         super(NoopQuotaDriverTestCase, self).setUp()
@@ -19,6 +19,8 @@ Tests For weights.
 import mock
 
 from nova.scheduler import weights as scheduler_weights
+from nova.scheduler.weights import io_ops
+from nova.scheduler.weights import ram
 from nova import test
 from nova.tests.unit.scheduler import fakes
 from nova import weights
@@ -71,3 +73,95 @@ class TestWeigher(test.NoDBTestCase):
         self.assertEqual(1, len(weighed_host))
         self.assertEqual('host1', weighed_host[0].obj.host)
         self.assertFalse(mock_weigh.called)
+
+    def test_update_weights(self):
+        host_values = [
+            ('host1', 'node1', {'free_ram_mb': 512}),
+            ('host2', 'node2', {'free_ram_mb': 1024}),
+            ('host3', 'node3', {'free_ram_mb': 2048}),
+        ]
+        hostinfo = [fakes.FakeHostState(host, node, values)
+                    for host, node, values in host_values]
+        weight_handler = scheduler_weights.HostWeightHandler()
+        weighers = [scheduler_weights.ram.RAMWeigher()]
+        weighed_hosts = weight_handler.get_weighed_objects(weighers,
+                                                           hostinfo, {})
+        self.assertEqual(1.0, weighed_hosts[0].weight)
+        self.assertEqual(0.5, weighed_hosts[1].weight)
+
+        # The weights of a subset of the hosts are normalized as before
+        hostinfo[2].free_ram_mb = 1024
+        weight_handler.update_weights(weighers, weighed_hosts[:1], {})
+        self.assertEqual(0.5, weighed_hosts[0].weight)
+        self.assertEqual(0.5, weighed_hosts[1].weight)
+
+    def _get_hostinfo(self):
+        host_values = [
+            ('host1', 'node1', {'free_ram_mb': 512, 'num_io_ops': 2}),
+            ('host2', 'node2', {'free_ram_mb': 1024, 'num_io_ops': 8}),
+            ('host3', 'node3', {'free_ram_mb': 2048, 'num_io_ops': 4}),
+            ('host4', 'node4', {'free_ram_mb': 1024, 'num_io_ops': 8}),
+        ]
+        return [fakes.FakeHostState(host, node, values)
+                for host, node, values in host_values]
+
+    def _get_weighers(self):
+        return [ram.RAMWeigher(), io_ops.IoOpsWeigher()]
+
+    def test_get_weighed_objects_limit(self):
+        hostinfo = self._get_hostinfo()
+        weight_handler = scheduler_weights.HostWeightHandler()
+        weighed_hosts = weight_handler.get_weighed_objects(
+            self._get_weighers(), hostinfo, {}, limit=2)
+        self.assertEqual(['host3', 'host1'],
+                         [weighed.obj.host for weighed in weighed_hosts])
+
+    def test_vectorized(self):
+        self.flags(io_ops_weight_multiplier=-2.0)
+        hostinfo = self._get_hostinfo()
+        weight_handler = scheduler_weights.HostWeightHandler()
+        expected = weight_handler.get_weighed_objects(self._get_weighers(),
+                                                      hostinfo, {})
+
+        weight_handler.vectorized = True
+        with mock.patch.object(
+                weight_handler, '_update_weights_array',
+                wraps=weight_handler._update_weights_array) as mock_array:
+            weighed_hosts = weight_handler.get_weighed_objects(
+                self._get_weighers(), hostinfo, {})
+        self.assertTrue(mock_array.called)
+        self.assertEqual([(weighed.obj.host, weighed.weight)
+                          for weighed in expected],
+                         [(weighed.obj.host, weighed.weight)
+                          for weighed in weighed_hosts])
+
+        for limit in range(1, 4):
+            weighed_hosts = weight_handler.get_weighed_objects(
+                self._get_weighers(), hostinfo, {}, limit=limit)
+            self.assertEqual(
+                [weighed.obj.host for weighed in expected[:limit]],
+                [weighed.obj.host for weighed in weighed_hosts])
+
+    def test_vectorized_update_weights(self):
+        hostinfo = self._get_hostinfo()
+        weight_handler = scheduler_weights.HostWeightHandler()
+        weight_handler.vectorized = True
+        weighers = [io_ops.IoOpsWeigher()]
+        with mock.patch.object(
+                weight_handler, '_update_weights_array',
+                wraps=weight_handler._update_weights_array) as mock_array:
+            weighed_hosts = weight_handler.get_weighed_objects(weighers,
+                                                               hostinfo, {})
+        self.assertTrue(mock_array.called)
+        self.assertEqual(-0.25, weighed_hosts[0].weight)
+        self.assertEqual(-1.0, weighed_hosts[-1].weight)
+
+        # The weights of a subset of the hosts are normalized as before, and
+        # weighers whose minimum and maximum are equal give 0
+        hostinfo[0].num_io_ops = 5
+        weight_handler.update_weights(weighers, weighed_hosts[:1], {})
+        self.assertEqual(-0.625, weighed_hosts[0].weight)
+        hostinfo[0].num_io_ops = 0
+        weighers = [io_ops.IoOpsWeigher()]
+        weight_handler.update_weights(weighers, weighed_hosts[:1], {})
+        self.assertEqual(0.0, weighed_hosts[0].weight)
@@ -0,0 +1,88 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+
+import fixtures
+import mock
+
+from nova import test
+from nova.virt.libvirt import diskinfo
+
+
+class DiskInfoCacheTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(DiskInfoCacheTestCase, self).setUp()
+        self.cache = diskinfo.DiskInfoCache()
+        self.inspect = mock.Mock(return_value=('base', 10))
+        temp_dir = self.useFixture(fixtures.TempDir()).path
+        self.path = os.path.join(temp_dir, 'disk')
+        self.other_path = os.path.join(temp_dir, 'disk.local')
+        for path in (self.path, self.other_path):
+            with open(path, 'w') as f:
+                f.write('data')
+
+    def _get(self, instance_name='instance-1', path=None):
+        return self.cache.get(instance_name, path or self.path, self.inspect)
+
+    def test_get(self):
+        self.assertEqual(('base', 10), self._get())
+        self.assertEqual(('base', 10), self._get())
+        self.inspect.assert_called_once_with(self.path)
+        self.assertEqual(1, len(self.cache))
+
+    def test_get_file_changed(self):
+        self._get()
+        os.utime(self.path, (0, 0))
+        self.inspect.return_value = ('base', 20)
+        self.assertEqual(('base', 20), self._get())
+        with open(self.path, 'a') as f:
+            f.write('more data')
+        os.utime(self.path, (0, 0))
+        self._get()
+        self.assertEqual(3, self.inspect.call_count)
+
+    def test_get_other_instance(self):
+        self._get()
+        self._get(instance_name='instance-2')
+        self.assertEqual(2, self.inspect.call_count)
+
+    def test_get_missing_file(self):
+        self.assertRaises(OSError, self._get, path=self.path + '.missing')
+        self.assertFalse(self.inspect.called)
+
+    def test_invalidate(self):
+        self._get()
+        self._get(instance_name='instance-2', path=self.other_path)
+        self.cache.invalidate('instance-1')
+        self.assertEqual(1, len(self.cache))
+        self._get()
+        self._get(instance_name='instance-2', path=self.other_path)
+        self.assertEqual(3, self.inspect.call_count)
+
+    def test_invalidate_while_inspecting(self):
+        def inspect(path):
+            self.cache.invalidate('instance-1')
+            return ('base', 10)
+
+        self.inspect.side_effect = inspect
+        self._get()
+        self.assertEqual(0, len(self.cache))
+
+    def test_retain(self):
+        self._get()
+        self._get(path=self.other_path)
+        self.cache.retain(set([self.other_path]))
+        self.assertEqual(1, len(self.cache))
+        self._get(path=self.other_path)
+        self.assertEqual(2, self.inspect.call_count)
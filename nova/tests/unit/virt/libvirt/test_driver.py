@@ -89,6 +89,7 @@ from nova.virt.libvirt import firewall
 from nova.virt.libvirt import guest as libvirt_guest
 from nova.virt.libvirt import host
 from nova.virt.libvirt import imagebackend
+from nova.virt.libvirt import imagecache
 from nova.virt.libvirt import lvm
 from nova.virt.libvirt import rbd_utils
 from nova.virt.libvirt import utils as libvirt_utils
@@ -4373,6 +4374,25 @@ class LibvirtConnTestCase(test.NoDBTestCase):
         self.assertEqual(uuids[3], vm4.UUIDString())
         mock_list.assert_called_with(only_running=False)
 
+    @mock.patch.object(host.Host, "list_instance_domains")
+    def test_get_power_states(self, mock_list):
+        vm1 = FakeVirtDomain(id=3, name="instance00000001")
+        vm2 = FakeVirtDomain(name="instance00000002")
+        vm2._info[0] = libvirt_driver.VIR_DOMAIN_SHUTOFF
+        vm3 = FakeVirtDomain(name="instance00000003")
+        ex = fakelibvirt.make_libvirtError(
+                fakelibvirt.libvirtError, "No such domain",
+                error_code=fakelibvirt.VIR_ERR_NO_DOMAIN)
+
+        mock_list.return_value = [vm1, vm2, vm3]
+        drvr = libvirt_driver.LibvirtDriver(fake.FakeVirtAPI(), False)
+        with mock.patch.object(vm3, 'info', side_effect=ex):
+            power_states = drvr.get_power_states()
+        self.assertEqual({vm1.UUIDString(): power_state.RUNNING,
+                          vm2.UUIDString(): power_state.SHUTDOWN},
+                         power_states)
+        mock_list.assert_called_with(only_running=False)
+
     @mock.patch.object(host.Host, "list_instance_domains")
     def test_get_all_block_devices(self, mock_list):
         xml = [
@@ -6454,6 +6474,43 @@ class LibvirtConnTestCase(test.NoDBTestCase):
                                         '/fake/instance/dir', disk_info)
         self.assertFalse(mock_fetch_image.called)
 
+    def test_prefetch_image(self):
+        self.flags(images_type='raw', group='libvirt')
+        drvr = libvirt_driver.LibvirtDriver(fake.FakeVirtAPI(), False)
+        instance = objects.Instance(**self.test_instance)
+        instance.root_gb = 1
+        target = os.path.join(CONF.instances_path,
+                              CONF.image_cache_subdirectory_name,
+                              imagecache.get_cache_fname(
+                                  {'image_id': instance.image_ref},
+                                  'image_id'))
+        with mock.patch.object(libvirt_driver.libvirt_utils,
+                               'fetch_image') as mock_fetch_image:
+            drvr.prefetch_image(self.context, instance, {})
+        mock_fetch_image.assert_called_once_with(self.context, target,
+                instance.image_ref, instance.user_id, instance.project_id,
+                max_size=units.Gi)
+
+    def test_prefetch_image_cached(self):
+        self.flags(images_type='raw', group='libvirt')
+        drvr = libvirt_driver.LibvirtDriver(fake.FakeVirtAPI(), False)
+        instance = objects.Instance(**self.test_instance)
+        with contextlib.nested(
+            mock.patch.object(libvirt_driver.libvirt_utils, 'fetch_image'),
+            mock.patch.object(os.path, 'exists', return_value=True)
+        ) as (mock_fetch_image, mock_exists):
+            drvr.prefetch_image(self.context, instance, {})
+        self.assertFalse(mock_fetch_image.called)
+
+    def test_prefetch_image_clone_backend(self):
+        self.flags(images_type='rbd', group='libvirt')
+        drvr = libvirt_driver.LibvirtDriver(fake.FakeVirtAPI(), False)
+        instance = objects.Instance(**self.test_instance)
+        with mock.patch.object(libvirt_driver.libvirt_utils,
+                               'fetch_image') as mock_fetch_image:
+            drvr.prefetch_image(self.context, instance, {})
+        self.assertFalse(mock_fetch_image.called)
+
     def test_create_images_and_backing_ephemeral_gets_created(self):
         drvr = libvirt_driver.LibvirtDriver(fake.FakeVirtAPI(), False)
         disk_info = [
@@ -8722,7 +8779,7 @@ class LibvirtConnTestCase(test.NoDBTestCase):
                         'disk_size': '10737418240',
                         'over_committed_disk_size': '21474836480'}]}
 
-        def side_effect(name, dom):
+        def side_effect(name, dom, **kwargs):
             if name == 'instance0000001':
                 raise OSError(errno.EACCES, 'Permission denied')
             if name == 'instance0000002':
@@ -8746,6 +8803,50 @@ class LibvirtConnTestCase(test.NoDBTestCase):
         drvr = libvirt_driver.LibvirtDriver(fake.FakeVirtAPI(), False)
         self.assertEqual(0, drvr._get_disk_over_committed_size_total())
 
+    @mock.patch.object(host.Host, "list_instance_domains")
+    @mock.patch.object(libvirt_driver.disk, 'get_disk_size',
+                       return_value=10 * units.Gi)
+    def test_disk_over_committed_size_total_cached(self, mock_size,
+                                                   mock_list):
+        path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                            'disk')
+        with open(path, 'w') as f:
+            f.write('data')
+        instance = objects.Instance(**self.test_instance)
+        dom = mock.Mock()
+        dom.name.return_value = instance.name
+        dom.XMLDesc.return_value = (
+            "<domain><devices>"
+            "<disk type='file'><driver name='qemu' type='qcow2'/>"
+            "<source file='%s'/><target dev='vda' bus='virtio'/></disk>"
+            "</devices></domain>" % path)
+        mock_list.return_value = [dom]
+        drvr = libvirt_driver.LibvirtDriver(fake.FakeVirtAPI(), False)
+
+        for i in range(2):
+            self.assertEqual(10 * units.Gi - 4,
+                             drvr._get_disk_over_committed_size_total())
+        self.assertEqual(1, mock_size.call_count)
+
+        # The disk changed
+        os.utime(path, (0, 0))
+        drvr._get_disk_over_committed_size_total()
+        self.assertEqual(2, mock_size.call_count)
+
+        # The instance was snapshotted
+        with mock.patch.object(drvr._host, 'get_guest',
+                               side_effect=exception.InstanceNotFound(
+                                   instance_id=instance.uuid)):
+            self.assertRaises(exception.InstanceNotRunning, drvr.snapshot,
+                              self.context, instance, 'image-id', None)
+        drvr._get_disk_over_committed_size_total()
+        self.assertEqual(3, mock_size.call_count)
+
+        # The instance is gone
+        mock_list.return_value = []
+        drvr._get_disk_over_committed_size_total()
+        self.assertEqual(0, len(drvr._disk_info_cache))
+
     def test_cpu_info(self):
         drvr = libvirt_driver.LibvirtDriver(fake.FakeVirtAPI(), True)
 
@@ -35,6 +35,7 @@ from nova import objects
 from nova import test
 from nova.tests.unit import fake_instance
 from nova import utils
+from nova.virt import imagecache as virt_imagecache
 from nova.virt.libvirt import imagecache
 from nova.virt.libvirt import utils as libvirt_utils
 
@@ -821,8 +822,10 @@ class ImageCacheManagerTestCase(test.NoDBTestCase):
     def test_compute_manager(self):
         was = {'called': False}
 
-        def fake_get_all_by_filters(context, *args, **kwargs):
+        def fake_get_all_by_filters_sort(context, *args, **kwargs):
             was['called'] = True
+            self.assertEqual(virt_imagecache.INSTANCE_FIELDS,
+                             kwargs['columns'])
             instances = []
             for x in range(2):
                 instances.append(fake_instance.fake_db_instance(
@@ -836,8 +839,8 @@ class ImageCacheManagerTestCase(test.NoDBTestCase):
         with utils.tempdir() as tmpdir:
             self.flags(instances_path=tmpdir)
 
-            self.stubs.Set(db, 'instance_get_all_by_filters',
-                           fake_get_all_by_filters)
+            self.stubs.Set(db, 'instance_get_all_by_filters_sort',
+                           fake_get_all_by_filters_sort)
             compute = importutils.import_object(CONF.compute_manager)
             self.flags(use_local=True, group='conductor')
             compute.conductor_api = conductor.API()
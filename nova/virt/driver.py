@@ -196,6 +196,17 @@ class ComputeDriver(object):
         # TODO(Vek): Need to pass context in for access to auth_token
         raise NotImplementedError()
 
+    def get_power_states(self):
+        """Return the power states of all the instances known to the
+        virtualization layer, as a dict keyed by instance UUID.
+
+        Instances which are not in the dict are not found on the
+        hypervisor. Drivers which can query all their instances at once
+        should implement this, so that the power states are not queried
+        one instance at a time.
+        """
+        raise NotImplementedError()
+
     def get_num_instances(self):
         """Return the total number of virtual machines.
 
@@ -324,6 +335,20 @@ class ComputeDriver(object):
         """
         raise NotImplementedError()
 
+    def prefetch_image(self, context, instance, image_meta):
+        """Fetch the image of an instance ahead of its spawn.
+
+        The compute manager calls this while the networks and block devices
+        of the instance are prepared, so that spawn() finds the image in the
+        local image cache. Drivers which do not cache images do nothing.
+
+        :param context: security context
+        :param instance: nova.objects.instance.Instance
+        :param image_meta: image object returned by nova.image.glance that
+                           defines the image from which to boot this instance
+        """
+        pass
+
     def destroy(self, context, instance, network_info, block_device_info=None,
                 destroy_disks=True, migrate_data=None):
         """Destroy the specified instance from the Hypervisor.
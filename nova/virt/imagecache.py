@@ -44,6 +44,11 @@ CONF = cfg.CONF
 CONF.register_opts(imagecache_opts)
 CONF.import_opt('host', 'nova.netconf')
 
+# Instance fields the image cache managers use, the compute manager only
+# loads these when listing the instances sharing the instances path.
+INSTANCE_FIELDS = ['id', 'uuid', 'host', 'node', 'vm_state', 'task_state',
+                   'image_ref', 'kernel_id', 'ramdisk_id']
+
 
 class ImageCacheManager(object):
     """Base class for the image cache manager.
@@ -0,0 +1,71 @@
+# Copyright (c) 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Cache of the information qemu-img gives about the disks of the instances.
+
+The virtual size and the backing file of a disk file can only change when
+the file is written, so the information is kept with the modification time
+and the size of the file, and a disk is only inspected again once one of
+them changed. The operations which create, replace or rebase the disks of
+an instance also invalidate its entries.
+"""
+
+import os
+
+
+class DiskInfoCache(object):
+    """The inspected information of the disk files, by path."""
+
+    def __init__(self):
+        # path -> (instance name, (mtime, size), information)
+        self._entries = {}
+        # Incremented by each invalidation, an inspection which started
+        # before is not cached
+        self._generation = 0
+
+    def get(self, instance_name, path, inspect):
+        """Return the information of a disk file of an instance.
+
+        inspect(path) is called to get it when it is not cached, or the
+        file changed since.
+        """
+        stat = os.stat(path)
+        key = (stat.st_mtime, stat.st_size)
+        entry = self._entries.get(path)
+        if entry is not None and entry[0] == instance_name and (
+                entry[1] == key):
+            return entry[2]
+        generation = self._generation
+        info = inspect(path)
+        if generation == self._generation:
+            self._entries[path] = (instance_name, key, info)
+        return info
+
+    def invalidate(self, instance_name):
+        """Forget the disks of an instance."""
+        self._generation += 1
+        for path, entry in list(self._entries.items()):
+            if entry[0] == instance_name:
+                del self._entries[path]
+
+    def retain(self, paths):
+        """Forget the disks whose path is not in paths."""
+        for path in list(self._entries):
+            if path not in paths:
+                del self._entries[path]
+
+    def __len__(self):
+        return len(self._entries)
@@ -91,6 +91,7 @@ from nova.virt import hardware
 from nova.virt.image import model as imgmodel
 from nova.virt.libvirt import blockinfo
 from nova.virt.libvirt import config as vconfig
+from nova.virt.libvirt import diskinfo
 from nova.virt.libvirt import dmcrypt
 from nova.virt.libvirt import firewall as libvirt_firewall
 from nova.virt.libvirt import guest as libvirt_guest
@@ -421,6 +422,7 @@ class LibvirtDriver(driver.ComputeDriver):
             self._get_volume_drivers(), self)
 
         self._disk_cachemode = None
+        self._disk_info_cache = diskinfo.DiskInfoCache()
         self.image_cache_manager = imagecache.ImageCacheManager()
         self.image_backend = imagebackend.Backend(CONF.use_cow_images)
 
@@ -613,6 +615,17 @@ class LibvirtDriver(driver.ComputeDriver):
 
         return uuids
 
+    def get_power_states(self):
+        power_states = {}
+        for dom in self._host.list_instance_domains(only_running=False):
+            try:
+                power_states[dom.UUIDString()] = self._get_power_state(dom)
+            except libvirt.libvirtError as ex:
+                # The domain was undefined since it was listed
+                if ex.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN:
+                    raise
+        return power_states
+
     def plug_vifs(self, instance, network_info):
         """Plug VIFs into networks."""
         for vif in network_info:
@@ -869,6 +882,7 @@ class LibvirtDriver(driver.ComputeDriver):
                                                   False)):
             attempts = int(instance.system_metadata.get('clean_attempts',
                                                         '0'))
+            self._disk_info_cache.invalidate(instance.name)
             success = self.delete_instance_files(instance)
             # NOTE(mriedem): This is used in the _run_pending_deletes periodic
             # task in the compute manager. The tight coupling is not great...
@@ -1300,6 +1314,7 @@ class LibvirtDriver(driver.ComputeDriver):
 
         This command only works with qemu 0.14+
         """
+        self._disk_info_cache.invalidate(instance.name)
         try:
             guest = self._host.get_guest(instance)
 
@@ -2405,6 +2420,7 @@ class LibvirtDriver(driver.ComputeDriver):
     # for xenapi(tr3buchet)
     def spawn(self, context, instance, image_meta, injected_files,
               admin_password, network_info=None, block_device_info=None):
+        self._disk_info_cache.invalidate(instance.name)
         disk_info = blockinfo.get_disk_info(CONF.libvirt.virt_type,
                                             instance,
                                             image_meta,
@@ -6066,6 +6082,7 @@ class LibvirtDriver(driver.ComputeDriver):
         :param network_info: instance network information
         :param block_migration: if true, post operation of block_migration.
         """
+        self._disk_info_cache.invalidate(instance.name)
         # Define migrated instance, otherwise, suspend/destroy does not work.
         image_meta = utils.get_image_from_system_metadata(
             instance.system_metadata)
@@ -6081,8 +6098,14 @@ class LibvirtDriver(driver.ComputeDriver):
                                   write_to_disk=True)
         self._host.write_instance_config(xml)
 
+    @staticmethod
+    def _inspect_disk(path):
+        """Return the backing file and the virtual size of a qcow2 disk."""
+        return (libvirt_utils.get_disk_backing_file(path),
+                disk.get_disk_size(path))
+
     def _get_instance_disk_info(self, instance_name, xml,
-                                block_device_info=None):
+                                block_device_info=None, use_cache=False):
         block_device_mapping = driver.block_device_info_get_mapping(
             block_device_info)
 
@@ -6131,8 +6154,14 @@ class LibvirtDriver(driver.ComputeDriver):
 
             disk_type = driver_nodes[cnt].get('type')
             if disk_type == "qcow2":
-                backing_file = libvirt_utils.get_disk_backing_file(path)
-                virt_size = disk.get_disk_size(path)
+                # NOTE: The periodic disk usage update inspects the disks
+                # of all the instances, only those which changed are
+                # inspected again.
+                if use_cache:
+                    backing_file, virt_size = self._disk_info_cache.get(
+                        instance_name, path, self._inspect_disk)
+                else:
+                    backing_file, virt_size = self._inspect_disk(path)
                 over_commit_size = int(virt_size) - dk_size
             else:
                 backing_file = ""
@@ -6171,6 +6200,7 @@ class LibvirtDriver(driver.ComputeDriver):
         """Return total over committed disk size for all instances."""
         # Disk size that all instance uses : virtual_size - disk_size
         disk_over_committed_size = 0
+        paths = set()
         for dom in self._host.list_instance_domains():
             try:
                 # TODO(sahid): list_instance_domain should
@@ -6179,8 +6209,10 @@ class LibvirtDriver(driver.ComputeDriver):
                 guest = libvirt_guest.Guest(dom)
                 xml = guest.get_xml_desc()
 
-                disk_infos = self._get_instance_disk_info(guest.name, xml)
+                disk_infos = self._get_instance_disk_info(guest.name, xml,
+                                                          use_cache=True)
                 for info in disk_infos:
+                    paths.add(info['path'])
                     disk_over_committed_size += int(
                         info['over_committed_disk_size'])
             except libvirt.libvirtError as ex:
@@ -6217,6 +6249,8 @@ class LibvirtDriver(driver.ComputeDriver):
                           'error': e})
             # NOTE(gtt116): give other tasks a chance.
             greenthread.sleep(0)
+        # Forget the disks which are gone
+        self._disk_info_cache.retain(paths)
         return disk_over_committed_size
 
     def unfilter_instance(self, instance, network_info):
@@ -6240,6 +6274,37 @@ class LibvirtDriver(driver.ComputeDriver):
         """Manage the local cache of images."""
         self.image_cache_manager.update(context, all_instances)
 
+    def prefetch_image(self, context, instance, image_meta):
+        """Fetch the root image of an instance into the image cache."""
+        if not instance.image_ref:
+            return
+        # NOTE: The backends supporting clone create the root disk from the
+        # image store, they may not need the image in the cache at all.
+        if self.image_backend.backend().SUPPORTS_CLONE:
+            return
+
+        filename = imagecache.get_cache_fname(
+            {'image_id': instance.image_ref}, 'image_id')
+        base_dir = os.path.join(CONF.instances_path,
+                                CONF.image_cache_subdirectory_name)
+        fileutils.ensure_tree(base_dir)
+        target = os.path.join(base_dir, filename)
+
+        # NOTE: This is the lock Image.cache() takes to fetch the image, so
+        # a spawn of the image waits for the prefetch to finish.
+        @utils.synchronized(filename, external=True,
+                            lock_path=os.path.join(CONF.instances_path,
+                                                   'locks'))
+        def _fetch_image():
+            if not os.path.exists(target):
+                libvirt_utils.fetch_image(context, target,
+                                          instance.image_ref,
+                                          instance.user_id,
+                                          instance.project_id,
+                                          max_size=instance.root_gb * units.Gi)
+
+        _fetch_image()
+
     def _cleanup_remote_migration(self, dest, inst_base, inst_base_resize,
                                   shared_storage=False):
         """Used only for cleanup in case migrate_disk_and_power_off fails."""
@@ -6279,6 +6344,7 @@ class LibvirtDriver(driver.ComputeDriver):
                                    timeout=0, retry_interval=0):
         LOG.debug("Starting migrate_disk_and_power_off",
                    instance=instance)
+        self._disk_info_cache.invalidate(instance.name)
 
         ephemerals = driver.block_device_info_get_ephemerals(block_device_info)
 
@@ -6468,6 +6534,7 @@ class LibvirtDriver(driver.ComputeDriver):
                          network_info, image_meta, resize_instance,
                          block_device_info=None, power_on=True):
         LOG.debug("Starting finish_migration", instance=instance)
+        self._disk_info_cache.invalidate(instance.name)
 
         # resize disks. only "disk" and "disk.local" are necessary.
         disk_info = jsonutils.loads(disk_info)
@@ -6523,6 +6590,7 @@ class LibvirtDriver(driver.ComputeDriver):
                                 block_device_info=None, power_on=True):
         LOG.debug("Starting finish_revert_migration",
                   instance=instance)
+        self._disk_info_cache.invalidate(instance.name)
 
         inst_base = libvirt_utils.get_instance_path(instance)
         inst_base_resize = inst_base + "_resize"
@@ -18,7 +18,13 @@ Pluggable Weighing support
 """
 
 import abc
+import heapq
+import time
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
 import six
 
 from nova import loadables
@@ -121,14 +127,74 @@ class BaseWeigher(object):
 class BaseWeightHandler(loadables.BaseLoader):
     object_class = WeighedObject
 
-    def get_weighed_objects(self, weighers, obj_list, weighing_properties):
-        """Return a sorted (descending), normalized list of WeighedObjects."""
+    # Set to True to normalize the weights of all the weighers and apply
+    # their multipliers at once, over a numpy array of the raw weights.
+    vectorized = False
+
+    # Object with an observe(kind, name, seconds) method, such as
+    # nova.scheduler.timings.Timings, recording the time spent in each
+    # weigher.
+    timings = None
+
+    def _use_numpy(self):
+        return self.vectorized and numpy is not None
+
+    def get_weighed_objects(self, weighers, obj_list, weighing_properties,
+                            limit=None):
+        """Return a sorted (descending), normalized list of WeighedObjects.
+
+        If limit is given, only the limit objects with the greatest weights
+        are returned, which avoids sorting all of them.
+        """
         weighed_objs = [self.object_class(obj, 0.0) for obj in obj_list]
 
         if len(weighed_objs) <= 1:
             return weighed_objs
 
+        self.update_weights(weighers, weighed_objs, weighing_properties)
+
+        if limit is not None and limit < len(weighed_objs):
+            if self._use_numpy():
+                return self._get_largest(weighed_objs, limit)
+            return heapq.nlargest(limit, weighed_objs, key=lambda x: x.weight)
+        return sorted(weighed_objs, key=lambda x: x.weight, reverse=True)
+
+    @staticmethod
+    def _get_largest(weighed_objs, limit):
+        """Return the limit WeighedObjects with the greatest weights, sorted
+        the same way as sorted() would, without sorting all of them.
+        """
+        weights = numpy.array([obj.weight for obj in weighed_objs])
+        kth = numpy.partition(weights, len(weights) - limit)[-limit]
+        above = numpy.flatnonzero(weights > kth)
+        # Objects of equal weight are kept in their original order
+        equal = numpy.flatnonzero(weights == kth)[:limit - len(above)]
+        indexes = numpy.concatenate((above, equal))
+        indexes = indexes[numpy.lexsort((indexes, -weights[indexes]))]
+        return [weighed_objs[i] for i in indexes]
+
+    def _observe(self, weigher, start):
+        if self.timings is not None:
+            self.timings.observe('weigher', weigher.__class__.__name__,
+                                 time.time() - start)
+
+    def update_weights(self, weighers, weighed_objs, weighing_properties):
+        """Compute again the weights of a list of WeighedObjects, in place.
+
+        The weights are normalized using the minimum and maximum values
+        recorded by each weigher, so a subset of previously weighed objects
+        can be weighed again consistently with the others.
+        """
+        if self._use_numpy() and weighers:
+            self._update_weights_array(weighers, weighed_objs,
+                                       weighing_properties)
+            return
+
+        for obj in weighed_objs:
+            obj.weight = 0.0
+
         for weigher in weighers:
+            start = time.time()
             weights = weigher.weigh_objects(weighed_objs, weighing_properties)
 
             # Normalize the weights
@@ -139,5 +205,36 @@ class BaseWeightHandler(loadables.BaseLoader):
             for i, weight in enumerate(weights):
                 obj = weighed_objs[i]
                 obj.weight += weigher.weight_multiplier() * weight
+            self._observe(weigher, start)
 
-        return sorted(weighed_objs, key=lambda x: x.weight, reverse=True)
+    def _update_weights_array(self, weighers, weighed_objs,
+                              weighing_properties):
+        """Same as update_weights(), over an array holding the raw weights
+        of all the weighers, one column per weigher.
+        """
+        raw = numpy.empty((len(weighed_objs), len(weighers)))
+        for column, weigher in enumerate(weighers):
+            start = time.time()
+            raw[:, column] = weigher.weigh_objects(weighed_objs,
+                                                   weighing_properties)
+            self._observe(weigher, start)
+
+        minvals = numpy.array([raw[:, column].min()
+                               if weigher.minval is None else weigher.minval
+                               for column, weigher in enumerate(weighers)],
+                              dtype=float)
+        maxvals = numpy.array([raw[:, column].max()
+                               if weigher.maxval is None else weigher.maxval
+                               for column, weigher in enumerate(weighers)],
+                              dtype=float)
+        multipliers = numpy.array([weigher.weight_multiplier()
+                                   for weigher in weighers], dtype=float)
+        ranges = maxvals - minvals
+        # Like normalize(), a weigher whose values are all equal gives 0
+        flat = ranges == 0
+        ranges[flat] = 1.0
+        multipliers[flat] = 0.0
+
+        weights = ((raw - minvals) / ranges).dot(multipliers)
+        for obj, weight in zip(weighed_objs, weights.tolist()):
+            obj.weight = weight